@@ -1,5 +1,6 @@
 # Keep imports sorted alphabetically
 import fabtools.arch
+import fabtools.build
 import fabtools.conda
 import fabtools.cron
 import fabtools.crux
@@ -8,6 +9,7 @@ import fabtools.disk
 import fabtools.files
 import fabtools.git
 import fabtools.group
+import fabtools.handlers
 import fabtools.mercurial
 import fabtools.mysql
 import fabtools.network
@@ -22,6 +24,7 @@ import fabtools.postgres
 import fabtools.python
 import fabtools.python_setuptools
 import fabtools.poweroff
+import fabtools.redis
 import fabtools.rpm
 import fabtools.service
 import fabtools.shorewall
@@ -15,7 +15,7 @@ should normally not use them directly but rather use the high-level wrapper
 
 from __future__ import with_statement
 
-from fabric.api import local
+from fabric.api import hide, local, settings
 from fabric.api import run
 from fabric.api import sudo
 from fabric.context_managers import cd
@@ -25,11 +25,11 @@ from fabtools.utils import run_as_root
 
 def _run(cmd, use_sudo=False, user=None):
     if use_sudo and user is None:
-        run_as_root(cmd)
+        return run_as_root(cmd)
     elif use_sudo:
-        sudo(cmd, user=user)
+        return sudo(cmd, user=user)
     else:
-        run(cmd)
+        return run(cmd)
 
 def checkout(path, use_sudo=False, user=None):
     """
@@ -236,3 +236,121 @@ def push(location, source=None, version=None, force=False):
     cmd = ' '.join(cmd)
 
     local(cmd)
+
+
+_STATUS_SEPARATOR = '--fabtools-bzr--'
+
+
+def status(path, location=None, use_sudo=False, user=None):
+    """
+    Get the state of a branch with a single command.
+
+    Returns a dict with the following keys:
+
+    - ``exists``: whether the ``path`` exists
+    - ``branch``: whether it is a Bazaar branch
+    - ``tree``: whether the branch has a working tree
+    - ``revno``: the revision number of the branch
+    - ``nick``: the nickname of the branch
+    - ``dirty``: whether versioned files in the working tree have local
+      modifications
+    - ``missing``: if a ``location`` is given, whether the branch at that
+      location has revisions that are missing from the local branch (this
+      contacts the remote branch), else ``None``
+
+    :param path: Path of the branch directory.
+    :type path: str
+
+    :param location: Location of a branch to compare with.
+    :type location: str
+    """
+    separator = 'echo %s; ' % _STATUS_SEPARATOR
+    cmd = (
+        'if [ -d %(path)s/.bzr ]; then cd %(path)s && echo branch; ' +
+        separator +
+        "bzr version-info --custom --template='{revno} {branch_nick}\\n'; " +
+        separator +
+        'if [ -d .bzr/checkout ]; then echo tree; '
+        'bzr status -S --versioned; fi; ' +
+        (separator + 'bzr missing --theirs-only --line %(location)s '
+         '>/dev/null; echo $?; ' if location else '') +
+        'elif [ -d %(path)s ]; then echo directory; '
+        'else echo missing; fi; true'
+    ) % {'path': path, 'location': location}
+    with settings(hide('running', 'stdout', 'warnings'), warn_only=True):
+        res = _run(cmd, use_sudo=use_sudo, user=user)
+    sections = [section.strip() for section in
+                res.replace('\r\n', '\n').split(_STATUS_SEPARATOR)]
+    state = sections[0].splitlines()[-1] if sections[0] else 'missing'
+    if state != 'branch':
+        return {
+            'exists': state == 'directory',
+            'branch': False,
+            'tree': False,
+            'revno': None,
+            'nick': None,
+            'dirty': False,
+            'missing': None,
+        }
+    revno, nick = (sections[1].split(None, 1) + [None])[:2]
+    tree = sections[2].splitlines()
+    return {
+        'exists': True,
+        'branch': True,
+        'tree': bool(tree) and tree[0] == 'tree',
+        'revno': revno,
+        'nick': nick,
+        'dirty': len(tree) > 1,
+        'missing': sections[3] == '1' if location else None,
+    }
+
+
+def sync(path, source=None, version=None, force=False, clone=False,
+         revert=False, use_sudo=False, user=None):
+    """
+    Branch or pull from ``source``, and update the working tree at
+    ``path``, with a single command.
+
+    If ``clone`` is ``True``, the ``source`` branch is branched into
+    ``path``.  Otherwise, a working tree is created if the branch has
+    none, local modifications are discarded if ``revert`` is ``True``,
+    changes are pulled from ``source`` if it is given, and the working
+    tree is updated to ``version`` (or the latest revision).
+
+    Returns the revision number of the branch after the update.
+
+    :param path: Path of the working copy directory.
+    :type path: str
+
+    :param source: Location to pull from.
+    :type source: str
+
+    :param version: revision to switch to
+    :type version: str
+
+    :param force: if ``True`` create the new branch even if the target
+                  directory already exists, or overwrite the branch
+                  unconditionally when pulling
+    :type force: bool
+    """
+    revision = ['-r', version] if version else []
+    if clone:
+        cmd = ['bzr', 'branch', '--quiet'] + revision
+        if force:
+            cmd.append('--use-existing-dir')
+        commands = [' '.join(cmd + [source, path]), 'cd %s' % path]
+    else:
+        commands = ['cd %s' % path,
+                    '{ [ -d .bzr/checkout ] || bzr checkout --quiet; }']
+        if revert:
+            commands.append('bzr revert --quiet')
+        if source:
+            cmd = ['bzr', 'pull', '--quiet'] + revision
+            if force:
+                cmd.append('--overwrite')
+            commands.append(' '.join(cmd + [source]))
+        commands.append(' '.join(['bzr', 'update', '--quiet'] + revision))
+    commands.append('bzr revno')
+    with settings(hide('stdout')):
+        res = _run(' && '.join(commands), use_sudo=use_sudo, user=user)
+    return res.splitlines()[-1].strip() if res else None
@@ -0,0 +1,146 @@
+"""
+Build cache
+===========
+
+This module provides a cache of binary artifacts for software compiled
+from source, such as Redis (see
+:func:`fabtools.require.redis.installed_from_source`) and Node.js (see
+:func:`fabtools.nodejs.install_from_source`).
+
+The cache is enabled by setting ``env.build_cache`` to a local
+directory. Software is then compiled only once for each combination
+of project, version, CPU architecture, distribution release and build
+flags: the installed files are packed in a tarball stored in the cache
+directory on the controller, which is then installed on all matching
+hosts, without a compiler or build dependencies.
+
+By default, the first host that needs an artifact builds it. You can
+set ``env.build_host`` to the host string of a designated builder,
+which must have the same architecture and distribution release as the
+hosts it builds for.
+
+::
+
+    from fabric.api import env
+
+    env.build_cache = '~/.cache/fabtools/builds'
+    env.build_host = 'builder.example.com'
+
+"""
+
+from contextlib import contextmanager
+from pipes import quote
+import hashlib
+import os
+
+from fabric.api import abort, env, hide, puts, run, settings
+
+from fabtools.system import distrib_id, distrib_release, get_arch
+from fabtools.utils import run_as_root, stream
+
+
+def cache_enabled():
+    """
+    Check if the build cache is enabled.
+    """
+    return bool(env.get('build_cache'))
+
+
+def cache_key(project, version, flags=()):
+    """
+    Get the cache key of an artifact built on the current host.
+
+    The key is made of the *project* name and *version*, the CPU
+    architecture and distribution release of the host, and a hash of
+    the build *flags* (such as ``configure`` options), if any.
+    """
+    parts = [project, version, distrib_id(), distrib_release(), get_arch()]
+    if flags:
+        digest = hashlib.sha1(' '.join(flags).encode('utf-8')).hexdigest()
+        parts.append(digest[:12])
+    return '-'.join(part.replace(' ', '_').replace('/', '_').lower()
+                    for part in parts)
+
+
+def install_cached(project, version, build, flags=()):
+    """
+    Install a compiled artifact from the build cache.
+
+    *build* is a function that compiles the software on the current
+    host, and installs it under the staging directory it is given as
+    argument (for instance with ``make install DESTDIR=...``). It is only
+    called if the artifact is not already in the cache, on
+    ``env.build_host`` if it is set, or on the current host otherwise.
+
+    The artifact is then extracted to the root of the current host, as
+    ``root``, without changing existing directories.
+
+    Concurrent tasks (when using Fabric's parallel mode) wait for the
+    first one to build the artifact, instead of building it again.
+
+    Returns the cache key of the artifact.
+
+    ::
+
+        from fabtools.build import install_cached
+
+        def build(destdir):
+            run('make && make install DESTDIR=%s' % destdir)
+
+        install_cached('myapp', '1.0', build)
+
+    """
+    key = cache_key(project, version, flags)
+    directory = os.path.expanduser(env.build_cache)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    archive = os.path.join(directory, key + '.tar.gz')
+
+    with _locked(archive + '.lock'):
+        if not os.path.exists(archive):
+            builder = env.get('build_host') or env.host_string
+            with settings(host_string=builder):
+                if builder != env.host_string and \
+                        cache_key(project, version, flags) != key:
+                    abort('Build host %s cannot build %s' % (builder, key))
+                _build_artifact(build, archive, key)
+
+    with open(archive, 'rb') as f:
+        stream(
+            'tar -xzf - -C / --no-same-owner --no-overwrite-dir',
+            stdin=f, user='root', label='Installing %s' % key)
+    return key
+
+
+def _build_artifact(build, archive, key):
+    """
+    Build an artifact and download it to the cache.
+    """
+    puts('Building %s on %s' % (key, env.host_string))
+    with settings(hide('running', 'stdout')):
+        destdir = run('d=$(mktemp -d) && chmod 755 "$d" && echo "$d"')
+    try:
+        build(destdir)
+        partial = archive + '.part'
+        with open(partial, 'wb') as f:
+            stream('tar -czf - -C %s .' % quote(destdir), stdout=f,
+                   label='Caching %s' % key)
+        os.rename(partial, archive)
+    finally:
+        with settings(hide('running', 'stdout')):
+            run_as_root('rm -rf %s' % quote(destdir))
+
+
+@contextmanager
+def _locked(path):
+    """
+    Hold an exclusive lock on a local file.
+    """
+    import fcntl
+
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -10,18 +10,19 @@ the `miniconda`_ distribution.
 """
 from contextlib import contextmanager
 from pipes import quote
-import os
+import json
 import posixpath
+import re
 
-from fabric.api import cd, run, settings, hide, prefix
+from fabric.api import cd, env as fabric_env, run, settings, hide, prefix
 from fabric.contrib import files
-from fabric.operations import sudo
+from fabric.operations import put, sudo
 import six
 
 from fabtools import utils
 import fabtools
 
-from fabtools.utils import download, run_as_root
+from fabtools.utils import download, host_cache, run_as_root
 
 MINICONDA_URL = 'http://repo.continuum.io/miniconda/Miniconda-latest-Linux-x86_64.sh'
 
@@ -129,31 +130,141 @@ def create_env(name=None, prefix=None, yes=True, override_channels=False,
         sudo(command, user=user)
     else:
         run(command)
+    _forget(name, prefix)
+
+
+def create_env_from_spec(spec_file, name=None, prefix=None, use_sudo=False,
+                         user=None):
+    """
+    Create a conda environment from an explicit spec file.
+
+    *spec_file* is the path of a local file made with
+    ``conda list --explicit``, which lists the URLs of the exact
+    packages to install. It is uploaded, and the packages are installed
+    without running the dependency solver, which is much faster and
+    gives the same environment on every host.
+
+    An existing environment with the same name or prefix is replaced.
+
+    ::
+
+        import fabtools
+
+        # On the development machine:
+        #   conda list --explicit > myenv.lock.txt
+        fabtools.conda.create_env_from_spec('myenv.lock.txt', name='myenv')
+
+    """
+    options = ['--yes', '--quiet']
+    if name:
+        options.append('--name ' + quote(name))
+    if prefix:
+        options.append('--prefix ' + quote(utils.abspath(prefix)))
+    options = ' '.join(options)
+
+    with settings(hide('running', 'stdout')):
+        remote_spec = run('mktemp')
+    command = 'conda create %s --file %s' % (options, quote(remote_spec))
+    try:
+        put(spec_file, remote_spec)
+        if use_sudo and user:
+            # mktemp makes the file readable by the login user only
+            with settings(hide('running', 'stdout')):
+                sudo('chown %s %s' % (quote(user), quote(remote_spec)))
+        if use_sudo:
+            sudo(command, user=user)
+        else:
+            run(command)
+    finally:
+        with settings(hide('running', 'stdout')):
+            run_as_root('rm -f %s' % quote(remote_spec))
+    _forget(name, prefix)
+
+
+def parse_explicit_spec(contents):
+    """
+    Get the packages of an explicit spec file (see
+    :func:`create_env_from_spec`).
+
+    Returns a dict mapping package names to versions.
+    """
+    return dict((name, version)
+                for name, version, build in _explicit_packages(contents))
+
+
+def _explicit_packages(contents):
+    """
+    Get the ``(name, version, build)`` tuples of the packages of an
+    explicit spec file.
+    """
+    packages = set()
+    for line in contents.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#') or line.startswith('@'):
+            continue
+        filename = posixpath.basename(line.split('#')[0])
+        for extension in ('.tar.bz2', '.conda'):
+            if filename.endswith(extension):
+                filename = filename[:-len(extension)]
+        packages.add(tuple(filename.rsplit('-', 2)))
+    return packages
+
+
+_environments = host_cache()
+
+_packages = host_cache()
+
+
+def environments(refresh=False):
+    """
+    Get the list of the paths of the conda environments.
+
+    The environments are listed with a single ``conda env list``
+    command the first time this function is called for a host, and the
+    list is then kept until an environment is created by this module.
+    Use *refresh* to list them again, if they were changed by other
+    means.
+    """
+    key = fabric_env.host_string
+    if refresh or key not in _environments:
+        with settings(hide('running', 'warnings', 'stderr', 'stdout'),
+                      warn_only=True):
+            res = run('conda env list --json')
+        try:
+            _environments[key] = json.loads(res).get('envs', [])
+        except ValueError:
+            _environments[key] = []
+    return list(_environments[key])
 
 
 def env_exists(name=None, prefix=None):
     """
     Check if a conda environment exists.
+
+    The answer comes from the cached list of :func:`environments`.
     """
+    paths = environments()
     if not prefix:  # search in default env dir
-        command = "conda info -e | grep -e '^%(name)s\s'" % locals()
-    else:
-        # check if just a prefix or prefix & name are given:
-        if name:
-            base = prefix
-        else:
-            # we were given a full path to the environment.
-            # we split this up into the parent directory + the environment path
-            # so we can call 'conda info' with CONDA_ENVS_PATH set to the
-            # parent dir
-            prefix = utils.abspath(prefix)
-            base, name = prefix, ''
-            while name == '':
-                base, name = os.path.split(base)
-        command = "CONDA_ENVS_PATH=%(base)s conda info -e | grep -e '^%(name)s\s'" % locals()
-    with settings(hide('running', 'warnings', 'stderr', 'stdout'), warn_only=True):
-        res = run(command, shell_escape=False)
-        return res.succeeded
+        if name in ('base', 'root'):
+            return bool(paths)
+        return any(posixpath.basename(path) == name and
+                   posixpath.basename(posixpath.dirname(path)) == 'envs'
+                   for path in paths)
+
+    # check if just a prefix or prefix & name are given
+    path = utils.abspath(prefix)
+    if name:
+        path = posixpath.join(path, name)
+    if path in paths:
+        return True
+    # environments created outside of the envs directories may not
+    # be registered, so look for their metadata directory
+    return fabtools.files.is_dir(posixpath.join(path, 'conda-meta'))
+
+
+def _forget(name=None, prefix=None):
+    _environments.pop(fabric_env.host_string, None)
+    _packages.get(fabric_env.host_string, {}).pop((name, prefix), None)
 
 
 @contextmanager
@@ -233,24 +344,92 @@ def install(packages=None, yes=True, force=False, file=None, unknown=False,
 
     command = 'conda install ' + options
     run(command)
+    _forget(name, prefix)
 
 
-def is_installed(package, name=None, prefix=None):
+def list_packages(name=None, prefix=None, refresh=False):
     """
-    Check if a conda package is installed.
+    Get the packages installed in a conda environment.
+
+    The packages are listed with a single ``conda list --json`` command
+    the first time this function is called for an environment, and the
+    list is then kept until packages are installed by this module. Use
+    *refresh* to list them again, if they were changed by other means.
+
+    Returns a dict mapping package names to versions.
 
     :param name: name of environment (in conda environment directory)
     :param prefix: full path to environment prefix
     """
-    options = []
-    if name:
-        options.append('--name ' + quote(name))
-    if prefix:
-        options.append('--prefix ' + quote(utils.abspath(prefix)))
+    return dict((pkg['name'], pkg['version'])
+                for pkg in _listing(name, prefix, refresh))
 
-    options = ' '.join(options)
 
-    command = 'conda list %(options)s | grep -q %(package)s' % locals()
-    with settings(hide('running', 'warnings', 'stderr', 'stdout'), warn_only=True):
-        res = run(command)
-    return res.succeeded
\ No newline at end of file
+def _listing(name=None, prefix=None, refresh=False):
+    cache = _packages.setdefault(fabric_env.host_string, {})
+    key = (name, prefix)
+    if refresh or key not in cache:
+        options = []
+        if name:
+            options.append('--name ' + quote(name))
+        if prefix:
+            options.append('--prefix ' + quote(utils.abspath(prefix)))
+        options = ' '.join(options)
+        with settings(hide('running', 'warnings', 'stderr', 'stdout'),
+                      warn_only=True):
+            res = run('conda list --json %(options)s' % locals())
+        try:
+            listing = json.loads(res)
+        except ValueError:
+            listing = []
+        if not isinstance(listing, list):  # error message
+            listing = []
+        cache[key] = listing
+    return cache[key]
+
+
+def _channel_packages(name=None, prefix=None):
+    """
+    Get the ``(name, version, build)`` tuples of the packages installed
+    from conda channels, leaving out the ones installed with ``pip``.
+    """
+    return set(
+        (pkg['name'], pkg['version'], pkg.get('build_string', ''))
+        for pkg in _listing(name, prefix)
+        if pkg.get('channel') != 'pypi' and pkg.get('platform') != 'pypi')
+
+
+def parse_spec(spec):
+    """
+    Split a package spec such as ``numpy=1.11`` into its name and
+    version, which is ``None`` if it is not given.
+
+    Only exact versions and version prefixes (``numpy==1.11.1``,
+    ``numpy=1.11``, ``numpy=1.11.*``) are supported. Other specs, such
+    as version ranges, raise a ``ValueError``.
+    """
+    match = re.match(r'^([\w.-]+)\s*(?:==?\s*(\w+(?:\.\w+)*)\.?\*?'
+                     r'(?:=[\w.]+)?)?$', spec.strip())
+    if match is None:
+        raise ValueError('Unsupported conda package spec: %r' % spec)
+    return match.group(1), match.group(2)
+
+
+def is_installed(package, name=None, prefix=None):
+    """
+    Check if a conda package is installed.
+
+    *package* may include a version, such as ``numpy=1.11``, which
+    matches all the versions starting with ``1.11``.
+
+    The answer comes from the cached :func:`list_packages`.
+
+    :param name: name of environment (in conda environment directory)
+    :param prefix: full path to environment prefix
+    """
+    package, version = parse_spec(package)
+    installed = list_packages(name=name, prefix=prefix).get(package)
+    if installed is None:
+        return False
+    return version is None or installed == version or \
+        installed.startswith(version + '.')
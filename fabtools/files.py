@@ -4,12 +4,18 @@ Files and directories
 """
 
 from pipes import quote
+import io
 import os
+import tarfile
+import threading
+import time
+import uuid
 
 from fabric.api import (
     abort,
     env,
     hide,
+    put,
     run,
     settings,
     sudo,
@@ -19,7 +25,7 @@ from fabric.contrib.files import upload_template as _upload_template
 from fabric.contrib.files import exists
 import six
 
-from fabtools.utils import run_as_root
+from fabtools.utils import read_chunks, run_as_root
 
 
 def is_file(path, use_sudo=False):
@@ -238,14 +244,29 @@ class watch(object):
             uncomment('/etc/daemon.conf', 'someoption')
             comment('/etc/daemon.conf', 'otheroption')
 
+    If you also provide a *handler* name, the callback is notified as a
+    handler (see :func:`fabtools.handlers.notify`), so that inside a
+    :func:`fabtools.handlers.deferred` block it only runs once, at the
+    end of the block::
+
+        from fabtools.handlers import deferred
+
+        with deferred():
+            for filename in ['/etc/daemon/a.conf', '/etc/daemon/b.conf']:
+                with watch(filename, callback=partial(restart, 'daemon'),
+                           handler='restart daemon'):
+                    uncomment(filename, 'someoption')
+
     """
 
-    def __init__(self, filenames, callback=None, use_sudo=False):
+    def __init__(self, filenames, callback=None, use_sudo=False,
+                 handler=None):
         if isinstance(filenames, six.string_types):
             self.filenames = [filenames]
         else:
             self.filenames = filenames
         self.callback = callback
+        self.handler = handler
         self.use_sudo = use_sudo
         self.digest = dict()
         self.changed = False
@@ -262,7 +283,11 @@ class watch(object):
                 self.changed = True
                 break
         if self.changed and self.callback:
-            self.callback()
+            if self.handler:
+                from fabtools.handlers import notify
+                notify(self.handler, self.callback)
+            else:
+                self.callback()
 
 
 def uncommented_lines(filename, use_sudo=False):
@@ -323,3 +348,141 @@ def remove(path, recursive=False, use_sudo=False):
     func = use_sudo and run_as_root or run
     options = '-r ' if recursive else ''
     func('/bin/rm {0}{1}'.format(options, quote(path)))
+
+
+def upload_archive(files, temp_dir='/tmp'):
+    """
+    Upload several files in a single transfer.
+
+    *files* is a dict mapping names to file contents. The files are
+    packed locally into a compressed ``tar`` archive, which is uploaded
+    to *temp_dir* on the remote host.
+
+    Returns a :class:`StagedFiles` object, that builds the shell
+    commands needed to extract the archive, install the files to
+    their final location, and clean up. This allows you to put many
+    files in place with one upload and a single remote command.
+
+    Example::
+
+        from fabtools.files import upload_archive
+        from fabtools.utils import run_as_root
+
+        staged = upload_archive({
+            'a.conf': 'foo = 1\n',
+            'b.conf': 'bar = 2\n',
+        })
+        run_as_root(staged.script([
+            staged.install('a.conf', '/etc/a.conf', mode='644'),
+            staged.install('b.conf', '/etc/b.conf', mode='644'),
+        ]))
+
+    """
+    buf = io.BytesIO()
+    archive = tarfile.open(fileobj=buf, mode='w:gz')
+    now = time.time()
+    for name, contents in sorted(files.items()):
+        if isinstance(contents, six.text_type):
+            contents = contents.encode('utf-8')
+        info = tarfile.TarInfo(name)
+        info.size = len(contents)
+        info.mtime = now
+        info.mode = 0o600
+        archive.addfile(info, io.BytesIO(contents))
+    archive.close()
+    buf.seek(0)
+
+    path = '%s/fabtools-%s.tar.gz' % (temp_dir.rstrip('/'), uuid.uuid4().hex)
+    with settings(hide('running')):
+        put(buf, path)
+    return StagedFiles(path)
+
+
+def tar_chunks(directory):
+    """
+    Pack a local directory into a compressed ``tar`` archive.
+
+    The archive is not stored anywhere: it is yielded as byte strings
+    while it is being built, so that it can be streamed to a remote
+    command (see :func:`fabtools.utils.stream`).
+    """
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def pack():
+        try:
+            with os.fdopen(write_fd, 'wb') as f:
+                with tarfile.open(fileobj=f, mode='w|gz') as archive:
+                    archive.add(directory, arcname='.')
+        except Exception as e:
+            errors.append(e)
+
+    packer = threading.Thread(target=pack)
+    packer.daemon = True
+    packer.start()
+    with os.fdopen(read_fd, 'rb') as f:
+        for chunk in read_chunks(f):
+            yield chunk
+    packer.join()
+    if errors:
+        raise errors[0]
+
+
+class StagedFiles(object):
+    """
+    Files uploaded by :func:`upload_archive`.
+    """
+
+    def __init__(self, archive):
+        self.archive = archive
+        self.directory = archive[:-len('.tar.gz')]
+
+    def path(self, name):
+        """
+        Get the remote path of an extracted file.
+        """
+        return '%s/%s' % (self.directory, name)
+
+    def extract(self):
+        """
+        Get the command that extracts the archive.
+        """
+        return 'mkdir -p %(directory)s && ' \
+            'tar -xzf %(archive)s -C %(directory)s --no-same-owner' % {
+                'archive': quote(self.archive),
+                'directory': quote(self.directory),
+            }
+
+    def install(self, name, destination, owner=None, group=None, mode=None):
+        """
+        Get the command that atomically installs an extracted file.
+
+        The file is copied next to its *destination*, gets its owner
+        and mode, and is then renamed.
+        """
+        tmp = quote(destination + '.fabtools-new')
+        commands = ['cp %s %s' % (quote(self.path(name)), tmp)]
+        if owner or group:
+            commands.append('chown %s %s' % (
+                quote('%s:%s' % (owner or '', group or '')), tmp))
+        if mode:
+            commands.append('chmod %s %s' % (quote(str(mode)), tmp))
+        commands.append('mv -f %s %s' % (tmp, quote(destination)))
+        return ' && '.join(commands)
+
+    def cleanup(self):
+        """
+        Get the command that removes the archive and extracted files.
+        """
+        return 'rm -rf %s %s' % (quote(self.directory), quote(self.archive))
+
+    def script(self, commands):
+        """
+        Build a script that extracts the archive, runs the *commands*,
+        and always cleans up.
+
+        The exit status of the script is the status of the commands.
+        """
+        commands = [self.extract()] + list(commands)
+        return '%s; status=$?; %s; exit $status' % (
+            ' && '.join(commands), self.cleanup())
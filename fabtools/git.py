@@ -10,14 +10,18 @@ should normally not use them directly but rather use the high-level wrapper
 
 """
 
-from fabric.api import run
+import posixpath
+
+from fabric.api import hide, run, settings
 from fabric.api import sudo
 from fabric.context_managers import cd
 
 from fabtools.utils import run_as_root
 
 
-def clone(remote_url, path=None, use_sudo=False, user=None, branch=None):
+def clone(remote_url, path=None, use_sudo=False, user=None, branch=None,
+          depth=None, filter=None, sparse=None, reference=None,
+          dissociate=True):
     """
     Clone a remote Git repository into a new directory.
 
@@ -41,20 +45,242 @@ def clone(remote_url, path=None, use_sudo=False, user=None, branch=None):
                    pointed to by the cloned repository's HEAD, point to
                    branch ``branch`` instead.
     :type branch: str
-    """
 
-    cmd = 'git clone --quiet %s' % remote_url
+    :param depth: Create a shallow clone with only the given number of
+                  commits of history.
+    :type depth: int
+
+    :param filter: Create a partial clone, using the given object filter
+                   (e.g. ``blob:none`` to download file contents only when
+                   they are checked out).  The remote server must support
+                   it.
+    :type filter: str
+
+    :param sparse: List of directories to check out, leaving the others
+                   out of the working tree (requires git >= 2.25).  The
+                   ``path`` must be given.
+    :type sparse: list
+
+    :param reference: Path of a local repository of the same project
+                      (such as a mirror made by :func:`update_mirror`),
+                      from which objects are copied instead of being
+                      downloaded.
+    :type reference: str
+
+    :param dissociate: If ``True``, the objects of the ``reference``
+                       repository are copied, so that the working copy does
+                       not depend on it.  Otherwise, they are shared
+                       through the ``alternates`` mechanism, which uses
+                       less disk space.
+    :type dissociate: bool
+    """
+    _run(_clone_command(remote_url, path, branch, depth, filter, sparse,
+                        reference, dissociate),
+         use_sudo, user)
+
+
+def _clone_command(remote_url, path=None, branch=None, depth=None,
+                   filter=None, sparse=None, reference=None,
+                   dissociate=True):
+    cmd = 'git clone --quiet'
+    if reference:
+        cmd += ' --reference %s' % reference
+        if dissociate:
+            cmd += ' --dissociate'
+    if depth:
+        cmd += ' --depth %d' % depth
+    if filter:
+        cmd += ' --filter=%s' % filter
+    if sparse:
+        if path is None:
+            raise ValueError("Path to the working copy is needed for a "
+                             "sparse checkout")
+        cmd += ' --sparse'
+    cmd += ' %s' % remote_url
     if branch is not None:
         cmd = cmd + ' -b %s' % branch
     if path is not None:
         cmd = cmd + ' %s' % path
+    if sparse:
+        cmd += ' && cd %s && %s' % (path, _sparse_command(sparse))
+    return cmd
+
 
+def _sparse_command(sparse):
+    return 'git sparse-checkout set %s' % ' '.join(sparse)
+
+
+def _run(cmd, use_sudo=False, user=None):
     if use_sudo and user is None:
-        run_as_root(cmd)
+        return run_as_root(cmd)
     elif use_sudo:
-        sudo(cmd, user=user)
+        return sudo(cmd, user=user)
     else:
-        run(cmd)
+        return run(cmd)
+
+
+_STATUS_SEPARATOR = '--fabtools-git--'
+
+
+def status(path, use_sudo=False, user=None):
+    """
+    Get the state of a working copy with a single command.
+
+    Returns a dict with the following keys:
+
+    - ``exists``: whether the ``path`` exists
+    - ``repository``: whether it is a Git working copy
+    - ``head``: the commit checked out, or ``None``
+    - ``branch``: the branch checked out, or ``None`` if the ``HEAD`` is
+      detached (e.g. on a tag)
+    - ``dirty``: whether tracked files have uncommitted changes
+    - ``remote_url``: the URL of the ``origin`` remote, or ``None``
+
+    :param path: Path of the working copy directory.
+    :type path: str
+    """
+    with settings(hide('running', 'stdout', 'warnings'), warn_only=True):
+        res = _run(_status_command(path), use_sudo, user)
+    return _parse_status(res)
+
+
+_PATH_SEPARATOR = '--fabtools-git-path--'
+
+
+def statuses(paths, use_sudo=False, user=None):
+    """
+    Get the state of many working copies with a single command.
+
+    Returns a list of dicts, in the same order as *paths*, with the
+    keys described in :func:`status`.
+    """
+    if not paths:
+        return []
+    cmd = ' '.join(
+        'echo %s; ( %s );' % (_PATH_SEPARATOR, _status_command(path))
+        for path in paths)
+    with settings(hide('running', 'stdout', 'warnings'), warn_only=True):
+        res = _run(cmd, use_sudo, user)
+    return [_parse_status(output)
+            for output in res.split(_PATH_SEPARATOR)[1:]]
+
+
+def _status_command(path):
+    separator = 'echo %s; ' % _STATUS_SEPARATOR
+    return (
+        'if [ -e %(path)s/.git ]; then cd %(path)s && echo repository; '
+        + separator + 'git rev-parse -q --verify HEAD; '
+        + separator + 'git symbolic-ref -q --short HEAD; '
+        + separator + 'git status --porcelain --untracked-files=no; '
+        + separator + 'git config --get remote.origin.url; '
+        'elif [ -d %(path)s ]; then echo directory; '
+        'else echo missing; fi; true'
+    ) % {'path': path}
+
+
+def _parse_status(res):
+    sections = [section.strip() for section in
+                res.replace('\r\n', '\n').split(_STATUS_SEPARATOR)]
+    state = sections[0].splitlines()[-1] if sections[0] else 'missing'
+    if state != 'repository':
+        return {
+            'exists': state == 'directory',
+            'repository': False,
+            'head': None,
+            'branch': None,
+            'dirty': False,
+            'remote_url': None,
+        }
+    head, branch, changes, remote_url = sections[1:5]
+    return {
+        'exists': True,
+        'repository': True,
+        'head': head or None,
+        'branch': branch or None,
+        'dirty': bool(changes),
+        'remote_url': remote_url or None,
+    }
+
+
+def update(path, branch='master', use_sudo=False, user=None, fetch=True,
+           depth=None, sparse=None, source='origin', merge=True,
+           force=False):
+    """
+    Fetch changes and check out a branch or tag with a single command.
+
+    The changes of a branch on the ``origin`` remote are merged into the
+    local branch, as ``git pull`` does, so that commits made in the
+    working copy are kept.  With *force*, the local branch is reset to
+    its state on the remote instead, leaving out such commits (git still
+    refuses to overwrite uncommitted changes).  A tag is checked out as
+    a detached ``HEAD``.
+
+    :param path: Path of the working copy directory.
+    :type path: str
+
+    :param branch: Name of the branch or tag to check out.
+    :type branch: str
+
+    :param fetch: Whether to fetch changes from the ``origin`` remote.
+    :type fetch: bool
+
+    :param depth: Keep a shallow history of the given number of commits,
+                  fetching only the given branch or tag.
+    :type depth: int
+
+    :param sparse: List of directories to check out.
+    :type sparse: list
+
+    :param source: Remote name or path of a local repository (such as a
+                   mirror made by :func:`update_mirror`) to fetch from.
+                   The branches are always stored as ``origin`` remote
+                   branches.
+    :type source: str
+
+    :param merge: Whether to merge the remote changes into the branch.
+                  If ``False``, the branch is only checked out.
+    :type merge: bool
+
+    :param force: Whether to reset the branch to its state on the remote.
+    :type force: bool
+    """
+    _run(_update_command(path, branch, fetch, depth, sparse, source, merge,
+                         force),
+         use_sudo, user)
+
+
+def _update_command(path, branch='master', fetch=True, depth=None,
+                    sparse=None, source='origin', merge=True, force=False):
+    commands = ['cd %s' % path]
+    if fetch and depth:
+        commands.append(
+            '{ git fetch --quiet --depth %(depth)d %(source)s '
+            '+refs/heads/%(branch)s:refs/remotes/origin/%(branch)s || '
+            'git fetch --quiet --depth %(depth)d %(source)s tag %(branch)s; }'
+            % locals())
+    elif fetch and source != 'origin':
+        commands.append(
+            "git fetch --quiet --tags %(source)s "
+            "'+refs/heads/*:refs/remotes/origin/*'" % locals())
+    elif fetch:
+        commands.append('git fetch --quiet origin')
+    if sparse:
+        commands.append(_sparse_command(sparse))
+    if force:
+        commands.append(
+            'if git rev-parse -q --verify refs/remotes/origin/%(branch)s '
+            '>/dev/null; '
+            'then git checkout -q -B %(branch)s origin/%(branch)s; '
+            'else git checkout -q %(branch)s; fi' % locals())
+    else:
+        commands.append('git checkout -q %(branch)s' % locals())
+        if merge:
+            commands.append(
+                'if git symbolic-ref -q HEAD >/dev/null && '
+                'git rev-parse -q --verify refs/remotes/origin/%(branch)s '
+                '>/dev/null; then git merge -q --no-edit origin/%(branch)s; '
+                'fi' % locals())
+    return ' && '.join(commands)
 
 
 def add_remote(path, name, remote_url, use_sudo=False, user=None, fetch=True):
@@ -227,3 +453,34 @@ def checkout(path, branch="master", use_sudo=False, user=None, force=False):
             sudo(cmd, user=user)
         else:
             run(cmd)
+
+
+def update_mirror(remote_url, path, use_sudo=False, user=None):
+    """
+    Create or refresh a bare mirror of a remote repository, with a
+    single command.
+
+    The mirror holds all the branches and tags of the remote repository,
+    and can be used as a ``reference`` for :func:`clone`, or as a
+    ``source`` for :func:`update`, so that the working copies of the
+    same project on a host do not download the same objects again.
+
+    :param remote_url: URL of the remote repository.
+    :type remote_url: str
+
+    :param path: Path of the mirror directory.
+    :type path: str
+    """
+    _run(_mirror_command(remote_url, path), use_sudo, user)
+
+
+def _mirror_command(remote_url, path):
+    return (
+        'if [ -d %(path)s ]; then cd %(path)s && git fetch --quiet --prune; '
+        'else mkdir -p %(parent)s && '
+        'git clone --quiet --mirror %(remote_url)s %(path)s; fi'
+    ) % {
+        'path': path,
+        'parent': posixpath.dirname(path.rstrip('/')),
+        'remote_url': remote_url,
+    }
@@ -0,0 +1,173 @@
+"""
+Deferred handlers
+=================
+
+This module provides a way to defer actions, such as reloading or
+restarting a service after a configuration change, so that they run
+only once even if they were requested many times.
+
+Inside a :func:`deferred` block, the handlers notified by the
+``require`` functions (and by :class:`fabtools.files.watch` when given
+a *handler* name) are queued, deduplicated by name, and run once at
+the end of the block. Outside of such a block, handlers run right
+away, like they always did.
+
+Example::
+
+    from fabtools import require
+    from fabtools.handlers import deferred
+
+    # nginx is only reloaded once, at the end of the block
+    with deferred():
+        for name in ['site1.example.com', 'site2.example.com']:
+            require.nginx.site(name, template_contents=TEMPLATE)
+
+"""
+
+from contextlib import contextmanager
+from collections import OrderedDict
+from functools import partial
+import os
+
+from fabric.api import env, settings
+
+
+_queues = []
+
+
+@contextmanager
+def deferred():
+    """
+    Context manager to defer and coalesce the handlers notified in a block.
+
+    The handlers are run at the end of the block, in the order they were
+    first notified, unless a handler depends on another one (see
+    :func:`notify`). If the block raises an exception, the handlers
+    are not run.
+
+    Nested blocks share the queue of the outermost block.
+
+    Handlers are run on the host where they were notified, so a block
+    may wrap a call to :func:`fabric.api.execute` on several hosts.
+
+    .. warning:: In Fabric's parallel mode, the task of each host runs in
+                 a separate process, which cannot add handlers to the
+                 queue of the block.  Handlers notified there are run
+                 right away instead, as if there was no block.  Use a
+                 :func:`deferred` block inside the parallel task to
+                 coalesce them for each host.
+    """
+    queue = _current_queue()
+    if queue is not None:
+        yield queue
+        return
+
+    queue = OrderedDict()
+    _queues.append((os.getpid(), queue))
+    try:
+        yield queue
+    finally:
+        _queues.pop()
+    _run(queue)
+
+
+def _current_queue():
+    """
+    Get the queue of the current block, if it was opened in this process.
+    """
+    while _queues and _queues[-1][0] != os.getpid():
+        # Forked by Fabric's parallel mode: the block belongs to the parent
+        _queues.pop()
+    return _queues[-1][1] if _queues else None
+
+
+def notify(name, callback, after=None):
+    """
+    Notify a handler.
+
+    Inside a :func:`deferred` block, the *callback* is queued under
+    *name*, and is only run once at the end of the block, no matter
+    how many times the handler was notified. Otherwise, it is called
+    right away.
+
+    *after* is an optional list of handler names that must be run
+    before this one, if they are queued.
+
+    ::
+
+        from functools import partial
+
+        from fabtools.handlers import notify
+        from fabtools.supervisor import update_config, start_process
+
+        notify('update supervisor', update_config)
+        notify('start myapp', partial(start_process, 'myapp'),
+               after=['update supervisor'])
+
+    """
+    queue = _current_queue()
+    if queue is None:
+        callback()
+        return
+
+    key = (env.host_string, name)
+    if key not in queue:
+        queue[key] = (callback, list(after or []))
+
+
+def is_notified(name):
+    """
+    Check if a handler is queued for the current host.
+    """
+    queue = _current_queue()
+    return queue is not None and (env.host_string, name) in queue
+
+
+def reload_service(service):
+    """
+    Notify a handler that reloads a service.
+
+    The reload is skipped if a restart of the same service is already
+    queued, as a restart also loads the new configuration.
+    """
+    from fabtools.service import reload
+
+    if not is_notified('restart %s' % service):
+        notify('reload %s' % service, partial(reload, service))
+
+
+def restart_service(service):
+    """
+    Notify a handler that restarts a service.
+
+    A queued reload of the same service is replaced by the restart.
+    """
+    from fabtools.service import restart
+
+    queue = _current_queue()
+    if queue is not None:
+        queue.pop((env.host_string, 'reload %s' % service), None)
+    notify('restart %s' % service, partial(restart, service))
+
+
+def _run(queue):
+    """
+    Run the queued handlers, honoring their dependencies.
+    """
+    done = set()
+
+    def run_handler(key, pending):
+        if key in done or key in pending:
+            return
+        callback, after = queue[key]
+        host_string = key[0]
+        for name in after:
+            dependency = (host_string, name)
+            if dependency in queue:
+                run_handler(dependency, pending | set([key]))
+        with settings(host_string=host_string):
+            callback()
+        done.add(key)
+
+    for key in list(queue):
+        run_handler(key, set())
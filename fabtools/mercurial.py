@@ -10,7 +10,7 @@ You should normally not use them directly but rather use the high-level wrapper
 
 """
 
-from fabric.api import run
+from fabric.api import hide, run, settings
 from fabric.api import sudo
 from fabric.context_managers import cd
 
@@ -113,3 +113,146 @@ def pull(path, use_sudo=False, user=None):
             sudo(cmd, user=user)
         else:
             run(cmd)
+
+
+def _run(cmd, use_sudo=False, user=None):
+    if use_sudo and user is None:
+        return run_as_root(cmd)
+    elif use_sudo:
+        return sudo(cmd, user=user)
+    else:
+        return run(cmd)
+
+
+# Use the command server client if available, to avoid the startup time
+# of the Python interpreter for each hg command
+_HG = 'if which chg >/dev/null 2>&1; then HG=chg; else HG=hg; fi; '
+
+_STATUS_SEPARATOR = '--fabtools-hg--'
+
+
+def status(path, use_sudo=False, user=None, remote=False):
+    """
+    Get the state of a working copy with a single command.
+
+    Returns a dict with the following keys:
+
+    - ``exists``: whether the ``path`` exists
+    - ``repository``: whether it is a Mercurial working copy
+    - ``revision``: the changeset id of the working directory parent
+    - ``branch``: the name of the branch
+    - ``dirty``: whether tracked files have uncommitted changes
+    - ``incoming``: if *remote* is ``True``, whether the default remote
+      repository has changesets that are not in the working copy (this
+      contacts the remote repository), else ``None``
+
+    :param path: Path of the working copy directory.
+    :type path: str
+
+    :param remote: Whether to check for incoming changesets.
+    :type remote: bool
+    """
+    with settings(hide('running', 'stdout', 'warnings'), warn_only=True):
+        res = _run(_HG + _status_command(path, remote), use_sudo, user)
+    return _parse_status(res, remote)
+
+
+_PATH_SEPARATOR = '--fabtools-hg-path--'
+
+
+def statuses(paths, use_sudo=False, user=None, remote=False):
+    """
+    Get the state of many working copies with a single command.
+
+    Returns a list of dicts, in the same order as *paths*, with the
+    keys described in :func:`status`.
+    """
+    if not paths:
+        return []
+    cmd = _HG + ' '.join(
+        'echo %s; ( %s );' % (_PATH_SEPARATOR, _status_command(path, remote))
+        for path in paths)
+    with settings(hide('running', 'stdout', 'warnings'), warn_only=True):
+        res = _run(cmd, use_sudo, user)
+    return [_parse_status(output, remote)
+            for output in res.split(_PATH_SEPARATOR)[1:]]
+
+
+def _status_command(path, remote=False):
+    separator = 'echo %s; ' % _STATUS_SEPARATOR
+    return (
+        'if [ -d %(path)s/.hg ]; then cd %(path)s && echo repository; ' +
+        separator + '$HG identify --id --branch; ' +
+        separator + ('$HG incoming --quiet >/dev/null; echo $?; '
+                     if remote else '') +
+        'elif [ -d %(path)s ]; then echo directory; '
+        'else echo missing; fi; true'
+    ) % {'path': path}
+
+
+def _parse_status(res, remote=False):
+    sections = [section.strip() for section in
+                res.replace('\r\n', '\n').split(_STATUS_SEPARATOR)]
+    state = sections[0].splitlines()[-1] if sections[0] else 'missing'
+    if state != 'repository':
+        return {
+            'exists': state == 'directory',
+            'repository': False,
+            'revision': None,
+            'branch': None,
+            'dirty': False,
+            'incoming': None,
+        }
+    revision, branch = sections[1].split()
+    return {
+        'exists': True,
+        'repository': True,
+        'revision': revision.rstrip('+'),
+        'branch': branch,
+        'dirty': revision.endswith('+'),
+        'incoming': sections[2] == '0' if remote else None,
+    }
+
+
+def sync(path, remote_url=None, branch='default', use_sudo=False,
+         user=None, pull=True):
+    """
+    Clone or pull a repository, and update the working copy to a branch,
+    with a single command.
+
+    If the ``path`` is not a working copy yet, the ``remote_url`` is
+    cloned.  Otherwise, changesets are pulled from the default remote
+    repository if ``pull`` is ``True``.
+
+    The ``chg`` command server client is used if it is installed, so that
+    the Python interpreter is not started for each ``hg`` command.
+
+    Returns the changeset id of the working copy after the update.
+
+    :param path: Path of the working copy directory.
+    :type path: str
+
+    :param remote_url: URL of the remote repository, to clone it.
+    :type remote_url: str
+
+    :param branch: Branch or tag to update to.
+    :type branch: str
+    """
+    with settings(hide('stdout')):
+        res = _run(_sync_command(path, remote_url, branch, pull), use_sudo,
+                   user)
+    return res.splitlines()[-1].strip() if res else None
+
+
+def _sync_command(path, remote_url=None, branch='default', pull=True):
+    if remote_url is not None:
+        prepare = '$HG --quiet clone --noupdate %s %s' % (remote_url, path)
+    elif pull:
+        prepare = '$HG --quiet pull -R %s' % path
+    else:
+        prepare = 'true'
+    return _HG + ' && '.join([
+        prepare,
+        '$HG --quiet update -R %s %s' % (path, branch),
+        '$HG identify --id -R %s' % path,
+    ])
@@ -8,53 +8,185 @@ This module provides tools for creating MySQL users and databases.
 from __future__ import with_statement
 
 from pipes import quote
+import re
 
 from fabric.api import env, hide, puts, run, settings
+import six
 
-from fabtools.system import UnsupportedFamily, distrib_family
 from fabtools.utils import run_as_root
 
 
-def query(query, use_sudo=True, **kwargs):
+def query(query, use_sudo=True, force=False, **kwargs):
     """
     Run a MySQL query.
-    """
-    family = distrib_family()
-    if family == 'debian':
-        from fabtools.deb import install, is_installed
-    elif family == 'redhat':
-        from fabtools.rpm import install, is_installed
-    else:
-        raise UnsupportedFamily(supported=['debian', 'redhat'])
 
-    func = use_sudo and run_as_root or run
+    If *force* is ``True``, the following statements are still run when
+    one of them fails.
 
-    user = kwargs.get('mysql_user') or env.get('mysql_user')
-    password = kwargs.get('mysql_password') or env.get('mysql_password')
-    func_mysql = 'mysql'
-    mysql_host = kwargs.get('mysql_host') or env.get('mysql_host')
+    The credentials are taken from the ``mysql_user``, ``mysql_password``
+    and ``mysql_host`` keyword arguments, or from the same keys in the
+    Fabric ``env``. The password is not put on the ``mysql`` command
+    line: it is written to a private temporary defaults file, which is
+    removed in the same command. Note that it is still part of the
+    command sent to the remote shell, so it may briefly show in the
+    arguments of that shell.
+    """
+    func = use_sudo and run_as_root or run
 
     options = [
         '--batch',
         '--raw',
         '--skip-column-names',
     ]
+    if force:
+        options.append('--force')
+    return func(_client_command(
+        'mysql', options, '--execute=%s' % quote(query), kwargs))
+
+
+def _client_command(program, options, arguments, kwargs, stdin=None,
+                    stdout=None):
+    """
+    Build the command running a MySQL client program, with the
+    credentials given in *kwargs* or in the Fabric ``env``.
+
+    *stdin* and *stdout* are optional commands to pipe the input from,
+    and the output to.
+    """
+    user = kwargs.get('mysql_user') or env.get('mysql_user')
+    password = kwargs.get('mysql_password') or env.get('mysql_password')
+    mysql_host = kwargs.get('mysql_host') or env.get('mysql_host')
+
+    options = list(options)
+    if password:
+        # Must come first
+        options.insert(0, '--defaults-extra-file="$f"')
     if user:
         options.append('--user=%s' % quote(user))
-    if password:
-        if not is_installed('sshpass'):
-            install('sshpass')
-        func_mysql = 'sshpass -p %(password)s mysql' % {'password': quote(password)}
-        options.append('--password')
     if mysql_host:
         options.append('--host=%s' % quote(mysql_host))
-    options = ' '.join(options)
 
-    return func('%(cmd)s %(options)s --execute=%(query)s' % {
-        'cmd': func_mysql,
-        'options': options,
-        'query': quote(query),
-    })
+    command = '%s %s %s' % (program, ' '.join(options), arguments)
+    if stdin:
+        command = '%s | %s' % (stdin, command)
+    if stdout:
+        command = '%s | %s' % (command, stdout)
+    if password:
+        # Option files unescape backslashes and quotes in quoted values
+        password = password.replace('\\', '\\\\').replace('"', '\\"')
+        command = (
+            'f=$(mktemp) && printf %(format)s %(password)s >"$f" && '
+            '%(command)s; status=$?; rm -f "$f"; exit $status' % {
+                'format': quote(r'[client]\npassword="%s"\n'),
+                'password': quote(password),
+                'command': command,
+            })
+    return command
+
+
+_STATEMENT_SEPARATOR = '--fabtools-statement--'
+
+
+def queries(statements, use_sudo=True, force=False, **kwargs):
+    """
+    Run several MySQL statements with a single ``mysql`` command.
+
+    Returns a list with the output of each statement. If a statement
+    fails (and ``warn_only`` is set), the list only holds the output
+    of the statements that ran before it, unless *force* is ``True``:
+    then the output of the failed statements is empty.
+
+    Extra arguments are passed to :py:func:`query`.
+
+    ::
+
+        import fabtools
+
+        users, databases = fabtools.mysql.queries([
+            'SELECT User FROM mysql.user',
+            'SHOW DATABASES',
+        ])
+
+    """
+    framed = []
+    for statement in statements:
+        framed.append(statement.strip().rstrip(';'))
+        framed.append("SELECT '%s'" % _STATEMENT_SEPARATOR)
+    res = query(';\n'.join(framed) + ';', use_sudo=use_sudo, force=force,
+                **kwargs)
+
+    outputs = []
+    lines = []
+    for line in res.splitlines():
+        if line.strip() == _STATEMENT_SEPARATOR:
+            outputs.append('\n'.join(lines))
+            lines = []
+        else:
+            lines.append(line)
+    return outputs
+
+
+def snapshot(accounts=(), **kwargs):
+    """
+    Get the MySQL users, databases and grants with a single command.
+
+    The grants are only read for the *accounts* given as
+    ``(user, host)`` tuples.
+
+    Returns a dict with a ``users`` set of ``(user, host)`` tuples,
+    a ``databases`` set, and a ``grants`` dict mapping each existing
+    account to a list of ``(privileges, target, grant_option)`` tuples,
+    where *privileges* is a frozenset.
+
+    Extra arguments are passed to :py:func:`query`.
+    """
+    accounts = list(accounts)
+    statements = [
+        'SELECT User, Host FROM mysql.user',
+        'SELECT SCHEMA_NAME FROM information_schema.SCHEMATA',
+    ]
+    statements += ["SHOW GRANTS FOR '%s'@'%s'" % account
+                   for account in accounts]
+    with settings(hide('running', 'stdout', 'stderr', 'warnings'),
+                  warn_only=True):
+        outputs = queries(statements, force=True, **kwargs)
+    outputs += [''] * (len(statements) - len(outputs))
+
+    users = set(tuple(line.split('\t', 1)) for line in outputs[0].splitlines())
+    databases = set(outputs[1].split())
+    grants = {}
+    for account, output in zip(accounts, outputs[2:]):
+        if account in users:
+            grants[account] = [grant for grant in map(
+                _parse_grant, output.splitlines()) if grant is not None]
+    return {'users': users, 'databases': databases, 'grants': grants}
+
+
+def _parse_grant(line):
+    """
+    Parse a line of ``SHOW GRANTS`` output.
+
+    Returns ``None`` for the lines that do not grant privileges on a
+    database object, such as the role grants of MySQL 8 and the
+    ``PROXY`` grants.
+    """
+    match = re.match(r'^GRANT (.+?) ON (\S+) TO .*?( WITH GRANT OPTION)?$',
+                     line)
+    if match is None or match.group(1).strip().upper() == 'PROXY':
+        return None
+    privileges, target, grant_option = match.groups()
+    return (_privileges(privileges), target.replace('`', ''),
+            bool(grant_option))
+
+
+def _privileges(privileges):
+    # Do not split the column lists of privileges like SELECT (a, b)
+    names = set(' '.join(name.split()).upper()
+                for name in re.split(r',(?![^()]*\))', privileges))
+    if 'ALL' in names:
+        names.remove('ALL')
+        names.add('ALL PRIVILEGES')
+    return frozenset(names)
 
 
 def user_exists(name, host='localhost', **kwargs):
@@ -124,17 +256,89 @@ def create_database(name, owner=None, owner_host='localhost', charset='utf8',
     """
     with settings(hide('running')):
 
-        query("CREATE DATABASE %(name)s CHARACTER SET %(charset)s COLLATE %(collate)s;" % {
-            'name': name,
-            'charset': charset,
-            'collate': collate
-        }, **kwargs)
-
-        if owner:
-            query("GRANT ALL PRIVILEGES ON %(name)s.* TO '%(owner)s'@'%(owner_host)s' WITH GRANT OPTION;" % {
+        statements = [
+            "CREATE DATABASE %(name)s CHARACTER SET %(charset)s COLLATE %(collate)s;" % {
                 'name': name,
-                'owner': owner,
-                'owner_host': owner_host
-            }, **kwargs)
+                'charset': charset,
+                'collate': collate
+            },
+        ]
+        if owner:
+            statements.append(
+                "GRANT ALL PRIVILEGES ON %(name)s.* TO '%(owner)s'@'%(owner_host)s' WITH GRANT OPTION;" % {
+                    'name': name,
+                    'owner': owner,
+                    'owner_host': owner_host
+                })
+        queries(statements, **kwargs)
 
     puts("Created MySQL database '%s'." % name)
+
+
+def load(name, source, use_sudo=True, **kwargs):
+    """
+    Load an SQL dump into a MySQL database.
+
+    *source* is a local path or file object, holding an SQL dump,
+    possibly compressed with ``gzip``. The dump is compressed on the fly
+    (unless it already is) and streamed over the SSH connection to the
+    ``mysql`` client, without temporary files.
+
+    Extra arguments are used for the credentials, as in :py:func:`query`.
+
+    ::
+
+        import fabtools
+
+        fabtools.mysql.load('myapp', 'seed.sql.gz')
+
+    """
+    from fabtools.utils import gzip_chunks, read_chunks, stream
+
+    if isinstance(source, six.string_types):
+        with open(source, 'rb') as f:
+            return load(name, f, use_sudo=use_sudo, **kwargs)
+
+    command = _client_command('mysql', [], quote(name), kwargs,
+                              stdin='gunzip -c')
+    return stream('set -o pipefail; ' + command,
+                  stdin=gzip_chunks(read_chunks(source)),
+                  user='root' if use_sudo else None,
+                  label='Loading %s' % name)
+
+
+def dump(name, destination, use_sudo=True, **kwargs):
+    """
+    Dump a MySQL database to a local file.
+
+    *destination* is a local path or file object. The dump is made with
+    ``mysqldump --single-transaction``, compressed with ``gzip`` on the
+    remote host, streamed over the SSH connection and, unless
+    *destination* is a path ending with ``.gz``, decompressed on the fly.
+
+    Extra arguments are used for the credentials, as in :py:func:`query`.
+
+    ::
+
+        import fabtools
+
+        fabtools.mysql.dump('myapp', 'myapp.sql.gz')
+
+    """
+    from fabtools.utils import GunzipWriter, stream
+
+    if isinstance(destination, six.string_types):
+        with open(destination, 'wb') as f:
+            if not destination.endswith('.gz'):
+                f = GunzipWriter(f)
+            return dump(name, f, use_sudo=use_sudo, **kwargs)
+
+    command = _client_command(
+        'mysqldump', ['--single-transaction', '--routines'], quote(name),
+        kwargs, stdout='gzip -c')
+    status = stream('set -o pipefail; ' + command, stdout=destination,
+                    user='root' if use_sudo else None,
+                    label='Dumping %s' % name)
+    if hasattr(destination, 'flush'):
+        destination.flush()
+    return status
@@ -17,10 +17,13 @@ try:
 except ImportError:
     import simplejson as json
 
-from fabric.api import cd, hide, run, settings
+from functools import partial
+
+from fabric.api import cd, env, hide, run, settings
+import six
 
 from fabtools.system import cpus, distrib_family
-from fabtools.utils import run_as_root
+from fabtools.utils import host_cache, run_as_root
 
 
 DEFAULT_VERSION = '0.10.13'
@@ -39,10 +42,25 @@ def install_from_source(version=DEFAULT_VERSION, checkinstall=False):
         # Install Node.js
         fabtools.nodejs.install_nodejs()
 
+    If the build cache is enabled (see :mod:`fabtools.build`), Node.js
+    is only compiled once for all similar hosts, and the other hosts do
+    not need a compiler. The cache is not used with *checkinstall*.
+
     .. note:: This function may not work for old versions of Node.js.
 
     """
+    from fabtools.build import cache_enabled, install_cached
+
+    if cache_enabled() and not checkinstall:
+        install_cached('nodejs', version, partial(_build, version))
+    else:
+        _build(version, checkinstall=checkinstall)
 
+
+def _build(version, destdir='', checkinstall=False):
+    """
+    Compile Node.js, and install it under *destdir*.
+    """
     from fabtools.require.deb import packages as require_deb_packages
     from fabtools.require.rpm import packages as require_rpm_packages
     from fabtools.require import file as require_file
@@ -82,7 +100,9 @@ def install_from_source(version=DEFAULT_VERSION, checkinstall=False):
     with cd(foldername):
         run('./configure')
         run('make -j%d' % (cpus() + 1))
-        if checkinstall:
+        if destdir:
+            run('make install DESTDIR=%(destdir)s' % locals())
+        elif checkinstall:
             run_as_root(
                 'checkinstall -y --pkgname=nodejs --pkgversion=%(version) '
                 '--showinstall=no make install' % locals())
@@ -122,16 +142,44 @@ def install_package(package, version=None, local=False, npm='npm'):
         fabtools.nodejs.install_package('underscore', local=False)
 
     """
-    if version:
-        package += '@%s' % version
+    install_packages({package: version}, local=local, npm=npm)
+
+
+def install_packages(packages, local=False, npm='npm'):
+    """
+    Install several Node.js packages with a single ``npm`` command.
+
+    *packages* is a list of package names, or a dict mapping package
+    names to versions (or ``None`` for the latest version).
+
+    If *local* is ``True``, the packages will be installed locally.
+
+    ::
+
+        import fabtools
+
+        fabtools.nodejs.install_packages({
+            'express': '4.14.0',
+            'forever': None,
+        })
+
+    """
+    if not isinstance(packages, dict):
+        packages = dict.fromkeys(packages)
+    if not packages:
+        return
+    specs = ' '.join(
+        name + ('@%s' % version if version else '')
+        for name, version in sorted(packages.items()))
 
     if local:
-        run('%(npm)s install -l %(package)s' % locals())
+        run('%(npm)s install -l %(specs)s' % locals())
     else:
-        run_as_root('HOME=/root %(npm)s install -g %(package)s' % locals())
+        run_as_root('HOME=/root %(npm)s install -g %(specs)s' % locals())
+    _forget(local, npm)
 
 
-def install_dependencies(npm='npm'):
+def install_dependencies(npm='npm', ci=False):
     """
     Install Node.js package dependencies.
 
@@ -139,16 +187,88 @@ def install_dependencies(npm='npm'):
     packages specified as dependencies in the ``package.json`` file
     found in the current directory.
 
+    If *ci* is ``True`` and a lockfile (``package-lock.json`` or
+    ``npm-shrinkwrap.json``) is found, ``npm ci`` is used instead. It
+    installs the exact versions of the lockfile, without resolving the
+    dependencies again, which is much faster for deployments.
+
     ::
 
         from fabric.api import cd
         from fabtools import nodejs
 
         with cd('/path/to/nodejsapp/'):
-            nodejs.install_dependencies()
+            nodejs.install_dependencies(ci=True)
 
     """
-    run('%(npm)s install' % locals())
+    if ci:
+        run('if [ -f package-lock.json ] || [ -f npm-shrinkwrap.json ]; '
+            'then %(npm)s ci; else %(npm)s install; fi' % locals())
+    else:
+        run('%(npm)s install' % locals())
+    _forget(True, npm)
+
+
+_snapshots = host_cache()
+
+
+def snapshot(local=False, npm='npm', refresh=False):
+    """
+    Get the installed Node.js packages.
+
+    The top-level packages are listed with a single ``npm list``
+    command, the first time this function is called for a host and a
+    prefix (the global prefix, or the current directory if *local* is
+    ``True``). The snapshot is then kept until the packages are changed
+    by the functions of this module. Use *refresh* to list them again,
+    if they were changed by other means.
+
+    Returns a dict mapping package names to versions.
+
+    ::
+
+        from fabtools.nodejs import snapshot
+
+        versions = snapshot()
+        if 'forever' not in versions:
+            print(u"forever is not installed")
+
+    """
+    cache = _snapshots.setdefault(env.host_string, {})
+    key = _snapshot_key(local, npm)
+    if refresh or key not in cache:
+        options = '-l' if local else '-g'
+        with settings(hide('running', 'stdout', 'stderr', 'warnings'),
+                      warn_only=True):
+            res = run('%(npm)s list %(options)s --depth=0 --json --silent'
+                      % locals(), pty=False)
+        cache[key] = _parse_listing(res)
+    return dict(cache[key])
+
+
+def _snapshot_key(local, npm):
+    if local:
+        return (npm, env.get('cwd', ''))
+    return (npm, None)
+
+
+def _forget(local, npm):
+    _snapshots.get(env.host_string, {}).pop(_snapshot_key(local, npm), None)
+
+
+def _parse_listing(output):
+    """
+    Parse the output of ``npm list --json``.
+    """
+    try:
+        listing = json.loads(output or '{}')
+    except ValueError:
+        return {}
+    return dict(
+        (name, data['version'])
+        for name, data in six.iteritems(listing.get('dependencies', {}))
+        if data.get('version')
+    )
 
 
 def package_version(package, local=False, npm='npm'):
@@ -157,23 +277,11 @@ def package_version(package, local=False, npm='npm'):
 
     Returns ``None``is the package is not installed. If *local* is
     ``True``, returns the version of the locally installed package.
-    """
-    options = ['--json true', '--silent']
-    if local:
-        options.append('-l')
-    else:
-        options.append('-g')
-    options = ' '.join(options)
-
-    with hide('running', 'stdout'):
-        res = run('%(npm)s list %(options)s' % locals(), pty=False)
 
-    dependencies = json.loads(res).get('dependencies', {})
-    pkg_data = dependencies.get(package)
-    if pkg_data:
-        return pkg_data['version']
-    else:
-        return None
+    The version is looked up in the :func:`snapshot` of the installed
+    packages.
+    """
+    return snapshot(local=local, npm=npm).get(package)
 
 
 def update_package(package, local=False, npm='npm'):
@@ -186,6 +294,7 @@ def update_package(package, local=False, npm='npm'):
         run('%(npm)s update -l %(package)s' % locals())
     else:
         run_as_root('HOME=/root %(npm)s update -g %(package)s' % locals())
+    _forget(local, npm)
 
 
 def uninstall_package(package, version=None, local=False, npm='npm'):
@@ -212,3 +321,4 @@ def uninstall_package(package, version=None, local=False, npm='npm'):
         run('%(npm)s uninstall -l %(package)s' % locals())
     else:
         run_as_root('HOME=/root %(npm)s uninstall -g %(package)s' % locals())
+    _forget(local, npm)
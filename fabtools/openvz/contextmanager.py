@@ -4,17 +4,15 @@ OpenVZ containers
 """
 
 from contextlib import contextmanager
-import hashlib
+from pipes import quote
+import io
 import os
-import posixpath
-import tempfile
 
 from fabric.api import (
     env,
     hide,
     output,
     settings,
-    sudo,
 )
 from fabric.operations import (
     _AttributeString,
@@ -27,13 +25,14 @@ from fabric.operations import (
 from fabric.state import default_channel
 from fabric.utils import error
 import fabric.operations
-import fabric.sftp
 
 from fabric.context_managers import (
     quiet as quiet_manager,
     warn_only as warn_only_manager,
 )
 
+from fabtools.utils import stream
+
 
 @contextmanager
 def guest(name_or_ctid):
@@ -47,6 +46,10 @@ def guest(name_or_ctid):
                  Use ``sudo(command, user='foo')`` to run them as
                  an unpriviledged user.
 
+    Files uploaded with ``put()`` are streamed directly into the
+    container, without temporary files on the host.  A file that replaces
+    an existing one keeps its mode and owner, unless a ``mode`` is given.
+
     Example::
 
         from fabtools.openvz import guest
@@ -63,7 +66,7 @@ def guest(name_or_ctid):
 
     # Monkey patch fabric operations
     _orig_run_command = fabric.operations._run_command
-    _orig_put = fabric.sftp.SFTP.put
+    _orig_put = fabric.operations.SFTP.put
 
     def run_guest_command(command, shell=True, pty=True, combine_stderr=True,
                           sudo=False, user=None, quiet=False, warn_only=False,
@@ -104,76 +107,83 @@ def guest(name_or_ctid):
                                  combine_stderr=combine_stderr)
 
     def put_guest(self, local_path, remote_path, use_sudo, mirror_local_mode,
-                  mode, local_is_path):
+                  mode, local_is_path, temp_dir=None):
         """
         Upload file to a guest container
         """
-        pre = self.ftp.getcwd()
-        pre = pre if pre else ''
-        if local_is_path and self.isdir(remote_path):
-            basename = os.path.basename(local_path)
-            remote_path = posixpath.join(remote_path, basename)
         if output.running:
             print("[%s] put: %s -> %s" % (
                 env.host_string,
                 local_path if local_is_path else '<file obj>',
-                posixpath.join(pre, remote_path)
+                remote_path
             ))
 
-        # Have to bounce off FS if doing file-like objects
-        fd, real_local_path = None, local_path
-        if not local_is_path:
-            fd, real_local_path = tempfile.mkstemp()
-            old_pointer = local_path.tell()
-            local_path.seek(0)
-            file_obj = os.fdopen(fd, 'wb')
-            file_obj.write(local_path.read())
-            file_obj.close()
-            local_path.seek(old_pointer)
-
-        # Use temporary file with a unique name on the host machine
-        guest_path = remote_path
-        hasher = hashlib.sha1()
-        hasher.update(env.host_string)
-        hasher.update(name_or_ctid)
-        hasher.update(guest_path)
-        host_path = hasher.hexdigest()
-
-        # Upload the file to host machine
-        rattrs = self.ftp.put(real_local_path, host_path)
-
-        # Copy file to the guest container
-        with settings(hide('everything'), cwd=""):
-            cmd = "cat \"%s\" | vzctl exec \"%s\" 'cat - > \"%s\"'" \
-                % (host_path, name_or_ctid, guest_path)
-            _orig_run_command(cmd, sudo=True)
-
-        # Revert to original remote_path for return value's sake
-        remote_path = guest_path
-
-        # Clean up
-        if not local_is_path:
-            os.remove(real_local_path)
-
-        # Handle modes if necessary
         if (local_is_path and mirror_local_mode) or (mode is not None):
             lmode = os.stat(local_path).st_mode if mirror_local_mode else mode
             lmode = lmode & 0o7777
-            rmode = rattrs.st_mode & 0o7777
-            if lmode != rmode:
-                with hide('everything'):
-                    sudo('chmod %o \"%s\"' % (lmode, remote_path))
-
-        return remote_path
+        else:
+            lmode = None
+
+        if local_is_path:
+            with open(local_path, 'rb') as f:
+                return _upload(name_or_ctid, f, remote_path, mode=lmode,
+                               basename=os.path.basename(local_path))
+        else:
+            old_pointer = local_path.tell()
+            local_path.seek(0)
+            try:
+                return _upload(name_or_ctid, local_path, remote_path,
+                               mode=lmode)
+            finally:
+                local_path.seek(old_pointer)
 
     fabric.operations._run_command = run_guest_command
-    fabric.sftp.SFTP.put = put_guest
+    fabric.operations.SFTP.put = put_guest
 
-    yield
+    try:
+        yield
+    finally:
+        # Monkey unpatch
+        fabric.operations._run_command = _orig_run_command
+        fabric.operations.SFTP.put = _orig_put
+
+
+def _upload(name_or_ctid, fileobj, remote_path, mode=None, basename=None):
+    """
+    Stream a local file object to a path inside a guest container.
 
-    # Monkey unpatch
-    fabric.operations._run_command = _orig_run_command
-    fabric.sftp.SFTP.put = _orig_put
+    The data is sent to the standard input of ``vzctl exec2``, without a
+    temporary file on the host.  Inside the container, it is written to a
+    temporary file next to the target, which gets the mode and owner of
+    the file it replaces (or *mode*, if given) before being renamed, so
+    that the target is never left half-written.  The temporary file is
+    removed if anything fails.
+
+    If *basename* is given and *remote_path* is a directory, the file is
+    uploaded with this name inside the directory.
+
+    Returns the path of the uploaded file.
+    """
+    script = 'cd 2>/dev/null || true; p=%s; ' % quote(remote_path)
+    if basename:
+        script += 'if [ -d "$p" ]; then p="$p"/%s; fi; ' % quote(basename)
+    script += (
+        't="$p.fabtools-$$"; '
+        '{ cat > "$t" && '
+        'if [ -e "$p" ]; then chmod "$(stat -c %a "$p")" "$t" && '
+        'chown "$(stat -c %U:%G "$p")" "$t"; fi'
+    )
+    if mode is not None:
+        script += ' && chmod %o "$t"' % mode
+    script += ' && mv -f "$t" "$p" && echo "$p"; } || { rm -f "$t"; exit 1; }'
+
+    result = io.BytesIO()
+    with settings(hide('running'), cwd='', command_prefixes=[], path='',
+                  shell_env={}):
+        stream('vzctl exec2 %s %s' % (name_or_ctid, quote(script)),
+               stdin=fileobj, stdout=result, user='root',
+               label='Uploading %s' % remote_path)
+    return result.getvalue().decode('utf-8').strip() or remote_path
 
 
 @contextmanager
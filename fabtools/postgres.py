@@ -4,9 +4,24 @@ PostgreSQL users and databases
 
 This module provides tools for creating PostgreSQL users and databases.
 
+The existence checks are answered from a snapshot of the PostgreSQL
+catalog (see :func:`catalog`), which is fetched with a single command
+the first time it is needed on a host, and then kept up to date by
+the functions of this module.
+
 """
 
-from fabric.api import cd, hide, sudo, settings
+from collections import OrderedDict
+from pipes import quote
+import itertools
+import os
+import re
+import zlib
+
+from fabric.api import cd, env, hide, sudo, settings
+import six
+
+from fabtools.utils import host_cache
 
 
 def _run_as_pg(command):
@@ -17,14 +32,169 @@ def _run_as_pg(command):
         return sudo(command, user='postgres')
 
 
-def user_exists(name):
+def query(sql, database='postgres'):
     """
-    Check if a PostgreSQL user exists.
+    Run one or more SQL statements with ``psql``, in a single command.
+
+    The statements are run as the ``postgres`` user, and the
+    output is unaligned, without headers, with ``|`` between columns.
+
+    ::
+
+        import fabtools
+
+        res = fabtools.postgres.query('SELECT datname FROM pg_database')
+        databases = res.splitlines()
+
+    """
+    with settings(hide('running', 'stdout')):
+        return _run_as_pg('psql -X -q -t -A -v ON_ERROR_STOP=1 -d %s -c %s' % (
+            quote(database), quote(sql)))
+
+
+_CATALOG_QUERY = (
+    "SELECT CASE WHEN rolcanlogin THEN 'user' ELSE 'role' END, rolname "
+    "FROM pg_roles UNION ALL SELECT 'database', datname FROM pg_database"
+)
+
+_CATALOG_SEPARATOR = '--fabtools-catalog--'
+
+_catalogs = host_cache()
+
+
+def catalog(refresh=False):
+    """
+    Get a snapshot of the PostgreSQL catalog of the current host.
+
+    The roles, the databases and the locales available on the system
+    are fetched with a single command the first time this function is
+    called for a host, and the snapshot is then updated by the functions
+    of this module that create or drop objects. Use *refresh* to fetch
+    it again, if the catalog was changed by other means.
+
+    Returns a dict with ``roles``, ``users`` (the roles that can log
+    in), ``databases`` and ``locales`` sets, and a ``schemas`` dict
+    caching the schemas of each database (see :func:`schemas`).
+
+    ::
+
+        import fabtools
+
+        roles = fabtools.postgres.catalog()['roles']
+
     """
+    key = env.host_string
+    if refresh or key not in _catalogs:
+        with settings(hide('running', 'stdout', 'stderr', 'warnings'),
+                      warn_only=True):
+            res = _run_as_pg(
+                'psql -X -t -A -c %(query)s; echo "%(separator)s $?"; '
+                'locale -a' % {
+                    'query': quote(_CATALOG_QUERY),
+                    'separator': _CATALOG_SEPARATOR,
+                })
+        objects, _, rest = res.partition(_CATALOG_SEPARATOR)
+        status, _, locales = rest.partition('\n')
+        snapshot = {
+            'roles': set(),
+            'users': set(),
+            'databases': set(),
+            'locales': set(_normalize_locale(locale)
+                           for locale in locales.split()),
+            'schemas': {},
+        }
+        for line in objects.splitlines():
+            kind, sep, name = line.partition('|')
+            if sep:
+                snapshot[kind + 's'].add(name)
+                if kind == 'user':
+                    snapshot['roles'].add(name)
+        if status.strip() != '0':
+            # PostgreSQL is not available (yet), so don't keep this
+            return snapshot
+        _catalogs[key] = snapshot
+    return _catalogs[key]
+
+
+def _normalize_locale(locale):
+    """
+    Normalize a locale name, so that ``en_US.UTF-8`` and ``en_US.utf8``
+    are the same.
+    """
+    name, sep, codeset = locale.partition('.')
+    codeset = re.sub(r'[^a-z0-9@]', '', codeset.lower())
+    return name + sep + codeset
+
+
+def has_locale(locale):
+    """
+    Check if a locale is available on the system.
+    """
+    return _normalize_locale(locale) in catalog()['locales']
+
+
+def _fetch_schemas(databases):
+    """
+    Fetch the schemas of many databases with a single command.
+    """
+    commands = []
+    for database in databases:
+        commands.append('echo %s %s; psql -X -t -A -d %s -c %s' % (
+            _CATALOG_SEPARATOR, quote(database), quote(database),
+            quote('SELECT nspname FROM pg_namespace')))
     with settings(hide('running', 'stdout', 'stderr', 'warnings'),
                   warn_only=True):
-        res = _run_as_pg('''psql -t -A -c "SELECT COUNT(*) FROM pg_user WHERE usename = '%(name)s';"''' % locals())
-    return (res == "1")
+        res = _run_as_pg('; '.join(commands))
+
+    snapshot = catalog()
+    database = None
+    for line in res.splitlines():
+        if line.startswith(_CATALOG_SEPARATOR + ' '):
+            database = line.split(None, 1)[1]
+            snapshot['schemas'][database] = set()
+        elif database is not None and line.strip():
+            snapshot['schemas'][database].add(line.strip())
+
+
+def _forget(kind, name):
+    snapshot = _catalogs.get(env.host_string)
+    if snapshot is not None:
+        snapshot[kind].discard(name)
+
+
+def _remember(kind, name):
+    snapshot = _catalogs.get(env.host_string)
+    if snapshot is not None:
+        snapshot[kind].add(name)
+        if kind == 'databases':
+            snapshot['schemas'].pop(name, None)
+
+
+def _remember_user(name, login):
+    _remember('roles', name)
+    if login:
+        _remember('users', name)
+
+
+def schemas(database):
+    """
+    Get the set of schemas in a database.
+
+    The result is kept in the :func:`catalog` snapshot.
+    """
+    snapshot = catalog()
+    if database not in snapshot['schemas']:
+        _fetch_schemas([database])
+    return snapshot['schemas'].get(database, set())
+
+
+def user_exists(name):
+    """
+    Check if a PostgreSQL user exists.
+
+    Roles that cannot log in, such as group roles, are not users.
+    """
+    return name in catalog()['users']
 
 
 def create_user(name, password, superuser=False, createdb=False,
@@ -46,6 +216,16 @@ def create_user(name, password, superuser=False, createdb=False,
             createdb=True, createrole=True, connection_limit=20)
 
     """
+    options = _user_options(password, superuser, createdb, createrole,
+                            inherit, login, connection_limit,
+                            encrypted_password)
+    _run_as_pg('''psql -c "CREATE USER "'"%(name)s"'" %(options)s;"''' % locals())
+    _remember_user(name, login)
+
+
+def _user_options(password, superuser=False, createdb=False,
+                  createrole=False, inherit=True, login=True,
+                  connection_limit=None, encrypted_password=False):
     options = [
         'SUPERUSER' if superuser else 'NOSUPERUSER',
         'CREATEDB' if createdb else 'NOCREATEDB',
@@ -56,9 +236,42 @@ def create_user(name, password, superuser=False, createdb=False,
     if connection_limit is not None:
         options.append('CONNECTION LIMIT %d' % connection_limit)
     password_type = 'ENCRYPTED' if encrypted_password else 'UNENCRYPTED'
-    options.append("%s PASSWORD '%s'" % (password_type, password))
-    options = ' '.join(options)
-    _run_as_pg('''psql -c "CREATE USER "'"%(name)s"'" %(options)s;"''' % locals())
+    options.append("%s PASSWORD '%s'" % (password_type,
+                                         password.replace("'", "''")))
+    return ' '.join(options)
+
+
+def _quote_ident(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def create_users(users):
+    """
+    Create many PostgreSQL users in a single transaction.
+
+    *users* is a list of dicts, with the arguments of :func:`create_user`.
+    If one of the users cannot be created, none of them is.
+
+    ::
+
+        import fabtools
+
+        fabtools.postgres.create_users([
+            {'name': 'tenant1', 'password': 's3cr3t'},
+            {'name': 'tenant2', 'password': 's3cr3t', 'createdb': True},
+        ])
+
+    """
+    statements = ['BEGIN']
+    for user in users:
+        options = dict(user)
+        name = options.pop('name')
+        statements.append('CREATE USER %s %s' % (_quote_ident(name),
+                                                 _user_options(**options)))
+    statements.append('COMMIT')
+    query(';\n'.join(statements) + ';')
+    for user in users:
+        _remember_user(user['name'], user.get('login', True))
 
 
 def drop_user(name):
@@ -75,15 +288,15 @@ def drop_user(name):
 
     """
     _run_as_pg('''psql -c "DROP USER %(name)s;"''' % locals())
+    _forget('roles', name)
+    _forget('users', name)
 
 
 def database_exists(name):
     """
     Check if a PostgreSQL database exists.
     """
-    with settings(hide('running', 'stdout', 'stderr', 'warnings'),
-                  warn_only=True):
-        return _run_as_pg('''psql -d %(name)s -c ""''' % locals()).succeeded
+    return name in catalog()['databases']
 
 
 def create_database(name, owner, template='template0', encoding='UTF8',
@@ -103,6 +316,60 @@ def create_database(name, owner, template='template0', encoding='UTF8',
     _run_as_pg('''createdb --owner %(owner)s --template %(template)s \
                   --encoding=%(encoding)s --lc-ctype=%(locale)s \
                   --lc-collate=%(locale)s %(name)s''' % locals())
+    _remember('databases', name)
+
+
+_FAILED_MARKER = '--fabtools-failed--'
+
+
+def create_databases(databases, concurrency=4):
+    """
+    Create many PostgreSQL databases with a single command.
+
+    *databases* is a list of dicts, with the arguments of
+    :func:`create_database`. As ``createdb`` cannot run inside a
+    transaction, up to *concurrency* databases are created at the same
+    time.
+
+    Returns the list of the databases that could not be created.
+
+    ::
+
+        import fabtools
+
+        failed = fabtools.postgres.create_databases([
+            {'name': 'tenant1', 'owner': 'tenant1'},
+            {'name': 'tenant2', 'owner': 'tenant2'},
+        ])
+
+    """
+    commands = []
+    for index, database in enumerate(databases):
+        options = {
+            'template': 'template0',
+            'encoding': 'UTF8',
+            'locale': 'en_US.UTF-8',
+        }
+        options.update(database)
+        options = dict((key, quote(value)) for key, value in options.items())
+        options['marker'] = _FAILED_MARKER
+        commands.append(
+            'createdb --owner %(owner)s --template %(template)s '
+            '--encoding=%(encoding)s --lc-ctype=%(locale)s '
+            '--lc-collate=%(locale)s %(name)s '
+            '|| echo %(marker)s %(name)s &' % options)
+        if (index + 1) % concurrency == 0:
+            commands.append('wait;')
+    commands.append('wait')
+    with settings(hide('running', 'stdout')):
+        res = _run_as_pg(' '.join(commands))
+
+    failed = [line.split(None, 1)[1] for line in res.splitlines()
+              if line.startswith(_FAILED_MARKER + ' ')]
+    for database in databases:
+        if database['name'] not in failed:
+            _remember('databases', database['name'])
+    return failed
 
 
 def drop_database(name):
@@ -119,6 +386,17 @@ def drop_database(name):
 
     """
     _run_as_pg('''dropdb %(name)s''' % locals())
+    _forget('databases', name)
+    snapshot = _catalogs.get(env.host_string)
+    if snapshot is not None:
+        snapshot['schemas'].pop(name, None)
+
+
+def schema_exists(name, database):
+    """
+    Check if a schema exists within a database.
+    """
+    return name in schemas(database)
 
 
 def create_schema(name, database, owner=None):
@@ -130,3 +408,210 @@ def create_schema(name, database, owner=None):
     else:
         _run_as_pg(
             '''psql %(database)s -c "CREATE SCHEMA %(name)s"''' % locals())
+    snapshot = _catalogs.get(env.host_string)
+    if snapshot is not None and database in snapshot['schemas']:
+        snapshot['schemas'][database].add(name)
+
+
+def create_schemas(schemas):
+    """
+    Create many schemas, in one or more databases, with a single command.
+
+    *schemas* is a list of dicts, with the arguments of
+    :func:`create_schema`. The schemas of each database are created
+    in a single transaction.
+    """
+    by_database = OrderedDict()
+    for schema in schemas:
+        statement = 'CREATE SCHEMA %s' % _quote_ident(schema['name'])
+        if schema.get('owner'):
+            statement += ' AUTHORIZATION %s' % _quote_ident(schema['owner'])
+        by_database.setdefault(schema['database'], []).append(statement)
+
+    commands = []
+    for database, statements in by_database.items():
+        commands.append('psql -X -q -v ON_ERROR_STOP=1 -d %s -c %s' % (
+            quote(database), quote('; '.join(statements))))
+    with settings(hide('running', 'stdout')):
+        _run_as_pg(' && '.join(commands))
+
+    snapshot = _catalogs.get(env.host_string)
+    for schema in schemas:
+        if snapshot is not None and schema['database'] in snapshot['schemas']:
+            snapshot['schemas'][schema['database']].add(schema['name'])
+
+
+def load(name, source, jobs=None):
+    """
+    Load a dump into a PostgreSQL database.
+
+    *source* is a local path or file object, holding either a plain SQL
+    dump (possibly compressed with ``gzip``) or a custom-format dump
+    (made with ``pg_dump -Fc``). The dump is compressed on the fly
+    (unless it already is) and streamed over the SSH connection to
+    ``psql`` or ``pg_restore``, without temporary files.
+
+    As parallel restore needs random access to the dump, *jobs* is
+    only used for directory-format dumps (made with ``pg_dump -Fd``),
+    given as the path of a local directory. Such a dump is streamed as
+    a ``tar`` archive to a remote temporary directory, restored with
+    ``pg_restore --jobs``, and removed.
+
+    ::
+
+        import fabtools
+
+        fabtools.postgres.load('myapp', 'seed.sql.gz')
+        fabtools.postgres.load('myapp', 'myapp.dump.d', jobs=8)
+
+    """
+    from fabtools.files import tar_chunks
+    from fabtools.utils import gzip_chunks, read_chunks, stream
+
+    label = 'Loading %s' % name
+    if isinstance(source, six.string_types) and os.path.isdir(source):
+        restore = 'pg_restore --exit-on-error -d %s "$d"' % quote(name)
+        if jobs:
+            restore = restore.replace(' -d ', ' --jobs=%d -d ' % jobs, 1)
+        command = ('d=$(mktemp -d) && tar -xzf - -C "$d" && %s; '
+                   'status=$?; rm -rf "$d"; exit $status' % restore)
+        with cd('~postgres'):
+            return stream(command, stdin=tar_chunks(source), user='postgres',
+                          label=label)
+
+    if isinstance(source, six.string_types):
+        with open(source, 'rb') as f:
+            return load(name, f, jobs=jobs)
+
+    chunks = read_chunks(source)
+    head = next(chunks, b'')
+    if head.startswith(b'\x1f\x8b'):
+        custom = zlib.decompressobj(31).decompress(head).startswith(b'PGDMP')
+    else:
+        custom = head.startswith(b'PGDMP')
+    if custom:
+        command = 'pg_restore --exit-on-error -d %s' % quote(name)
+    else:
+        command = 'psql -X -q -v ON_ERROR_STOP=1 -d %s' % quote(name)
+    chunks = gzip_chunks(itertools.chain([head], chunks))
+    with cd('~postgres'):
+        return stream('set -o pipefail; gunzip -c | ' + command,
+                      stdin=chunks, user='postgres', label=label)
+
+
+def dump(name, destination, format='custom'):
+    """
+    Dump a PostgreSQL database to a local file.
+
+    *destination* is a local path or file object. The *format* is
+    either ``custom`` (for ``pg_restore``) or ``plain`` (SQL). Plain
+    dumps are compressed with ``gzip`` on the remote host, streamed
+    over the SSH connection and, unless *destination* is a path ending
+    with ``.gz``, decompressed on the fly.
+
+    ::
+
+        import fabtools
+
+        fabtools.postgres.dump('myapp', 'myapp.dump')
+        fabtools.postgres.dump('myapp', 'myapp.sql.gz', format='plain')
+
+    """
+    from fabtools.utils import GunzipWriter, stream
+
+    if isinstance(destination, six.string_types):
+        with open(destination, 'wb') as f:
+            if format == 'plain' and not destination.endswith('.gz'):
+                return dump(name, GunzipWriter(f), format=format)
+            return dump(name, f, format=format)
+
+    if format == 'custom':
+        command = 'pg_dump -Fc %s' % quote(name)
+    elif format == 'plain':
+        command = 'set -o pipefail; pg_dump %s | gzip -c' % quote(name)
+    else:
+        raise ValueError('Unsupported dump format: %r' % format)
+    with cd('~postgres'):
+        status = stream(command, stdout=destination, user='postgres',
+                        label='Dumping %s' % name)
+    if hasattr(destination, 'flush'):
+        destination.flush()
+    return status
+
+
+# Settings that need a server restart to be changed
+RESTART_SETTINGS = frozenset([
+    'huge_pages',
+    'max_connections',
+    'max_worker_processes',
+    'shared_buffers',
+])
+
+
+def tuning_profile(cpus, memory, ssd=True, connections=100,
+                   version=90300):
+    """
+    Compute PostgreSQL settings suited to the hardware.
+
+    *memory* is the total RAM in bytes, *ssd* tells if the data is on
+    solid-state storage, *connections* is the expected number of
+    connections, and *version* is the server version number (as in
+    ``server_version_num``), to only use the settings it supports.
+
+    Returns an ordered dict of settings, with values formatted for
+    ``postgresql.conf``.
+
+    ::
+
+        from fabtools.postgres import tuning_profile
+
+        settings = tuning_profile(cpus=64, memory=256 * 1024 ** 3,
+                                  connections=400, version=100000)
+
+    """
+    mb = memory // (1024 * 1024)
+    workers = max(cpus, 1)
+    per_gather = min(max(workers // 2, 1), 4)
+
+    shared_buffers = mb // 4
+    if version < 90300:
+        # Older versions need System V shared memory for all of it
+        shared_buffers = min(shared_buffers, 8192)
+    work_mem = (mb - shared_buffers) * 1024 // (connections * 3)
+    if version >= 90600:
+        work_mem //= per_gather
+    work_mem = max(work_mem, 4096)
+
+    profile = OrderedDict()
+    profile['shared_buffers'] = '%dMB' % shared_buffers
+    profile['effective_cache_size'] = '%dMB' % (mb * 3 // 4)
+    profile['work_mem'] = '%dkB' % work_mem
+    profile['maintenance_work_mem'] = '%dMB' % min(mb // 16, 2048)
+    if version >= 90500:
+        profile['min_wal_size'] = '%dMB' % min(max(mb // 64, 80), 4096)
+        profile['max_wal_size'] = '%dMB' % min(max(mb // 16, 1024), 16384)
+    profile['checkpoint_completion_target'] = '0.9'
+    profile['random_page_cost'] = '1.1' if ssd else '4'
+    profile['effective_io_concurrency'] = '200' if ssd else '2'
+    if version >= 90400:
+        profile['max_worker_processes'] = str(workers)
+        profile['huge_pages'] = 'try' if mb >= 32768 else 'off'
+    if version >= 90600:
+        profile['max_parallel_workers_per_gather'] = str(per_gather)
+    if version >= 100000:
+        profile['max_parallel_workers'] = str(workers)
+    if version >= 110000:
+        profile['max_parallel_maintenance_workers'] = str(per_gather)
+    return profile
+
+
+def huge_pages_needed(profile):
+    """
+    Get the number of 2 MB huge pages needed for the shared buffers of
+    a :func:`tuning_profile`, or 0 if huge pages are not used.
+    """
+    if profile.get('huge_pages', 'off') == 'off':
+        return 0
+    shared_buffers = int(profile['shared_buffers'][:-len('MB')])
+    # Leave room for the other shared memory segments
+    return shared_buffers * 105 // 100 // 2 + 1
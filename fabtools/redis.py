@@ -0,0 +1,152 @@
+"""
+Redis
+=====
+
+This module provides tools to tune and benchmark `Redis`_ instances
+installed by :func:`fabtools.require.redis.instance`.
+
+.. _Redis: http://redis.io/
+
+"""
+
+from collections import OrderedDict
+import csv
+
+from fabric.api import hide, puts, run, settings
+
+
+PROFILES = ('cache', 'store')
+
+
+def _parse_version(version):
+    return tuple(map(int, version.split('.')))
+
+
+def tuning_profile(profile, cpus, memory, version, memory_share=1.0):
+    """
+    Compute Redis settings suited to the hardware.
+
+    *profile* is either ``'cache'``, for an instance that holds data
+    that can be rebuilt (persistence is disabled, and the least recently
+    used keys are evicted when memory is full), or ``'store'``, for an
+    instance that holds data that must be kept (writes fail instead of
+    evicting keys when memory is full).
+
+    *memory* is the total RAM in bytes, and *version* is the Redis
+    version, to only use the directives it supports: the TCP backlog
+    needs 2.8, lazy freeing needs 4.0 and I/O threads need 6.0.
+
+    The memory limit is computed from the part of the RAM given to the
+    instance, which is all of it by default. When a host runs several
+    instances, set *memory_share* to the fraction of the RAM that each
+    one may use (such as ``0.5`` for two instances of the same size), so
+    that together they do not use more memory than the host has.
+
+    Returns an ordered dict of configuration directives.
+
+    ::
+
+        from fabtools.redis import tuning_profile
+
+        settings = tuning_profile('cache', cpus=8, memory=16 * 1024 ** 3,
+                                  version='6.0.9')
+
+    """
+    if profile not in PROFILES:
+        raise ValueError('Unknown Redis tuning profile: %r' % profile)
+
+    if not 0 < memory_share <= 1:
+        raise ValueError('Invalid Redis memory share: %r' % memory_share)
+
+    version = _parse_version(version)
+    mb = int(memory * memory_share) // (1024 * 1024)
+
+    params = OrderedDict()
+    params['loglevel'] = 'notice'
+    if profile == 'cache':
+        params['maxmemory'] = '%dmb' % (mb * 3 // 4)
+        params['maxmemory-policy'] = 'allkeys-lru'
+        params['save'] = ['""']
+        params['appendonly'] = 'no'
+    else:
+        # Leave room for the copy-on-write pages of background saves
+        params['maxmemory'] = '%dmb' % (mb // 2)
+        params['maxmemory-policy'] = 'noeviction'
+    if version >= (2, 8):
+        params['tcp-backlog'] = '65535'
+        params['tcp-keepalive'] = '300'
+    if version >= (4, 0):
+        params['lazyfree-lazy-eviction'] = 'yes'
+        params['lazyfree-lazy-expire'] = 'yes'
+        params['lazyfree-lazy-server-del'] = 'yes'
+    if version >= (6, 0) and cpus >= 4:
+        # Keep some cores for the main thread and the kernel
+        params['io-threads'] = str(min(cpus * 3 // 4, 8))
+        params['io-threads-do-reads'] = 'yes'
+    return params
+
+
+def benchmark(port=6379, host='127.0.0.1', version=None, requests=100000,
+              clients=50, tests=('set', 'get'), pipeline=1):
+    """
+    Benchmark a Redis instance using the bundled ``redis-benchmark``.
+
+    The benchmark runs on the remote host, against the instance
+    listening on *host* and *port*, using the binaries of the given
+    Redis *version* (by default, the version installed by
+    :func:`fabtools.require.redis.installed_from_source`).
+
+    Returns an ordered dict of the number of requests per second for
+    each test.
+
+    Run it before and after a change, and use :func:`report` to show
+    the difference::
+
+        from fabtools import require
+        from fabtools.redis import benchmark, report
+
+        before = benchmark()
+        require.redis.instance('mydb', profile='cache')
+        report(before, benchmark())
+
+    """
+    if version is None:
+        from fabtools.require.redis import VERSION as version
+
+    redis_benchmark = '/opt/redis-%(version)s/redis-benchmark' % locals()
+    tests = ','.join(tests)
+    command = (
+        '%(redis_benchmark)s -h %(host)s -p %(port)s -n %(requests)s'
+        ' -c %(clients)s -P %(pipeline)s -t %(tests)s --csv' % locals())
+    with settings(hide('running', 'stdout')):
+        res = run(command)
+    return _parse_benchmark(res)
+
+
+def _parse_benchmark(output):
+    """
+    Parse the CSV output of ``redis-benchmark``.
+    """
+    results = OrderedDict()
+    for row in csv.reader(output.splitlines()):
+        if len(row) < 2:
+            continue
+        try:
+            results[row[0]] = float(row[1])
+        except ValueError:
+            # Header line of newer versions
+            continue
+    return results
+
+
+def report(before, after):
+    """
+    Show the requests per second of two :func:`benchmark` results.
+    """
+    for test, ops in after.items():
+        if test in before and before[test]:
+            change = (ops - before[test]) * 100 / before[test]
+            puts('%s: %.0f -> %.0f requests per second (%+.1f%%)' % (
+                test, before[test], ops, change))
+        else:
+            puts('%s: %.0f requests per second' % (test, ops))
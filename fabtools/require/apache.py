@@ -7,11 +7,7 @@ the `Apache HTTP Server <http://httpd.apache.org/>`_.
 
 """
 
-from fabric.api import (
-    abort,
-    hide,
-    settings,
-)
+from fabric.api import abort
 from fabric.colors import red
 
 from fabtools.apache import (
@@ -20,12 +16,16 @@ from fabtools.apache import (
     disable_site,
     enable_site,
     _site_config_path,
+    _site_link_path,
 )
-from fabtools.service import reload as reload_service
+from fabtools.handlers import reload_service
+from fabtools.service import reload as reload_now
 from fabtools.system import UnsupportedFamily, distrib_family
-from fabtools.utils import run_as_root
 
-from fabtools.require.files import template_file
+from fabtools.require.files import (
+    files as require_files,
+    symlinks as require_symlinks,
+)
 from fabtools.require.service import started as require_started
 
 
@@ -59,7 +59,8 @@ def module_enabled(module):
     """
     Require an Apache module to be enabled.
 
-    This will cause Apache to reload its configuration.
+    This will cause Apache to reload its configuration (see
+    :func:`fabtools.handlers.deferred`).
 
     ::
 
@@ -76,7 +77,8 @@ def module_disabled(module):
     """
     Require an Apache module to be disabled.
 
-    This will cause Apache to reload its configuration.
+    This will cause Apache to reload its configuration (see
+    :func:`fabtools.handlers.deferred`).
 
     ::
 
@@ -93,7 +95,8 @@ def site_enabled(config):
     """
     Require an Apache site to be enabled.
 
-    This will cause Apache to reload its configuration.
+    This will cause Apache to reload its configuration (see
+    :func:`fabtools.handlers.deferred`).
 
     ::
 
@@ -110,7 +113,8 @@ def site_disabled(config):
     """
     Require an Apache site to be disabled.
 
-    This will cause Apache to reload its configuration.
+    This will cause Apache to reload its configuration (see
+    :func:`fabtools.handlers.deferred`).
 
     ::
 
@@ -132,6 +136,10 @@ def site(site_name, template_contents=None, template_source=None, enabled=True,
     string (*template_contents*) or as the path to a local template
     file (*template_source*).
 
+    Apache is then reloaded. Inside a :func:`fabtools.handlers.deferred`
+    block, it is only reloaded once, at the end of the block, however
+    many sites were changed.
+
     ::
 
         from fabtools import require
@@ -163,32 +171,101 @@ def site(site_name, template_contents=None, template_source=None, enabled=True,
 
     .. seealso:: :py:func:`fabtools.require.files.template_file`
     """
-    server()
+    spec = dict(kwargs)
+    spec.update({
+        'site_name': site_name,
+        'template_contents': template_contents,
+        'template_source': template_source,
+        'enabled': enabled,
+    })
+    sites([spec], check_config=check_config)
 
-    config_path = _site_config_path(site_name)
 
-    context = {
-        'port': 80,
-    }
-    context.update(kwargs)
-    context['config_name'] = site_name
+def sites(specs, check_config=True):
+    """
+    Require several Apache sites.
 
-    template_file(config_path, template_contents, template_source, context,
-                  use_sudo=True)
+    *specs* is a list of dicts, each with a ``site_name`` key, a
+    ``template_contents`` or ``template_source`` key, an optional
+    ``enabled`` key (defaults to ``True``), and the other keys used as
+    the template context, as accepted by :func:`site`.
 
-    if enabled:
-        enable_site(site_name)
-    else:
-        disable_site(site_name)
+    All the configuration files are rendered locally, and the ones that
+    changed are uploaded as a single archive. The links in
+    ``/etc/apache2/sites-enabled`` are then updated with a single
+    command, and the configuration is tested once with ``apache2ctl
+    configtest``. If the test fails, the changed sites are bisected to
+    find the broken ones, which are disabled for safety before aborting.
 
-    if check_config:
-        with settings(hide('running', 'warnings'), warn_only=True):
-            if run_as_root('apache2ctl configtest').failed:
-                disable_site(site_name)
-                message = red("Error in %(site_name)s apache site config (disabling for safety)" % locals())
-                abort(message)
+    Apache is reloaded if anything changed (see
+    :func:`fabtools.handlers.deferred`).
 
-    reload_service('apache2')
+    ::
+
+        from fabtools import require
+
+        require.apache.sites([
+            {
+                'site_name': 'tenant%d.example.com' % i,
+                'template_contents': CONFIG_TPL,
+                'hostname': 'tenant%d.example.com' % i,
+                'document_root': '/var/www/tenant%d' % i,
+            }
+            for i in range(1000)
+        ])
+
+    """
+    server()
+
+    contents = {}
+    links = {}
+    names = {}
+    for spec in specs:
+        spec = dict(spec)
+        site_name = spec.pop('site_name')
+        template_contents = spec.pop('template_contents', None)
+        template_source = spec.pop('template_source', None)
+        enabled = spec.pop('enabled', True)
+
+        context = {
+            'port': 80,
+        }
+        context.update(spec)
+        context['config_name'] = site_name
+
+        config_path = _site_config_path(site_name)
+        contents[config_path] = _render(template_contents, template_source,
+                                        context)
+        link_path = _site_link_path(site_name)
+        links[link_path] = config_path if enabled else None
+        names[link_path] = site_name
+
+    changed_files = require_files(contents, use_sudo=True, owner='root',
+                                  group='root', mode='644')
+    suspects = [
+        link_path for link_path, config_path in links.items()
+        if config_path in changed_files
+    ]
+    changed_links, broken = require_symlinks(
+        links, check='apache2ctl configtest' if check_config else None,
+        suspects=suspects, use_sudo=True)
+
+    if broken:
+        if changed_links or set(suspects) - set(broken):
+            reload_now('apache2')
+        site_names = ', '.join(names[link_path] for link_path in broken)
+        message = red("Error in %(site_names)s apache site config (disabling for safety)" % locals())
+        abort(message)
+
+    if changed_files or changed_links:
+        reload_service('apache2')
+
+
+def _render(template_contents, template_source, context):
+    if template_contents is None:
+        with open(template_source) as template_file:
+            template_contents = template_file.read()
+    return template_contents % context
 
 
 # backward compatibility (deprecated)
@@ -11,7 +11,6 @@ This module provides high-level tools for managing `Bazaar`_ repositories.
 from __future__ import with_statement
 
 import os
-import posixpath
 
 from six.moves.urllib.parse import urlparse
 
@@ -19,7 +18,6 @@ from fabric.api import abort, env, puts, run
 from fabric.colors import cyan
 
 from fabtools import bazaar, utils
-from fabtools.files import is_dir
 from fabtools.system import UnsupportedFamily
 
 
@@ -77,6 +75,10 @@ def working_copy(source, target=None, version=None, update=True, force=False,
 
     If the ``target`` exists and ``update`` is ``False``, nothing will be done.
 
+    The state of the ``target`` is read with a single command (see
+    :func:`fabtools.bazaar.status`), and changes are applied with another
+    single command (see :func:`fabtools.bazaar.sync`).
+
     :param source: URL/path of the source branch
     :type source: str
 
@@ -113,52 +115,36 @@ def working_copy(source, target=None, version=None, update=True, force=False,
     command()
 
     suargs = dict(use_sudo=use_sudo, user=user)
-    vfsargs = dict(version=version, force=force, **suargs)  # vers, force, su
-    before = None
-    exists = False
-    local_mods = False
     src_url = urlparse(source)
 
-    def ensure_tree(dir):
-        if not is_dir(posixpath.join(dir, '.bzr', 'checkout'),
-                      use_sudo=use_sudo):
-            bazaar.checkout(dir, **suargs)
-
     if target is None:
         src_path = os.getcwd() if src_url.path == '.' else src_url.path
         target = src_path.split('/')[-1]
 
-    if is_dir(target, use_sudo=use_sudo) and not update:
+    state = bazaar.status(target, **suargs)
+
+    if state['exists'] and not update:
         puts(("Working tree '%s' already exists, "
               "not updating (update=False)") % target)
         return
 
-    if is_dir(posixpath.join(target, '.bzr'), use_sudo=use_sudo):
-        ensure_tree(target)
+    before = state['revno']
+    local_mods = state['dirty']
 
-        before = bazaar.get_version(target)
-        exists = True
-        local_mods = bazaar.has_local_mods(target)
-
-        if local_mods and force:
-            bazaar.reset(target, **suargs)
-        elif local_mods:
-            abort(("Working tree '%s' has local modifications; "
-                   "use force=True to discard them") % target)
+    if local_mods and not force:
+        abort(("Working tree '%s' has local modifications; "
+               "use force=True to discard them") % target)
 
     if src_url.scheme in ('', 'file'):  # local source
         target_url = 'bzr+ssh://%s/%s' % (
             env.host_string, utils.abspath(target))
         bazaar.push(target_url, source=source, version=version, force=force)
-        ensure_tree(target)
-        bazaar.switch_version(target, version=version, **suargs)
+        after = bazaar.sync(target, version=version, revert=local_mods,
+                            **suargs)
     else:  # remote source
-        if exists:
-            bazaar.pull(target, location=source, **vfsargs)
-            bazaar.switch_version(target, version=version, **suargs)
-        else:
-            bazaar.clone(source, target, **vfsargs)
-    after = bazaar.get_version(target)
+        after = bazaar.sync(target, source=source, version=version,
+                            force=force, clone=not state['branch'],
+                            revert=local_mods, **suargs)
 
     if before != after or local_mods:
         chg = 'created at revision'
@@ -10,10 +10,13 @@ from fabtools.conda import (
     is_conda_installed,
     install_miniconda,
     create_env,
+    create_env_from_spec,
     env_exists,
     env,
     install,
-    is_installed
+    is_installed,
+    _channel_packages,
+    _explicit_packages,
 )
 from fabtools.system import UnsupportedFamily, distrib_family
 
@@ -31,21 +34,37 @@ def conda(prefix='~/miniconda', use_sudo=False):
         install_miniconda(prefix=prefix, use_sudo=use_sudo)
 
 
-def env(name=None, pkg_list=None, **kwargs):
+def env(name=None, pkg_list=None, spec_file=None, **kwargs):
     """
     Require a conda environment.
     If pkg_list is given, these are also required.
 
+    If *spec_file* is given, the environment is created from this local
+    explicit spec file, without running the dependency solver (see
+    :func:`fabtools.conda.create_env_from_spec`). An existing
+    environment is created again if the names, versions or builds of
+    its conda packages differ from the spec. Packages installed with
+    ``pip`` are not taken into account.
+
     :param name: name of environment
     :param pkg_list: list of required packages
+    :param spec_file: local explicit spec file
     :param **kwargs: arguments to fabtools.conda.create_env()
     """
 
     conda()
 
-    prefix = kwargs.get('prefix', None)
-    if not env_exists(name=name, prefix=prefix):
-        create_env(name=name, packages=pkg_list, **kwargs)
+    prefix = kwargs.pop('prefix', None)
+    if spec_file:
+        with open(spec_file) as f:
+            wanted = _explicit_packages(f.read())
+        if not env_exists(name=name, prefix=prefix) or \
+                _channel_packages(name=name, prefix=prefix) != wanted:
+            create_env_from_spec(spec_file, name=name, prefix=prefix,
+                                 use_sudo=kwargs.get('use_sudo', False),
+                                 user=kwargs.get('user'))
+    elif not env_exists(name=name, prefix=prefix):
+        create_env(name=name, prefix=prefix, packages=pkg_list, **kwargs)
     else:
         packages(pkg_list, name=name, prefix=prefix, **kwargs)
 
@@ -64,5 +83,25 @@ def packages(pkg_list, name=None, prefix=None, **kwargs):
     """
     Require several conda packages.
 
+    The installed packages are read from a single listing (see
+    :func:`fabtools.conda.list_packages`), and the missing packages are
+    all installed with a single ``conda install`` command, so that the
+    dependency solver runs only once.
+
+    Packages may include a version, such as ``numpy=1.11``, but not a
+    version range (see :func:`fabtools.conda.parse_spec`).
+
+    Returns the list of the packages that were installed.
+
+    ::
+
+        from fabtools import require
+
+        require.conda.packages(['numpy=1.11', 'pandas'], name='myenv')
+
     """
-    install(pkg_list, name=name, prefix=prefix, **kwargs)
+    missing = [pkg for pkg in pkg_list or []
+               if not is_installed(pkg, name=name, prefix=prefix)]
+    if missing:
+        install(missing, name=name, prefix=prefix, **kwargs)
+    return missing
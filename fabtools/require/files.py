@@ -12,13 +12,14 @@ from tempfile import mkstemp
 from six.moves.urllib.parse import urlparse
 import hashlib
 import os
+import posixpath
 
 import six
 
 if six.PY2:
     from future_builtins import oct  # NOQA isort:skip
 
-from fabric.api import hide, put, run, settings
+from fabric.api import abort, hide, put, run, settings
 
 from fabtools.files import (
     group as _group,
@@ -28,6 +29,7 @@ from fabtools.files import (
     mode as _mode,
     owner as _owner,
     umask,
+    upload_archive,
 )
 from fabtools.utils import run_as_root
 
@@ -216,6 +218,169 @@ def template_file(path=None, template_contents=None, template_source=None,
     file(path=path, contents=template_contents % context, **kwargs)
 
 
+def files(contents, use_sudo=False, owner=None, group=None, mode=None):
+    """
+    Require several files to have specific contents.
+
+    *contents* is a dict mapping remote paths to file contents. The MD5
+    digests of the existing files are checked with a single command,
+    and only the files that differ are uploaded, in a single archive,
+    and atomically installed with a single command.
+
+    Returns the sorted list of the paths that were changed.
+
+    ::
+
+        from fabtools import require
+
+        require.files.files({
+            '/etc/myapp/a.conf': 'foo = 1\n',
+            '/etc/myapp/b.conf': 'bar = 2\n',
+        }, use_sudo=True, mode='644')
+
+    """
+    func = use_sudo and run_as_root or run
+    paths = sorted(contents)
+    if not paths:
+        return []
+
+    with settings(hide('running', 'stdout')):
+        res = func('md5sum %s 2>/dev/null; true' % ' '.join(
+            quote(path) for path in paths))
+    digests = {}
+    for line in res.splitlines():
+        parts = line.split(None, 1)
+        if len(parts) == 2:
+            digests[parts[1].strip()] = parts[0]
+
+    encoded = {}
+    for path in paths:
+        data = contents[path]
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+        encoded[path] = data
+    changed = [
+        path for path in paths
+        if digests.get(path) != hashlib.md5(encoded[path]).hexdigest()
+    ]
+    if not changed:
+        return []
+
+    staged = upload_archive(dict(
+        (str(index), encoded[path]) for index, path in enumerate(changed)))
+    func(staged.script([
+        staged.install(str(index), path, owner=owner, group=group, mode=mode)
+        for index, path in enumerate(changed)
+    ]))
+    return changed
+
+
+def symlinks(links, check=None, suspects=(), use_sudo=False):
+    """
+    Require several symbolic links, using a single command.
+
+    *links* is a dict mapping link paths to their targets, or to
+    ``None`` for links that must not exist.
+
+    If a *check* command is given (such as ``nginx -t``), it is run
+    with the links in place. If it fails, the new links, along with the
+    *suspects* (links whose target was changed by other means), are
+    bisected to find the ones that break the check, and those links are
+    removed. Each step of the search only needs a single command.
+
+    Returns a tuple of two lists: the paths of the links that were
+    changed, and the paths of the links that were removed because
+    they broke the check.
+    """
+    func = use_sudo and run_as_root or run
+    paths = sorted(links)
+    if not paths:
+        return [], []
+
+    with settings(hide('running', 'stdout')):
+        res = func('for path in %s; do echo "$path -> $(readlink "$path")"; '
+                   'done' % ' '.join(quote(path) for path in paths))
+    state = {}
+    for line in res.splitlines():
+        path, sep, target = line.partition(' -> ')
+        if sep:
+            state[path] = target.strip() or None
+
+    changed = [path for path in paths
+               if not _same_target(path, state.get(path), links[path])]
+    candidates = [
+        path for path in paths
+        if links[path] and (path in changed or path in suspects)
+    ]
+
+    def attempt(wanted, with_check=True):
+        commands = []
+        for path in sorted(wanted):
+            target = wanted[path]
+            if not _same_target(path, state.get(path), target):
+                if target:
+                    commands.append('ln -sfn %s %s' % (quote(target),
+                                                       quote(path)))
+                else:
+                    commands.append('rm -f %s' % quote(path))
+                state[path] = target
+        if with_check:
+            commands.append(check)
+        if not commands:
+            return True
+        with settings(hide('running', 'stdout', 'stderr', 'warnings'),
+                      warn_only=True):
+            return func(' && '.join(commands)).succeeded
+
+    if not check or not candidates:
+        attempt(links, with_check=False)
+        return changed, []
+
+    if attempt(links):
+        return changed, []
+
+    base = dict(links)
+    for path in candidates:
+        base[path] = None
+    if not attempt(base):
+        abort("%s fails even without the new links" % check)
+
+    good, broken = [], []
+
+    def search(group, known_bad=False):
+        if not known_bad:
+            wanted = dict(base)
+            wanted.update((path, links[path]) for path in good + group)
+            if attempt(wanted):
+                good.extend(group)
+                return
+        if len(group) == 1:
+            broken.extend(group)
+            return
+        half = len(group) // 2
+        search(group[:half])
+        search(group[half:])
+
+    search(candidates, known_bad=True)
+
+    final = dict(base)
+    final.update((path, links[path]) for path in good)
+    attempt(final, with_check=False)
+    return [path for path in changed if path not in broken], broken
+
+
+def _same_target(path, current, target):
+    """
+    Check if two link targets point to the same place, relative
+    targets being taken from the directory of the link at *path*.
+    """
+    if current is None or target is None:
+        return current == target
+    directory = posixpath.dirname(path)
+    return (posixpath.normpath(posixpath.join(directory, current)) ==
+            posixpath.normpath(posixpath.join(directory, target)))
+
+
 def temporary_directory(template=None):
     """
     Require a temporary directory.
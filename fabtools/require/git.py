@@ -8,11 +8,17 @@ This module provides high-level tools for managing `Git`_ repositories.
 
 """
 
-from fabric.api import run
+import posixpath
+import re
+
+from fabric.api import env, run
 
 from fabtools import git
-from fabtools.files import is_dir
 from fabtools.system import UnsupportedFamily, distrib_family
+from fabtools.utils import host_cache
+
+
+MIRROR_DIR = '/var/cache/fabtools/git'
 
 
 def command():
@@ -49,8 +55,54 @@ def command():
                 supported=['debian', 'redhat', 'sun', 'gentoo'])
 
 
+_mirrors = host_cache()
+
+
+def mirror(remote_url, cache_dir=None, use_sudo=False, user=None,
+           refresh=False):
+    """
+    Require a bare mirror of a remote repository in a cache directory.
+
+    The mirror is created if needed, and refreshed at most once per run
+    on each host (unless *refresh* is ``True``), so that it can be used
+    by many working copies of the same project on the host (see the
+    *use_mirror* option of :func:`working_copy`).
+
+    The cache directory defaults to ``env.git_mirror_dir``, or to
+    ``/var/cache/fabtools/git``, and must be writable by the user running
+    ``git``.
+
+    Returns the path of the mirror.
+
+    ::
+
+        from fabtools import require
+
+        path = require.git.mirror('https://github.com/example/app.git',
+                                  use_sudo=True)
+
+    """
+    command()
+
+    path = _mirror_path(remote_url, cache_dir)
+    refreshed = _mirrors.setdefault(env.host_string, set())
+    if refresh or path not in refreshed:
+        git.update_mirror(remote_url, path, use_sudo=use_sudo, user=user)
+        refreshed.add(path)
+    return path
+
+
+def _mirror_path(remote_url, cache_dir=None):
+    cache_dir = cache_dir or env.get('git_mirror_dir') or MIRROR_DIR
+    name = re.sub(r'[^A-Za-z0-9._-]+', '_', remote_url.split('://')[-1])
+    if not name.endswith('.git'):
+        name += '.git'
+    return posixpath.join(cache_dir, name)
+
+
 def working_copy(remote_url, path=None, branch="master", update=True,
-                 use_sudo=False, user=None):
+                 use_sudo=False, user=None, depth=None, filter=None,
+                 sparse=None, use_mirror=False, force=False):
     """
     Require a working copy of the repository from the ``remote_url``.
 
@@ -62,10 +114,19 @@ def working_copy(remote_url, path=None, branch="master", update=True,
 
     If the ``path`` exists and ``update`` is ``True``, it will fetch
     changes from the remote repository, check out the specified branch,
-    then merge the remote changes into the working copy.
+    and merge the remote changes into it.
 
     If the ``path`` exists and ``update`` is ``False``, it will only
-    check out the specified branch, without fetching remote changesets.
+    check out the specified branch if another one is checked out,
+    fetching remote changesets only in that case, without merging them.
+
+    If ``force`` is ``True``, the branch is reset to its state on the
+    remote repository instead, which discards the commits made in the
+    working copy.
+
+    The state of the working copy is read with a single command (see
+    :func:`fabtools.git.status`), and the clone or update is done with
+    another single command.
 
     :param remote_url: URL of the remote repository (e.g.
                        https://github.com/ronnix/fabtools.git).  The given URL
@@ -98,26 +159,116 @@ def working_copy(remote_url, path=None, branch="master", update=True,
                  with the given user.  If ``use_sudo is False`` this parameter
                  has no effect.
     :type user: str
+
+    :param depth: Only fetch the given number of commits of history, for
+                  the clone and the updates.  This makes the first
+                  checkout of repositories with a long history much
+                  faster.
+    :type depth: int
+
+    :param filter: Object filter for a partial clone (e.g. ``blob:none``).
+                   File contents are then only downloaded when they are
+                   checked out.
+    :type filter: str
+
+    :param sparse: List of directories to check out (requires git >= 2.25).
+    :type sparse: list
+
+    :param use_mirror: If ``True``, a shared mirror of the remote
+                       repository is maintained on the host (see
+                       :func:`mirror`), and the working copy is cloned and
+                       updated from it, so that several working copies of
+                       the same project do not download the same objects
+                       again.  The ``origin`` remote of the working copy is
+                       still ``remote_url``.
+    :type use_mirror: bool
+
+    :param force: If ``True``, reset the branch to its state on the remote
+                  repository, discarding local commits.
+    :type force: bool
+
+    ::
+
+        from fabtools import require
+
+        require.git.working_copy('https://github.com/example/monorepo.git',
+                                 path='/srv/monorepo', depth=1,
+                                 filter='blob:none', sparse=['services/api'])
+
     """
 
     command()
 
     if path is None:
-        path = remote_url.split('/')[-1]
-        if path.endswith('.git'):
-            path = path[:-4]
-
-    if is_dir(path, use_sudo=use_sudo):
-        # always fetch changesets from remote and checkout branch / tag
-        git.fetch(path=path, use_sudo=use_sudo, user=user)
-        git.checkout(path=path, branch=branch, use_sudo=use_sudo, user=user)
-        if update:
-            # only 'merge' if update is True
-            git.pull(path=path, use_sudo=use_sudo, user=user)
-
-    elif not is_dir(path, use_sudo=use_sudo):
-        git.clone(remote_url, path=path, use_sudo=use_sudo, user=user)
-        git.checkout(path=path, branch=branch, use_sudo=use_sudo, user=user)
+        path = _default_path(remote_url)
+
+    state = git.status(path, use_sudo=use_sudo, user=user)
+
+    if _up_to_date(state, branch, update):
+        return
+
+    reference = None
+    if use_mirror:
+        reference = mirror(remote_url, use_sudo=use_sudo, user=user)
+
+    git._run(_working_copy_command(state, remote_url, path, branch, depth,
+                                   filter, sparse, reference, update, force),
+             use_sudo, user)
+
+
+def working_copies(repositories, use_sudo=False, user=None, concurrency=4):
+    """
+    Require many working copies, cloning or updating them concurrently.
+
+    *repositories* is a list of remote URLs, or of dicts with the
+    arguments of :func:`working_copy`.  See
+    :func:`fabtools.require.vcs.working_copies` for details.
+
+    ::
+
+        from fabtools import require
+
+        require.git.working_copies([
+            'https://github.com/example/api.git',
+            {'remote_url': 'https://github.com/example/web.git',
+             'path': '/srv/web', 'branch': 'stable'},
+        ], concurrency=8)
+
+    """
+    from fabtools.require.vcs import working_copies
+
+    return working_copies(
+        [dict(_options(repository), vcs='git')
+         for repository in repositories],
+        use_sudo=use_sudo, user=user, concurrency=concurrency)
+
+
+def _options(repository):
+    if isinstance(repository, dict):
+        return repository
+    return {'remote_url': repository}
+
+
+def _default_path(remote_url):
+    path = remote_url.split('/')[-1]
+    if path.endswith('.git'):
+        path = path[:-4]
+    return path
+
+
+def _up_to_date(state, branch, update):
+    return state['repository'] and not update and state['branch'] == branch
+
 
+def _working_copy_command(state, remote_url, path, branch='master',
+                          depth=None, filter=None, sparse=None,
+                          reference=None, update=True, force=False):
+    if state['repository']:
+        return git._update_command(path, branch=branch, depth=depth,
+                                   sparse=sparse,
+                                   source=reference or 'origin',
+                                   merge=update, force=force)
     else:
-        raise ValueError("Invalid combination of parameters.")
+        return git._clone_command(remote_url, path=path, branch=branch,
+                                  depth=depth, filter=filter, sparse=sparse,
+                                  reference=reference)
@@ -2,7 +2,13 @@
 System groups
 =============
 """
+from pipes import quote
+
+import six
+
 from fabtools.group import create, exists
+from fabtools.user import snapshot
+from fabtools.utils import run_as_root
 
 
 def group(name, gid=None):
@@ -23,3 +29,44 @@ def group(name, gid=None):
     # Make sure the group exists
     if not exists(name):
         create(name, gid=gid)
+
+
+def groups(specs):
+    """
+    Require several groups.
+
+    *specs* is a list of group names, or of dicts holding a ``name``
+    and an optional ``gid``.
+
+    The existing groups are read with a single command, and all the
+    missing groups are then created in a single batch.
+
+    ::
+
+        from fabtools import require
+
+        require.groups.groups(['admins', {'name': 'deploy', 'gid': 2000}])
+
+    """
+
+    specs = [
+        {'name': spec} if isinstance(spec, six.string_types) else spec
+        for spec in specs
+    ]
+
+    existing = set(snapshot()['groups'])
+
+    commands = []
+    for spec in specs:
+        name = spec['name']
+        if name in existing:
+            continue
+        args = []
+        if spec.get('gid'):
+            args.append('-g %s' % spec['gid'])
+        args.append(quote(name))
+        commands.append('groupadd %s' % ' '.join(args))
+        existing.add(name)
+
+    if commands:
+        run_as_root(' && '.join(commands))
@@ -8,10 +8,9 @@ This module provides high-level tools for managing `Mercurial`_ repositories.
 
 """
 
-from fabric.api import run
+from fabric.api import hide, run, settings
 
 from fabtools import mercurial
-from fabtools.files import is_dir
 from fabtools.system import UnsupportedFamily, distrib_family
 
 
@@ -63,6 +62,10 @@ def working_copy(remote_url, path=None, branch="default", update=True,
     If the ``path`` exists and ``update`` is ``False``, it will only
     check out the specified branch, without pulling remote changesets.
 
+    The state of the working copy is read with a single command (see
+    :func:`fabtools.mercurial.status`), and the clone or update is done
+    with another single command (see :func:`fabtools.mercurial.sync`).
+
     :param remote_url: URL of the remote repository
     :type remote_url: str
 
@@ -97,16 +100,27 @@ def working_copy(remote_url, path=None, branch="default", update=True,
     command()
 
     if path is None:
-        path = remote_url.split('/')[-1]
-
-    if is_dir(path, use_sudo=use_sudo):
-        mercurial.pull(path, use_sudo=use_sudo, user=user)
-        if update:
-            mercurial.update(path=path, branch=branch, use_sudo=use_sudo,
-                             user=user)
-    elif not is_dir(path, use_sudo=use_sudo):
-        mercurial.clone(remote_url, path=path, use_sudo=use_sudo, user=user)
-        mercurial.update(
-            path=path, branch=branch, use_sudo=use_sudo, user=user)
-    else:
-        raise ValueError("Invalid combination of parameters.")
+        path = _default_path(remote_url)
+
+    state = mercurial.status(path, use_sudo=use_sudo, user=user)
+
+    cmd = _working_copy_command(state, remote_url, path, branch, update)
+    if cmd is not None:
+        with settings(hide('stdout')):
+            mercurial._run(cmd, use_sudo, user)
+
+
+def _default_path(remote_url):
+    return remote_url.split('/')[-1]
+
+
+def _working_copy_command(state, remote_url, path, branch='default',
+                          update=True):
+    if not state['repository']:
+        return mercurial._sync_command(path, remote_url=remote_url,
+                                       branch=branch)
+    elif update:
+        return mercurial._sync_command(path, branch=branch)
+    elif state['branch'] != branch:
+        return mercurial._sync_command(path, branch=branch, pull=False)
+    return None
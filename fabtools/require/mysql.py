@@ -9,12 +9,15 @@ and creating MySQL users and databases.
 
 from pipes import quote
 
-from fabric.api import hide, prompt, run, settings
+from fabric.api import hide, prompt, puts, run, settings
 
 from fabtools.mysql import (
+    _privileges,
     create_database,
     create_user,
     database_exists,
+    queries,
+    snapshot,
     user_exists,
 )
 from fabtools.system import UnsupportedFamily, distrib_family
@@ -133,3 +136,177 @@ def database(name, **kwargs):
     """
     if not database_exists(name, **kwargs):
         create_database(name, **kwargs)
+
+
+def users(users, **kwargs):
+    """
+    Require many MySQL users.
+
+    *users* is a list of dicts with ``name``, ``password`` and an
+    optional ``host`` (``localhost`` by default). The existing users
+    are read with a single command, and the missing ones are created
+    with another one. Existing users are *not* modified.
+
+    Extra arguments are passed to :py:func:`fabtools.mysql.query`.
+
+    Returns the list of the created users, as ``(name, host)`` tuples.
+
+    Example::
+
+        from fabric.api import settings
+        from fabtools import require
+
+        with settings(mysql_user='root', mysql_password='s3cr3t'):
+            require.mysql.users([
+                {'name': 'tenant1', 'password': 'somerandomstring'},
+                {'name': 'tenant2', 'password': 'otherrandomstring'},
+            ])
+
+    """
+    return _provision(users=users, **kwargs)['users']
+
+
+def databases(databases, **kwargs):
+    """
+    Require many MySQL databases.
+
+    *databases* is a list of dicts with ``name`` and the optional
+    ``owner``, ``owner_host``, ``charset`` and ``collate`` arguments
+    of :py:func:`fabtools.mysql.create_database`. The existing databases
+    are read with a single command, and the missing ones are created
+    with another one.
+
+    Extra arguments are passed to :py:func:`fabtools.mysql.query`.
+
+    Returns the list of the created databases.
+
+    Example::
+
+        from fabric.api import settings
+        from fabtools import require
+
+        with settings(mysql_user='root', mysql_password='s3cr3t'):
+            require.mysql.databases([
+                {'name': 'tenant1', 'owner': 'tenant1'},
+                {'name': 'tenant2', 'owner': 'tenant2'},
+            ])
+
+    """
+    return _provision(databases=databases, **kwargs)['databases']
+
+
+def grants(grants, **kwargs):
+    """
+    Require MySQL privileges.
+
+    *grants* is a list of dicts with ``user``, ``database`` and the
+    optional ``host`` (``localhost`` by default), ``table`` (``*`` by
+    default), ``privileges`` (``ALL PRIVILEGES`` by default) and
+    ``grant_option`` (``False`` by default). The current privileges of
+    the users are read with a single command, and the missing ones are
+    granted with another one, followed by a single ``FLUSH PRIVILEGES``.
+    Privileges that are not listed are kept.
+
+    Extra arguments are passed to :py:func:`fabtools.mysql.query`.
+
+    Returns the list of the ``GRANT`` statements that were run.
+
+    Example::
+
+        from fabric.api import settings
+        from fabtools import require
+
+        with settings(mysql_user='root', mysql_password='s3cr3t'):
+            require.mysql.grants([
+                {'user': 'app', 'database': 'shop'},
+                {'user': 'reporting', 'database': 'shop',
+                 'privileges': 'SELECT, SHOW VIEW'},
+            ])
+
+    """
+    return _provision(grants=grants, **kwargs)['grants']
+
+
+def _provision(users=(), databases=(), grants=(), **kwargs):
+    """
+    Create the missing users and databases, and grant the missing
+    privileges, with a single command.
+    """
+    grants = [dict({'host': 'localhost', 'table': '*',
+                    'privileges': 'ALL PRIVILEGES', 'grant_option': False},
+                   **grant) for grant in grants]
+    accounts = []
+    for grant in grants:
+        account = (grant['user'], grant['host'])
+        if account not in accounts:
+            accounts.append(account)
+    state = snapshot(accounts, **kwargs)
+
+    statements = []
+    changes = {'users': [], 'databases': [], 'grants': []}
+
+    for user in users:
+        account = (user['name'], user.get('host', 'localhost'))
+        if account in state['users'] or account in changes['users']:
+            continue
+        statements.append("CREATE USER '%s'@'%s' IDENTIFIED BY '%s'" % (
+            account + (user['password'].replace("'", "''"),)))
+        changes['users'].append(account)
+
+    for database in databases:
+        name = database['name']
+        if name in state['databases'] or name in changes['databases']:
+            continue
+        statements.append(
+            'CREATE DATABASE %s CHARACTER SET %s COLLATE %s' % (
+                name, database.get('charset', 'utf8'),
+                database.get('collate', 'utf8_general_ci')))
+        if database.get('owner'):
+            statements.append(
+                "GRANT ALL PRIVILEGES ON %s.* TO '%s'@'%s' "
+                "WITH GRANT OPTION" % (name, database['owner'],
+                                       database.get('owner_host',
+                                                    'localhost')))
+        changes['databases'].append(name)
+
+    for grant in grants:
+        target = '%s.%s' % (grant['database'], grant['table'])
+        privileges = _privileges(grant['privileges'])
+        current = state['grants'].get((grant['user'], grant['host']), [])
+        if any(_covers(existing, privileges, target, grant['grant_option'])
+               for existing in current):
+            continue
+        statement = "GRANT %s ON %s TO '%s'@'%s'" % (
+            grant['privileges'], target, grant['user'], grant['host'])
+        if grant['grant_option']:
+            statement += ' WITH GRANT OPTION'
+        if statement not in changes['grants']:
+            statements.append(statement)
+            changes['grants'].append(statement)
+
+    if statements:
+        statements.append('FLUSH PRIVILEGES')
+        with settings(hide('running')):
+            queries(statements, **kwargs)
+        if changes['users']:
+            puts('Created MySQL users: %s' % ', '.join(
+                "'%s'@'%s'" % account for account in changes['users']))
+        if changes['databases']:
+            puts('Created MySQL databases: %s' % ', '.join(
+                changes['databases']))
+        for statement in changes['grants']:
+            puts('Granted MySQL privileges: %s' % statement)
+    return changes
+
+
+def _covers(existing, privileges, target, grant_option):
+    """
+    Check if an existing grant includes the required privileges.
+    """
+    existing_privileges, existing_target, existing_grant_option = existing
+    if grant_option and not existing_grant_option:
+        return False
+    if existing_target not in (target, '*.*'):
+        return False
+    return 'ALL PRIVILEGES' in existing_privileges or \
+        privileges <= existing_privileges
@@ -9,21 +9,21 @@ web server and managing the configuration of web sites.
 
 """
 
-from fabric.api import (
-    abort,
-    hide,
-    settings,
-)
+import posixpath
+
+from fabric.api import abort
 from fabric.colors import red
 
 from fabtools.deb import is_installed
-from fabtools.files import is_link
+from fabtools.handlers import reload_service
 from fabtools.nginx import disable, enable
-from fabtools.service import reload as reload_service
+from fabtools.service import reload as reload_now
 from fabtools.system import UnsupportedFamily, distrib_family
-from fabtools.utils import run_as_root
 
-from fabtools.require.files import template_file
+from fabtools.require.files import (
+    files as require_files,
+    symlinks as require_symlinks,
+)
 from fabtools.require.service import started as require_started
 
 
@@ -60,7 +60,8 @@ def enabled(config):
     """
     Require an nginx site to be enabled.
 
-    This will cause nginx to reload its configuration.
+    This will cause nginx to reload its configuration (see
+    :func:`fabtools.handlers.deferred`).
 
     ::
 
@@ -77,7 +78,8 @@ def disabled(config):
     """
     Require an nginx site to be disabled.
 
-    This will cause nginx to reload its configuration.
+    This will cause nginx to reload its configuration (see
+    :func:`fabtools.handlers.deferred`).
 
     ::
 
@@ -99,6 +101,10 @@ def site(server_name, template_contents=None, template_source=None,
     string (*template_contents*) or as the path to a local template
     file (*template_source*).
 
+    nginx is then reloaded. Inside a :func:`fabtools.handlers.deferred`
+    block, it is only reloaded once, at the end of the block, however
+    many sites were changed.
+
     ::
 
         from fabtools import require
@@ -119,40 +125,103 @@ def site(server_name, template_contents=None, template_source=None,
         )
 
     .. seealso:: :py:func:`fabtools.require.files.template_file`
+    """
+    spec = dict(kwargs)
+    spec.update({
+        'server_name': server_name,
+        'template_contents': template_contents,
+        'template_source': template_source,
+        'enabled': enabled,
+    })
+    sites([spec], check_config=check_config)
+
+
+def sites(specs, check_config=True):
+    """
+    Require several nginx sites.
+
+    *specs* is a list of dicts, each with a ``server_name`` key, a
+    ``template_contents`` or ``template_source`` key, an optional
+    ``enabled`` key (defaults to ``True``), and the other keys used as
+    the template context, as accepted by :func:`site`.
+
+    All the configuration files are rendered locally, and the ones that
+    changed are uploaded as a single archive. The links in
+    ``/etc/nginx/sites-enabled`` are then updated with a single command,
+    and the configuration is tested once with ``nginx -t``. If the test
+    fails, the changed sites are bisected to find the broken ones, which
+    are disabled for safety before aborting.
+
+    nginx is reloaded if anything changed (see
+    :func:`fabtools.handlers.deferred`).
+
+    ::
+
+        from fabtools import require
+
+        require.nginx.sites([
+            {
+                'server_name': 'tenant%d.example.com' % i,
+                'template_contents': CONFIG_TPL,
+                'docroot': '/var/www/tenant%d' % i,
+            }
+            for i in range(1000)
+        ])
+
     """
     if not is_installed('nginx-common'):
         # nginx-common is always installed if nginx exists
         server()
 
-    config_filename = '/etc/nginx/sites-available/%s.conf' % server_name
-
-    context = {
-        'port': 80,
-    }
-    context.update(kwargs)
-    context['server_name'] = server_name
-
-    template_file(config_filename, template_contents, template_source,
-                  context, use_sudo=True)
-
-    link_filename = '/etc/nginx/sites-enabled/%s.conf' % server_name
-    if enabled:
-        if not is_link(link_filename):
-            run_as_root(
-                "ln -s %(config_filename)s %(link_filename)s" % locals())
-
-        # Make sure we don't break the config
-        if check_config:
-            with settings(hide('running', 'warnings'), warn_only=True):
-                if run_as_root('nginx -t').failed:
-                    run_as_root("rm %(link_filename)s" % locals())
-                    message = red("Error in %(server_name)s nginx site config (disabling for safety)" % locals())
-                    abort(message)
-    else:
-        if is_link(link_filename):
-            run_as_root("rm %(link_filename)s" % locals())
-
-    reload_service('nginx')
+    contents = {}
+    links = {}
+    for spec in specs:
+        spec = dict(spec)
+        server_name = spec.pop('server_name')
+        template_contents = spec.pop('template_contents', None)
+        template_source = spec.pop('template_source', None)
+        enabled = spec.pop('enabled', True)
+
+        context = {
+            'port': 80,
+        }
+        context.update(spec)
+        context['server_name'] = server_name
+
+        config_filename = '/etc/nginx/sites-available/%s.conf' % server_name
+        contents[config_filename] = _render(template_contents,
+                                            template_source, context)
+        link_filename = '/etc/nginx/sites-enabled/%s.conf' % server_name
+        links[link_filename] = config_filename if enabled else None
+
+    changed_files = require_files(contents, use_sudo=True, owner='root',
+                                  group='root', mode='644')
+    suspects = [
+        link_filename for link_filename, config_filename in links.items()
+        if config_filename in changed_files
+    ]
+    changed_links, broken = require_symlinks(
+        links, check='nginx -t' if check_config else None,
+        suspects=suspects, use_sudo=True)
+
+    if broken:
+        if changed_links or set(suspects) - set(broken):
+            reload_now('nginx')
+        names = ', '.join(
+            posixpath.basename(link_filename)[:-len('.conf')]
+            for link_filename in broken)
+        message = red("Error in %(names)s nginx site config (disabling for safety)" % locals())
+        abort(message)
+
+    if changed_files or changed_links:
+        reload_service('nginx')
+
+
+def _render(template_contents, template_source, context):
+    if template_contents is None:
+        with open(template_source) as template_file:
+            template_contents = template_file.read()
+    return template_contents % context
 
 
 PROXIED_SITE_TEMPLATE = """\
@@ -60,3 +60,40 @@ def package(pkg_name, version=None, local=False):
     else:
         if pkg_version is None:
             nodejs.install_package(pkg_name, local=local)
+
+
+def packages(pkg_list, local=False):
+    """
+    Require several Node.js packages.
+
+    *pkg_list* is a list of package names, or a dict mapping package
+    names to versions (or ``None`` to accept any installed version).
+
+    The installed packages are read from a single listing (see
+    :func:`fabtools.nodejs.snapshot`), and the missing or outdated
+    packages are installed with a single ``npm install`` command.
+
+    If `local` is ``True``, the packages will be installed locally.
+
+    Returns the sorted list of the packages that were installed.
+
+    ::
+
+        from fabtools import require
+
+        require.nodejs.packages({
+            'coffee-script': '1.10.0',
+            'forever': None,
+        })
+
+    """
+    if not isinstance(pkg_list, dict):
+        pkg_list = dict.fromkeys(pkg_list)
+
+    installed = nodejs.snapshot(local=local)
+    needed = dict(
+        (name, version) for name, version in pkg_list.items()
+        if name not in installed or (version and installed[name] != version)
+    )
+    nodejs.install_packages(needed, local=local)
+    return sorted(needed)
@@ -3,15 +3,29 @@ PostgreSQL users and databases
 ==============================
 """
 
-from fabric.api import cd, hide, run, settings
-from fabtools.files import is_file
+from pipes import quote
+import posixpath
+
+from fabric.api import abort, cd, hide, run, settings
+from fabtools.files import is_file, upload_archive
 from fabtools.postgres import (
+    RESTART_SETTINGS,
+    _fetch_schemas,
+    _run_as_pg,
+    catalog,
     create_database,
+    create_databases,
+    create_schemas,
     create_user,
+    create_users,
     database_exists,
+    has_locale,
+    huge_pages_needed,
+    tuning_profile,
     user_exists,
 )
 from fabtools.system import UnsupportedFamily, distrib_family
+from fabtools.utils import run_as_root
 
 from fabtools.require.service import started, restarted
 from fabtools.require.system import locale as require_locale
@@ -30,22 +44,30 @@ def _service_name(version=None):
             return run('ls postgresql-*').splitlines()[0]
 
 
-def server(version=None):
+def server(version=None, tune=False, connections=None):
     """
     Require a PostgreSQL server to be installed and running.
 
+    If *tune* is ``True``, the server settings are also adapted to
+    the hardware of the host (see :func:`tuning`), for the expected
+    number of *connections*.
+
     ::
 
         from fabtools import require
 
         require.postgres.server()
 
+        require.postgres.server(tune=True, connections=400)
+
     """
     family = distrib_family()
     if family == 'debian':
         _server_debian(version)
     else:
         raise UnsupportedFamily(supported=['debian'])
+    if tune:
+        tuning(connections=connections, version=version)
 
 
 def _server_debian(version):
@@ -86,6 +108,47 @@ def user(name, password, superuser=False, createdb=False,
                     login, connection_limit, encrypted_password)
 
 
+def users(users):
+    """
+    Require many PostgreSQL users.
+
+    *users* is a list of dicts, with the arguments of :func:`user`.
+    The existing users are found with a single catalog query, and the
+    missing ones are all created in a single transaction. As with
+    :func:`user`, existing users are *not* modified.
+
+    Returns the list of the created users.
+
+    ::
+
+        from fabtools import require
+
+        require.postgres.users([
+            {'name': 'tenant%d' % i, 'password': passwords[i]}
+            for i in range(100)
+        ])
+
+    """
+    existing = catalog()['users']
+    missing = _missing(users, lambda user: user['name'] not in existing)
+    if missing:
+        create_users(missing)
+    return [user['name'] for user in missing]
+
+
+def _missing(items, is_missing):
+    """
+    Filter the missing items, keeping the first of duplicate names.
+    """
+    missing = []
+    names = set()
+    for item in items:
+        if item['name'] not in names and is_missing(item):
+            missing.append(item)
+        names.add(item['name'])
+    return missing
+
+
 def database(name, owner, template='template0', encoding='UTF8',
              locale='en_US.UTF-8'):
     """
@@ -100,9 +163,246 @@ def database(name, owner, template='template0', encoding='UTF8',
     """
     if not database_exists(name):
 
-        if locale not in run('locale -a').split():
+        if not has_locale(locale):
             require_locale(locale)
             restarted(_service_name())
+            catalog(refresh=True)
 
         create_database(name, owner, template=template, encoding=encoding,
                         locale=locale)
+
+
+def databases(databases, concurrency=4):
+    """
+    Require many PostgreSQL databases.
+
+    *databases* is a list of dicts, with the arguments of
+    :func:`database`. The existing databases are found with a single
+    catalog query, and the missing ones are created with a single
+    command, up to *concurrency* at the same time.
+
+    Returns the list of the created databases.
+
+    ::
+
+        from fabtools import require
+
+        require.postgres.databases([
+            {'name': 'tenant%d' % i, 'owner': 'tenant%d' % i}
+            for i in range(100)
+        ])
+
+    """
+    existing = catalog()['databases']
+    missing = _missing(databases,
+                       lambda database: database['name'] not in existing)
+    if not missing:
+        return []
+
+    locales = set(database.get('locale', 'en_US.UTF-8')
+                  for database in missing)
+    missing_locales = [locale for locale in sorted(locales)
+                       if not has_locale(locale)]
+    if missing_locales:
+        for locale in missing_locales:
+            require_locale(locale)
+        restarted(_service_name())
+        catalog(refresh=True)
+
+    failed = create_databases(missing, concurrency=concurrency)
+    if failed:
+        abort('Could not create PostgreSQL databases: %s' % ', '.join(failed))
+    return [database['name'] for database in missing]
+
+
+def schemas(schemas):
+    """
+    Require many schemas, in one or more PostgreSQL databases.
+
+    *schemas* is a list of dicts with ``name``, ``database`` and an
+    optional ``owner``. The existing schemas of all the databases are
+    found with a single command, and the missing ones are created with
+    another one.
+
+    Returns the list of the created schemas, as ``(database, name)``
+    tuples.
+
+    ::
+
+        from fabtools import require
+
+        require.postgres.schemas([
+            {'name': 'billing', 'database': 'tenant1', 'owner': 'tenant1'},
+            {'name': 'billing', 'database': 'tenant2', 'owner': 'tenant2'},
+        ])
+
+    """
+    snapshot = catalog()
+    unknown = []
+    for schema in schemas:
+        database = schema['database']
+        if database not in snapshot['schemas'] and database not in unknown:
+            unknown.append(database)
+    if unknown:
+        _fetch_schemas(unknown)
+
+    missing = []
+    keys = set()
+    for schema in schemas:
+        key = (schema['database'], schema['name'])
+        if key not in keys and \
+                schema['name'] not in snapshot['schemas'].get(key[0], ()):
+            missing.append(schema)
+        keys.add(key)
+    if missing:
+        create_schemas(missing)
+    return [(schema['database'], schema['name']) for schema in missing]
+
+
+TUNING_FILE = 'fabtools-tuning.conf'
+
+_TUNING_SEPARATOR = '--fabtools-tuning--'
+
+
+def tuning(connections=None, ssd=None, overrides=None, version=None):
+    """
+    Require PostgreSQL settings suited to the hardware of the host.
+
+    The number of CPUs, the amount of RAM, the storage type and the
+    current server settings are read with a single command, and the
+    settings computed by :func:`fabtools.postgres.tuning_profile` are
+    written to a managed ``conf.d/fabtools-tuning.conf`` include file
+    (with ``include_dir`` since PostgreSQL 9.3, or ``include`` before).
+
+    *connections* is the expected number of connections (by default,
+    the current ``max_connections``, which is otherwise left alone),
+    *ssd* overrides the detected storage type, and *overrides* is a
+    dict of settings that take precedence over the computed ones.
+
+    If huge pages are used, the ``vm.nr_hugepages`` kernel parameter
+    is raised to fit the shared buffers.
+
+    The server is reloaded only if a setting changed, or restarted if
+    one of the changed settings needs it (such as ``shared_buffers``).
+
+    Returns a dict of the changed settings.
+
+    ::
+
+        from fabtools import require
+
+        require.postgres.tuning(connections=200,
+                                overrides={'random_page_cost': '1.5'})
+
+    """
+    from fabtools.handlers import reload_service, restart_service
+    from fabtools.require.system import sysctl as require_sysctl
+
+    facts = _tuning_facts()
+    if ssd is None:
+        ssd = facts['ssd']
+    profile = tuning_profile(
+        cpus=facts['cpus'], memory=facts['memory'], ssd=ssd,
+        connections=connections or facts['max_connections'],
+        version=facts['version'])
+    if connections:
+        profile['max_connections'] = str(connections)
+    profile.update(overrides or {})
+
+    contents = '# Managed by fabtools: do not edit\n' + ''.join(
+        "%s = '%s'\n" % item for item in profile.items())
+    current = _parse_settings(facts['current'])
+    changed = dict((name, value) for name, value in profile.items()
+                   if current.get(name) != value)
+
+    if contents != facts['current'] or not facts['included']:
+        config_file = facts['config_file']
+        include_dir = posixpath.join(posixpath.dirname(config_file),
+                                     'conf.d')
+        include_line = _include_line(facts['version'])
+        staged = upload_archive({TUNING_FILE: contents})
+        with settings(hide('running', 'stdout')):
+            run_as_root(staged.script([
+                'mkdir -p %s' % quote(include_dir),
+                'chown postgres:postgres %s' % quote(include_dir),
+                staged.install(TUNING_FILE,
+                               posixpath.join(include_dir, TUNING_FILE),
+                               owner='postgres', group='postgres',
+                               mode='644'),
+                '{ grep -q %s %s || echo %s >> %s; }' % (
+                    quote('^' + include_line), quote(config_file),
+                    quote(include_line), quote(config_file)),
+            ]))
+        if not facts['included']:
+            changed = dict(profile)
+
+    hugepages = huge_pages_needed(profile)
+    if hugepages > facts['nr_hugepages']:
+        require_sysctl('vm.nr_hugepages', str(hugepages))
+
+    if changed:
+        service = _service_name(version)
+        if RESTART_SETTINGS.intersection(changed):
+            restart_service(service)
+        else:
+            reload_service(service)
+    return changed
+
+
+def _tuning_facts():
+    """
+    Read the hardware and the PostgreSQL settings with a single command.
+    """
+    query = ("SELECT current_setting('server_version_num'), "
+             "current_setting('max_connections')")
+    commands = [
+        'nproc',
+        'grep MemTotal /proc/meminfo',
+        'cat /sys/block/*/queue/rotational 2>/dev/null',
+        'sysctl -n vm.nr_hugepages',
+        "psql -X -t -A -F ' ' -c %s" % quote(query),
+        'f=$(psql -X -t -A -c %s) && echo "$f"' % quote('SHOW config_file'),
+        'grep -c -e %s -e %s "$f"' % (quote('^' + _include_line(90300)),
+                                      quote('^' + _include_line(90100))),
+        'cat "$(dirname "$f")/conf.d/%s" 2>/dev/null' % TUNING_FILE,
+    ]
+    with settings(hide('running', 'stdout')):
+        res = _run_as_pg(('; echo %s; ' % _TUNING_SEPARATOR).join(commands) +
+                         '; true')
+    sections = [section.strip('\r\n') for section in
+                res.split(_TUNING_SEPARATOR)]
+    (cpus, meminfo, rotational, nr_hugepages, pg_settings, config_file,
+     included, current) = sections
+    version, max_connections = pg_settings.split()
+    return {
+        'cpus': int(cpus),
+        'memory': int(meminfo.split()[1]) * 1024,
+        'ssd': '1' not in rotational.split(),
+        'nr_hugepages': int(nr_hugepages or 0),
+        'version': int(version),
+        'max_connections': int(max_connections),
+        'config_file': config_file,
+        'included': included.strip() not in ('', '0'),
+        'current': current + '\n' if current else '',
+    }
+
+
+def _include_line(version):
+    """
+    Get the line including the tuning file in ``postgresql.conf``.
+
+    The ``include_dir`` directive only exists since PostgreSQL 9.3, so the
+    file itself is included on older versions.
+    """
+    if version >= 90300:
+        return "include_dir = 'conf.d'"
+    return "include 'conf.d/%s'" % TUNING_FILE
+
+
+def _parse_settings(contents):
+    values = {}
+    for line in contents.splitlines():
+        name, sep, value = line.partition('=')
+        if sep and not name.startswith('#'):
+            values[name.strip()] = value.strip().strip("'")
+    return values
@@ -8,9 +8,16 @@ This module provides high-level tools for managing `Redis`_ instances.
 
 """
 
-from fabric.api import cd, run, settings
+from functools import partial
+from pipes import quote
+import re
+
+from fabric.api import cd, hide, run, settings
+from fabric.utils import warn
 
 from fabtools.files import is_file, watch
+from fabtools.handlers import notify
+from fabtools.redis import _parse_version, tuning_profile
 from fabtools.system import distrib_family
 from fabtools.utils import run_as_root
 import fabtools.supervisor
@@ -28,15 +35,48 @@ BINARIES = [
 ]
 
 
+TRANSPARENT_HUGEPAGE = '/sys/kernel/mm/transparent_hugepage/enabled'
+
+SYSFS_SETTING = 'kernel/mm/transparent_hugepage/enabled = never'
+
+_TUNING_SEPARATOR = '--fabtools-redis--'
+
+
 def installed_from_source(version=VERSION):
     """
     Require Redis to be installed from source.
 
     The compiled binaries will be installed in ``/opt/redis-{version}/``.
+
+    If the build cache is enabled (see :mod:`fabtools.build`), Redis is
+    only compiled once for all similar hosts, and the other hosts do
+    not need a compiler.
     """
+    from fabtools.build import cache_enabled, install_cached
     from fabtools.require import directory as require_directory
-    from fabtools.require import file as require_file
     from fabtools.require import user as require_user
+
+    require_user('redis', home='/var/lib/redis', system=True)
+    require_directory('/var/lib/redis', owner='redis', use_sudo=True)
+
+    dest_dir = '/opt/redis-%(version)s' % locals()
+    require_directory(dest_dir, use_sudo=True, owner='redis')
+
+    if not is_file('%(dest_dir)s/redis-server' % locals()):
+
+        if cache_enabled():
+            install_cached('redis', version, partial(_build, version))
+            run_as_root('chown redis: %s' % ' '.join(
+                '%s/%s' % (dest_dir, filename) for filename in BINARIES))
+        else:
+            _build(version)
+
+
+def _build(version, destdir=''):
+    """
+    Compile Redis, and install the binaries under *destdir*.
+    """
+    from fabtools.require import file as require_file
     from fabtools.require.deb import packages as require_deb_packages
     from fabtools.require.rpm import packages as require_rpm_packages
 
@@ -53,31 +93,33 @@ def installed_from_source(version=VERSION):
             'make',
         ])
 
-    require_user('redis', home='/var/lib/redis', system=True)
-    require_directory('/var/lib/redis', owner='redis', use_sudo=True)
-
     dest_dir = '/opt/redis-%(version)s' % locals()
-    require_directory(dest_dir, use_sudo=True, owner='redis')
 
-    if not is_file('%(dest_dir)s/redis-server' % locals()):
+    with cd('/tmp'):
 
-        with cd('/tmp'):
+        # Download and unpack the tarball
+        tarball = 'redis-%(version)s.tar.gz' % locals()
+        url = _download_url(version) + tarball
+        require_file(tarball, url=url)
+        run('tar xzf %(tarball)s' % locals())
 
-            # Download and unpack the tarball
-            tarball = 'redis-%(version)s.tar.gz' % locals()
-            url = _download_url(version) + tarball
-            require_file(tarball, url=url)
-            run('tar xzf %(tarball)s' % locals())
+        # Compile and install binaries
+        with cd('redis-%(version)s' % locals()):
+            run('make')
 
-            # Compile and install binaries
-            with cd('redis-%(version)s' % locals()):
-                run('make')
+            if destdir:
+                staging_dir = destdir + dest_dir
+                sources = ' '.join('src/%s' % filename
+                                   for filename in BINARIES)
+                run('mkdir -p %(staging_dir)s && '
+                    'cp -pf %(sources)s %(staging_dir)s/' % locals())
+                return
 
-                for filename in BINARIES:
-                    run_as_root(
-                        'cp -pf src/%(filename)s %(dest_dir)s/' % locals())
-                    run_as_root(
-                        'chown redis: %(dest_dir)s/%(filename)s' % locals())
+            for filename in BINARIES:
+                run_as_root(
+                    'cp -pf src/%(filename)s %(dest_dir)s/' % locals())
+                run_as_root(
+                    'chown redis: %(dest_dir)s/%(filename)s' % locals())
 
 
 def _download_url(version):
@@ -87,11 +129,8 @@ def _download_url(version):
         return 'http://download.redis.io/releases/'
 
 
-def _parse_version(version):
-    return tuple(map(int, version.split('.')))
-
-
-def instance(name, version=VERSION, bind='127.0.0.1', port=6379, **kwargs):
+def instance(name, version=VERSION, bind='127.0.0.1', port=6379,
+             profile=None, memory_share=1.0, **kwargs):
     """
     Require a Redis instance to be running.
 
@@ -169,6 +208,30 @@ def instance(name, version=VERSION, bind='127.0.0.1', port=6379, **kwargs):
 
     .. seealso:: `Redis Persistence <http://redis.io/topics/persistence>`_
 
+    You can tune the instance for the host by giving a *profile*, either
+    ``'cache'`` or ``'store'`` (see :func:`fabtools.redis.tuning_profile`).
+    The memory limit, eviction policy, I/O threads and lazy freeing
+    options are then computed from the number of CPUs and the RAM of
+    the host, transparent huge pages are disabled (they cause latency
+    spikes and memory usage issues with Redis), and the
+    ``net.core.somaxconn`` kernel parameter is raised to match the TCP
+    backlog. Extra keyword arguments still take precedence: ::
+
+        require.redis.instance('cache', port=6380, profile='cache',
+                               maxmemory='2gb')
+
+    If the host runs several instances, give each one a *memory_share*
+    of the RAM, so that their memory limits add up to what the host
+    has: ::
+
+        require.redis.instance('cache', port=6380, profile='cache',
+                               memory_share=0.25)
+        require.redis.instance('jobs', port=6381, profile='store',
+                               memory_share=0.75)
+
+    .. seealso:: `Redis latency problems troubleshooting
+                 <http://redis.io/topics/latency>`_
+
     """
     from fabtools.require import directory as require_directory
     from fabtools.require import file as require_file
@@ -187,6 +250,11 @@ def instance(name, version=VERSION, bind='127.0.0.1', port=6379, **kwargs):
 
     # Set default parameters
     params = {}
+    if profile is not None:
+        facts = _tuning_facts()
+        params.update(tuning_profile(profile, facts['cpus'], facts['memory'],
+                                     version, memory_share))
+        _tune_kernel(facts)
     params.update(kwargs)
     params.setdefault('bind', bind)
     params.setdefault('port', port)
@@ -224,6 +292,64 @@ def instance(name, version=VERSION, bind='127.0.0.1', port=6379, **kwargs):
         command="%(redis_server)s %(config_filename)s" % locals(),
     )
 
-    # Restart if needed
+    # Restart if needed, once supervisor knows about the process
     if config.changed:
-        fabtools.supervisor.restart_process(process_name)
+        notify('restart %s' % process_name,
+               partial(fabtools.supervisor.restart_process, process_name),
+               after=['update supervisor', 'start supervisor processes'])
+
+
+def _tuning_facts():
+    """
+    Read the hardware and the kernel settings with a single command.
+    """
+    commands = [
+        'nproc',
+        'grep MemTotal /proc/meminfo',
+        'cat %s 2>/dev/null' % TRANSPARENT_HUGEPAGE,
+    ]
+    with settings(hide('running', 'stdout')):
+        res = run(('; echo %s; ' % _TUNING_SEPARATOR).join(commands) +
+                  '; true')
+    cpus, meminfo, thp = [section.strip('\r\n') for section in
+                          res.split(_TUNING_SEPARATOR)]
+    # The active choice is shown in brackets, as in "always [never]"
+    match = re.search(r'\[(\w+)\]', thp)
+    return {
+        'cpus': int(cpus),
+        'memory': int(meminfo.split()[1]) * 1024,
+        'transparent_hugepage': match.group(1) if match else thp.strip(),
+    }
+
+
+def _tune_kernel(facts):
+    """
+    Set the kernel parameters recommended for Redis.
+    """
+    from fabtools.require.system import sysctl as require_sysctl
+
+    with settings(warn_only=True):
+        require_sysctl('net.core.somaxconn', '65535')
+
+    if facts['transparent_hugepage'] not in ('never', ''):
+        # Disable now, and on boot using systemd-tmpfiles, or sysfsutils
+        # on hosts without systemd
+        with settings(hide('running', 'stdout'), warn_only=True):
+            res = run_as_root(
+                'echo never > %(path)s && '
+                'if which systemctl >/dev/null 2>&1; then '
+                'mkdir -p /etc/tmpfiles.d && '
+                'echo "w %(path)s - - - - never" '
+                '> /etc/tmpfiles.d/redis-transparent-hugepage.conf && '
+                'echo persisted; '
+                'elif [ -f /etc/sysfs.conf ]; then '
+                'grep -qxF %(line)s /etc/sysfs.conf || '
+                'echo %(line)s >> /etc/sysfs.conf; echo persisted; '
+                'fi' % {
+                    'path': TRANSPARENT_HUGEPAGE,
+                    'line': quote(SYSFS_SETTING),
+                })
+        if res.succeeded and 'persisted' not in res:
+            warn('Transparent huge pages will be enabled again on reboot: '
+                 'install sysfsutils, or add "echo never > %s" to '
+                 '/etc/rc.local' % TRANSPARENT_HUGEPAGE)
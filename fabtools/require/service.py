@@ -11,65 +11,78 @@ support both `upstart`_ services and traditional SysV-style
 
 """
 
-from fabtools.service import is_running, restart, start, stop
-from fabtools.system import using_systemd
-import fabtools.systemd as systemd
+import six
+
+from fabtools.service import _action, _snapshot
 
 
 def started(service):
     """
     Require a service to be started.
 
+    *service* may also be a list of services. Their state is checked
+    with a single command, and the stopped ones are started together.
+
     ::
 
         from fabtools import require
 
         require.service.started('foo')
+        require.service.started(['nginx', 'postgresql', 'redis-server'])
     """
-    if not is_running(service):
-        if using_systemd():
-            systemd.start(service)
-        else:
-            start(service)
+    services = _services(service)
+    init_system, states = _snapshot(services)
+    _action(init_system, 'start', [
+        name for name in services if not _is_running(states, name)])
 
 
 def stopped(service):
     """
     Require a service to be stopped.
 
+    *service* may also be a list of services.
+
     ::
 
         from fabtools import require
 
         require.service.stopped('foo')
     """
-    if is_running(service):
-        if using_systemd():
-            systemd.stop(service)
-        else:
-            stop(service)
+    services = _services(service)
+    init_system, states = _snapshot(services)
+    _action(init_system, 'stop', [
+        name for name in services if _is_running(states, name)])
 
 
 def restarted(service):
     """
     Require a service to be restarted.
 
+    *service* may also be a list of services. The running ones are
+    restarted together, and the other ones are started.
+
     ::
 
         from fabtools import require
 
         require.service.restarted('foo')
     """
-    if is_running(service):
-        if using_systemd():
-            systemd.restart(service)
-        else:
-            restart(service)
-    else:
-        if using_systemd():
-            systemd.start(service)
-        else:
-            start(service)
+    services = _services(service)
+    init_system, states = _snapshot(services)
+    running = [name for name in services if _is_running(states, name)]
+    _action(init_system, 'restart', running)
+    _action(init_system, 'start', [
+        name for name in services if name not in running])
+
+
+def _services(service):
+    if isinstance(service, six.string_types):
+        return [service]
+    return list(service)
+
+
+def _is_running(states, service):
+    return bool(states.get(service, {}).get('running'))
 
 
 __all__ = ['started', 'stopped', 'restarted']
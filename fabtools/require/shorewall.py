@@ -7,6 +7,7 @@ from fabric.api import hide, puts, settings, shell_env
 from fabric.contrib.files import sed
 
 from fabtools.files import watch
+from fabtools.handlers import notify
 from fabtools.service import start, stop, restart
 from fabtools.shorewall import (
     Ping,
@@ -275,6 +276,10 @@ def firewall(zones=None, interfaces=None, policy=None, rules=None,
             ]
         )
 
+    If the configuration changed, the firewall is restarted. Inside a
+    :func:`fabtools.handlers.deferred` block, the restart happens at the
+    end of the block.
+
     """
 
     family = distrib_family()
@@ -293,13 +298,17 @@ def firewall(zones=None, interfaces=None, policy=None, rules=None,
 
     if config.changed:
         puts("Shorewall configuration changed")
-        if is_started():
-            restart('shorewall')
+        notify('restart shorewall', _restart_if_started)
 
     with settings(hide('running'), shell_env()):
         sed('/etc/default/shorewall', 'startup=0', 'startup=1', use_sudo=True)
 
 
+def _restart_if_started():
+    if is_started():
+        restart('shorewall')
+
+
 def started():
     """
     Ensure that the firewall is started.
@@ -9,8 +9,10 @@ processes using `supervisor`_.
 
 """
 
-from fabtools.files import watch
-from fabtools.supervisor import update_config, process_status, start_process
+from fabric.api import env
+
+from fabtools.handlers import is_notified, notify
+from fabtools.supervisor import start_process, status, update_config
 from fabtools.system import UnsupportedFamily, distrib_family
 
 
@@ -48,11 +50,44 @@ def process(name, use_pip=False, **kwargs):
             stdout_logfile='/path/to/logs/myapp.log',
             )
 
+    Inside a :func:`fabtools.handlers.deferred` block, the supervisor
+    configuration is only reloaded once, at the end of the block, before
+    the processes are started.
+
+    .. seealso:: :func:`processes` to require many processes at once
+
     .. _supervisor documentation: http://supervisord.org/configuration.html#program-x-section-values
 
     """
+    processes({name: kwargs}, use_pip=use_pip)
+
+
+def processes(programs, use_pip=False):
+    """
+    Require several supervisor processes to be running.
+
+    *programs* is a dict mapping process names to dicts of program
+    configuration parameters, as accepted by :func:`process`.
+
+    Supervisor is installed and started once, all the configuration
+    files are written with a single upload, the configuration is updated
+    once, and the stopped processes are started with a single command.
+
+    Example::
+
+        from fabtools import require
+
+        require.supervisor.processes(dict(
+            ('worker%d' % i, {
+                'command': '/srv/app/bin/worker --queue %d' % i,
+                'user': 'app',
+            })
+            for i in range(100)
+        ))
 
-    from fabtools.require import file as require_file
+    """
+
+    from fabtools.require.files import files as require_files
     from fabtools.require.python import package as require_python_package
     from fabtools.require.deb import package as require_deb_package
     from fabtools.require.rpm import package as require_rpm_package
@@ -65,17 +100,17 @@ def process(name, use_pip=False, **kwargs):
         require_package = require_deb_package
         package_name = 'supervisor'
         daemon_name = 'supervisor'
-        filename = '/etc/supervisor/conf.d/%(name)s.conf' % locals()
+        filename = '/etc/supervisor/conf.d/%(name)s.conf'
     elif family == 'redhat':
         require_package = require_rpm_package
         package_name = 'supervisord'
         daemon_name = 'supervisord'
-        filename = '/etc/supervisord.d/%(name)s.ini' % locals()
+        filename = '/etc/supervisord.d/%(name)s.ini'
     elif family == 'arch':
         require_package = require_arch_package
         package_name = 'supervisor'
         daemon_name = 'supervisord'
-        filename = '/etc/supervisor.d/%(name)s.ini' % locals()
+        filename = '/etc/supervisor.d/%(name)s.ini'
     else:
         raise UnsupportedFamily(supported=['debian', 'redhat', 'arch'])
     if use_pip:
@@ -86,22 +121,42 @@ def process(name, use_pip=False, **kwargs):
     require_package(package_name)
     require_started(daemon_name)
 
-    # Set default parameters
-    params = {}
-    params.update(kwargs)
-    params.setdefault('autorestart', 'true')
-    params.setdefault('redirect_stderr', 'true')
-
-    # Build config file from parameters
-    lines = []
-    lines.append('[program:%(name)s]' % locals())
-    for key, value in sorted(params.items()):
-        lines.append("%s=%s" % (key, value))
-
-    # Upload config file
-    with watch(filename, callback=update_config, use_sudo=True):
-        require_file(filename, contents='\n'.join(lines), use_sudo=True)
-
-    # Start the process if needed
-    if process_status(name) == 'STOPPED':
-        start_process(name)
+    contents = {}
+    for name, kwargs in programs.items():
+
+        # Set default parameters
+        params = {}
+        params.update(kwargs)
+        params.setdefault('autorestart', 'true')
+        params.setdefault('redirect_stderr', 'true')
+
+        # Build config file from parameters
+        lines = []
+        lines.append('[program:%(name)s]' % locals())
+        for key, value in sorted(params.items()):
+            lines.append("%s=%s" % (key, value))
+
+        contents[filename % locals()] = '\n'.join(lines)
+
+    # Upload config files
+    if require_files(contents, use_sudo=True, mode='644'):
+        notify('update supervisor', update_config)
+
+    # Start the processes if needed
+    if is_notified('start supervisor processes'):
+        _pending[env.host_string].update(programs)
+    else:
+        _pending[env.host_string] = set(programs)
+        notify('start supervisor processes', _start_pending,
+               after=['update supervisor'])
+
+
+_pending = {}
+
+
+def _start_pending():
+    names = _pending.pop(env.host_string, set())
+    states = status()
+    stopped = [name for name in sorted(names) if states.get(name) == 'STOPPED']
+    if stopped:
+        start_process(stopped)
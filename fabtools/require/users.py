@@ -3,8 +3,24 @@ System users
 ============
 """
 
-from fabtools.files import is_file
-from fabtools.user import create, exists, modify
+from pipes import quote
+import hashlib
+import posixpath
+
+from fabric.api import abort, hide, settings, warn
+import six
+
+from fabtools.files import upload_archive
+from fabtools.user import (
+    _create_args,
+    _known_hosts_name,
+    _load_public_keys,
+    _merge_known_hosts,
+    _merge_public_keys,
+    _modify_args,
+    _password_matches,
+    snapshot,
+)
 from fabtools.utils import run_as_root
 
 
@@ -36,24 +52,341 @@ def user(name, comment=None, home=None, create_home=None, skeleton_dir=None,
 
     """
 
-    from fabtools.require import directory as require_directory
+    users([{
+        'name': name,
+        'comment': comment,
+        'home': home,
+        'create_home': create_home,
+        'skeleton_dir': skeleton_dir,
+        'group': group,
+        'create_group': create_group,
+        'extra_groups': extra_groups,
+        'password': password,
+        'system': system,
+        'shell': shell,
+        'uid': uid,
+        'ssh_public_keys': ssh_public_keys,
+        'non_unique': non_unique,
+    }])
+
+
+def users(specs):
+    """
+    Require several users and their home directories.
+
+    *specs* is a list of user names, or of dicts holding a ``name``
+    and any other argument accepted by :func:`user`.
+
+    The current state of all users and groups is read with a single
+    command (see :func:`fabtools.user.snapshot`). Missing users are
+    created, and existing users are only modified where their account
+    differs from the requirements. All the ``groupadd``, ``useradd``
+    and ``usermod`` commands are then applied in a single batch.
+
+    ::
+
+        from fabtools import require
+
+        require.users.users([
+            'alice',
+            {'name': 'bob', 'shell': '/bin/bash', 'extra_groups': ['adm']},
+            {'name': 'worker', 'system': True, 'home': '/srv/worker'},
+        ])
+
+    """
+
+    specs = [
+        {'name': spec} if isinstance(spec, six.string_types) else spec
+        for spec in specs
+    ]
+
+    state = snapshot()
+    existing_users = state['users']
+    existing_groups = set(state['groups'])
+
+    commands = []
+    for spec in specs:
+        name = spec['name']
+        group = spec.get('group')
+
+        # Make sure the primary group exists
+        if group and spec.get('create_group', True) \
+                and group not in existing_groups:
+            commands.append('groupadd %s' % quote(group))
+            existing_groups.add(group)
+
+        # Make sure the user exists
+        if name not in existing_users:
+            args = _create_args(
+                name,
+                comment=spec.get('comment'),
+                home=spec.get('home'),
+                create_home=spec.get('create_home'),
+                skeleton_dir=spec.get('skeleton_dir'),
+                group=group,
+                extra_groups=spec.get('extra_groups'),
+                password=spec.get('password'),
+                system=spec.get('system', False),
+                shell=spec.get('shell'),
+                uid=spec.get('uid'),
+                non_unique=spec.get('non_unique', False),
+            )
+            commands.append('useradd %s' % args)
+        else:
+            args = _modify_args(name, **_changes(
+                spec, existing_users[name], state['passwords'].get(name)))
+            if args:
+                commands.append('usermod %s' % args)
+
+        # Make sure the home directory exists and is owned by user
+        home = spec.get('home')
+        if home:
+            owner = name if not group else '%s:%s' % (name, group)
+            commands.append('mkdir -p %(home)s && chown %(owner)s %(home)s' % {
+                'home': quote(home),
+                'owner': quote(owner),
+            })
+
+    if commands:
+        run_as_root(' && '.join(commands))
+
+    keys_by_user = {}
+    for spec in specs:
+        ssh_public_keys = spec.get('ssh_public_keys')
+        if ssh_public_keys:
+            if isinstance(ssh_public_keys, six.string_types):
+                ssh_public_keys = [ssh_public_keys]
+            keys_by_user[spec['name']] = ssh_public_keys
+    if keys_by_user:
+        authorized_keys_by_user(keys_by_user)
+
+
+def _changes(spec, current, crypted_password):
+    """
+    Get the ``usermod`` arguments needed to bring a user in line with
+    its requirements.
+    """
+    changes = {}
+    for key in ['comment', 'home', 'shell']:
+        value = spec.get(key)
+        if value and value != current[key]:
+            changes[key] = value
+    group = spec.get('group')
+    if group and group != current['group']:
+        changes['group'] = group
+    extra_groups = spec.get('extra_groups')
+    if extra_groups and set(extra_groups) != set(current['groups']):
+        changes['extra_groups'] = extra_groups
+    password = spec.get('password')
+    if password and not _password_matches(password, crypted_password):
+        changes['password'] = password
+    uid = spec.get('uid')
+    if uid and int(uid) != current['uid']:
+        changes['uid'] = uid
+        changes['non_unique'] = spec.get('non_unique', False)
+    return changes
+
+
+def authorized_keys(name, keys, exclusive=False):
+    """
+    Require SSH public keys to be authorized for a user.
+
+    Each item of *keys* can be either a public key, or the local
+    filename of a file holding one or more public keys.
+
+    Keys are compared by type and value, regardless of their comment.
+    If *exclusive* is ``True``, any other key is removed from the
+    user's ``authorized_keys`` file, so you can use it to revoke keys.
+
+    The current file is read with a single command, and it is only
+    rewritten if needed, with one upload and one atomic rename.
 
-    # Make sure the user exists
-    if not exists(name):
-        create(name, comment=comment, home=home, create_home=create_home,
-               skeleton_dir=skeleton_dir, group=group,
-               create_group=create_group, extra_groups=extra_groups,
-               password=password, system=system, shell=shell, uid=uid,
-               ssh_public_keys=ssh_public_keys, non_unique=non_unique)
-    else:
-        modify(name, comment=comment, home=home, group=group,
-               extra_groups=extra_groups, password=password,
-               shell=shell, uid=uid, ssh_public_keys=ssh_public_keys,
-               non_unique=non_unique)
+    ::
+
+        from fabtools import require
+
+        require.users.authorized_keys('alice', [
+            '~/.ssh/id_rsa.pub',
+            'ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAIE... bob@laptop',
+        ], exclusive=True)
+
+    """
+    authorized_keys_by_user({name: keys}, exclusive=exclusive)
 
-    # Make sure the home directory exists and is owned by user
-    if home:
-        require_directory(home, owner=name, use_sudo=True)
+
+_KEYS_SEPARATOR = '--fabtools-authorized-keys--'
+
+
+def authorized_keys_by_user(keys_by_user, exclusive=False):
+    """
+    Require SSH public keys to be authorized for several users.
+
+    *keys_by_user* is a dict mapping user names to lists of keys, as
+    accepted by :func:`authorized_keys`.
+
+    All the files are read with a single command, and all the files
+    that need to change are written with a single upload.
+
+    ::
+
+        from fabtools import require
+
+        require.users.authorized_keys_by_user({
+            'alice': ['keys/alice.pub'],
+            'deploy': ['keys/alice.pub', 'keys/ci.pub'],
+        })
+
+    """
+    names = sorted(keys_by_user)
+    if not names:
+        return
+
+    current = _read_authorized_keys(names)
+
+    files = {}
+    changed = []
+    for name in names:
+        home, lines = current[name]
+        required = _load_public_keys(keys_by_user[name])
+        merged = _merge_public_keys(lines, required, exclusive=exclusive)
+        if merged != lines:
+            files[name] = ''.join(line + '\n' for line in merged)
+            changed.append((name, posixpath.join(home, '.ssh')))
+
+    if not changed:
+        return
+
+    staged = upload_archive(files)
+    commands = []
+    for name, ssh_dir in changed:
+        commands.append(
+            'mkdir -p %(ssh_dir)s && chown %(name)s %(ssh_dir)s && '
+            'chmod 700 %(ssh_dir)s' % {
+                'ssh_dir': quote(ssh_dir),
+                'name': quote(name),
+            })
+        commands.append(staged.install(
+            name, posixpath.join(ssh_dir, 'authorized_keys'), owner=name,
+            mode='600'))
+    run_as_root(staged.script(commands))
+
+
+def _read_authorized_keys(names):
+    """
+    Get the home directories and authorized keys of several users.
+    """
+    commands = []
+    for name in names:
+        commands.append(
+            "echo %(separator)s; "
+            "home=$(getent passwd %(name)s | cut -d: -f6); echo \"$home\"; "
+            "[ -n \"$home\" ] && "
+            "cat \"$home/.ssh/authorized_keys\" 2>/dev/null; echo" % {
+                'separator': _KEYS_SEPARATOR,
+                'name': quote(name),
+            })
+    with settings(hide('running', 'stdout')):
+        res = run_as_root('; '.join(commands))
+
+    current = {}
+    sections = (res.replace('\r\n', '\n') + '\n').split(
+        _KEYS_SEPARATOR + '\n')[1:]
+    for name, section in zip(names, sections):
+        lines = section.splitlines() or ['']
+        home = lines[0].strip()
+        if not home:
+            abort("User %s does not exist" % name)
+        current[name] = (home, [line for line in lines[1:] if line.strip()])
+    return current
+
+
+_KNOWN_HOSTS_SEPARATOR = '--fabtools-known-hosts--'
+
+
+def known_hosts(name, hostnames, key_types=('rsa', 'ecdsa', 'ed25519'),
+                timeout=5, hash_hosts=False):
+    """
+    Require the SSH host keys of several hosts to be known to a user.
+
+    *hostnames* is a list of host names, optionally followed by a port
+    (``host:port``). The known hosts file is read and all the hosts are
+    scanned with a single command, as ``ssh-keyscan`` queries the hosts
+    concurrently. Hosts not answering within *timeout* seconds are
+    skipped with a warning.
+
+    Existing entries are recognized even if they are hashed, so keys are
+    never added twice, and the file is rewritten once if needed. If
+    *hash_hosts* is ``True``, new entries are hashed like ``ssh-keygen
+    -H`` would do.
+
+    ::
+
+        from fabtools import require
+
+        require.users.known_hosts('deploy', [
+            'github.com',
+            'bitbucket.org',
+            'git.example.com:2222',
+        ])
+
+    """
+    if not hostnames:
+        return
+
+    by_port = {}
+    for hostname in hostnames:
+        host, sep, port = hostname.partition(':')
+        by_port.setdefault(port or '22', []).append(host)
+
+    commands = [
+        'echo ~%(name)s; echo %(separator)s; '
+        'cat ~%(name)s/.ssh/known_hosts 2>/dev/null; echo %(separator)s' % {
+            'name': name,
+            'separator': _KNOWN_HOSTS_SEPARATOR,
+        }
+    ]
+    for port in sorted(by_port):
+        commands.append(
+            'ssh-keyscan -T %(timeout)d -t %(types)s -p %(port)s '
+            '%(hosts)s 2>/dev/null' % {
+                'timeout': timeout,
+                'types': ','.join(key_types),
+                'port': port,
+                'hosts': ' '.join(quote(host) for host in by_port[port]),
+            })
+    with settings(hide('running', 'stdout')):
+        res = run_as_root('; '.join(commands) + '; true')
+
+    home, current, scanned = res.replace('\r\n', '\n').split(
+        _KNOWN_HOSTS_SEPARATOR + '\n')
+    home = home.strip()
+    if home.startswith('~'):
+        abort("User %s does not exist" % name)
+    current = [line for line in current.splitlines() if line.strip()]
+    scanned = scanned.splitlines()
+
+    found = set(line.split()[0] for line in scanned if line.strip())
+    for hostname in hostnames:
+        if _known_hosts_name(hostname) not in found:
+            warn("Could not get the SSH host keys of %s" % hostname)
+
+    merged = _merge_known_hosts(current, scanned, hash_hosts=hash_hosts)
+    if merged == current:
+        return
+
+    ssh_dir = posixpath.join(home, '.ssh')
+    staged = upload_archive({
+        'known_hosts': ''.join(line + '\n' for line in merged),
+    })
+    run_as_root(staged.script([
+        'mkdir -p %(ssh_dir)s && chown %(name)s %(ssh_dir)s && '
+        'chmod 700 %(ssh_dir)s' % {
+            'ssh_dir': quote(ssh_dir),
+            'name': quote(name),
+        },
+        staged.install('known_hosts', posixpath.join(ssh_dir, 'known_hosts'),
+                       owner=name, mode='644'),
+    ]))
 
 
 def sudoer(username, hosts="ALL", operators="ALL", passwd=False,
@@ -61,15 +394,93 @@ def sudoer(username, hosts="ALL", operators="ALL", passwd=False,
     """
     Require sudo permissions for a given user.
 
+    The entry is written to ``/etc/sudoers.d/fabtools-<username>``, and
+    is checked with ``visudo`` before being installed.
+
     .. note:: This function can be accessed directly from the
               ``fabtools.require`` module for convenience.
 
+    .. seealso:: :func:`sudoers` to manage many entries at once
+
+    """
+    sudoers([{
+        'username': username,
+        'hosts': hosts,
+        'operators': operators,
+        'passwd': passwd,
+        'commands': commands,
+    }])
+
+
+def sudoers(entries):
+    """
+    Require sudo permissions for several users.
+
+    *entries* is a list of dicts with a ``username`` key, and optional
+    ``hosts``, ``operators``, ``passwd`` and ``commands`` keys, with the
+    same meaning as the arguments of :func:`sudoer`. The entries of a
+    user are written to ``/etc/sudoers.d/fabtools-<username>``.
+
+    The files are rendered locally, and only the files whose digest
+    changed are uploaded. They are all checked with ``visudo -cf`` and
+    atomically installed in the same command, so that an invalid entry
+    never reaches the sudo configuration.
+
+    ::
+
+        from fabtools import require
+
+        require.users.sudoers([
+            {'username': 'alice'},
+            {'username': 'deploy', 'commands': '/usr/sbin/service nginx *'},
+            {'username': 'backup', 'operators': 'postgres', 'passwd': True},
+        ])
+
     """
+    files = {}
+    for entry in entries:
+        filename = '/etc/sudoers.d/fabtools-%s' % entry['username'].strip()
+        files[filename] = files.get(filename, '') + _sudoers_line(**entry)
+    if not files:
+        return
+
+    filenames = sorted(files)
+    with settings(hide('running', 'stdout')):
+        res = run_as_root('md5sum %s 2>/dev/null; true' % ' '.join(
+            quote(filename) for filename in filenames))
+    digests = {}
+    for line in res.splitlines():
+        parts = line.split(None, 1)
+        if len(parts) == 2:
+            digests[parts[1].strip()] = parts[0]
+
+    changed = [
+        filename for filename in filenames
+        if digests.get(filename) != hashlib.md5(
+            files[filename].encode('utf-8')).hexdigest()
+    ]
+    if not changed:
+        return
+
+    staged = upload_archive(dict(
+        (posixpath.basename(filename), files[filename])
+        for filename in changed))
+    commands = [
+        'visudo -cf %s' % quote(staged.path(posixpath.basename(filename)))
+        for filename in changed
+    ]
+    commands.extend(
+        staged.install(posixpath.basename(filename), filename,
+                       owner='root', group='root', mode='0440')
+        for filename in changed)
+    with settings(hide('running', 'stdout'), warn_only=True):
+        res = run_as_root(staged.script(commands))
+    if res.failed:
+        abort("Invalid sudoers entries, not installed:\n%s" % res)
+
+
+def _sudoers_line(username, hosts="ALL", operators="ALL", passwd=False,
+                  commands="ALL"):
     tags = "PASSWD:" if passwd else "NOPASSWD:"
-    spec = "%(username)s %(hosts)s=(%(operators)s) %(tags)s %(commands)s" %\
-           locals()
-    filename = '/etc/sudoers.d/fabtools-%s' % username.strip()
-    if is_file(filename):
-        run_as_root('chmod 0640 %(filename)s && rm -f %(filename)s' % locals())
-    run_as_root('echo "%(spec)s" >%(filename)s && chmod 0440 %(filename)s' %
-                locals(), shell=True)
+    return "%(username)s %(hosts)s=(%(operators)s) %(tags)s %(commands)s\n" % \
+        locals()
@@ -0,0 +1,151 @@
+"""
+Version control
+===============
+
+This module provides high-level tools to require many working copies of
+`Git`_ and `Mercurial`_ repositories at once.
+
+.. _Git: http://git-scm.com/
+.. _Mercurial: http://mercurial.selenic.com/
+
+"""
+
+from collections import OrderedDict
+
+from fabric.api import env
+from fabric.utils import error
+
+from fabtools import git, mercurial
+from fabtools.require import git as require_git
+from fabtools.require import mercurial as require_mercurial
+from fabtools.utils import run_concurrently
+
+
+BACKENDS = ('git', 'hg')
+
+
+def working_copies(repositories, use_sudo=False, user=None, concurrency=4):
+    """
+    Require many working copies, cloning or updating them concurrently.
+
+    *repositories* is a list of dicts with a ``vcs`` key (``git``, the
+    default, or ``hg``) and the arguments of
+    :func:`fabtools.require.git.working_copy` or
+    :func:`fabtools.require.mercurial.working_copy`.
+
+    The state of all the working copies is read with a single command
+    for each version control system.  Then, as clones and updates mostly
+    wait for the network, they run at the same time on the remote host,
+    up to *concurrency* at once (see
+    :func:`fabtools.utils.run_concurrently`), so that the whole checkout
+    takes about as long as the slowest repository.  The Git mirrors
+    needed by the ``use_mirror`` option are refreshed first, in the same
+    way.
+
+    Returns an ordered dict mapping the path of each working copy to the
+    output of its clone or update command, with the ``succeeded`` and
+    ``failed`` attributes of the results of Fabric's ``run``, or to
+    ``None`` if there was nothing to do.
+
+    A failure does not stop the other checkouts.  Once they are all
+    finished, this aborts with the errors of the failed ones, unless
+    ``warn_only`` is set.
+
+    ::
+
+        from fabtools import require
+
+        require.vcs.working_copies([
+            {'remote_url': 'https://github.com/example/api.git',
+             'path': '/srv/api'},
+            {'vcs': 'hg', 'remote_url': 'https://hg.example.com/web',
+             'path': '/srv/web', 'branch': 'stable'},
+        ], concurrency=8)
+
+    """
+    repositories = [_options(repository) for repository in repositories]
+    states = _states(repositories, use_sudo, user)
+
+    commands = OrderedDict()
+    mirrors = OrderedDict()
+    for (vcs, options), state in zip(repositories, states):
+        path = options['path']
+        if vcs == 'git':
+            branch = options.get('branch', 'master')
+            if require_git._up_to_date(state, branch,
+                                       options.get('update', True)):
+                commands[path] = None
+                continue
+            reference = None
+            if options.get('use_mirror'):
+                reference = require_git._mirror_path(options['remote_url'])
+                mirrors[reference] = options['remote_url']
+            commands[path] = require_git._working_copy_command(
+                state, options['remote_url'], path, branch,
+                options.get('depth'), options.get('filter'),
+                options.get('sparse'), reference,
+                options.get('update', True), options.get('force', False))
+        else:
+            commands[path] = require_mercurial._working_copy_command(
+                state, options['remote_url'], path,
+                options.get('branch', 'default'),
+                options.get('update', True))
+
+    errors = []
+    if mirrors:
+        refreshed = require_git._mirrors.setdefault(env.host_string, set())
+        paths = [path for path in mirrors if path not in refreshed]
+        results = run_concurrently(
+            [git._mirror_command(mirrors[path], path) for path in paths],
+            concurrency=concurrency, use_sudo=use_sudo, user=user)
+        for path, result in zip(paths, results):
+            if result.succeeded:
+                refreshed.add(path)
+            else:
+                errors.append('%s: %s' % (mirrors[path], result))
+
+    pending = [path for path, cmd in commands.items() if cmd is not None]
+    results = run_concurrently([commands[path] for path in pending],
+                               concurrency=concurrency, use_sudo=use_sudo,
+                               user=user)
+    for path, result in zip(pending, results):
+        commands[path] = result
+        if result.failed:
+            errors.append('%s: %s' % (path, result))
+
+    if errors:
+        error('Could not check out working copies:\n\n%s' %
+              '\n'.join(errors))
+    return commands
+
+
+def _options(repository):
+    options = dict(repository)
+    vcs = options.pop('vcs', 'git')
+    if vcs not in BACKENDS:
+        raise ValueError('Unsupported version control system: %r' % vcs)
+    if options.get('path') is None:
+        if vcs == 'git':
+            options['path'] = require_git._default_path(options['remote_url'])
+        else:
+            options['path'] = require_mercurial._default_path(
+                options['remote_url'])
+    return vcs, options
+
+
+def _states(repositories, use_sudo, user):
+    """
+    Get the state of the working copies, with one command for each
+    version control system.
+    """
+    states = {}
+    for vcs, require_module, module in [
+            ('git', require_git, git),
+            ('hg', require_mercurial, mercurial)]:
+        paths = [options['path'] for kind, options in repositories
+                 if kind == vcs]
+        if paths:
+            require_module.command()
+            states[vcs] = iter(module.statuses(paths, use_sudo=use_sudo,
+                                               user=user))
+    return [next(states[vcs]) for vcs, options in repositories]
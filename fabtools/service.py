@@ -10,41 +10,316 @@ and traditional SysV-style ``/etc/init.d/`` scripts.
 
 """
 
+from pipes import quote
+import re
+
 from fabric.api import hide, settings
+import six
 
 from fabtools import systemd
-from fabtools.system import using_systemd, distrib_family
+from fabtools.system import distrib_family
 from fabtools.utils import run_as_root
 
 
+_SNAPSHOT_SEPARATOR = '--fabtools-services--'
+
+
+def _snapshot_command(services=None):
+    if services:
+        systemd_listing = (
+            'systemctl show --property=Id --property=ActiveState '
+            '--property=UnitFileState --no-pager %s' % ' '.join(
+                quote(_unit_name(service)) for service in services))
+        upstart_listing = '; '.join(
+            _status_command('upstart', service) for service in services)
+        openrc_listing = '; '.join(
+            _status_command('openrc', service) for service in services)
+        sysv_listing = upstart_listing
+    else:
+        systemd_listing = (
+            'systemctl list-units --all --type=service --no-legend '
+            '--no-pager --plain; echo %s; '
+            'systemctl list-unit-files --type=service --no-legend --no-pager'
+            % _SNAPSHOT_SEPARATOR)
+        upstart_listing = ('initctl list; echo %s; service --status-all 2>&1'
+                           % _SNAPSHOT_SEPARATOR)
+        openrc_listing = 'rc-status --all'
+        sysv_listing = 'service --status-all 2>&1'
+    return (
+        'if which systemctl >/dev/null 2>&1; then '
+        'echo systemd; %(systemd)s; '
+        'elif which initctl >/dev/null 2>&1; then '
+        'echo upstart; %(upstart)s; '
+        'elif which rc-status >/dev/null 2>&1; then '
+        'echo openrc; %(openrc)s; echo %(separator)s; rc-update show; '
+        'else '
+        'echo sysv; %(sysv)s; echo %(separator)s; '
+        'ls /etc/rc2.d /etc/rc3.d 2>/dev/null; '
+        'fi' % {
+            'systemd': systemd_listing,
+            'upstart': upstart_listing,
+            'openrc': openrc_listing,
+            'sysv': sysv_listing,
+            'separator': _SNAPSHOT_SEPARATOR,
+        })
+
+
+def _status_command(init_system, service):
+    """
+    Check a named service the way :func:`is_running` always did, and
+    print its name and the result.
+    """
+    name = quote(service)
+    if init_system == 'openrc':
+        check = '/etc/init.d/%(name)s status 2>&1 | grep -q " started"'
+    else:
+        # Upstart jobs exit with 0 even when stopped
+        check = ('if [ -f /etc/init/%(name)s.conf ]; then '
+                 'service %(name)s status 2>&1 | grep -q running; '
+                 'else service %(name)s status >/dev/null 2>&1; fi')
+    return (check + '; echo %(name)s $?') % locals()
+
+
+def snapshot(services=None):
+    """
+    Get the state of system services, using a single command.
+
+    The init system is detected on the fly. When you pass a list of
+    *services*, only those are queried: with ``systemctl show`` on
+    systemd hosts, which also resolves unit aliases, and with the exit
+    status of ``service NAME status`` on other hosts. Otherwise, all the
+    services are listed with ``systemctl``, ``initctl``, ``rc-status``
+    or ``service --status-all``, whose output is less reliable for
+    scripts that do not implement ``status``.
+
+    The states are read again on each call, as services are also
+    started and stopped by package installs and other commands.
+
+    Returns a dict mapping service names to dicts with a ``running``
+    and an ``enabled`` key. The ``enabled`` value is ``None`` when the
+    init system does not tell.
+
+    Example::
+
+        import fabtools
+
+        services = fabtools.service.snapshot()
+        for name in ['nginx', 'postgresql']:
+            if not services.get(name, {}).get('running'):
+                print("Service %s is not running!" % name)
+
+    """
+    return _snapshot(services)[1]
+
+
+def _snapshot(services=None):
+    """
+    Get the init system and the state of system services.
+    """
+    with settings(hide('running', 'stdout', 'stderr', 'warnings'),
+                  warn_only=True):
+        res = run_as_root(_snapshot_command(services), pty=False)
+    init_system, _, listing = res.replace('\r\n', '\n').partition('\n')
+    init_system = init_system.strip()
+    first, _, second = listing.partition(_SNAPSHOT_SEPARATOR + '\n')
+    if services:
+        if init_system == 'systemd':
+            return init_system, _parse_systemctl_show(services, first)
+        return init_system, _parse_status_codes(init_system, first, second)
+    parser = {
+        'systemd': _parse_systemctl_list,
+        'upstart': _parse_initctl_list,
+        'openrc': _parse_rc_status,
+    }.get(init_system, _parse_sysv)
+    return init_system, parser(first, second)
+
+
+_ENABLED_STATES = set([
+    'alias',
+    'enabled',
+    'enabled-runtime',
+    'generated',
+    'indirect',
+    'static',
+    'transient',
+])
+
+
+def _unit_name(service):
+    if service.endswith('.service'):
+        return service
+    return service + '.service'
+
+
+def _service_name(unit):
+    return re.sub(r'\.service$', '', unit)
+
+
+def _parse_systemctl_show(services, text):
+    states = {}
+    blocks = text.strip().split('\n\n')
+    for service, block in zip(services, blocks):
+        properties = dict(
+            line.split('=', 1) for line in block.splitlines() if '=' in line)
+        states[service] = {
+            'running': properties.get('ActiveState') == 'active',
+            'enabled': properties.get('UnitFileState') in _ENABLED_STATES,
+        }
+    return states
+
+
+def _parse_systemctl_list(units, unit_files):
+    states = {}
+    for line in units.splitlines():
+        fields = line.split()
+        if fields and not fields[0].endswith('.service'):
+            fields = fields[1:]
+        if len(fields) >= 3:
+            states[_service_name(fields[0])] = {
+                'running': fields[2] == 'active',
+                'enabled': None,
+            }
+    for line in unit_files.splitlines():
+        fields = line.split()
+        if len(fields) >= 2 and fields[0].endswith('.service'):
+            state = states.setdefault(_service_name(fields[0]),
+                                      {'running': False})
+            state['enabled'] = fields[1] in _ENABLED_STATES
+    return states
+
+
+_STATUS_ALL_RE = re.compile(r'^\s*\[\s*([+?-])\s*\]\s+(\S+)')
+_STATUS_RE = re.compile(r'^(\S+)\b.*\bis (running|stopped)')
+
+
+def _parse_status_all(text):
+    states = {}
+    for line in text.splitlines():
+        match = _STATUS_ALL_RE.match(line)
+        if match:
+            running = match.group(1) == '+'
+            name = match.group(2)
+        else:
+            match = _STATUS_RE.match(line)
+            if not match:
+                continue
+            running = match.group(2) == 'running'
+            name = match.group(1)
+        states[name] = {'running': running, 'enabled': None}
+    return states
+
+
+def _parse_initctl_list(jobs, scripts):
+    states = _parse_status_all(scripts)
+    for line in jobs.splitlines():
+        fields = line.split()
+        if not fields:
+            continue
+        running = 'start/running' in line
+        state = states.get(fields[0])
+        if state is None or not state['running']:
+            states[fields[0]] = {'running': running, 'enabled': None}
+    return states
+
+
+def _parse_rc_status(services, runlevels):
+    states = {}
+    for line in services.splitlines():
+        match = re.match(r'^\s*(\S+)\s+\[\s*(\w+)\s*\]', line)
+        if match:
+            states[match.group(1)] = {
+                'running': match.group(2) == 'started',
+                'enabled': False,
+            }
+    for line in runlevels.splitlines():
+        match = re.match(r'^\s*(\S+)\s*\|\s*(.*)$', line)
+        if match:
+            state = states.setdefault(match.group(1), {'running': False})
+            state['enabled'] = bool(match.group(2).strip())
+    return states
+
+
+def _parse_status_codes(init_system, codes, enabled):
+    """
+    Parse the output of the checks of :func:`_status_command`.
+    """
+    if init_system == 'openrc':
+        boot = _parse_rc_status('', enabled)
+    elif init_system == 'sysv':
+        boot = _parse_sysv('', enabled)
+    else:
+        boot = None
+    states = {}
+    for line in codes.splitlines():
+        fields = line.rsplit(None, 1)
+        if len(fields) == 2 and fields[1].isdigit():
+            name = fields[0]
+            states[name] = {
+                'running': fields[1] == '0',
+                'enabled': (None if boot is None else
+                            bool(boot.get(name, {}).get('enabled'))),
+            }
+    return states
+
+
+def _parse_sysv(status, links):
+    states = _parse_status_all(status)
+    enabled = set()
+    for line in links.splitlines():
+        match = re.match(r'^S\d\d(\S+)$', line.strip())
+        if match:
+            enabled.add(match.group(1))
+    for name in enabled:
+        states.setdefault(name, {'running': False})
+    for name, state in states.items():
+        state['enabled'] = name in enabled
+    return states
+
+
+def _lookup(states, service, key):
+    if isinstance(service, six.string_types):
+        return bool(states.get(service, {}).get(key))
+    return dict((name, bool(states.get(name, {}).get(key)))
+                for name in service)
+
+
 def is_running(service):
     """
     Check if a service is running.
 
+    *service* may also be a list of service names, in which case a dict
+    mapping each name to a boolean is returned. In both cases, a single
+    command is used.
+
     ::
 
         import fabtools
 
         if fabtools.service.is_running('foo'):
             print "Service foo is running!"
+
+        running = fabtools.service.is_running(['foo', 'bar'])
     """
-    with settings(hide('running', 'stdout', 'stderr', 'warnings'),
-                  warn_only=True):
-        if using_systemd():
-            return systemd.is_running(service)
-        else:
-            if distrib_family() != "gentoo":
-                test_upstart = run_as_root('test -f /etc/init/%s.conf' %
-                                           service)
-                status = _service(service, 'status')
-                if test_upstart.succeeded:
-                    return 'running' in status
-                else:
-                    return status.succeeded
-            else:
-                # gentoo
-                status = _service(service, 'status')
-                return ' started' in status
+    names = [service] if isinstance(service, six.string_types) else service
+    return _lookup(snapshot(names), service, 'running')
+
+
+def is_enabled(service):
+    """
+    Check if a service is enabled at boot.
+
+    *service* may also be a list of service names, in which case a dict
+    mapping each name to a boolean is returned.
+
+    ::
+
+        import fabtools
+
+        if not fabtools.service.is_enabled('foo'):
+            print "Service foo will not start at boot!"
+    """
+    names = [service] if isinstance(service, six.string_types) else service
+    return _lookup(snapshot(names), service, 'enabled')
 
 
 def start(service):
@@ -142,3 +417,21 @@ def _service(service, action):
         status = run_as_root('/etc/init.d/%(service)s %(action)s' % locals(),
                              pty=False)
     return status
+
+
+def _action(init_system, action, services):
+    """
+    Run an action on several services with a single command.
+    """
+    if not services:
+        return
+    if init_system == 'systemd':
+        systemd.action(action, services)
+        return
+    if init_system == 'openrc':
+        template = '/etc/init.d/%(service)s %(action)s'
+    else:
+        template = 'service %(service)s %(action)s'
+    run_as_root(' && '.join(
+        template % {'service': quote(service), 'action': action}
+        for service in services), pty=False)
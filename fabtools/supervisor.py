@@ -5,11 +5,32 @@ Supervisor processes
 This module provides high-level tools for managing long-running
 processes using `supervisord`_.
 
+By default, the functions in this module use the ``supervisorctl``
+command. If you set ``env.supervisor_backend`` to ``'xmlrpc'``, they
+talk to the XML-RPC interface of supervisord instead, through its unix
+socket (``env.supervisor_socket``, defaults to
+``/var/run/supervisor.sock``). The requests are relayed by ``socat`` or
+``nc -U`` over the existing SSH connection, which avoids starting a
+Python interpreter on the remote host for each operation, and the
+operations on several processes are batched in a single
+``system.multicall``::
+
+    from fabric.api import env
+    import fabtools
+
+    env.supervisor_backend = 'xmlrpc'
+
+    fabtools.supervisor.restart_process(['web1', 'web2', 'worker'])
+
 .. _supervisord: http://supervisord.org/
 
 """
 
-from fabric.api import hide, settings
+import base64
+
+from fabric.api import abort, env, hide, settings
+import six
+from six.moves import xmlrpc_client
 
 from fabtools.utils import run_as_root
 
@@ -18,7 +39,10 @@ def reload_config():
     """
     Reload supervisor configuration.
     """
-    run_as_root("supervisorctl reload")
+    if _use_xmlrpc():
+        multicall([('supervisor.restart', ())])
+    else:
+        run_as_root("supervisorctl reload")
 
 
 def update_config():
@@ -28,13 +52,167 @@ def update_config():
     Less heavy-handed than a full reload, as it doesn't restart the
     backend supervisor process and all managed processes.
     """
-    run_as_root("supervisorctl update")
+    if _use_xmlrpc():
+        _update_config_xmlrpc()
+    else:
+        run_as_root("supervisorctl update")
+
+
+def _update_config_xmlrpc():
+    calls = [('supervisor.reloadConfig', ())]
+    results = multicall(calls)
+    _check(calls, results)
+    # reloadConfig returns [[added, changed, removed]]
+    added, changed, removed = results[0][0][0]
+    calls = []
+    for group in changed + removed:
+        calls.append(('supervisor.stopProcessGroup', (group,)))
+        calls.append(('supervisor.removeProcessGroup', (group,)))
+    for group in changed + added:
+        calls.append(('supervisor.addProcessGroup', (group,)))
+    _check(calls, multicall(calls))
+
+
+# Fault codes of the supervisord XML-RPC interface
+BAD_NAME = 10
+ALREADY_STARTED = 60
+NOT_RUNNING = 70
+ALREADY_ADDED = 90
+
+_IGNORED_FAULTS = {
+    'supervisor.startProcess': ALREADY_STARTED,
+    'supervisor.stopProcess': NOT_RUNNING,
+    'supervisor.stopProcessGroup': BAD_NAME,
+    'supervisor.addProcessGroup': ALREADY_ADDED,
+}
+
+
+def _use_xmlrpc():
+    return env.get('supervisor_backend') == 'xmlrpc'
+
+
+def multicall(calls, socket=None):
+    """
+    Call several methods of the supervisord XML-RPC interface at once.
+
+    *calls* is a list of ``(method_name, params)`` tuples. They are sent
+    in a single ``system.multicall`` request to the unix *socket* of
+    supervisord (defaults to ``env.supervisor_socket``, or
+    ``/var/run/supervisor.sock``), using a single remote command.
+
+    Returns the list of results, in the same order as the calls. The
+    result of a successful call is wrapped in a list, and a failed call
+    gives a dict with ``faultCode`` and ``faultString`` keys.
+
+    ::
+
+        from fabtools.supervisor import multicall
+
+        results = multicall([
+            ('supervisor.getState', ()),
+            ('supervisor.getAllProcessInfo', ()),
+        ])
+
+    """
+    if not calls:
+        return []
+    socket = socket or env.get('supervisor_socket', '/var/run/supervisor.sock')
+    body = xmlrpc_client.dumps(([
+        {'methodName': method, 'params': list(params)}
+        for method, params in calls
+    ],), 'system.multicall')
+    if isinstance(body, six.text_type):
+        body = body.encode('utf-8')
+    request = (
+        b'POST /RPC2 HTTP/1.0\r\n'
+        b'Host: localhost\r\n'
+        b'Content-Type: text/xml\r\n'
+        b'Content-Length: ' + str(len(body)).encode('ascii') + b'\r\n'
+        b'\r\n' + body
+    )
+    command = (
+        'echo %(request)s | base64 -d | { '
+        'if which socat >/dev/null 2>&1; '
+        'then socat -t 30 - UNIX-CONNECT:%(socket)s; '
+        'else nc -U %(socket)s; fi; }' % {
+            'request': base64.b64encode(request).decode('ascii'),
+            'socket': socket,
+        })
+    with settings(hide('running', 'stdout')):
+        res = run_as_root(command, pty=False)
+
+    response = res.replace('\r\n', '\n')
+    headers, sep, body = response.partition('\n\n')
+    status_line = headers.split('\n', 1)[0]
+    if not sep or ' 200 ' not in status_line + ' ':
+        abort("Unexpected response from supervisord: %s" % status_line)
+    try:
+        return xmlrpc_client.loads(body)[0][0]
+    except xmlrpc_client.Fault as e:
+        abort("supervisord error: %s" % e.faultString)
+
+
+def _check(calls, results):
+    """
+    Abort if one of the calls failed, except for harmless faults.
+    """
+    for (method, params), result in zip(calls, results):
+        if isinstance(result, dict):
+            if result['faultCode'] != _IGNORED_FAULTS.get(method):
+                abort("supervisord error in %s%r: %s" % (
+                    method, tuple(params), result['faultString']))
+
+
+def _process_name(info):
+    if info['group'] == info['name']:
+        return info['name']
+    return '%s:%s' % (info['group'], info['name'])
+
+
+def status():
+    """
+    Get the status of all supervisor processes, using a single command.
+
+    Returns a dict mapping process names (``group:name`` for processes
+    in a group) to their state, such as ``RUNNING`` or ``STOPPED``.
+
+    ::
+
+        import fabtools
+
+        states = fabtools.supervisor.status()
+        stopped = [name for name, state in states.items()
+                   if state != 'RUNNING']
+
+    """
+    if _use_xmlrpc():
+        infos = multicall([('supervisor.getAllProcessInfo', ())])[0][0]
+        return dict((_process_name(info), info['statename'])
+                    for info in infos)
+
+    with settings(
+            hide('running', 'stdout', 'stderr', 'warnings'), warn_only=True):
+        res = run_as_root("supervisorctl status")
+    states = {}
+    for line in res.splitlines():
+        fields = line.split()
+        if len(fields) >= 2 and fields[1].isupper():
+            states[fields[0]] = fields[1]
+    return states
 
 
 def process_status(name):
     """
     Get the status of a supervisor process.
+
+    .. seealso:: :func:`status` to get the status of all processes
     """
+    if _use_xmlrpc():
+        result = multicall([('supervisor.getProcessInfo', (name,))])[0]
+        if isinstance(result, dict):
+            return None
+        return result[0]['statename']
+
     with settings(
             hide('running', 'stdout', 'stderr', 'warnings'), warn_only=True):
         res = run_as_root("supervisorctl status %(name)s" % locals())
@@ -47,19 +225,56 @@ def process_status(name):
 def start_process(name):
     """
     Start a supervisor process
+
+    *name* may also be a list of processes, which are started with a
+    single command.
     """
-    run_as_root("supervisorctl start %(name)s" % locals())
+    if _use_xmlrpc():
+        _process_calls('supervisor.startProcess', name)
+    else:
+        run_as_root("supervisorctl start %s" % _names(name))
 
 
 def stop_process(name):
     """
     Stop a supervisor process
+
+    *name* may also be a list of processes, which are stopped with a
+    single command.
     """
-    run_as_root("supervisorctl stop %(name)s" % locals())
+    if _use_xmlrpc():
+        _process_calls('supervisor.stopProcess', name)
+    else:
+        run_as_root("supervisorctl stop %s" % _names(name))
 
 
 def restart_process(name):
     """
     Restart a supervisor process
+
+    *name* may also be a list of processes, which are restarted with a
+    single command.
     """
-    run_as_root("supervisorctl restart %(name)s" % locals())
+    if _use_xmlrpc():
+        # supervisord runs the calls of a multicall in order, waiting
+        # for the processes to stop before starting them again
+        _process_calls(['supervisor.stopProcess', 'supervisor.startProcess'],
+                       name)
+    else:
+        run_as_root("supervisorctl restart %s" % _names(name))
+
+
+def _process_calls(methods, name):
+    if isinstance(methods, six.string_types):
+        methods = [methods]
+    if isinstance(name, six.string_types):
+        name = [name]
+    calls = [(method, (process, True))
+             for method in methods for process in name]
+    _check(calls, multicall(calls))
+
+
+def _names(name):
+    if isinstance(name, six.string_types):
+        return name
+    return ' '.join(name)
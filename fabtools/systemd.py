@@ -9,14 +9,19 @@ This module provides low-level tools for managing `systemd`_ services.
 """
 
 from fabric.api import hide, settings
+import six
 
 from fabtools.utils import run_as_root
 
 
 def action(action, service):
-    return run_as_root(
-        'systemctl %s %s.service --no-pager' % (action, service,)
-    )
+    """
+    Run a ``systemctl`` action on a service, or on a list of services.
+    """
+    if isinstance(service, six.string_types):
+        service = [service]
+    return run_as_root('systemctl %s %s --no-pager' % (
+        action, ' '.join('%s.service' % name for name in service)))
 
 
 def enable(service):
@@ -0,0 +1,3924 @@
+"""
+Simulated hosts
+===============
+
+This module provides an in-process simulation of a remote host, so
+that fabtools functions can be exercised without a real target system.
+
+A :class:`SimulatedHost` holds a virtual filesystem along with the state
+of users, groups, packages, services and PostgreSQL objects. Inside the
+:func:`simulated` context manager, Fabric's ``run``, ``sudo``, ``put``
+and ``get`` operations (and the streaming commands of
+:func:`fabtools.utils.stream`) are routed to the simulated host matching
+``env.host_string`` instead of opening an SSH connection.
+
+Example::
+
+    from fabtools import require
+    from fabtools.tests.simulated import SimulatedHost, simulated
+
+    host = SimulatedHost()
+    with simulated(host):
+        require.user('alice')
+
+    assert 'alice' in host.users
+    print("%d commands were run" % len(host.history))
+
+Many hosts can be simulated at once, which is useful for scaling tests::
+
+    from fabric.api import execute
+
+    hosts = [SimulatedHost('web%d' % i) for i in range(200)]
+    with simulated(*hosts):
+        execute(deploy, hosts=[host.host_string for host in hosts])
+
+The shell interpreter understands simple commands, pipelines, ``&&``,
+``||``, ``;``, ``{ ...; }``, ``if`` and ``for`` constructs, redirections,
+``$(...)`` substitutions and variables. Programs are implemented by
+handlers, and you can add or override them with
+:meth:`SimulatedHost.register`.
+
+.. warning:: This is a simulation: only the commands and options used
+             by fabtools are supported, and unknown commands fail with
+             exit status 127.
+
+"""
+
+from contextlib import contextmanager
+from collections import OrderedDict
+import base64
+import fnmatch
+import gzip
+import hashlib
+import io
+import json
+import posixpath
+import re
+import stat
+import tarfile
+import time
+import zlib
+
+from fabric.api import env, output
+from fabric.context_managers import (
+    quiet as quiet_manager,
+    warn_only as warn_only_manager,
+)
+from fabric.operations import (
+    _AttributeString,
+    _prefix_commands,
+    _prefix_env_vars,
+)
+from fabric.utils import error
+import fabric.operations
+import fabric.sftp
+import six
+from six.moves import xmlrpc_client
+
+from fabtools.utils import clear_host_caches
+import fabtools.utils
+
+
+class SimulatedCommandError(Exception):
+    """
+    Raised by a command handler to fail with a message and exit status.
+    """
+
+    def __init__(self, message, status=1):
+        self.status = status
+        super(SimulatedCommandError, self).__init__(message)
+
+
+class _Exit(Exception):
+
+    def __init__(self, status):
+        self.status = status
+        super(_Exit, self).__init__(status)
+
+
+class _Node(object):
+    """
+    An entry of the virtual filesystem.
+    """
+
+    def __init__(self, kind, owner='root', group='root', mode=0o644,
+                 data=b'', target=None):
+        self.kind = kind
+        self.owner = owner
+        self.group = group
+        self.mode = mode
+        self.data = data
+        self.target = target
+        self.mtime = int(time.time())
+
+    def copy(self):
+        node = _Node(self.kind, self.owner, self.group, self.mode, self.data,
+                     self.target)
+        node.mtime = self.mtime
+        return node
+
+
+class _Attributes(object):
+    """
+    Mimic ``paramiko.SFTPAttributes``.
+    """
+
+    def __init__(self, node):
+        type_bits = {
+            'file': stat.S_IFREG,
+            'dir': stat.S_IFDIR,
+            'link': stat.S_IFLNK,
+        }[node.kind]
+        self.st_mode = type_bits | node.mode
+        self.st_size = len(node.data)
+        self.st_mtime = node.mtime
+        self.st_atime = node.mtime
+
+
+# Shell syntax
+
+_OPERATORS = ['2>&1', '>&2', '2>>', '&>', '&&', '||', '>>', '2>',
+              ';', '|', '&', '>', '<', '(', ')', '\n']
+
+_REDIRECTS = ['2>&1', '>&2', '2>>', '&>', '>>', '2>', '>', '<']
+
+_SEPARATORS = [';', '&', '\n']
+
+
+class _Word(object):
+    """
+    A shell word, made of literal, variable and substitution parts.
+    """
+
+    def __init__(self):
+        self.parts = []
+
+    def add(self, kind, value, quoted):
+        if kind == 'lit' and self.parts and self.parts[-1][0] == 'lit' \
+                and self.parts[-1][2] == quoted:
+            value = self.parts.pop()[1] + value
+        self.parts.append((kind, value, quoted))
+
+    def literal(self):
+        """
+        Return the unquoted literal value of a word (used for keywords).
+        """
+        if len(self.parts) == 1 and self.parts[0][0] == 'lit' \
+                and not self.parts[0][2]:
+            return self.parts[0][1]
+        return None
+
+    def __repr__(self):
+        return '<_Word %r>' % (self.parts,)
+
+
+def _tokenize(source):
+    """
+    Split a shell command line into operators and words.
+    """
+    tokens = []
+    word = None
+    i = 0
+    n = len(source)
+
+    def flush():
+        if word is not None:
+            tokens.append(('word', word))
+        return None
+
+    while i < n:
+        c = source[i]
+
+        if c in ' \t':
+            word = flush()
+            i += 1
+            continue
+
+        if c == '#' and word is None:
+            while i < n and source[i] != '\n':
+                i += 1
+            continue
+
+        if c == '\\':
+            if i + 1 < n and source[i + 1] == '\n':
+                i += 2
+                continue
+            word = word or _Word()
+            word.add('lit', source[i + 1:i + 2], True)
+            i += 2
+            continue
+
+        op = None
+        for candidate in _OPERATORS:
+            if source.startswith(candidate, i):
+                if candidate[0] == '2' and word is not None:
+                    continue
+                op = candidate
+                break
+        if op is not None:
+            word = flush()
+            tokens.append(('op', op))
+            i += len(op)
+            continue
+
+        word = word or _Word()
+
+        if c == "'":
+            end = source.find("'", i + 1)
+            if end < 0:
+                raise SimulatedCommandError('unterminated quote', 2)
+            word.add('lit', source[i + 1:end], True)
+            i = end + 1
+        elif c == '"':
+            i = _tokenize_double_quoted(source, i + 1, word)
+        elif c == '$':
+            i = _tokenize_dollar(source, i, word, quoted=False)
+        else:
+            word.add('lit', c, False)
+            i += 1
+
+    flush()
+    return tokens
+
+
+def _tokenize_double_quoted(source, i, word):
+    n = len(source)
+    while i < n:
+        c = source[i]
+        if c == '"':
+            return i + 1
+        if c == '\\' and i + 1 < n and source[i + 1] in '"\\$`\n':
+            if source[i + 1] != '\n':
+                word.add('lit', source[i + 1], True)
+            i += 2
+        elif c == '$':
+            i = _tokenize_dollar(source, i, word, quoted=True)
+        else:
+            word.add('lit', c, True)
+            i += 1
+    raise SimulatedCommandError('unterminated quote', 2)
+
+
+def _tokenize_dollar(source, i, word, quoted):
+    n = len(source)
+    if source.startswith('$(', i):
+        depth = 0
+        j = i + 1
+        in_quote = None
+        while j < n:
+            c = source[j]
+            if in_quote:
+                if c == in_quote:
+                    in_quote = None
+                elif c == '\\' and in_quote == '"':
+                    j += 1
+            elif c in '"\'':
+                in_quote = c
+            elif c == '(':
+                depth += 1
+            elif c == ')':
+                depth -= 1
+                if depth == 0:
+                    word.add('sub', source[i + 2:j], quoted)
+                    return j + 1
+            j += 1
+        raise SimulatedCommandError('unterminated substitution', 2)
+    if source.startswith('${', i):
+        end = source.find('}', i)
+        word.add('var', source[i + 2:end], quoted)
+        return end + 1
+    match = re.compile(r'[A-Za-z_][A-Za-z0-9_]*|[?$#0-9]').match(source, i + 1)
+    if match:
+        word.add('var', match.group(0), quoted)
+        return match.end()
+    word.add('lit', '$', quoted)
+    return i + 1
+
+
+class _Parser(object):
+    """
+    Recursive descent parser for the supported subset of the shell grammar.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def peek_keyword(self):
+        kind, value = self.peek()
+        if kind == 'word':
+            return value.literal()
+        return None
+
+    def next(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def expect_keyword(self, keyword):
+        if self.peek_keyword() != keyword:
+            raise SimulatedCommandError(
+                'syntax error: expected %r' % keyword, 2)
+        self.next()
+
+    def skip_separators(self):
+        while self.peek() in [('op', sep) for sep in _SEPARATORS]:
+            self.next()
+
+    def parse_list(self, terminators=()):
+        items = []
+        self.skip_separators()
+        while True:
+            kind, value = self.peek()
+            if kind is None or (kind == 'op' and value == ')'):
+                break
+            if self.peek_keyword() in terminators:
+                break
+            items.append(self.parse_and_or())
+            self.skip_separators()
+        return ('list', items)
+
+    def parse_and_or(self):
+        items = [(None, self.parse_pipeline())]
+        while self.peek() in [('op', '&&'), ('op', '||')]:
+            op = self.next()[1]
+            while self.peek() == ('op', '\n'):
+                self.next()
+            items.append((op, self.parse_pipeline()))
+        return ('and_or', items)
+
+    def parse_pipeline(self):
+        negate = False
+        if self.peek_keyword() == '!':
+            self.next()
+            negate = True
+        commands = [self.parse_command()]
+        while self.peek() == ('op', '|'):
+            self.next()
+            commands.append(self.parse_command())
+        return ('pipeline', negate, commands)
+
+    def parse_command(self):
+        keyword = self.peek_keyword()
+        if keyword == '{':
+            self.next()
+            body = self.parse_list(terminators=('}',))
+            self.expect_keyword('}')
+            return ('group', body, self.parse_redirects())
+        if keyword == 'if':
+            return self.parse_if()
+        if keyword == 'for':
+            return self.parse_for()
+        if self.peek() == ('op', '('):
+            self.next()
+            body = self.parse_list()
+            if self.next() != ('op', ')'):
+                raise SimulatedCommandError('syntax error: expected )', 2)
+            return ('subshell', body, self.parse_redirects())
+        return self.parse_simple()
+
+    def parse_if(self):
+        self.expect_keyword('if')
+        clauses = []
+        condition = self.parse_list(terminators=('then',))
+        self.expect_keyword('then')
+        body = self.parse_list(terminators=('elif', 'else', 'fi'))
+        clauses.append((condition, body))
+        otherwise = None
+        while True:
+            keyword = self.peek_keyword()
+            if keyword == 'elif':
+                self.next()
+                condition = self.parse_list(terminators=('then',))
+                self.expect_keyword('then')
+                body = self.parse_list(terminators=('elif', 'else', 'fi'))
+                clauses.append((condition, body))
+            elif keyword == 'else':
+                self.next()
+                otherwise = self.parse_list(terminators=('fi',))
+            else:
+                break
+        self.expect_keyword('fi')
+        return ('if', clauses, otherwise, self.parse_redirects())
+
+    def parse_for(self):
+        self.expect_keyword('for')
+        name = self.next()[1].literal()
+        values = []
+        if self.peek_keyword() == 'in':
+            self.next()
+            while self.peek()[0] == 'word' and self.peek_keyword() != 'do':
+                values.append(self.next()[1])
+        self.skip_separators()
+        self.expect_keyword('do')
+        body = self.parse_list(terminators=('done',))
+        self.expect_keyword('done')
+        return ('for', name, values, body, self.parse_redirects())
+
+    def parse_redirects(self):
+        redirects = []
+        while self.peek()[0] == 'op' and self.peek()[1] in _REDIRECTS:
+            op = self.next()[1]
+            target = None
+            if op not in ('2>&1', '>&2'):
+                kind, target = self.next()
+                if kind != 'word':
+                    raise SimulatedCommandError(
+                        'syntax error near %r' % op, 2)
+            redirects.append((op, target))
+        return redirects
+
+    def parse_simple(self):
+        words = []
+        redirects = []
+        while True:
+            kind, value = self.peek()
+            if kind == 'word':
+                if not words and value.literal() in (
+                        'then', 'else', 'elif', 'fi', 'do', 'done', '}'):
+                    break
+                words.append(self.next()[1])
+            elif kind == 'op' and value in _REDIRECTS:
+                redirects.extend(self.parse_redirects())
+            else:
+                break
+        if not words and not redirects:
+            raise SimulatedCommandError(
+                'syntax error near unexpected token %r' % (value,), 2)
+        return ('simple', words, redirects)
+
+
+def _parse(source):
+    parser = _Parser(_tokenize(source))
+    tree = parser.parse_list()
+    if parser.pos < len(parser.tokens):
+        raise SimulatedCommandError(
+            'syntax error near unexpected token %r' % (parser.peek()[1],), 2)
+    return tree
+
+
+class _Context(object):
+    """
+    Execution context of a simulated shell process.
+    """
+
+    def __init__(self, host, user, cwd, variables):
+        self.host = host
+        self.user = user
+        self.cwd = cwd
+        self.variables = variables
+        self.errexit = False
+        self.status = 0
+
+    def child(self):
+        ctx = _Context(self.host, self.user, self.cwd, dict(self.variables))
+        ctx.errexit = self.errexit
+        return ctx
+
+    def abspath(self, path):
+        if not posixpath.isabs(path):
+            path = posixpath.join(self.cwd, path)
+        return posixpath.normpath(path).replace('//', '/')
+
+
+class Invocation(object):
+    """
+    Arguments passed to a command handler.
+
+    Handlers are called with an :class:`Invocation` and return either
+    a string (the standard output, with exit status 0) or a tuple
+    ``(stdout, status)``. They can also raise
+    :class:`SimulatedCommandError`.
+    """
+
+    def __init__(self, ctx, name, args, stdin):
+        self.ctx = ctx
+        self.host = ctx.host
+        self.name = name
+        self.args = args
+        self.stdin = stdin
+        self.stderr = []
+
+    @property
+    def user(self):
+        return self.ctx.user
+
+    def path(self, path):
+        return self.ctx.abspath(path)
+
+    def error(self, message):
+        self.stderr.append(message + '\n')
+
+
+class SimulatedHost(object):
+    """
+    A simulated remote host.
+
+    *distrib* and *release* control the answers to ``lsb_release``,
+    which determine the :func:`~fabtools.system.distrib_family`.
+    Debian-family hosts have ``dpkg`` packages, and other hosts have
+    ``rpm`` packages.
+
+    The state of the host is available as plain Python attributes:
+
+    - :attr:`users` and :attr:`groups`: dicts of account information
+    - :attr:`packages`: dict of installed system packages and versions
+    - :attr:`pip_packages`: dict of installed Python packages
+    - :attr:`units`: dict of service states (``active`` and ``enabled``)
+    - :attr:`locales`: list of the names printed by ``locale -a``
+    - :attr:`pg_roles`, :attr:`pg_databases` and :attr:`pg_schemas`,
+      and :attr:`pg_settings` for ``SHOW`` and ``current_setting()``
+    - :attr:`mysql_users` (keyed by ``(user, host)``),
+      :attr:`mysql_databases` and :attr:`mysql_grants` (lists of
+      ``(privileges, target, grant_option)`` keyed by ``(user, host)``);
+      installing ``mysql-server`` creates ``root@localhost`` with the
+      password in :attr:`mysql_root_password`
+    - :attr:`npm_registry`: dict of the latest version of the packages
+      that ``npm`` can install, and :attr:`npm_packages`: dicts of
+      installed packages keyed by prefix (``/usr/local`` for global
+      packages, or the project directory)
+    - :attr:`conda_channel`: dict of the latest version of the packages
+      that ``conda`` can install, and :attr:`conda_envs`: dicts of
+      installed packages keyed by environment prefix (the first one is
+      the root environment, in ``~/miniconda``), mapping names to
+      versions or to dicts with ``version``, ``build`` and ``channel``
+      keys (``pypi`` for packages installed with ``pip``)
+    - :attr:`git_remotes`: dict of the remote Git repositories that
+      can be cloned, keyed by URL, each with ``branches`` and ``tags``
+      dicts mapping names to commits, and :attr:`git_repos`: dict of the
+      working copies keyed by path (see :meth:`git_remote`), whose
+      ``local_commits`` set holds the commits made in the working copy
+    - :attr:`hg_remotes` and :attr:`hg_repos`: the same for Mercurial
+      (see :meth:`hg_remote`), and :attr:`bzr_remotes` and
+      :attr:`bzr_repos`: the same for Bazaar (see :meth:`bzr_remote`)
+    - :attr:`containers`: dict of the OpenVZ containers of the host,
+      which are simulated hosts themselves, keyed by name or CTID (see
+      ``vzctl exec``)
+    - :attr:`supervisor`: dict of supervisor process states, updated
+      from the configuration files by ``supervisorctl update``
+    - :attr:`ssh_host_keys`: dict mapping the names of other hosts to
+      lists of ``(type, key)`` tuples returned by ``ssh-keyscan``
+    - :attr:`history`: list of all commands sent to the host, which
+      is handy to count round-trips
+
+    Use :meth:`write_file`, :meth:`read_file`, :meth:`exists` and
+    :meth:`mkdir` to inspect or prepare the virtual filesystem.
+    """
+
+    def __init__(self, host_string='simulated', distrib='Ubuntu',
+                 release='14.04', codename='trusty', arch='x86_64', cpus=2,
+                 memory=2 * 1024 ** 3, systemd=True, user='vagrant'):
+        self.host_string = host_string
+        self.distrib = distrib
+        self.release = release
+        self.codename = codename
+        self.arch = arch
+        self.cpus = cpus
+        self.memory = memory
+        self.systemd = systemd
+        self.login_user = user
+        self.hostname = host_string.split('@')[-1].split(':')[0]
+        self.history = []
+        self.fs = {}
+        self.users = OrderedDict()
+        self.groups = OrderedDict()
+        self.shadow = {}
+        self.packages = {}
+        self.pip_packages = {}
+        self.units = OrderedDict()
+        self.sysctl = {}
+        self.locales = ['C', 'C.UTF-8', 'POSIX', 'en_US.utf8']
+        self.pg_roles = OrderedDict()
+        self.pg_databases = OrderedDict()
+        self.pg_schemas = OrderedDict()
+        self.pg_settings = OrderedDict([
+            ('server_version_num', '90300'),
+            ('max_connections', '100'),
+            ('config_file', '/etc/postgresql/9.3/main/postgresql.conf'),
+        ])
+        self.mysql_users = OrderedDict()
+        self.mysql_databases = OrderedDict()
+        self.mysql_grants = OrderedDict()
+        self.npm_registry = {}
+        self.npm_packages = {}
+        self.conda_channel = {}
+        self.conda_envs = OrderedDict()
+        self.git_remotes = {}
+        self.git_repos = OrderedDict()
+        self.hg_remotes = {}
+        self.hg_repos = OrderedDict()
+        self.bzr_remotes = {}
+        self.bzr_repos = OrderedDict()
+        self.containers = {}
+        self.urls = {}
+        self.ssh_host_keys = {}
+        self.supervisor = OrderedDict()
+        self.package_programs = {
+            'curl': ['/usr/bin/curl'],
+            'bzr': ['/usr/bin/bzr'],
+            'git': ['/usr/bin/git'],
+            'mercurial': ['/usr/bin/hg', '/usr/bin/chg'],
+            'nginx': ['/usr/sbin/nginx'],
+            'mysql-server': ['/usr/bin/mysql'],
+            'postgresql': ['/usr/bin/psql', '/usr/bin/createdb'],
+            'supervisor': ['/usr/bin/supervisorctl'],
+        }
+        self.package_directories = {
+            'apache2': ['/etc/apache2/sites-available',
+                        '/etc/apache2/sites-enabled'],
+            'nginx': ['/etc/nginx/sites-available',
+                      '/etc/nginx/sites-enabled'],
+            'nginx-common': ['/etc/nginx/sites-available',
+                             '/etc/nginx/sites-enabled'],
+            'supervisor': ['/etc/supervisor/conf.d'],
+            'supervisord': ['/etc/supervisord.d'],
+        }
+        self.mysql_root_password = ''
+        self.handlers = {}
+        self._mktemp_counter = 0
+        self._setup_filesystem()
+        self._setup_accounts()
+        self._register_builtin_handlers()
+
+    def __repr__(self):
+        return '<SimulatedHost %s>' % self.host_string
+
+    @property
+    def family(self):
+        if self.distrib in ['Debian', 'Ubuntu', 'LinuxMint', 'elementary OS']:
+            return 'debian'
+        return 'redhat'
+
+    # Setup
+
+    def _setup_filesystem(self):
+        self.fs['/'] = _Node('dir', mode=0o755)
+        for path in ['/bin', '/sbin', '/etc', '/etc/sudoers.d', '/home',
+                     '/root', '/usr', '/usr/bin', '/usr/sbin', '/usr/local',
+                     '/usr/local/bin', '/var', '/var/lib', '/var/log', '/opt',
+                     '/srv', '/dev', '/proc']:
+            self.fs[path] = _Node('dir', mode=0o755)
+        self.fs['/root'].mode = 0o700
+        self.fs['/etc/sudoers.d'].mode = 0o750
+        self.fs['/tmp'] = _Node('dir', mode=0o1777)
+        self.fs['/var/tmp'] = _Node('dir', mode=0o1777)
+        for program in ['/bin/sh', '/bin/bash', '/bin/cp', '/bin/mv',
+                        '/bin/rm', '/bin/ln', '/usr/bin/md5sum',
+                        '/usr/bin/python', '/usr/sbin/visudo',
+                        '/sbin/sysctl']:
+            self.fs[program] = _Node('file', mode=0o755)
+        if self.family == 'debian':
+            self.fs['/usr/bin/lsb_release'] = _Node('file', mode=0o755)
+            self.fs['/usr/bin/dpkg'] = _Node('file', mode=0o755)
+            self.fs['/usr/bin/apt-get'] = _Node('file', mode=0o755)
+            self.fs['/etc/debian_version'] = _Node('file', data=b'8.0\n')
+        else:
+            self.fs['/usr/bin/rpm'] = _Node('file', mode=0o755)
+            self.fs['/usr/bin/yum'] = _Node('file', mode=0o755)
+            self.fs['/etc/redhat-release'] = _Node(
+                'file', data=('%s release %s\n' % (
+                    self.distrib, self.release)).encode('utf-8'))
+        if self.systemd:
+            self.fs['/bin/systemctl'] = _Node('file', mode=0o755)
+        self.fs['/etc/hostname'] = _Node(
+            'file', data=(self.hostname + '\n').encode('utf-8'))
+        self.fs['/proc/meminfo'] = _Node('file', data=(
+            'MemTotal:       %d kB\n' % (self.memory // 1024)).encode('utf-8'))
+        for path in ['/sys', '/sys/block', '/sys/block/sda',
+                     '/sys/block/sda/queue', '/sys/kernel', '/sys/kernel/mm',
+                     '/sys/kernel/mm/transparent_hugepage']:
+            self.fs[path] = _Node('dir', mode=0o755)
+        self.fs['/sys/block/sda/queue/rotational'] = _Node('file', data=b'0\n')
+        self.fs['/sys/kernel/mm/transparent_hugepage/enabled'] = _Node(
+            'file', data=b'[always] madvise never\n')
+        self.fs['/etc/sudoers'] = _Node('file', mode=0o440)
+
+    def _setup_accounts(self):
+        self.add_group('root', gid=0)
+        self.add_user('root', uid=0, gid=0, home='/root', shell='/bin/bash',
+                      create_home=False)
+        self.add_group('sudo', gid=27)
+        self.add_group('users', gid=100)
+        if self.login_user != 'root':
+            self.add_user(self.login_user, uid=1000, shell='/bin/bash',
+                          extra_groups=['sudo'])
+
+    def add_user(self, name, uid=None, gid=None, home=None, shell='/bin/sh',
+                 comment='', extra_groups=(), create_home=True, system=False):
+        """
+        Add a user account, creating its primary group if needed.
+        """
+        if uid is None:
+            uid = self._next_id(
+                [info['uid'] for info in self.users.values()], system)
+        if gid is None:
+            if name in self.groups:
+                gid = self.groups[name]['gid']
+            else:
+                gid = self.add_group(name, gid=uid if uid not in [
+                    info['gid'] for info in self.groups.values()] else None,
+                    system=system)['gid']
+        if home is None:
+            home = '/home/%s' % name
+        self.users[name] = {
+            'uid': int(uid),
+            'gid': int(gid),
+            'comment': comment,
+            'home': home,
+            'shell': shell,
+        }
+        self.shadow[name] = '!'
+        for group in extra_groups:
+            self.groups[group]['members'].append(name)
+        if create_home and home not in self.fs:
+            self.mkdir(home, owner=name, group=self._group_name(gid),
+                       mode=0o755)
+        return self.users[name]
+
+    def add_group(self, name, gid=None, system=False):
+        """
+        Add a group.
+        """
+        if gid is None:
+            gid = self._next_id(
+                [info['gid'] for info in self.groups.values()], system)
+        self.groups[name] = {'gid': int(gid), 'members': []}
+        return self.groups[name]
+
+    def _next_id(self, used, system):
+        if system:
+            candidates = [i for i in used if 100 <= i < 1000]
+            return max(candidates) + 1 if candidates else 100
+        candidates = [i for i in used if i >= 1000]
+        return max(candidates) + 1 if candidates else 1000
+
+    def _group_name(self, gid):
+        for name, info in self.groups.items():
+            if info['gid'] == int(gid):
+                return name
+        return str(gid)
+
+    def user_groups(self, name):
+        """
+        Return the names of all groups a user belongs to.
+        """
+        info = self.users[name]
+        groups = [self._group_name(info['gid'])]
+        for group, group_info in self.groups.items():
+            if name in group_info['members'] and group not in groups:
+                groups.append(group)
+        return groups
+
+    def home(self, name):
+        if name in self.users:
+            return self.users[name]['home']
+        return None
+
+    # Filesystem helpers
+
+    def _resolve(self, path, follow=True, depth=0):
+        path = posixpath.normpath(path).replace('//', '/')
+        node = self.fs.get(path)
+        if follow and node is not None and node.kind == 'link' and depth < 20:
+            target = node.target
+            if not posixpath.isabs(target):
+                target = posixpath.join(posixpath.dirname(path), target)
+            return self._resolve(target, follow, depth + 1)
+        return path, node
+
+    def exists(self, path):
+        """
+        Check if a path exists in the virtual filesystem.
+        """
+        return self._resolve(path)[1] is not None
+
+    def is_file(self, path):
+        node = self._resolve(path)[1]
+        return node is not None and node.kind == 'file'
+
+    def is_dir(self, path):
+        node = self._resolve(path)[1]
+        return node is not None and node.kind == 'dir'
+
+    def node(self, path, follow=True):
+        """
+        Return the filesystem entry for a path, or ``None``.
+        """
+        return self._resolve(path, follow)[1]
+
+    def mkdir(self, path, owner='root', group=None, mode=0o755):
+        """
+        Create a directory and its missing parents.
+        """
+        path = posixpath.normpath(path)
+        parent = posixpath.dirname(path)
+        if parent != path and parent not in self.fs:
+            self.mkdir(parent)
+        if path not in self.fs:
+            self.fs[path] = _Node('dir', owner=owner, group=group or owner,
+                                  mode=mode)
+        return self.fs[path]
+
+    def write_file(self, path, data, owner='root', group=None, mode=0o644):
+        """
+        Create or replace a file in the virtual filesystem.
+        """
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+        path, node = self._resolve(path)
+        parent = posixpath.dirname(path)
+        if parent not in self.fs:
+            self.mkdir(parent)
+        if node is None:
+            node = self.fs[path] = _Node('file', owner=owner,
+                                         group=group or owner, mode=mode)
+        node.data = data
+        node.mtime = int(time.time())
+        return node
+
+    def read_file(self, path):
+        """
+        Return the contents of a file in the virtual filesystem, as text.
+        """
+        node = self._resolve(path)[1]
+        if node is None or node.kind != 'file':
+            raise IOError('No such file: %s' % path)
+        return node.data.decode('utf-8', 'replace')
+
+    def listdir(self, path):
+        path = self._resolve(path)[0]
+        prefix = path.rstrip('/') + '/'
+        return sorted(
+            name[len(prefix):] for name in self.fs
+            if name.startswith(prefix) and name != path and
+            '/' not in name[len(prefix):]
+        )
+
+    def _remove_tree(self, path):
+        prefix = path.rstrip('/') + '/'
+        for name in list(self.fs):
+            if name == path or name.startswith(prefix):
+                del self.fs[name]
+
+    def _can_write(self, user, path):
+        if user == 'root':
+            return True
+        node = self.node(path)
+        if node is None:
+            return False
+        if node.owner == user:
+            return bool(node.mode & 0o200)
+        if node.group in self.user_groups(user):
+            return bool(node.mode & 0o020)
+        return bool(node.mode & 0o002)
+
+    def _can_read(self, user, path):
+        if user == 'root':
+            return True
+        node = self.node(path)
+        if node is None:
+            return False
+        if node.owner == user:
+            return bool(node.mode & 0o400)
+        if node.group in self.user_groups(user):
+            return bool(node.mode & 0o040)
+        return bool(node.mode & 0o004)
+
+    def _check_create(self, user, path):
+        parent = posixpath.dirname(path)
+        if not self.is_dir(parent):
+            raise SimulatedCommandError(
+                '%s: No such file or directory' % path)
+        if not self._can_write(user, parent):
+            raise SimulatedCommandError('%s: Permission denied' % path)
+
+    def _write(self, user, path, data, append=False):
+        if path == '/dev/null':
+            return
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+        real_path, node = self._resolve(path)
+        if node is None:
+            self._check_create(user, real_path)
+            group = self._group_name(self.users[user]['gid']) \
+                if user in self.users else user
+            node = self.fs[real_path] = _Node(
+                'file', owner=user, group=group,
+                mode=0o644 if user == 'root' else 0o664)
+        elif node.kind == 'dir':
+            raise SimulatedCommandError('%s: Is a directory' % path)
+        elif not self._can_write(user, real_path):
+            raise SimulatedCommandError('%s: Permission denied' % path)
+        node.data = node.data + data if append else data
+        node.mtime = int(time.time())
+
+    def _read(self, user, path):
+        if path == '/dev/null':
+            return b''
+        node = self.node(path)
+        if node is None:
+            raise SimulatedCommandError(
+                '%s: No such file or directory' % path)
+        if node.kind == 'dir':
+            raise SimulatedCommandError('%s: Is a directory' % path)
+        if not self._can_read(user, path):
+            raise SimulatedCommandError('%s: Permission denied' % path)
+        return node.data
+
+    # Command execution
+
+    def git_remote(self, url, branches=None, tags=None):
+        """
+        Add a remote Git repository that can be cloned from *url*.
+
+        *branches* and *tags* map names to commit identifiers. By
+        default, the repository has a ``master`` branch.
+        """
+        remote = self.git_remotes[url] = {
+            'branches': dict(branches or {'master': 'c0ffee0'}),
+            'tags': dict(tags or {}),
+            'fetches': 0,
+        }
+        return remote
+
+    def hg_remote(self, url, branches=None):
+        """
+        Add a remote Mercurial repository that can be cloned from *url*.
+
+        *branches* maps names to changeset ids. By default, the repository
+        has a ``default`` branch.
+        """
+        remote = self.hg_remotes[url] = {
+            'branches': dict(branches or {'default': 'c0ffee0c0ffe'}),
+            'pulls': 0,
+        }
+        return remote
+
+    def bzr_remote(self, url, revno=1):
+        """
+        Add a remote Bazaar branch that can be branched from *url*, with
+        *revno* revisions.
+        """
+        remote = self.bzr_remotes[url] = {'revno': revno, 'pulls': 0}
+        return remote
+
+    def register(self, name, handler):
+        """
+        Register a handler for the program *name*.
+
+        The handler is called with an :class:`Invocation`.
+        """
+        self.handlers[name] = handler
+
+    def execute(self, command, user=None, stdin=''):
+        """
+        Run a shell command on the simulated host.
+
+        Returns a ``(stdout, stderr, status)`` tuple.
+        """
+        if user is None:
+            user = self.login_user
+        self.history.append(command)
+        ctx = _Context(self, user, self.home(user) or '/',
+                       self._default_variables(user))
+        stdout, stderr = [], []
+        try:
+            status = self._run_tree(_parse(command), ctx, stdin, stdout,
+                                    stderr)
+        except _Exit as e:
+            status = e.status
+        except SimulatedCommandError as e:
+            stderr.append('sh: %s\n' % e)
+            status = e.status
+        return ''.join(stdout), ''.join(stderr), status
+
+    def _default_variables(self, user):
+        return {
+            'HOME': self.home(user) or '/',
+            'USER': user,
+            'LOGNAME': user,
+            'PATH': '/usr/local/bin:/usr/bin:/bin:/usr/sbin:/sbin',
+            'SHELL': '/bin/bash',
+        }
+
+    def _run_tree(self, node, ctx, stdin, stdout, stderr):
+        kind = node[0]
+        if kind == 'list':
+            status = 0
+            for item in node[1]:
+                status = self._run_tree(item, ctx, stdin, stdout, stderr)
+            return status
+        if kind == 'and_or':
+            status = 0
+            last = len(node[1]) - 1
+            for index, (op, pipeline) in enumerate(node[1]):
+                if op == '&&' and status != 0:
+                    continue
+                if op == '||' and status == 0:
+                    continue
+                status = self._run_pipeline(pipeline, ctx, stdin, stdout,
+                                            stderr)
+                if status != 0 and ctx.errexit and index == last \
+                        and not pipeline[1]:
+                    raise _Exit(status)
+            ctx.status = status
+            return status
+        raise AssertionError(kind)
+
+    def _run_pipeline(self, pipeline, ctx, stdin, stdout, stderr):
+        _, negate, commands = pipeline
+        data = stdin
+        status = 0
+        for index, command in enumerate(commands):
+            out = stdout if index == len(commands) - 1 else []
+            status = self._run_command(command, ctx, data, out, stderr)
+            data = ''.join(out)
+        if negate:
+            status = 0 if status else 1
+        ctx.status = status
+        return status
+
+    def _run_command(self, command, ctx, stdin, stdout, stderr):
+        kind = command[0]
+        if kind == 'simple':
+            return self._run_simple(command, ctx, stdin, stdout, stderr)
+        redirects = command[-1]
+        out, err = [], []
+        stdin = self._apply_input(redirects, ctx, stdin)
+        if kind == 'group':
+            status = self._run_tree(command[1], ctx, stdin, out, err)
+        elif kind == 'subshell':
+            try:
+                status = self._run_tree(command[1], ctx.child(), stdin, out,
+                                        err)
+            except _Exit as e:
+                status = e.status
+        elif kind == 'if':
+            status = 0
+            for condition, body in command[1]:
+                errexit, ctx.errexit = ctx.errexit, False
+                try:
+                    matched = self._run_tree(condition, ctx, stdin, out,
+                                             err) == 0
+                finally:
+                    ctx.errexit = errexit
+                if matched:
+                    status = self._run_tree(body, ctx, stdin, out, err)
+                    break
+            else:
+                if command[2] is not None:
+                    status = self._run_tree(command[2], ctx, stdin, out, err)
+        elif kind == 'for':
+            status = 0
+            name, values, body = command[1], command[2], command[3]
+            for value in self._expand_words(values, ctx):
+                ctx.variables[name] = value
+                status = self._run_tree(body, ctx, stdin, out, err)
+        else:
+            raise AssertionError(kind)
+        self._apply_output(redirects, ctx, out, err, stdout, stderr)
+        return status
+
+    def _apply_input(self, redirects, ctx, stdin):
+        for op, target in redirects:
+            if op == '<':
+                path = ctx.abspath(self._expand_word(target, ctx)[0])
+                stdin = _to_text(self._read(ctx.user, path))
+        return stdin
+
+    def _apply_output(self, redirects, ctx, out, err, stdout, stderr):
+        out_target, err_target = stdout, stderr
+        for op, target in redirects:
+            if op == '<':
+                continue
+            if op == '2>&1':
+                err_target = out_target
+                continue
+            if op == '>&2':
+                out_target = err_target
+                continue
+            path = self._expand_word(target, ctx)[0]
+            if path != '/dev/null':
+                path = ctx.abspath(path)
+            sink = _FileSink(self, ctx.user, path, append='>>' in op)
+            if op in ('>', '>>'):
+                out_target = sink
+            elif op in ('2>', '2>>'):
+                err_target = sink
+            elif op == '&>':
+                out_target = err_target = sink
+        if out_target is err_target and out_target is not stdout \
+                and out_target is not stderr:
+            out_target.extend(out + err)
+        else:
+            out_target.extend(out)
+            err_target.extend(err)
+        for target in (out_target, err_target):
+            if isinstance(target, _FileSink):
+                target.flush()
+
+    def _run_simple(self, command, ctx, stdin, stdout, stderr):
+        _, words, redirects = command
+        args = self._expand_words(words, ctx)
+        assignments = {}
+        while args and re.match(r'^[A-Za-z_][A-Za-z0-9_]*=', args[0]):
+            name, value = args.pop(0).split('=', 1)
+            assignments[name] = value
+        if not args:
+            ctx.variables.update(assignments)
+            status = 0
+            out, err = [], []
+        else:
+            out, err = [], []
+            stdin = self._apply_input(redirects, ctx, stdin)
+            status = self.call(ctx, args, stdin, out, err)
+        self._apply_output(redirects, ctx, out, err, stdout, stderr)
+        return status
+
+    def call(self, ctx, args, stdin, stdout, stderr):
+        """
+        Call the handler for a program with expanded arguments.
+        """
+        name = posixpath.basename(args[0])
+        handler = self.handlers.get(name)
+        if handler is None:
+            stderr.append('sh: %s: command not found\n' % args[0])
+            return 127
+        invocation = Invocation(ctx, name, args[1:], stdin)
+        try:
+            result = handler(invocation)
+        except SimulatedCommandError as e:
+            stderr.extend(invocation.stderr)
+            stderr.append('%s: %s\n' % (name, e))
+            return e.status
+        stderr.extend(invocation.stderr)
+        if isinstance(result, tuple):
+            result, status = result
+        else:
+            status = 0
+        if result:
+            stdout.append(result)
+        return status
+
+    def run_script(self, ctx, script, stdin=''):
+        """
+        Run a nested shell script in the given context.
+        """
+        stdout, stderr = [], []
+        try:
+            status = self._run_tree(_parse(script), ctx, stdin, stdout,
+                                    stderr)
+        except _Exit as e:
+            status = e.status
+        return ''.join(stdout), ''.join(stderr), status
+
+    # Expansion
+
+    def _expand_words(self, words, ctx):
+        args = []
+        for word in words:
+            args.extend(self._expand_word(word, ctx))
+        return args
+
+    def _expand_word(self, word, ctx):
+        text = ''
+        pattern = ''
+        globbing = False
+        split_fields = False
+        for index, (kind, value, quoted) in enumerate(word.parts):
+            if kind == 'lit':
+                if index == 0 and not quoted and value.startswith('~'):
+                    value = self._expand_tilde(value, ctx)
+                text += value
+                if quoted:
+                    pattern += re.sub(r'([*?\[])', r'[\1]', value)
+                else:
+                    globbing = globbing or bool(re.search(r'[*?]', value))
+                    pattern += value
+                continue
+            if kind == 'var':
+                value = self._variable(value, ctx)
+            else:
+                sub_ctx = ctx.child()
+                value = self.run_script(sub_ctx, value)[0].rstrip('\n')
+            if not quoted:
+                split_fields = True
+            text += value
+            pattern += re.sub(r'([*?\[])', r'[\1]', value)
+        if split_fields:
+            return text.split()
+        if globbing:
+            matches = self._glob(ctx.abspath(pattern))
+            if matches:
+                if not posixpath.isabs(pattern):
+                    prefix = ctx.cwd.rstrip('/') + '/'
+                    matches = [m[len(prefix):] for m in matches]
+                return matches
+        return [text]
+
+    def _expand_tilde(self, value, ctx):
+        name, sep, rest = value[1:].partition('/')
+        if not name:
+            home = ctx.variables.get('HOME', '/')
+        else:
+            home = self.home(name)
+            if home is None:
+                return value
+        return home + sep + rest
+
+    def _variable(self, name, ctx):
+        if name == '?':
+            return str(ctx.status)
+        if name == '$':
+            return '4242'
+        return ctx.variables.get(name, '')
+
+    def _glob(self, pattern):
+        return sorted(path for path in self.fs
+                      if fnmatch.fnmatchcase(path, pattern) and
+                      path.count('/') == pattern.count('/'))
+
+    # Handlers
+
+    def _register_builtin_handlers(self):
+        for attr in dir(self):
+            if attr.startswith('_cmd_'):
+                name = attr[len('_cmd_'):].replace('__', '-')
+                self.handlers[name] = getattr(self, attr)
+        self.handlers['['] = self._cmd_test
+        self.handlers[':'] = self._cmd_true
+        self.handlers['pip3'] = self._cmd_pip
+        self.handlers['python3'] = self._cmd_python
+        self.handlers['bash'] = self._cmd_sh
+        self.handlers['yes'] = self._cmd_true
+        self.handlers['sha1sum'] = self._cmd_md5sum
+        self.handlers['sha256sum'] = self._cmd_md5sum
+        self.handlers['chgrp'] = self._cmd_chown
+        self.handlers['chg'] = self._cmd_hg
+
+    def _cmd_true(self, inv):
+        return ''
+
+    def _cmd_false(self, inv):
+        return '', 1
+
+    def _cmd_exit(self, inv):
+        raise _Exit(int(inv.args[0]) if inv.args else inv.ctx.status)
+
+    def _cmd_wait(self, inv):
+        return ''
+
+    def _cmd_set(self, inv):
+        for arg in inv.args:
+            if arg.startswith('-') and 'e' in arg:
+                inv.ctx.errexit = True
+            elif arg.startswith('+') and 'e' in arg:
+                inv.ctx.errexit = False
+        return ''
+
+    def _cmd_export(self, inv):
+        for arg in inv.args:
+            if '=' in arg:
+                name, value = arg.split('=', 1)
+                inv.ctx.variables[name] = value
+        return ''
+
+    def _cmd_cd(self, inv):
+        path = inv.args[0] if inv.args else inv.ctx.variables.get('HOME')
+        path = inv.path(path)
+        if not self.is_dir(path):
+            raise SimulatedCommandError('%s: No such file or directory' %
+                                        path)
+        inv.ctx.cwd = self._resolve(path)[0]
+        return ''
+
+    def _cmd_pwd(self, inv):
+        return inv.ctx.cwd + '\n'
+
+    def _cmd_echo(self, inv):
+        args = list(inv.args)
+        newline = True
+        while args and args[0] in ('-n', '-e', '-ne', '-en'):
+            if 'n' in args.pop(0):
+                newline = False
+        return ' '.join(args) + ('\n' if newline else '')
+
+    def _cmd_printf(self, inv):
+        fmt = inv.args[0].replace('\\n', '\n').replace('\\t', '\t')
+        values = inv.args[1:]
+        result = ''
+        while True:
+            count = len(re.findall(r'%[sd]', fmt))
+            chunk, values = values[:count], values[count:]
+            chunk += [''] * (count - len(chunk))
+            result += re.sub(r'%[sd]', lambda m: chunk.pop(0), fmt)
+            if not values or not count:
+                break
+        return result.replace('%%', '%')
+
+    def _cmd_cat(self, inv):
+        if not inv.args or inv.args == ['-']:
+            return inv.stdin
+        return ''.join(self._read(inv.user, inv.path(path)).decode(
+            'utf-8', 'replace') for path in inv.args if path != '-')
+
+    def _cmd_tee(self, inv):
+        append = '-a' in inv.args
+        for path in inv.args:
+            if not path.startswith('-'):
+                self._write(inv.user, inv.path(path), inv.stdin,
+                            append=append)
+        return inv.stdin
+
+    def _cmd_test(self, inv):
+        args = list(inv.args)
+        if inv.name == '[':
+            if not args or args[-1] != ']':
+                raise SimulatedCommandError("missing `]'", 2)
+            args = args[:-1]
+        return '', 0 if self._test(inv, args) else 1
+
+    def _test(self, inv, args):
+        if args and args[0] == '!':
+            return not self._test(inv, args[1:])
+        if len(args) == 0:
+            return False
+        if len(args) == 1:
+            return args[0] != ''
+        if len(args) == 2:
+            op, value = args
+            if op == '-z':
+                return value == ''
+            if op == '-n':
+                return value != ''
+            path = inv.path(value)
+            node = self.node(path)
+            if op == '-L' or op == '-h':
+                node = self.node(path, follow=False)
+                return node is not None and node.kind == 'link'
+            if node is None:
+                return False
+            if op == '-e':
+                return True
+            if op == '-f':
+                return node.kind == 'file'
+            if op == '-d':
+                return node.kind == 'dir'
+            if op == '-s':
+                return node.kind == 'file' and len(node.data) > 0
+            if op == '-x':
+                return bool(node.mode & 0o111)
+            if op == '-r':
+                return self._can_read(inv.user, path)
+            if op == '-w':
+                return self._can_write(inv.user, path)
+            raise SimulatedCommandError('unknown operator %s' % op, 2)
+        left, op, right = args[:3]
+        if op in ('=', '=='):
+            return left == right
+        if op == '!=':
+            return left != right
+        numeric = {'-eq': '__eq__', '-ne': '__ne__', '-lt': '__lt__',
+                   '-le': '__le__', '-gt': '__gt__', '-ge': '__ge__'}
+        if op in numeric:
+            return getattr(int(left), numeric[op])(int(right))
+        raise SimulatedCommandError('unknown operator %s' % op, 2)
+
+    def _cmd_mkdir(self, inv):
+        parents = False
+        mode = None
+        paths = []
+        args = list(inv.args)
+        while args:
+            arg = args.pop(0)
+            if arg == '-m':
+                mode = int(args.pop(0), 8)
+            elif arg.startswith('-'):
+                parents = parents or 'p' in arg
+            else:
+                paths.append(arg)
+        for path in paths:
+            path = inv.path(path)
+            if self.exists(path):
+                if parents and self.is_dir(path):
+                    continue
+                raise SimulatedCommandError(
+                    "cannot create directory '%s': File exists" % path)
+            missing = []
+            current = path
+            while not self.exists(current):
+                missing.insert(0, current)
+                current = posixpath.dirname(current)
+            if len(missing) > 1 and not parents:
+                raise SimulatedCommandError(
+                    "cannot create directory '%s': No such file or directory"
+                    % path)
+            for directory in missing:
+                self._check_create(inv.user, directory)
+                group = self._group_name(self.users[inv.user]['gid']) \
+                    if inv.user in self.users else inv.user
+                self.fs[directory] = _Node(
+                    'dir', owner=inv.user, group=group,
+                    mode=mode if mode is not None else 0o755)
+        return ''
+
+    def _cmd_touch(self, inv):
+        for path in inv.args:
+            if path.startswith('-'):
+                continue
+            path = inv.path(path)
+            node = self.node(path)
+            if node is None:
+                self._write(inv.user, path, b'')
+            else:
+                node.mtime = int(time.time())
+        return ''
+
+    def _cmd_rm(self, inv):
+        recursive = force = False
+        for arg in inv.args:
+            if arg.startswith('-'):
+                recursive = recursive or 'r' in arg or 'R' in arg
+                force = force or 'f' in arg
+        for path in inv.args:
+            if path.startswith('-'):
+                continue
+            path = inv.path(path)
+            node = self.node(path, follow=False)
+            if node is None:
+                if force:
+                    continue
+                raise SimulatedCommandError(
+                    "cannot remove '%s': No such file or directory" % path)
+            if not self._can_write(inv.user, posixpath.dirname(path)):
+                raise SimulatedCommandError(
+                    "cannot remove '%s': Permission denied" % path)
+            if node.kind == 'dir':
+                if not recursive:
+                    raise SimulatedCommandError(
+                        "cannot remove '%s': Is a directory" % path)
+                self._remove_tree(path)
+            else:
+                del self.fs[path]
+        return ''
+
+    def _cmd_rmdir(self, inv):
+        for path in inv.args:
+            path = inv.path(path)
+            if self.listdir(path):
+                raise SimulatedCommandError(
+                    "failed to remove '%s': Directory not empty" % path)
+            del self.fs[path]
+        return ''
+
+    def _copy_tree(self, source, destination, move=False):
+        source = source.rstrip('/') or '/'
+        prefix = source + '/'
+        for name in sorted(self.fs):
+            if name == source or name.startswith(prefix):
+                node = self.fs[name] if move else self.fs[name].copy()
+                self.fs[destination + name[len(source):]] = node
+        if move:
+            self._remove_tree(source)
+
+    def _target(self, inv, source, destination):
+        if self.is_dir(destination):
+            return posixpath.join(destination, posixpath.basename(source))
+        return destination
+
+    def _cmd_mv(self, inv):
+        paths = [inv.path(p) for p in inv.args if not p.startswith('-')]
+        destination = paths.pop()
+        for source in paths:
+            if self.node(source, follow=False) is None:
+                raise SimulatedCommandError(
+                    "cannot stat '%s': No such file or directory" % source)
+            target = self._target(inv, source, destination)
+            self._check_create(inv.user, target)
+            if self.is_dir(target):
+                self._remove_tree(target)
+            self._copy_tree(source, target, move=True)
+        return ''
+
+    def _cmd_cp(self, inv):
+        recursive = any(a.startswith('-') and ('r' in a or 'R' in a or
+                                               'a' in a)
+                        for a in inv.args)
+        preserve = any(a.startswith('-') and ('p' in a or 'a' in a)
+                       for a in inv.args)
+        paths = [inv.path(p) for p in inv.args if not p.startswith('-')]
+        destination = paths.pop()
+        for source in paths:
+            node = self.node(source)
+            if node is None:
+                raise SimulatedCommandError(
+                    "cannot stat '%s': No such file or directory" % source)
+            target = self._target(inv, source, destination)
+            if node.kind == 'dir':
+                if not recursive:
+                    raise SimulatedCommandError(
+                        "omitting directory '%s'" % source)
+                self._copy_tree(self._resolve(source)[0], target)
+            else:
+                existing = self.node(target)
+                self._write(inv.user, target, node.data)
+                if existing is None and not preserve:
+                    self.node(target).mode = node.mode
+            if preserve:
+                self.fs[self._resolve(target)[0]] = node.copy()
+        return ''
+
+    def _cmd_ln(self, inv):
+        force = any(a.startswith('-') and 'f' in a for a in inv.args)
+        paths = [p for p in inv.args if not p.startswith('-')]
+        target, link = paths[0], inv.path(paths[1])
+        if self.is_dir(link) and not force:
+            link = posixpath.join(link, posixpath.basename(target))
+        if self.node(link, follow=False) is not None:
+            if not force:
+                raise SimulatedCommandError(
+                    "failed to create symbolic link '%s': File exists" % link)
+            del self.fs[link]
+        self._check_create(inv.user, link)
+        self.fs[link] = _Node('link', owner=inv.user, group=inv.user,
+                              mode=0o777, target=target)
+        return ''
+
+    def _cmd_readlink(self, inv):
+        path = inv.path(inv.args[-1])
+        if '-f' in inv.args:
+            return self._resolve(path)[0] + '\n'
+        node = self.node(path, follow=False)
+        if node is None or node.kind != 'link':
+            return '', 1
+        return node.target + '\n'
+
+    def _cmd_chmod(self, inv):
+        args = [a for a in inv.args if a not in ('-R', '-f')]
+        mode, paths = args[0], args[1:]
+        for path in paths:
+            path = inv.path(path)
+            node = self.node(path)
+            if node is None:
+                raise SimulatedCommandError(
+                    "cannot access '%s': No such file or directory" % path)
+            if inv.user not in ('root', node.owner):
+                raise SimulatedCommandError(
+                    "changing permissions of '%s': Operation not permitted"
+                    % path)
+            node.mode = self._parse_mode(mode, node.mode)
+        return ''
+
+    def _parse_mode(self, mode, current):
+        if re.match(r'^[0-7]+$', mode):
+            return int(mode, 8)
+        for clause in mode.split(','):
+            match = re.match(r'^([ugoa]*)([+=-])([rwxst]*)$', clause)
+            if not match:
+                raise SimulatedCommandError('invalid mode: %s' % mode)
+            who, op, perms = match.groups()
+            who = who or 'a'
+            bits = 0
+            for char, value in [('r', 4), ('w', 2), ('x', 1)]:
+                if char in perms:
+                    for scope, shift in [('u', 6), ('g', 3), ('o', 0)]:
+                        if scope in who or 'a' in who:
+                            bits |= value << shift
+            if op == '+':
+                current |= bits
+            elif op == '-':
+                current &= ~bits
+            else:
+                current = bits
+        return current
+
+    def _cmd_chown(self, inv):
+        recursive = '-R' in inv.args
+        args = [a for a in inv.args if not a.startswith('-')]
+        spec, paths = args[0], args[1:]
+        if inv.name == 'chgrp':
+            owner, group = '', spec
+        elif ':' in spec:
+            owner, group = spec.split(':', 1)
+            if owner and not group and spec.endswith(':'):
+                if owner not in self.users:
+                    raise SimulatedCommandError("invalid user: '%s'" % spec)
+                group = self._group_name(self.users[owner]['gid'])
+        else:
+            owner, group = spec, ''
+        if owner and owner not in self.users:
+            raise SimulatedCommandError("invalid user: '%s'" % spec)
+        if group and group not in self.groups:
+            raise SimulatedCommandError("invalid group: '%s'" % spec)
+        if inv.user != 'root':
+            raise SimulatedCommandError(
+                "changing ownership: Operation not permitted")
+        for path in paths:
+            path = self._resolve(inv.path(path))[0]
+            if path not in self.fs:
+                raise SimulatedCommandError(
+                    "cannot access '%s': No such file or directory" % path)
+            prefix = path.rstrip('/') + '/'
+            for name in list(self.fs):
+                if name == path or (recursive and name.startswith(prefix)):
+                    if owner:
+                        self.fs[name].owner = owner
+                    if group:
+                        self.fs[name].group = group
+        return ''
+
+    def _cmd_stat(self, inv):
+        fmt = None
+        args = list(inv.args)
+        paths = []
+        while args:
+            arg = args.pop(0)
+            if arg == '-c':
+                fmt = args.pop(0)
+            elif arg.startswith('--format='):
+                fmt = arg[len('--format='):]
+            elif arg == '-f':
+                raise SimulatedCommandError("illegal option -- f")
+            elif not arg.startswith('-'):
+                paths.append(arg)
+        result = ''
+        for path in paths:
+            path = inv.path(path)
+            node = self.node(path)
+            if node is None:
+                raise SimulatedCommandError(
+                    "cannot stat '%s': No such file or directory" % path)
+            if fmt is None:
+                result += '  File: %s\n' % path
+                continue
+            values = {
+                '%U': node.owner,
+                '%G': node.group,
+                '%a': '%o' % node.mode,
+                '%Y': str(node.mtime),
+                '%s': str(len(node.data)),
+                '%n': path,
+                '%F': {'file': 'regular file', 'dir': 'directory',
+                       'link': 'symbolic link'}[node.kind],
+            }
+            result += re.sub(r'%[UGaYsnF]',
+                             lambda m: values[m.group(0)], fmt) + '\n'
+        return result
+
+    def _cmd_md5sum(self, inv):
+        algorithm = {'md5sum': 'md5', 'sha1sum': 'sha1',
+                     'sha256sum': 'sha256'}[inv.name]
+        result = ''
+        status = 0
+        for path in inv.args:
+            if path.startswith('-'):
+                continue
+            try:
+                data = self._read(inv.user, inv.path(path))
+            except SimulatedCommandError as e:
+                inv.error('%s: %s' % (inv.name, e))
+                status = 1
+                continue
+            digest = hashlib.new(algorithm, data).hexdigest()
+            result += '%s  %s\n' % (digest, path)
+        if not inv.args:
+            digest = hashlib.new(algorithm, inv.stdin.encode('utf-8'))
+            result = '%s  -\n' % digest.hexdigest()
+        return result, status
+
+    def _cmd_umask(self, inv):
+        return '0022\n' if inv.user == 'root' else '0002\n'
+
+    def _cmd_mktemp(self, inv):
+        directory = '-d' in inv.args or '--directory' in inv.args
+        templates = [a for a in inv.args if not a.startswith('-')]
+        template = templates[0] if templates else '/tmp/tmp.XXXXXXXXXX'
+        self._mktemp_counter += 1
+        suffix = '%010d' % self._mktemp_counter
+        path = re.sub(r'X+$', lambda m: suffix[-len(m.group(0)):], template)
+        path = inv.path(path)
+        if directory:
+            self._check_create(inv.user, path)
+            self.fs[path] = _Node('dir', owner=inv.user, group=inv.user,
+                                  mode=0o700)
+        else:
+            self._write(inv.user, path, b'')
+            self.node(path).mode = 0o600
+        return path + '\n'
+
+    def _cmd_ls(self, inv):
+        paths = [p for p in inv.args if not p.startswith('-')] or ['.']
+        result = []
+        for path in paths:
+            path = inv.path(path)
+            if self.is_dir(path):
+                result.extend(self.listdir(path))
+            elif self.exists(path):
+                result.append(path)
+            else:
+                raise SimulatedCommandError(
+                    "cannot access '%s': No such file or directory" % path, 2)
+        return ''.join(name + '\n' for name in result)
+
+    def _cmd_find(self, inv):
+        args = list(inv.args)
+        root = inv.path(args.pop(0)) if args and \
+            not args[0].startswith('-') else inv.ctx.cwd
+        kind = name = None
+        while args:
+            arg = args.pop(0)
+            if arg == '-type':
+                kind = {'f': 'file', 'd': 'dir', 'l': 'link'}[args.pop(0)]
+            elif arg == '-name':
+                name = args.pop(0)
+        prefix = root.rstrip('/') + '/'
+        result = []
+        for path in sorted(self.fs):
+            if path != root and not path.startswith(prefix):
+                continue
+            node = self.fs[path]
+            if kind and node.kind != kind:
+                continue
+            if name and not fnmatch.fnmatch(posixpath.basename(path), name):
+                continue
+            result.append(path)
+        return ''.join(path + '\n' for path in result)
+
+    def _cmd_grep(self, inv):
+        args = list(inv.args)
+        flags = ''
+        pattern = None
+        paths = []
+        while args:
+            arg = args.pop(0)
+            if arg == '-e' and pattern is not None:
+                pattern += '\\|' + args.pop(0)
+            elif arg == '-e':
+                pattern = args.pop(0)
+            elif arg.startswith('-') and len(arg) > 1 and pattern is None:
+                flags += arg[1:]
+            elif pattern is None:
+                pattern = arg
+            else:
+                paths.append(arg)
+        if 'F' in flags:
+            regex = re.escape(pattern)
+        else:
+            regex = pattern.replace('\\|', '|').replace('\\(', '(') \
+                .replace('\\)', ')')
+        if 'x' in flags:
+            regex = '^(?:%s)$' % regex
+        regex = re.compile(regex, re.I if 'i' in flags else 0)
+        if paths:
+            text = ''.join(self._read(inv.user, inv.path(p)).decode(
+                'utf-8', 'replace') for p in paths)
+        else:
+            text = inv.stdin
+        lines = [line for line in text.splitlines()
+                 if bool(regex.search(line)) != ('v' in flags)]
+        status = 0 if lines else 1
+        if 'q' in flags:
+            return '', status
+        if 'c' in flags:
+            return '%d\n' % len(lines), status
+        return ''.join(line + '\n' for line in lines), status
+
+    def _cmd_head(self, inv):
+        count = 10
+        args = list(inv.args)
+        if args and args[0] == '-n':
+            count = int(args[1])
+        elif args and re.match(r'^-\d+$', args[0]):
+            count = int(args[0][1:])
+        lines = inv.stdin.splitlines(True)
+        return ''.join(lines[:count])
+
+    def _cmd_tail(self, inv):
+        count = 10
+        args = list(inv.args)
+        if args and args[0] == '-n':
+            count = int(args[1])
+        lines = inv.stdin.splitlines(True)
+        return ''.join(lines[-count:]) if count else ''
+
+    def _cmd_wc(self, inv):
+        return '%d\n' % len(inv.stdin.splitlines())
+
+    def _cmd_sort(self, inv):
+        lines = sorted(inv.stdin.splitlines())
+        if '-u' in inv.args:
+            lines = sorted(set(lines))
+        return ''.join(line + '\n' for line in lines)
+
+    def _cmd_cut(self, inv):
+        delimiter = '\t'
+        fields = None
+        args = list(inv.args)
+        while args:
+            arg = args.pop(0)
+            if arg == '-d':
+                delimiter = args.pop(0)
+            elif arg.startswith('-d'):
+                delimiter = arg[2:]
+            elif arg == '-f':
+                fields = args.pop(0)
+            elif arg.startswith('-f'):
+                fields = arg[2:]
+        indexes = [int(f) - 1 for f in fields.split(',')]
+        result = ''
+        for line in inv.stdin.splitlines():
+            parts = line.split(delimiter)
+            result += delimiter.join(
+                parts[i] for i in indexes if i < len(parts)) + '\n'
+        return result
+
+    def _cmd_sleep(self, inv):
+        return ''
+
+    def _cmd_date(self, inv):
+        if inv.args and inv.args[0] == '+%s':
+            return '%d\n' % time.time()
+        return time.strftime('%a %b %d %H:%M:%S UTC %Y\n')
+
+    def _cmd_hostname(self, inv):
+        if inv.args and not inv.args[0].startswith('-'):
+            if inv.user != 'root':
+                raise SimulatedCommandError(
+                    'you must be root to change the host name')
+            self.hostname = inv.args[0]
+            return ''
+        return self.hostname + '\n'
+
+    def _cmd_uname(self, inv):
+        values = {'-s': 'Linux', '-m': self.arch, '-r': '3.16.0-4-amd64',
+                  '-n': self.hostname, '-v': '#1 SMP'}
+        if not inv.args:
+            return 'Linux\n'
+        if '-a' in inv.args:
+            return ' '.join(values[k] for k in ['-s', '-n', '-r', '-v',
+                                                '-m']) + '\n'
+        return ' '.join(values[a] for a in inv.args) + '\n'
+
+    def _cmd_dirname(self, inv):
+        return (posixpath.dirname(inv.args[0].rstrip('/')) or '.') + '\n'
+
+    def _cmd_nproc(self, inv):
+        return '%d\n' % self.cpus
+
+    def _cmd_locale(self, inv):
+        if '-a' in inv.args:
+            return ''.join('%s\n' % name for name in self.locales)
+        return 'LANG=%s\n' % self.locales[-1]
+
+    def _cmd_lsb_release(self, inv):
+        if not self.exists('/usr/bin/lsb_release'):
+            raise SimulatedCommandError('command not found', 127)
+        args = ' '.join(inv.args)
+        if '-i' in inv.args or '--id' in args:
+            value = self.distrib
+        elif '-r' in inv.args or '--release' in args:
+            value = self.release
+        elif '-c' in inv.args or '--codename' in args:
+            value = self.codename
+        elif '-d' in inv.args or '--desc' in args:
+            value = '%s %s' % (self.distrib, self.release)
+        else:
+            raise SimulatedCommandError('unsupported options', 2)
+        return value + '\n'
+
+    def _cmd_which(self, inv):
+        result = ''
+        status = 0
+        for name in inv.args:
+            for directory in inv.ctx.variables['PATH'].split(':'):
+                path = posixpath.join(directory, name)
+                if self.is_file(path):
+                    result += path + '\n'
+                    break
+            else:
+                status = 1
+        return result, status
+
+    def _cmd_whoami(self, inv):
+        return inv.user + '\n'
+
+    def _cmd_id(self, inv):
+        args = [a for a in inv.args if a.startswith('-')]
+        names = [a for a in inv.args if not a.startswith('-')]
+        name = names[0] if names else inv.user
+        if name not in self.users:
+            raise SimulatedCommandError("'%s': no such user" % name)
+        info = self.users[name]
+        if args == ['-u']:
+            return '%d\n' % info['uid']
+        if args == ['-g']:
+            return '%d\n' % info['gid']
+        if args in (['-un'], ['-u', '-n'], ['-nu']):
+            return name + '\n'
+        if args in (['-gn'], ['-g', '-n'], ['-ng']):
+            return self._group_name(info['gid']) + '\n'
+        if args in (['-Gn'], ['-G', '-n'], ['-nG']):
+            return ' '.join(self.user_groups(name)) + '\n'
+        return 'uid=%d(%s) gid=%d(%s)\n' % (
+            info['uid'], name, info['gid'], self._group_name(info['gid']))
+
+    def _cmd_sudo(self, inv):
+        args = list(inv.args)
+        user = 'root'
+        while args and args[0].startswith('-'):
+            option = args.pop(0)
+            if option == '-u':
+                user = args.pop(0)
+            elif option == '-p':
+                args.pop(0)
+        if inv.user != 'root' and 'sudo' not in self.user_groups(inv.user):
+            raise SimulatedCommandError(
+                '%s is not in the sudoers file' % inv.user)
+        ctx = inv.ctx.child()
+        ctx.user = user
+        ctx.variables.update(self._default_variables(user))
+        out, err = [], []
+        status = self.call(ctx, args, inv.stdin, out, err)
+        inv.stderr.extend(err)
+        return ''.join(out), status
+
+    def _cmd_su(self, inv):
+        args = [a for a in inv.args if a != '-']
+        command = None
+        if '-c' in args:
+            index = args.index('-c')
+            command = args[index + 1]
+            del args[index:index + 2]
+        ctx = inv.ctx.child()
+        ctx.user = args[0] if args else 'root'
+        ctx.variables.update(self._default_variables(ctx.user))
+        out, err, status = self.run_script(ctx, command or inv.stdin)
+        inv.stderr.append(err)
+        return out, status
+
+    def _cmd_sh(self, inv):
+        args = [a for a in inv.args if a not in ('-l', '-e', '-x')]
+        ctx = inv.ctx.child()
+        ctx.errexit = '-e' in inv.args
+        if args and args[0] == '-c':
+            script = args[1]
+        elif args and args[0] == '-s' or not args:
+            script = inv.stdin
+        else:
+            script = self._read(inv.user, inv.path(args[0])).decode('utf-8')
+            for index, value in enumerate(args[1:]):
+                ctx.variables[str(index + 1)] = value
+        out, err, status = self.run_script(ctx, script)
+        inv.stderr.append(err)
+        return out, status
+
+    def _cmd_visudo(self, inv):
+        args = list(inv.args)
+        path = '/etc/sudoers'
+        if '-f' in args:
+            path = args[args.index('-f') + 1]
+        elif '-cf' in args:
+            path = args[args.index('-cf') + 1]
+        path = inv.path(path)
+        text = self._read(inv.user, path).decode('utf-8', 'replace')
+        for number, line in enumerate(text.splitlines()):
+            line = line.strip()
+            if not line or line.startswith('#') or line.startswith('Defaults'):
+                continue
+            if not re.match(r'^\S+\s+\S+\s*=\s*(\([^)]*\)\s*)?'
+                            r'((NO)?PASSWD:\s*)?\S.*$', line):
+                inv.error('>>> %s: syntax error near line %d <<<' % (
+                    path, number + 1))
+                return 'parse error in %s near line %d\n' % (
+                    path, number + 1), 1
+        return '%s: parsed OK\n' % path
+
+    def _cmd_tar(self, inv):
+        args = list(inv.args)
+        directory = inv.ctx.cwd
+        archive = None
+        flags = args.pop(0).lstrip('-') if args else ''
+        members = []
+        while args:
+            arg = args.pop(0)
+            if arg == '-C':
+                directory = inv.path(args.pop(0))
+            elif arg == '-f':
+                archive = args.pop(0)
+            elif arg.startswith('--'):
+                continue
+            elif arg.startswith('-') and arg != '-':
+                flags += arg.lstrip('-')
+            else:
+                members.append(arg)
+        if 'f' in flags and archive is None:
+            archive = members.pop(0)
+        if 'c' in flags:
+            if archive != '-':
+                raise SimulatedCommandError(
+                    'only standard output is supported', 2)
+            return self._create_tar(inv.user, directory, members,
+                                    'w:gz' if 'z' in flags else 'w')
+        if 'x' not in flags:
+            raise SimulatedCommandError('only extraction is supported', 2)
+        if archive in (None, '-'):
+            data = _to_bytes(inv.stdin)
+        else:
+            data = self._read(inv.user, inv.path(archive))
+        mode = 'r:gz' if 'z' in flags else 'r:*'
+        with tarfile.open(fileobj=io.BytesIO(data), mode=mode) as archive:
+            for member in archive.getmembers():
+                path = posixpath.normpath(
+                    posixpath.join(directory, member.name))
+                if member.isdir():
+                    self.mkdir(path, owner=inv.user)
+                elif member.issym():
+                    self.fs[path] = _Node('link', owner=inv.user,
+                                          target=member.linkname)
+                else:
+                    content = archive.extractfile(member).read()
+                    self._write(inv.user, path, content)
+                    self.node(path).mode = member.mode & 0o7777
+        return ''
+
+    def _create_tar(self, user, directory, members, mode):
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode=mode) as archive:
+            for member in members:
+                root = posixpath.normpath(posixpath.join(directory, member))
+                if self.node(root) is None:
+                    raise SimulatedCommandError(
+                        '%s: Cannot stat: No such file or directory' % member)
+                prefix = root.rstrip('/') + '/'
+                paths = sorted(path for path in self.fs
+                               if path == root or path.startswith(prefix))
+                for path in paths:
+                    node = self.fs[path]
+                    name = posixpath.normpath(posixpath.join(
+                        member, posixpath.relpath(path, root)))
+                    info = tarfile.TarInfo(name)
+                    info.mode = node.mode
+                    info.uname = info.gname = node.owner
+                    info.mtime = node.mtime
+                    data = None
+                    if node.kind == 'dir':
+                        info.type = tarfile.DIRTYPE
+                    elif node.kind == 'link':
+                        info.type = tarfile.SYMTYPE
+                        info.linkname = node.target
+                    else:
+                        data = self._read(user, path)
+                        info.size = len(data)
+                    archive.addfile(info, data is not None and
+                                    io.BytesIO(data) or None)
+        return buf.getvalue().decode('latin-1')
+
+    def _cmd_gzip(self, inv):
+        flags = ''.join(a.lstrip('-') for a in inv.args if a.startswith('-'))
+        files = [a for a in inv.args if not a.startswith('-')]
+        if files:
+            raise SimulatedCommandError('only standard input is supported', 2)
+        data = _to_bytes(inv.stdin)
+        if 'd' in flags or inv.name in ('gunzip', 'zcat'):
+            try:
+                return _to_text(_gzip_decompress(data))
+            except (IOError, OSError, zlib.error):
+                raise SimulatedCommandError('stdin: not in gzip format')
+        return _gzip_compress(data).decode('latin-1')
+
+    def _cmd_gunzip(self, inv):
+        return self._cmd_gzip(inv)
+
+    def _cmd_zcat(self, inv):
+        return self._cmd_gzip(inv)
+
+    def _cmd_sysctl(self, inv):
+        result = ''
+        for arg in inv.args:
+            if arg.startswith('-'):
+                continue
+            if '=' in arg:
+                if inv.user != 'root':
+                    raise SimulatedCommandError(
+                        'permission denied on key %r' % arg.split('=')[0])
+                key, value = arg.split('=', 1)
+                self.sysctl[key] = value
+                result += value + '\n'
+            else:
+                result += self.sysctl.get(arg, '') + '\n'
+        return result
+
+    def _cmd_curl(self, inv):
+        urls = [a for a in inv.args if '://' in a]
+        if not urls or urls[0] not in self.urls:
+            raise SimulatedCommandError('Could not resolve host', 6)
+        data = self.urls[urls[0]]
+        if '-O' in inv.args:
+            name = posixpath.basename(urls[0])
+            self._write(inv.user, inv.path(name), data)
+            return ''
+        if '-o' in inv.args:
+            path = inv.args[inv.args.index('-o') + 1]
+            self._write(inv.user, inv.path(path), data)
+            return ''
+        return data.decode('utf-8') if isinstance(data, bytes) else data
+
+    def _cmd_wget(self, inv):
+        urls = [a for a in inv.args if '://' in a]
+        if not urls or urls[0] not in self.urls:
+            raise SimulatedCommandError('unable to resolve host address', 4)
+        data = self.urls[urls[0]]
+        path = posixpath.basename(urls[0])
+        if '-O' in inv.args:
+            path = inv.args[inv.args.index('-O') + 1]
+        if path == '-':
+            return data.decode('utf-8') if isinstance(data, bytes) else data
+        self._write(inv.user, inv.path(path), data)
+        return ''
+
+    _KEY_TYPES = {
+        'dsa': 'ssh-dss',
+        'ecdsa': 'ecdsa-sha2-nistp256',
+        'ed25519': 'ssh-ed25519',
+        'rsa': 'ssh-rsa',
+    }
+
+    def _cmd_ssh__keyscan(self, inv):
+        args = list(inv.args)
+        types = ['rsa', 'ecdsa', 'ed25519']
+        port = '22'
+        hosts = []
+        while args:
+            arg = args.pop(0)
+            if arg == '-t':
+                types = args.pop(0).split(',')
+            elif arg == '-p':
+                port = args.pop(0)
+            elif arg in ('-T', '-f'):
+                args.pop(0)
+            elif not arg.startswith('-'):
+                hosts.append(arg)
+        lines = []
+        for host in hosts:
+            if host not in self.ssh_host_keys:
+                inv.error('getaddrinfo %s: Name or service not known' % host)
+                continue
+            name = host if port == '22' else '[%s]:%s' % (host, port)
+            for key_type, key in self.ssh_host_keys[host]:
+                if key_type in [self._KEY_TYPES.get(t) for t in types]:
+                    inv.error('# %s:%s SSH-2.0-OpenSSH_6.6.1' % (host, port))
+                    lines.append('%s %s %s\n' % (name, key_type, key))
+        return ''.join(lines)
+
+    # Accounts
+
+    def _cmd_getent(self, inv):
+        database, keys = inv.args[0], inv.args[1:]
+        if database == 'passwd':
+            entries = [
+                '%s:x:%d:%d:%s:%s:%s' % (
+                    name, info['uid'], info['gid'], info['comment'],
+                    info['home'], info['shell'])
+                for name, info in self.users.items()
+                if not keys or name in keys or str(info['uid']) in keys
+            ]
+        elif database == 'group':
+            entries = [
+                '%s:x:%d:%s' % (name, info['gid'],
+                                ','.join(info['members']))
+                for name, info in self.groups.items()
+                if not keys or name in keys or str(info['gid']) in keys
+            ]
+        elif database == 'shadow':
+            if inv.user != 'root':
+                return '', 2
+            entries = [
+                '%s:%s:17000:0:99999:7:::' % (name, self.shadow[name])
+                for name in self.users
+                if not keys or name in keys
+            ]
+        else:
+            raise SimulatedCommandError('Unknown database: %s' % database)
+        if keys and not entries:
+            return '', 2
+        return ''.join(entry + '\n' for entry in entries)
+
+    def _require_root(self, inv):
+        if inv.user != 'root':
+            raise SimulatedCommandError('Permission denied.', 1)
+
+    def _parse_user_options(self, args):
+        options = {}
+        flags = {'-c': 'comment', '-d': 'home', '-g': 'group',
+                 '-G': 'extra_groups', '-k': 'skeleton', '-p': 'password',
+                 '-s': 'shell', '-u': 'uid', '-l': 'login', '-K': 'key'}
+        args = list(args)
+        name = None
+        while args:
+            arg = args.pop(0)
+            if arg in flags:
+                options[flags[arg]] = args.pop(0)
+            elif arg.startswith('-'):
+                options[arg] = True
+            else:
+                name = arg
+        return name, options
+
+    def _cmd_useradd(self, inv):
+        self._require_root(inv)
+        name, options = self._parse_user_options(inv.args)
+        if name in self.users:
+            raise SimulatedCommandError(
+                "user '%s' already exists" % name, 9)
+        group = options.get('group')
+        if group is not None and group not in self.groups:
+            raise SimulatedCommandError("group '%s' does not exist" % group,
+                                        6)
+        extra_groups = [g for g in options.get('extra_groups', '').split(',')
+                        if g]
+        for extra in extra_groups:
+            if extra not in self.groups:
+                raise SimulatedCommandError(
+                    "group '%s' does not exist" % extra, 6)
+        system = bool(options.get('-r'))
+        create_home = options.get('-m', not system and '-M' not in options)
+        uid = options.get('uid')
+        if uid is not None and not options.get('-o') and int(uid) in [
+                info['uid'] for info in self.users.values()]:
+            raise SimulatedCommandError('UID %s is not unique' % uid, 4)
+        self.add_user(
+            name,
+            uid=uid,
+            gid=self.groups[group]['gid'] if group else None,
+            home=options.get('home'),
+            shell=options.get('shell', '/bin/sh'),
+            comment=options.get('comment', ''),
+            extra_groups=extra_groups,
+            create_home=bool(create_home),
+            system=system,
+        )
+        if 'password' in options:
+            self.shadow[name] = options['password']
+        return ''
+
+    def _cmd_usermod(self, inv):
+        self._require_root(inv)
+        name, options = self._parse_user_options(inv.args)
+        if name not in self.users:
+            raise SimulatedCommandError("user '%s' does not exist" % name, 6)
+        info = self.users[name]
+        if 'comment' in options:
+            info['comment'] = options['comment']
+        if 'home' in options:
+            if options.get('-m') and self.exists(info['home']):
+                self._copy_tree(info['home'], options['home'], move=True)
+            info['home'] = options['home']
+        if 'group' in options:
+            if options['group'] not in self.groups:
+                raise SimulatedCommandError(
+                    "group '%s' does not exist" % options['group'], 6)
+            info['gid'] = self.groups[options['group']]['gid']
+        if 'extra_groups' in options:
+            wanted = [g for g in options['extra_groups'].split(',') if g]
+            for group in wanted:
+                if group not in self.groups:
+                    raise SimulatedCommandError(
+                        "group '%s' does not exist" % group, 6)
+            for group, group_info in self.groups.items():
+                if group in wanted and name not in group_info['members']:
+                    group_info['members'].append(name)
+                elif group not in wanted and name in group_info['members'] \
+                        and not options.get('-a'):
+                    group_info['members'].remove(name)
+        if 'shell' in options:
+            info['shell'] = options['shell']
+        if 'uid' in options:
+            info['uid'] = int(options['uid'])
+        if 'password' in options:
+            self.shadow[name] = options['password']
+        if 'login' in options:
+            self.users[options['login']] = self.users.pop(name)
+            self.shadow[options['login']] = self.shadow.pop(name)
+        return ''
+
+    def _cmd_userdel(self, inv):
+        self._require_root(inv)
+        name = [a for a in inv.args if not a.startswith('-')][0]
+        if name not in self.users:
+            raise SimulatedCommandError("user '%s' does not exist" % name, 6)
+        info = self.users.pop(name)
+        self.shadow.pop(name, None)
+        for group_info in self.groups.values():
+            if name in group_info['members']:
+                group_info['members'].remove(name)
+        if '-r' in inv.args:
+            self._remove_tree(info['home'])
+        return ''
+
+    def _cmd_groupadd(self, inv):
+        self._require_root(inv)
+        args = list(inv.args)
+        gid = None
+        system = False
+        name = None
+        while args:
+            arg = args.pop(0)
+            if arg == '-g':
+                gid = args.pop(0)
+            elif arg == '-r':
+                system = True
+            elif not arg.startswith('-'):
+                name = arg
+        if name in self.groups:
+            raise SimulatedCommandError(
+                "group '%s' already exists" % name, 9)
+        self.add_group(name, gid=gid, system=system)
+        return ''
+
+    def _cmd_groupdel(self, inv):
+        self._require_root(inv)
+        name = inv.args[-1]
+        if name not in self.groups:
+            raise SimulatedCommandError(
+                "group '%s' does not exist" % name, 6)
+        del self.groups[name]
+        return ''
+
+    def _cmd_gpasswd(self, inv):
+        self._require_root(inv)
+        option, user, group = inv.args
+        members = self.groups[group]['members']
+        if option == '-a' and user not in members:
+            members.append(user)
+        elif option == '-d' and user in members:
+            members.remove(user)
+        return ''
+
+    # Packages
+
+    def install_package(self, name, version='1.0'):
+        """
+        Install a system package, with the side effects of its scripts.
+        """
+        self.packages[name] = version
+        if name.startswith('mysql-server'):
+            self.mysql_users.setdefault(
+                ('root', 'localhost'), {'password': self.mysql_root_password})
+        if name.startswith('postgresql') and 'postgres' not in self.users:
+            self.add_user('postgres', home='/var/lib/postgresql',
+                          shell='/bin/bash', system=True)
+            config_file = self.pg_settings['config_file']
+            self.mkdir(posixpath.dirname(config_file), owner='postgres')
+            self.write_file(config_file, "data_directory = "
+                            "'/var/lib/postgresql/main'\n", owner='postgres')
+            self.mkdir('/etc/init.d')
+            self.write_file('/etc/init.d/postgresql', '', mode=0o755)
+        for program in self.package_programs.get(name, []):
+            self.fs[program] = _Node('file', mode=0o755)
+        for directory in self.package_directories.get(name, []):
+            self.mkdir(directory)
+
+    def _cmd_dpkg(self, inv):
+        if self.family != 'debian':
+            raise SimulatedCommandError('command not found', 127)
+        if inv.args[0] == '-s':
+            name = inv.args[1]
+            if name not in self.packages:
+                inv.error("dpkg-query: package '%s' is not installed" % name)
+                return '', 1
+            return 'Package: %s\nStatus: install ok installed\n' \
+                'Version: %s\n' % (name, self.packages[name])
+        if inv.args[0] == '--get-selections':
+            return ''.join('%s\t\t\tinstall\n' % name
+                           for name in sorted(self.packages))
+        raise SimulatedCommandError('unsupported options', 2)
+
+    def _cmd_dpkg__query(self, inv):
+        args = list(inv.args)
+        fmt = '${Package}\t${Version}\n'
+        names = []
+        while args:
+            arg = args.pop(0)
+            if arg.startswith('-f='):
+                fmt = arg[3:]
+            elif arg.startswith('--showformat='):
+                fmt = arg[len('--showformat='):]
+            elif arg == '-f':
+                fmt = args.pop(0)
+            elif not arg.startswith('-'):
+                names.append(arg)
+        fmt = fmt.replace('\\n', '\n').replace('\\t', '\t')
+        result = ''
+        status = 0
+        for name in names or sorted(self.packages):
+            if name in self.packages:
+                status_text = 'install ok installed'
+                version = self.packages[name]
+            else:
+                inv.error('dpkg-query: no packages found matching %s' % name)
+                status = 1
+                continue
+            result += fmt.replace('${Package}', name) \
+                .replace('${Version}', version) \
+                .replace('${Status}', status_text) \
+                .replace('${db:Status-Abbrev}', 'ii ')
+        return result, status
+
+    def _cmd_apt__get(self, inv):
+        self._require_root(inv)
+        args = [a for a in inv.args if not a.startswith('-')]
+        action, names = args[0], args[1:]
+        if action == 'install':
+            for name in names:
+                name, _, version = name.partition('=')
+                self.install_package(name, version or '1.0')
+        elif action in ('remove', 'purge'):
+            for name in names:
+                self.packages.pop(name, None)
+        return ''
+
+    def _cmd_rpm(self, inv):
+        if self.family == 'debian':
+            raise SimulatedCommandError('command not found', 127)
+        names = [a for a in inv.args if not a.startswith('-')]
+        result = ''
+        status = 0
+        for name in names:
+            if name in self.packages:
+                result += '%s-%s\n' % (name, self.packages[name])
+            else:
+                result += 'package %s is not installed\n' % name
+                status = 1
+        return result, status
+
+    def _cmd_yum(self, inv):
+        self._require_root(inv)
+        args = [a for a in inv.args if not a.startswith('-')]
+        action, names = args[0], args[1:]
+        if action == 'install':
+            for name in names:
+                self.install_package(name)
+        elif action == 'remove':
+            for name in names:
+                self.packages.pop(name, None)
+        return ''
+
+    def _cmd_pip(self, inv):
+        args = [a for a in inv.args if not a.startswith('-')]
+        if '--version' in inv.args:
+            return 'pip 9.0.1 from /usr/lib/python2.7/dist-packages\n'
+        action, names = args[0], args[1:]
+        if action == 'freeze':
+            return ''.join('%s==%s\n' % item
+                           for item in sorted(self.pip_packages.items()))
+        if action == 'install':
+            for name in names:
+                name, _, version = name.partition('==')
+                self.pip_packages[name] = version or '1.0'
+            return ''
+        if action == 'uninstall':
+            for name in names:
+                self.pip_packages.pop(name, None)
+            return ''
+        raise SimulatedCommandError('unsupported pip command', 2)
+
+    def _cmd_python(self, inv):
+        args = list(inv.args)
+        if args[:2] == ['-m', 'pip']:
+            ctx = inv.ctx
+            out, err = [], []
+            status = self.call(ctx, ['pip'] + args[2:], inv.stdin, out, err)
+            inv.stderr.extend(err)
+            return ''.join(out), status
+        if args and args[0] == '-c' and 'cpu_count' in args[1]:
+            return '%d\n' % self.cpus
+        if args == ['-V'] or args == ['--version']:
+            return 'Python 2.7.9\n'
+        raise SimulatedCommandError('unsupported python invocation', 2)
+
+    # Services
+
+    def unit(self, name):
+        """
+        Return the state of a service, creating it if needed.
+        """
+        name = re.sub(r'\.service$', '', name)
+        return self.units.setdefault(name, {'active': False,
+                                            'enabled': False})
+
+    def _cmd_systemctl(self, inv):
+        if not self.systemd:
+            raise SimulatedCommandError('command not found', 127)
+        args = [a for a in inv.args if not a.startswith('--')]
+        action, names = args[0], args[1:]
+        if action in ('is-active', 'is-enabled'):
+            key = 'active' if action == 'is-active' else 'enabled'
+            labels = {
+                'active': ('active', 'inactive'),
+                'enabled': ('enabled', 'disabled'),
+            }[key]
+            result = ''
+            status = 0
+            for name in names:
+                state = self.unit(name)[key]
+                result += (labels[0] if state else labels[1]) + '\n'
+                if not state:
+                    status = 3 if key == 'active' else 1
+            return result, status
+        if action == 'status':
+            unit = self.unit(names[0])
+            return 'Active: %s\n' % (
+                'active (running)' if unit['active'] else 'inactive (dead)'
+            ), 0 if unit['active'] else 3
+        if action == 'daemon-reload':
+            return ''
+        if action == 'list-units':
+            return ''.join(
+                '%s.service loaded %s %s %s\n' % (
+                    name,
+                    'active' if unit['active'] else 'inactive',
+                    'running' if unit['active'] else 'dead',
+                    name)
+                for name, unit in self.units.items())
+        if action == 'list-unit-files':
+            return ''.join(
+                '%s.service %s\n' % (
+                    name, 'enabled' if unit['enabled'] else 'disabled')
+                for name, unit in self.units.items())
+        if action == 'show':
+            blocks = []
+            for name in names:
+                unit = self.units.get(re.sub(r'\.service$', '', name))
+                blocks.append('Id=%s\nActiveState=%s\nUnitFileState=%s\n' % (
+                    name,
+                    'active' if unit and unit['active'] else 'inactive',
+                    ('enabled' if unit['enabled'] else 'disabled')
+                    if unit else ''))
+            return '\n'.join(blocks)
+        self._require_root(inv)
+        for name in names:
+            unit = self.unit(name)
+            if action in ('start', 'restart', 'reload', 'reload-or-restart',
+                          'try-restart'):
+                if action != 'try-restart' or unit['active']:
+                    unit['active'] = True
+                unit.setdefault('actions', []).append(action)
+            elif action == 'stop':
+                unit['active'] = False
+                unit.setdefault('actions', []).append(action)
+            elif action == 'enable':
+                unit['enabled'] = True
+            elif action == 'disable':
+                unit['enabled'] = False
+            else:
+                raise SimulatedCommandError('unknown command %s' % action)
+        return ''
+
+    def _cmd_service(self, inv):
+        if inv.args == ['--status-all']:
+            return ''.join(
+                ' [ %s ]  %s\n' % ('+' if unit['active'] else '-', name)
+                for name, unit in self.units.items())
+        name, action = inv.args[0], inv.args[1]
+        unit = self.unit(name)
+        if action == 'status':
+            if unit['active']:
+                return '%s is running\n' % name
+            return '%s is not running\n' % name, 3
+        self._require_root(inv)
+        if action in ('start', 'restart', 'reload', 'force-reload'):
+            unit['active'] = True
+        elif action == 'stop':
+            unit['active'] = False
+        else:
+            raise SimulatedCommandError('unknown action %s' % action)
+        unit.setdefault('actions', []).append(action)
+        return ''
+
+    # Supervisor
+
+    _SUPERVISOR_DIRS = [
+        '/etc/supervisor/conf.d',
+        '/etc/supervisord.d',
+        '/etc/supervisor.d',
+    ]
+
+    def _supervisor_programs(self):
+        programs = OrderedDict()
+        for directory in self._SUPERVISOR_DIRS:
+            if not self.is_dir(directory):
+                continue
+            for name in self.listdir(directory):
+                text = self.read_file(posixpath.join(directory, name))
+                program = None
+                for line in text.splitlines():
+                    match = re.match(r'^\[program:([^\]]+)\]', line)
+                    if match:
+                        program = match.group(1)
+                        programs[program] = True
+                    elif program and line.startswith('autostart='):
+                        programs[program] = line.split('=', 1)[1] == 'true'
+        return programs
+
+    def _cmd_supervisorctl(self, inv):
+        if not inv.args:
+            raise SimulatedCommandError('interactive mode not supported', 2)
+        action, names = inv.args[0], inv.args[1:]
+        if action == 'status':
+            lines = []
+            status = 0
+            for name in names or list(self.supervisor):
+                state = self.supervisor.get(name)
+                if state is None:
+                    lines.append('%s: ERROR (no such process)\n' % name)
+                    status = 4
+                    continue
+                lines.append('%-32s %-8s %s\n' % (
+                    name, state,
+                    'pid 4242, uptime 0:00:01' if state == 'RUNNING'
+                    else 'Not started'))
+                if state != 'RUNNING':
+                    status = status or 3
+            return ''.join(lines), status
+        self._require_root(inv)
+        if action in ('update', 'reload', 'reread'):
+            if action == 'reread':
+                return ''
+            programs = self._supervisor_programs()
+            for name in list(self.supervisor):
+                if name not in programs:
+                    del self.supervisor[name]
+            for name, autostart in programs.items():
+                if name not in self.supervisor or action == 'reload':
+                    self.supervisor[name] = (
+                        'RUNNING' if autostart else 'STOPPED')
+            return ''
+        if action in ('start', 'stop', 'restart'):
+            result = ''
+            status = 0
+            for name in names:
+                if name not in self.supervisor:
+                    result += '%s: ERROR (no such process)\n' % name
+                    status = 1
+                    continue
+                self.supervisor[name] = (
+                    'STOPPED' if action == 'stop' else 'RUNNING')
+                result += '%s: %s\n' % (
+                    name, 'stopped' if action == 'stop' else 'started')
+            return result, status
+        raise SimulatedCommandError('*** Unknown syntax: %s' % action)
+
+    def _cmd_base64(self, inv):
+        if '-d' in inv.args or '--decode' in inv.args:
+            return base64.b64decode(inv.stdin.strip()).decode('utf-8')
+        return base64.b64encode(inv.stdin.encode('utf-8')).decode('ascii') + '\n'
+
+    def _cmd_socat(self, inv):
+        address = [a for a in inv.args if a.startswith('UNIX-CONNECT:')]
+        return self._supervisor_rpc(inv, address[0][len('UNIX-CONNECT:'):])
+
+    def _cmd_nc(self, inv):
+        if '-U' not in inv.args:
+            raise SimulatedCommandError('only unix sockets are supported')
+        return self._supervisor_rpc(inv, inv.args[-1])
+
+    supervisor_socket = '/var/run/supervisor.sock'
+
+    def _supervisor_rpc(self, inv, path):
+        """
+        Answer an XML-RPC request sent to the supervisord unix socket.
+        """
+        if path != self.supervisor_socket or 'supervisor' not in self.packages:
+            raise SimulatedCommandError(
+                'connect to %s failed: No such file or directory' % path)
+        self._require_root(inv)
+        body = inv.stdin.replace('\r\n', '\n').partition('\n\n')[2]
+        params, method = xmlrpc_client.loads(body)
+        if method == 'system.multicall':
+            result = []
+            for call in params[0]:
+                try:
+                    result.append([self._supervisor_call(
+                        call['methodName'], call['params'])])
+                except xmlrpc_client.Fault as e:
+                    result.append({'faultCode': e.faultCode,
+                                   'faultString': e.faultString})
+            response = xmlrpc_client.dumps((result,), methodresponse=True)
+        else:
+            try:
+                response = xmlrpc_client.dumps(
+                    (self._supervisor_call(method, params),),
+                    methodresponse=True)
+            except xmlrpc_client.Fault as e:
+                response = xmlrpc_client.dumps(e, methodresponse=True)
+        return ('HTTP/1.0 200 OK\r\nContent-Type: text/xml\r\n'
+                'Content-Length: %d\r\n\r\n%s' % (len(response), response))
+
+    def _supervisor_call(self, method, params):
+        def info(name):
+            group, _, process = name.rpartition(':')
+            return {
+                'name': process,
+                'group': group or process,
+                'statename': self.supervisor[name],
+            }
+
+        def check(name):
+            if name not in self.supervisor:
+                raise xmlrpc_client.Fault(10, 'BAD_NAME: %s' % name)
+
+        if method == 'supervisor.getAllProcessInfo':
+            return [info(name) for name in self.supervisor]
+        if method == 'supervisor.getProcessInfo':
+            check(params[0])
+            return info(params[0])
+        if method == 'supervisor.startProcess':
+            check(params[0])
+            if self.supervisor[params[0]] == 'RUNNING':
+                raise xmlrpc_client.Fault(60, 'ALREADY_STARTED: %s' % params[0])
+            self.supervisor[params[0]] = 'RUNNING'
+            return True
+        if method == 'supervisor.stopProcess':
+            check(params[0])
+            if self.supervisor[params[0]] != 'RUNNING':
+                raise xmlrpc_client.Fault(70, 'NOT_RUNNING: %s' % params[0])
+            self.supervisor[params[0]] = 'STOPPED'
+            return True
+        if method == 'supervisor.reloadConfig':
+            programs = self._supervisor_programs()
+            self._supervisor_config = programs
+            added = [name for name in programs if name not in self.supervisor]
+            removed = [name for name in self.supervisor
+                       if name not in programs]
+            return [[added, [], removed]]
+        if method == 'supervisor.addProcessGroup':
+            programs = getattr(self, '_supervisor_config', {})
+            if params[0] in self.supervisor:
+                raise xmlrpc_client.Fault(90, 'ALREADY_ADDED: %s' % params[0])
+            self.supervisor[params[0]] = (
+                'RUNNING' if programs.get(params[0], True) else 'STOPPED')
+            return True
+        if method in ('supervisor.stopProcessGroup',
+                      'supervisor.removeProcessGroup'):
+            check(params[0])
+            if method == 'supervisor.removeProcessGroup':
+                del self.supervisor[params[0]]
+            else:
+                self.supervisor[params[0]] = 'STOPPED'
+            return []
+        raise xmlrpc_client.Fault(1, 'UNKNOWN_METHOD')
+
+    # PostgreSQL
+
+    def _check_postgres(self, inv):
+        if inv.user != 'postgres':
+            raise SimulatedCommandError(
+                'FATAL:  role "%s" does not exist' % inv.user, 2)
+
+    def _cmd_psql(self, inv):
+        self._check_postgres(inv)
+        args = list(inv.args)
+        database = 'postgres'
+        separator = '|'
+        commands = []
+        while args:
+            arg = args.pop(0)
+            if arg in ('-d', '--dbname'):
+                database = args.pop(0)
+            elif arg in ('-F', '--field-separator'):
+                separator = args.pop(0)
+            elif arg in ('-v', '--set', '-U'):
+                args.pop(0)
+            elif arg == '-c':
+                commands.append(args.pop(0))
+            elif arg.startswith('-'):
+                continue
+            else:
+                database = arg
+        if database not in self.pg_databases and database != 'postgres':
+            raise SimulatedCommandError(
+                'FATAL:  database "%s" does not exist' % database, 2)
+        if not commands:
+            commands = [_strip_sql_comments(inv.stdin)]
+        result = ''
+        for command in commands:
+            # The statements of a command run in a single transaction
+            saved = [OrderedDict(state) for state in (
+                self.pg_roles, self.pg_schemas)]
+            try:
+                for statement in [s.strip() for s in command.split(';')]:
+                    if statement:
+                        result += self.sql(statement, database).replace(
+                            '|', separator)
+            except SimulatedCommandError:
+                for state, copy in zip((self.pg_roles, self.pg_schemas),
+                                       saved):
+                    state.clear()
+                    state.update(copy)
+                raise
+        return result
+
+    def sql(self, statement, database='postgres'):
+        """
+        Execute one of the SQL statements understood by the simulation.
+
+        Override or extend this method to support more statements.
+        """
+        match = re.match(r'^SHOW (\w+)$', statement, re.I)
+        if match:
+            return self.pg_settings[match.group(1).lower()] + '\n'
+        if re.match(r"^SELECT current_setting\('\w+'\)"
+                    r"(, current_setting\('\w+'\))*$", statement, re.I):
+            names = re.findall(r"current_setting\('(\w+)'\)", statement)
+            return '|'.join(self.pg_settings[name] for name in names) + '\n'
+        if re.match(r'^(BEGIN|COMMIT)$', statement, re.I):
+            return statement.upper() + '\n'
+        match = re.match(r"^SELECT COUNT\(\*\) FROM pg_user "
+                         r"WHERE usename = '([^']*)'$", statement, re.I)
+        if match:
+            return '%d\n' % (match.group(1) in self.pg_roles)
+        if re.match(r"^SELECT CASE WHEN rolcanlogin THEN 'user' ELSE 'role' "
+                    r"END, rolname FROM pg_roles UNION ALL "
+                    r"SELECT 'database', datname FROM pg_database$",
+                    statement, re.I):
+            roles = [('user', 'postgres')] + [
+                ('role' if 'NOLOGIN' in role.get('options', '').upper()
+                 else 'user', name)
+                for name, role in self.pg_roles.items()]
+            databases = ['postgres', 'template0', 'template1']
+            databases += list(self.pg_databases)
+            return ''.join(['%s|%s\n' % role for role in roles] +
+                           ['database|%s\n' % name for name in databases])
+        if re.match(r'^SELECT nspname FROM pg_namespace$', statement, re.I):
+            names = ['pg_catalog', 'information_schema', 'public']
+            names += [name for db, name in self.pg_schemas if db == database]
+            return ''.join('%s\n' % name for name in names)
+        match = re.match(r'^CREATE (USER|ROLE) "?([^"\s]+)"?\s*(.*)$',
+                         statement, re.I)
+        if match:
+            name = match.group(2)
+            if name in self.pg_roles:
+                raise SimulatedCommandError(
+                    'ERROR:  role "%s" already exists' % name)
+            self.pg_roles[name] = {'options': match.group(3)}
+            return 'CREATE ROLE\n'
+        match = re.match(r'^DROP (USER|ROLE) "?([^"\s]+)"?$', statement,
+                         re.I)
+        if match:
+            if self.pg_roles.pop(match.group(2), None) is None:
+                raise SimulatedCommandError(
+                    'ERROR:  role "%s" does not exist' % match.group(2))
+            return 'DROP ROLE\n'
+        match = re.match(r'^CREATE SCHEMA "?([^"\s]+)"?'
+                         r'(?: AUTHORIZATION "?([^"\s]+)"?)?$',
+                         statement, re.I)
+        if match:
+            key = (database, match.group(1))
+            if key in self.pg_schemas:
+                raise SimulatedCommandError(
+                    'ERROR:  schema "%s" already exists' % match.group(1))
+            self.pg_schemas[key] = {'owner': match.group(2) or 'postgres'}
+            return 'CREATE SCHEMA\n'
+        raise SimulatedCommandError(
+            'ERROR:  unsupported statement: %s' % statement)
+
+    def _cmd_createdb(self, inv):
+        self._check_postgres(inv)
+        args = list(inv.args)
+        owner = 'postgres'
+        name = None
+        while args:
+            arg = args.pop(0)
+            if arg in ('--owner', '-O'):
+                owner = args.pop(0)
+            elif arg in ('--template', '-T', '-E', '--encoding'):
+                args.pop(0)
+            elif not arg.startswith('-'):
+                name = arg
+        if name in self.pg_databases:
+            raise SimulatedCommandError(
+                'database creation failed: ERROR:  database "%s" already '
+                'exists' % name)
+        if owner != 'postgres' and owner not in self.pg_roles:
+            raise SimulatedCommandError(
+                'database creation failed: ERROR:  role "%s" does not exist'
+                % owner)
+        self.pg_databases[name] = {'owner': owner}
+        return ''
+
+    def _cmd_dropdb(self, inv):
+        self._check_postgres(inv)
+        name = inv.args[-1]
+        if self.pg_databases.pop(name, None) is None:
+            raise SimulatedCommandError(
+                'database removal failed: ERROR:  database "%s" does not '
+                'exist' % name)
+        return ''
+
+    def _cmd_pg_dump(self, inv):
+        self._check_postgres(inv)
+        name = [a for a in inv.args if not a.startswith('-')][-1]
+        if name not in self.pg_databases:
+            raise SimulatedCommandError(
+                'pg_dump: [archiver (db)] connection to database "%s" '
+                'failed: FATAL:  database "%s" does not exist' % (name, name))
+        lines = ['-- PostgreSQL database dump']
+        for (database, schema), info in self.pg_schemas.items():
+            if database == name:
+                lines.append('CREATE SCHEMA %s AUTHORIZATION %s;' % (
+                    schema, info['owner']))
+        sql = ''.join(line + '\n' for line in lines)
+        if '-Fc' in inv.args:
+            return 'PGDMP\n' + sql
+        return sql
+
+    def _cmd_pg_restore(self, inv):
+        self._check_postgres(inv)
+        args = list(inv.args)
+        database = None
+        sources = []
+        while args:
+            arg = args.pop(0)
+            if arg in ('-d', '--dbname'):
+                database = args.pop(0)
+            elif not arg.startswith('-'):
+                sources.append(inv.path(arg))
+        if sources and self.is_dir(sources[0]):
+            data = self.read_file(posixpath.join(sources[0], 'toc.dat'))
+        else:
+            data = inv.stdin
+        if not data.startswith('PGDMP'):
+            raise SimulatedCommandError(
+                'pg_restore: [archiver] input file does not appear to be a '
+                'valid archive', 1)
+        inv.stdin = data[len('PGDMP'):]
+        return self._cmd_psql(_reinvoke(inv, ['-d', database or 'postgres']))
+
+    # MySQL
+
+    _MYSQL_SYSTEM_DATABASES = ['information_schema', 'mysql',
+                               'performance_schema']
+
+    def _cmd_mysql(self, inv):
+        if not self.exists('/usr/bin/mysql'):
+            raise SimulatedCommandError('mysql: command not found', 127)
+        user = 'root' if inv.user == 'root' else inv.user
+        password = ''
+        database = None
+        force = False
+        statements = inv.stdin
+        for arg in inv.args:
+            name, _, value = arg.partition('=')
+            if name in ('--force', '-f'):
+                force = True
+            elif name == '--defaults-extra-file':
+                password = self._mysql_option_file_password(inv.path(value))
+            elif name in ('--user', '-u'):
+                user = value
+            elif name == '--password':
+                password = value
+            elif name in ('--execute', '-e'):
+                statements = value
+            elif not arg.startswith('-'):
+                database = arg
+        account = self.mysql_users.get((user, 'localhost'))
+        if account is None or account.get('password', '') != password:
+            raise SimulatedCommandError(
+                "ERROR 1045 (28000): Access denied for user '%s'@'localhost' "
+                "(using password: %s)" % (user, 'YES' if password else 'NO'))
+        result = ''
+        status = 0
+        for statement in _split_sql(_strip_sql_comments(statements)):
+            match = re.match(r'^use\s+`?(\w+)`?$', statement, re.I)
+            if match:
+                database = match.group(1)
+                continue
+            try:
+                result += self.mysql_sql(statement, database)
+            except SimulatedCommandError as exc:
+                if not force:
+                    raise
+                inv.error(str(exc))
+                status = 1
+        return result, status
+
+    def _cmd_npm(self, inv):
+        command = inv.args[0]
+        options = [arg for arg in inv.args[1:] if arg.startswith('-')]
+        names = [arg for arg in inv.args[1:] if not arg.startswith('-')]
+        is_global = '-g' in options
+        prefix = '/usr/local' if is_global else inv.ctx.cwd
+        installed = self.npm_packages.setdefault(prefix, {})
+        if command in ('list', 'ls'):
+            return json.dumps({'dependencies': dict(
+                (name, {'version': version})
+                for name, version in installed.items())}) + '\n'
+        if is_global and inv.user != 'root':
+            raise SimulatedCommandError('EACCES: permission denied', 243)
+        if command == 'uninstall':
+            for name in names:
+                installed.pop(name.split('@')[0], None)
+            return ''
+        if command == 'ci' or (command == 'install' and not names):
+            manifest = json.loads(_to_text(self._read(
+                inv.user, inv.path('package.json'))))
+            if command == 'ci':
+                if not any(self.exists(inv.path(name)) for name in
+                           ['package-lock.json', 'npm-shrinkwrap.json']):
+                    raise SimulatedCommandError(
+                        'The `npm ci` command can only install with an '
+                        'existing package-lock.json', 1)
+                installed.clear()
+            names = [name + '@' + version.lstrip('^~') for name, version in
+                     manifest.get('dependencies', {}).items()]
+        if command not in ('install', 'update', 'ci'):
+            raise SimulatedCommandError('unknown command %r' % command, 1)
+        specs = [spec.partition('@')[::2] for spec in names]
+        for name, version in specs:
+            if name not in self.npm_registry:
+                raise SimulatedCommandError('E404 Not Found: %s' % name, 1)
+        for name, version in specs:
+            installed[name] = version or self.npm_registry[name]
+        return ''
+
+    def _cmd_conda(self, inv):
+        args = list(inv.args)
+        root = posixpath.join(self.users[self.login_user]['home'], 'miniconda')
+        if args == ['-V']:
+            return 'conda 4.3.30\n'
+        command = args.pop(0)
+        if command == 'env' and args[:1] == ['list']:
+            return json.dumps({'envs': list(self.conda_envs)}) + '\n'
+        prefix, spec_file, specs = root, None, []
+        while args:
+            arg = args.pop(0)
+            if arg in ('--name', '-n'):
+                prefix = posixpath.join(root, 'envs', args.pop(0))
+            elif arg in ('--prefix', '-p'):
+                prefix = inv.path(args.pop(0))
+            elif arg == '--file':
+                spec_file = args.pop(0)
+            elif arg == '-c':
+                args.pop(0)
+            elif not arg.startswith('-'):
+                specs.append(arg)
+        if command == 'list':
+            if prefix not in self.conda_envs:
+                return json.dumps({'error': 'EnvironmentLocationNotFound'}), 1
+            listing = []
+            for name, package in sorted(self.conda_envs[prefix].items()):
+                if not isinstance(package, dict):
+                    package = {'version': package}
+                listing.append({
+                    'name': name,
+                    'version': package['version'],
+                    'build_string': package.get('build', '0'),
+                    'channel': package.get('channel', 'pkgs/main'),
+                })
+            return json.dumps(listing) + '\n'
+        if command not in ('create', 'install'):
+            raise SimulatedCommandError('unknown command %r' % command, 2)
+        if command == 'install' and prefix not in self.conda_envs:
+            raise SimulatedCommandError('environment does not exist', 1)
+        packages = {}
+        if spec_file:
+            lines = _to_text(self._read(inv.user, inv.path(spec_file)))
+            if '@EXPLICIT' in lines:
+                for line in lines.splitlines():
+                    if '://' in line:
+                        filename = posixpath.basename(line).split('.tar')[0]
+                        name, version, build = filename.rsplit('-', 2)
+                        packages[name] = {'version': version,
+                                          'build': build}
+            else:
+                specs.extend(lines.split())
+        for spec in specs:
+            name, _, version = spec.partition('=')
+            if name not in self.conda_channel:
+                raise SimulatedCommandError(
+                    'PackagesNotFoundError: %s' % name, 1)
+            packages[name] = version or self.conda_channel[name]
+        if command == 'create':
+            self.conda_envs[prefix] = {}
+            self.mkdir(posixpath.join(prefix, 'conda-meta'),
+                       owner=inv.user)
+        self.conda_envs[prefix].update(packages)
+        return ''
+
+    def _cmd_git(self, inv):
+        args = list(inv.args)
+        while args and args[0] == '-C':
+            args.pop(0)
+            inv.ctx = inv.ctx.child()
+            inv.ctx.cwd = inv.path(args.pop(0))
+        command = args.pop(0)
+        if command == '--version':
+            return 'git version 2.30.2\n'
+        if command == 'clone':
+            return self._git_clone(inv, args)
+        repo = self.git_repos.get(inv.ctx.cwd)
+        if repo is None:
+            raise SimulatedCommandError(
+                'fatal: not a git repository', 128)
+        return getattr(self, '_git_' + command.replace('-', '_'))(
+            inv, repo, args)
+
+    def _git_clone(self, inv, args):
+        options = {}
+        names = []
+        while args:
+            arg = args.pop(0)
+            if arg in ('-b', '--branch', '--depth', '--reference'):
+                options[arg] = args.pop(0)
+            elif arg.startswith('--') and '=' in arg:
+                key, value = arg.split('=', 1)
+                options[key] = value
+            elif arg.startswith('-'):
+                options[arg] = True
+            else:
+                names.append(arg)
+        url = names[0]
+        path = inv.path(names[1] if len(names) > 1 else
+                        posixpath.basename(url)[:-len('.git')]
+                        if url.endswith('.git') else posixpath.basename(url))
+        remote = self.git_remotes.get(url)
+        if remote is None:
+            raise SimulatedCommandError(
+                "fatal: repository '%s' not found" % url, 128)
+        if self.exists(path) and self.listdir(path):
+            raise SimulatedCommandError(
+                "fatal: destination path '%s' already exists and is not "
+                "an empty directory." % posixpath.basename(path), 128)
+        branch = options.get('-b', options.get('--branch', 'master'))
+        depth = options.get('--depth')
+        reference = options.get('--reference')
+        if reference is not None and \
+                self.git_repos.get(inv.path(reference), {}).get('url') != url:
+            raise SimulatedCommandError(
+                'fatal: reference repository %r is not a local repository.'
+                % reference, 128)
+        repo = {
+            'url': url,
+            'bare': bool(options.get('--mirror') or options.get('--bare')),
+            'reference': inv.path(reference) if reference else None,
+            'dissociate': bool(options.get('--dissociate')),
+            'remote': {},
+            'tags': {},
+            'branches': {},
+            'head': None,
+            'branch': None,
+            'dirty': False,
+            'depth': int(depth) if depth else None,
+            'filter': options.get('--filter'),
+            'sparse': [] if options.get('--sparse') else None,
+            'local_commits': set(),
+        }
+        if not self.exists(path):
+            self._check_create(inv.user, path)
+            self.mkdir(path, owner=inv.user)
+        self.git_repos[path] = repo
+        if repo['bare']:
+            repo['branches'] = dict(remote['branches'])
+            repo['tags'] = dict(remote['tags'])
+            remote['fetches'] += 1
+            return ''
+        self.mkdir(posixpath.join(path, '.git'), owner=inv.user)
+        if reference:
+            repo['remote'] = dict(self.git_repos[repo['reference']][
+                'branches'])
+            repo['tags'] = dict(self.git_repos[repo['reference']]['tags'])
+        else:
+            self._git_fetch(inv, repo, [])
+        if branch in remote['branches']:
+            repo['branches'][branch] = repo['head'] = \
+                remote['branches'][branch]
+            repo['branch'] = branch
+        elif branch in remote['tags']:
+            repo['head'] = remote['tags'][branch]
+        else:
+            raise SimulatedCommandError(
+                'fatal: Remote branch %s not found in upstream origin' %
+                branch, 128)
+        return ''
+
+    def _git_fetch(self, inv, repo, args):
+        sources = [arg for arg in args if not arg.startswith('-')]
+        if sources and sources[0] != 'origin':
+            source = self.git_repos.get(inv.path(sources[0]))
+            if source is None:
+                raise SimulatedCommandError(
+                    "fatal: '%s' does not appear to be a git repository" %
+                    sources[0], 128)
+            branches, tags = source['branches'], source['tags']
+        else:
+            remote = self.git_remotes[repo['url']]
+            remote['fetches'] += 1
+            branches, tags = remote['branches'], remote['tags']
+        if repo['bare']:
+            repo['branches'] = dict(branches)
+            repo['tags'] = dict(tags)
+        else:
+            repo['remote'] = dict(branches)
+            repo['tags'].update(tags)
+        return ''
+
+    def _git_rev_parse(self, inv, repo, args):
+        names = [arg for arg in args if not arg.startswith('-')]
+        if '--git-dir' in args:
+            return '.git\n'
+        result = ''
+        for name in names:
+            commit = self._git_resolve(repo, name)
+            if commit is None:
+                return result, 1
+            result += commit + '\n'
+        return result
+
+    def _git_resolve(self, repo, name):
+        if name == 'HEAD':
+            return repo['head']
+        for prefix, refs in [('refs/remotes/origin/', repo['remote']),
+                             ('origin/', repo['remote']),
+                             ('refs/heads/', repo['branches']),
+                             ('refs/tags/', repo['tags']),
+                             ('', repo['branches']), ('', repo['tags'])]:
+            if name.startswith(prefix) and name[len(prefix):] in refs:
+                return refs[name[len(prefix):]]
+        return None
+
+    def _git_symbolic_ref(self, inv, repo, args):
+        if repo['branch'] is None:
+            return '', 1
+        return repo['branch'] + '\n'
+
+    def _git_status(self, inv, repo, args):
+        return ' M README\n' if repo['dirty'] else ''
+
+    def _git_config(self, inv, repo, args):
+        if args[-1] == 'remote.origin.url':
+            return repo['url'] + '\n'
+        return '', 1
+
+    def _git_checkout(self, inv, repo, args):
+        args = [arg for arg in args if arg not in ('-q', '--quiet')]
+        if args[0] == '-B':
+            name, start = args[1], args[2]
+            commit = self._git_resolve(repo, start)
+            if commit is None:
+                raise SimulatedCommandError(
+                    "fatal: '%s' is not a commit" % start, 128)
+            repo['branches'][name] = commit
+            repo['branch'], repo['head'] = name, commit
+            return ''
+        name = args[0]
+        if name in repo['branches']:
+            repo['branch'], repo['head'] = name, repo['branches'][name]
+        elif name in repo['remote']:
+            repo['branches'][name] = repo['remote'][name]
+            repo['branch'], repo['head'] = name, repo['remote'][name]
+        elif name in repo['tags']:
+            repo['branch'], repo['head'] = None, repo['tags'][name]
+        else:
+            raise SimulatedCommandError(
+                "error: pathspec '%s' did not match any file(s) known "
+                "to git" % name, 1)
+        return ''
+
+    def _git_merge(self, inv, repo, args):
+        names = [arg for arg in args if not arg.startswith('-')]
+        commit = self._git_resolve(repo, names[0])
+        if commit is None:
+            raise SimulatedCommandError(
+                'merge: %s - not something we can merge' % names[0], 1)
+        local = repo['local_commits']
+        if repo['head'] in local:
+            # Merge commit on top of the local commits
+            if commit in repo['head'].split('+'):
+                return 'Already up to date.\n'
+            commit = '%s+%s' % (repo['head'], commit)
+            local.add(commit)
+        repo['head'] = repo['branches'][repo['branch']] = commit
+        return ''
+
+    def _git_sparse_checkout(self, inv, repo, args):
+        if args[0] == 'set':
+            repo['sparse'] = [arg for arg in args[1:]
+                              if not arg.startswith('-')]
+        return ''
+
+    def _cmd_hg(self, inv):
+        args = [arg for arg in inv.args if arg not in ('-q', '--quiet')]
+        path = inv.ctx.cwd
+        for option in ('-R', '--repository', '--cwd'):
+            while option in args:
+                index = args.index(option)
+                path = inv.path(args[index + 1])
+                del args[index:index + 2]
+        command = args.pop(0)
+        options = [arg for arg in args if arg.startswith('-')]
+        names = [arg for arg in args if not arg.startswith('-')]
+        if command == '--version':
+            return 'Mercurial Distributed SCM (version 4.5.3)\n'
+        if command == 'clone':
+            return self._hg_clone(inv, names, options)
+        repo = self.hg_repos.get(path)
+        if repo is None:
+            raise SimulatedCommandError(
+                'abort: no repository found in %r (.hg not found)!' % path,
+                255)
+        remote = self.hg_remotes[repo['url']]
+        if command == 'pull':
+            remote['pulls'] += 1
+            repo['branches'] = dict(remote['branches'])
+            return ''
+        if command in ('update', 'up'):
+            name = names[0] if names else repo['branch']
+            if name not in repo['branches']:
+                raise SimulatedCommandError(
+                    "abort: unknown revision '%s'!" % name, 255)
+            repo['branch'] = name
+            repo['revision'] = repo['branches'][name]
+            return ''
+        if command in ('identify', 'id'):
+            result = []
+            if '--id' in options or '-i' in options:
+                result.append(repo['revision'] + ('+' if repo['dirty']
+                                                  else ''))
+            if '--branch' in options or '-b' in options:
+                result.append(repo['branch'])
+            return ' '.join(result) + '\n'
+        if command == 'incoming':
+            if remote['branches'] != repo['branches']:
+                return 'changeset\n'
+            return '', 1
+        raise SimulatedCommandError('hg: unknown command %r' % command, 255)
+
+    def _hg_clone(self, inv, names, options):
+        url = names[0]
+        path = inv.path(names[1] if len(names) > 1 else
+                        posixpath.basename(url))
+        remote = self.hg_remotes.get(url)
+        if remote is None:
+            raise SimulatedCommandError(
+                'abort: repository %s not found!' % url, 255)
+        if self.exists(path):
+            raise SimulatedCommandError(
+                'abort: destination %r is not empty' % path, 255)
+        self._check_create(inv.user, path)
+        self.mkdir(path, owner=inv.user)
+        self.mkdir(posixpath.join(path, '.hg'), owner=inv.user)
+        remote['pulls'] += 1
+        repo = self.hg_repos[path] = {
+            'url': url,
+            'branches': dict(remote['branches']),
+            'branch': 'default',
+            'revision': '000000000000',
+            'dirty': False,
+        }
+        if '--noupdate' not in options and '-U' not in options:
+            repo['revision'] = repo['branches']['default']
+        return ''
+
+    def _cmd_bzr(self, inv):
+        args = [arg for arg in inv.args if arg not in ('-q', '--quiet')]
+        command = args.pop(0)
+        options = {}
+        names = []
+        while args:
+            arg = args.pop(0)
+            if arg in ('-r', '-d', '--template'):
+                options[arg] = args.pop(0)
+            elif arg.startswith('--') and '=' in arg:
+                key, value = arg.split('=', 1)
+                options[key] = value
+            elif arg.startswith('-'):
+                options[arg] = True
+            else:
+                names.append(arg)
+        if command == '--version':
+            return 'Bazaar (bzr) 2.7.0\n'
+        if command == 'branch':
+            return self._bzr_branch(inv, names, options)
+        if command in ('update', 'revno') and names:
+            path = inv.path(names[0])
+        else:
+            path = inv.path(options.get('-d', '.'))
+        repo = self.bzr_repos.get(path)
+        if repo is None:
+            raise SimulatedCommandError(
+                'ERROR: Not a branch: "%s/".' % path, 3)
+        version = int(options['-r']) if '-r' in options else None
+        if command == 'revno':
+            return '%d\n' % repo['revno']
+        if command == 'version-info':
+            return options['--template'].replace(
+                '{revno}', str(repo['revno'])).replace(
+                '{branch_nick}', posixpath.basename(path)).replace(
+                '\\n', '\n')
+        if command == 'checkout':
+            repo['tree'] = repo['revno']
+            self.mkdir(posixpath.join(path, '.bzr', 'checkout'),
+                       owner=inv.user)
+            return ''
+        if repo['tree'] is None and command in ('status', 'revert',
+                                                'update'):
+            raise SimulatedCommandError(
+                'ERROR: No WorkingTree exists for "%s".' % path, 3)
+        if command == 'status':
+            return ' M  README\n' if repo['dirty'] else ''
+        if command == 'revert':
+            repo['dirty'] = False
+            return ''
+        if command == 'update':
+            repo['tree'] = version or repo['revno']
+            return ''
+        if command == 'pull':
+            remote = self.bzr_remotes[names[0] if names else repo['parent']]
+            remote['pulls'] += 1
+            repo['revno'] = version or remote['revno']
+            return ''
+        if command == 'missing':
+            remote = self.bzr_remotes[names[0] if names else repo['parent']]
+            if remote['revno'] > repo['revno']:
+                return 'revision\n', 1
+            return ''
+        raise SimulatedCommandError(
+            'ERROR: unknown command "%s"' % command, 3)
+
+    def _bzr_branch(self, inv, names, options):
+        url = names[0]
+        path = inv.path(names[1] if len(names) > 1 else
+                        posixpath.basename(url))
+        remote = self.bzr_remotes.get(url)
+        if remote is None:
+            raise SimulatedCommandError(
+                'ERROR: Not a branch: "%s/".' % url, 3)
+        if self.exists(path) and '--use-existing-dir' not in options:
+            raise SimulatedCommandError(
+                'ERROR: Target directory "%s" already exists.' % path, 3)
+        if not self.exists(path):
+            self._check_create(inv.user, path)
+            self.mkdir(path, owner=inv.user)
+        self.mkdir(posixpath.join(path, '.bzr', 'checkout'), owner=inv.user)
+        remote['pulls'] += 1
+        revno = int(options['-r']) if '-r' in options else remote['revno']
+        self.bzr_repos[path] = {
+            'parent': url,
+            'revno': revno,
+            'tree': revno,
+            'dirty': False,
+        }
+        return ''
+
+    def _cmd_vzctl(self, inv):
+        command, ctid = inv.args[0], inv.args[1]
+        if inv.user != 'root':
+            raise SimulatedCommandError('Unable to open /dev/vzctl', 1)
+        container = self.containers.get(ctid)
+        if container is None:
+            raise SimulatedCommandError(
+                'Container(s) not found: %s' % ctid, 11)
+        if command not in ('exec', 'exec2'):
+            raise SimulatedCommandError('Unknown action: %s' % command, 1)
+        out, err, status = container.execute(' '.join(inv.args[2:]),
+                                             user='root', stdin=inv.stdin)
+        inv.stderr.append(err)
+        return out, status if command == 'exec2' else 0
+
+    def _cmd_mysqldump(self, inv):
+        names = [a for a in inv.args if not a.startswith('-')]
+        out, status = self._cmd_mysql(_reinvoke(inv, [
+            a for a in inv.args if a.startswith('-')] + [
+            '--execute=SHOW DATABASES']))
+        if names[-1] not in out.split():
+            raise SimulatedCommandError(
+                "mysqldump: Got error: 1049: Unknown database '%s' when "
+                "selecting the database" % names[-1], 2)
+        return '-- MySQL dump of %s\n' % names[-1]
+
+    def _mysql_option_file_password(self, path):
+        match = re.search(r'^password\s*=\s*(?:"((?:[^"\\]|\\.)*)"|(.*))$',
+                          self.read_file(path), re.M)
+        if match is None:
+            return ''
+        if match.group(1) is None:
+            return match.group(2).strip()
+        return re.sub(r'\\(.)', r'\1', match.group(1))
+
+    def mysql_sql(self, statement, database=None):
+        """
+        Execute one of the MySQL statements understood by the simulation.
+
+        Override or extend this method to support more statements.
+        """
+        account = r"'?([^'@\s]*)'?@'?([^'\s]*)'?"
+        match = re.match(r"^SELECT '([^']*)'$", statement, re.I)
+        if match:
+            return match.group(1) + '\n'
+        match = re.match(r"^SELECT COUNT\(\*\) FROM (?:mysql\.)?user "
+                         r"WHERE User = '([^']*)' AND Host = '([^']*)'$",
+                         statement, re.I)
+        if match:
+            return '%d\n' % (match.groups() in self.mysql_users)
+        if re.match(r'^SELECT User, Host FROM mysql\.user$', statement, re.I):
+            return ''.join('%s\t%s\n' % key for key in self.mysql_users)
+        if re.match(r'^SELECT SCHEMA_NAME FROM information_schema\.SCHEMATA$',
+                    statement, re.I):
+            names = self._MYSQL_SYSTEM_DATABASES + list(self.mysql_databases)
+            return ''.join('%s\n' % name for name in names)
+        match = re.match(r'^SHOW GRANTS FOR %s$' % account, statement, re.I)
+        if match:
+            key = match.group(1), match.group(2)
+            if key not in self.mysql_users:
+                raise SimulatedCommandError(
+                    "ERROR 1141 (42000): There is no such grant defined for "
+                    "user '%s' on host '%s'" % key)
+            lines = ["GRANT USAGE ON *.* TO '%s'@'%s'" % key]
+            for privileges, target, grant_option in self.mysql_grants.get(
+                    key, []):
+                database, _, table = target.partition('.')
+                if database != '*':
+                    target = '`%s`.%s' % (database, table)
+                lines.append("GRANT %s ON %s TO '%s'@'%s'%s" % (
+                    privileges, target, key[0], key[1],
+                    ' WITH GRANT OPTION' if grant_option else ''))
+            return ''.join(line + '\n' for line in lines)
+        match = re.match(r"^SHOW DATABASES(?: LIKE '([^']*)')?$", statement,
+                         re.I)
+        if match:
+            names = self._MYSQL_SYSTEM_DATABASES + list(self.mysql_databases)
+            return ''.join('%s\n' % name for name in names
+                           if match.group(1) in (None, name))
+        match = re.match(r"^CREATE USER %s IDENTIFIED BY '([^']*)'$"
+                         % account, statement, re.I)
+        if match:
+            key = match.group(1), match.group(2)
+            if key in self.mysql_users:
+                raise SimulatedCommandError(
+                    "ERROR 1396 (HY000): Operation CREATE USER failed for "
+                    "'%s'@'%s'" % key)
+            self.mysql_users[key] = {'password': match.group(3)}
+            return ''
+        match = re.match(r'^DROP USER %s$' % account, statement, re.I)
+        if match:
+            key = match.group(1), match.group(2)
+            if self.mysql_users.pop(key, None) is None:
+                raise SimulatedCommandError(
+                    "ERROR 1396 (HY000): Operation DROP USER failed for "
+                    "'%s'@'%s'" % key)
+            self.mysql_grants.pop(key, None)
+            return ''
+        match = re.match(r'^CREATE DATABASE `?(\w+)`?', statement, re.I)
+        if match:
+            name = match.group(1)
+            if name in self.mysql_databases or \
+                    name in self._MYSQL_SYSTEM_DATABASES:
+                raise SimulatedCommandError(
+                    "ERROR 1007 (HY000): Can't create database '%s'; "
+                    "database exists" % name)
+            self.mysql_databases[name] = {}
+            return ''
+        match = re.match(r'^DROP DATABASE `?(\w+)`?$', statement, re.I)
+        if match:
+            if self.mysql_databases.pop(match.group(1), None) is None:
+                raise SimulatedCommandError(
+                    "ERROR 1008 (HY000): Can't drop database '%s'; "
+                    "database doesn't exist" % match.group(1))
+            return ''
+        match = re.match(r'^GRANT (.+?) ON (\S+) TO %s( WITH GRANT OPTION)?$'
+                         % account, statement, re.I)
+        if match:
+            privileges, target, name, host, grant_option = match.groups()
+            self.mysql_grants.setdefault((name, host), []).append(
+                (privileges, target, bool(grant_option)))
+            return ''
+        if re.match(r'^FLUSH PRIVILEGES$', statement, re.I):
+            return ''
+        raise SimulatedCommandError(
+            'ERROR 1064 (42000): unsupported statement: %s' % statement)
+
+
+class _FileSink(list):
+    """
+    Collect the output of a command redirected to a file.
+    """
+
+    def __init__(self, host, user, path, append):
+        super(_FileSink, self).__init__()
+        self.host = host
+        self.user = user
+        self.path = path
+        self.append = append
+        self.written = False
+
+    def flush(self):
+        if self.written:
+            return
+        self.written = True
+        self.host._write(self.user, self.path, ''.join(self), self.append)
+
+
+class _SimulatedSFTPClient(object):
+    """
+    Mimic the parts of ``paramiko.SFTPClient`` used by Fabric.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        if env.user in host.users:
+            self.user = env.user
+        else:
+            self.user = host.login_user
+
+    def _path(self, path):
+        if not posixpath.isabs(path):
+            path = posixpath.join(self.getcwd(), path)
+        return posixpath.normpath(path)
+
+    def getcwd(self):
+        return self.host.home(self.user) or '/'
+
+    def normalize(self, path):
+        return self._path(path)
+
+    def stat(self, path):
+        node = self.host.node(self._path(path))
+        if node is None:
+            raise IOError(2, 'No such file')
+        return _Attributes(node)
+
+    def lstat(self, path):
+        node = self.host.node(self._path(path), follow=False)
+        if node is None:
+            raise IOError(2, 'No such file')
+        return _Attributes(node)
+
+    def listdir(self, path='.'):
+        return self.host.listdir(self._path(path))
+
+    def mkdir(self, path, mode=0o777):
+        path = self._path(path)
+        self.host._check_create(self.user, path)
+        self.host.fs[path] = _Node('dir', owner=self.user, group=self.user,
+                                   mode=mode & 0o755)
+
+    def chmod(self, path, mode):
+        self.host.node(self._path(path)).mode = mode
+
+    def putfo(self, fl, remotepath, *args, **kwargs):
+        path = self._path(remotepath)
+        data = fl.read()
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+        self.host.history.append('put: %s' % path)
+        try:
+            self.host._write(self.user, path, data)
+        except SimulatedCommandError as e:
+            raise IOError(13, str(e))
+        return _Attributes(self.host.node(path))
+
+    def put(self, localpath, remotepath, *args, **kwargs):
+        with open(localpath, 'rb') as fl:
+            return self.putfo(fl, remotepath)
+
+    def getfo(self, remotepath, fl, *args, **kwargs):
+        path = self._path(remotepath)
+        self.host.history.append('get: %s' % path)
+        try:
+            data = self.host._read(self.user, path)
+        except SimulatedCommandError as e:
+            raise IOError(2, str(e))
+        fl.write(data)
+        return len(data)
+
+    def get(self, remotepath, localpath, *args, **kwargs):
+        with open(localpath, 'wb') as fl:
+            return self.getfo(remotepath, fl)
+
+    def close(self):
+        pass
+
+
+class _SimulatedSFTP(fabric.sftp.SFTP):
+    """
+    Fabric's SFTP wrapper, talking to a simulated host.
+    """
+
+    def __init__(self, host_string):
+        self.ftp = _SimulatedSFTPClient(_lookup(host_string))
+
+
+_HOSTS = {}
+
+
+def _lookup(host_string):
+    if host_string in _HOSTS:
+        return _HOSTS[host_string]
+    hostname = host_string.split('@')[-1]
+    for key, host in _HOSTS.items():
+        key = key.split('@')[-1]
+        if hostname == key or hostname.split(':')[0] == key:
+            return host
+    raise KeyError('No simulated host for %r' % host_string)
+
+
+def _run_simulated_command(command, shell=True, pty=True, combine_stderr=None,
+                           sudo=False, user=None, quiet=False,
+                           warn_only=False, stdout=None, stderr=None,
+                           group=None, timeout=None, shell_escape=None,
+                           capture_buffer_size=None):
+    """
+    Run a command on the simulated host matching ``env.host_string``.
+
+    (Replacement for ``fabric.operations._run_command``.)
+    """
+    manager = _noop
+    if warn_only:
+        manager = warn_only_manager
+    # Quiet's behavior is a superset of warn_only's, so it wins.
+    if quiet:
+        manager = quiet_manager
+    with manager():
+        host = _lookup(env.host_string)
+        given_command = command
+        full_command = _prefix_env_vars(_prefix_commands(command, 'remote'))
+        which = 'sudo' if sudo else 'run'
+        if sudo:
+            effective_user = user or 'root'
+        elif env.user in host.users:
+            effective_user = env.user
+        else:
+            effective_user = host.login_user
+        if output.running:
+            print("[%s] %s: %s" % (env.host_string, which, given_command))
+
+        result_stdout, result_stderr, status = host.execute(
+            full_command, user=effective_user)
+        if combine_stderr is None:
+            combine_stderr = env.combine_stderr
+        if combine_stderr or pty:
+            result_stdout += result_stderr
+            result_stderr = ''
+        if output.stdout and result_stdout.strip():
+            for line in result_stdout.strip().splitlines():
+                print("[%s] out: %s" % (env.host_string, line))
+
+        out = _AttributeString(result_stdout.strip())
+        err = _AttributeString(result_stderr.strip())
+
+        out.failed = False
+        out.command = given_command
+        out.real_command = full_command
+        if status not in env.ok_ret_codes:
+            out.failed = True
+            msg = "%s() received nonzero return code %s while executing" % (
+                which, status
+            )
+            if env.warn_only:
+                msg += " '%s'!" % given_command
+            else:
+                msg += "!\n\nRequested: %s\nExecuted: %s" % (
+                    given_command, full_command
+                )
+            error(message=msg, stdout=out, stderr=err)
+
+        out.return_code = status
+        out.succeeded = not out.failed
+        out.stderr = err
+        return out
+
+
+def _reinvoke(inv, args):
+    """
+    Copy an invocation, with other arguments.
+    """
+    copy = Invocation(inv.ctx, inv.name, args, inv.stdin)
+    copy.stderr = inv.stderr
+    return copy
+
+
+def _strip_sql_comments(statements):
+    return '\n'.join(line for line in (statements or '').splitlines()
+                     if not line.lstrip().startswith('--'))
+
+
+def _to_bytes(text):
+    """
+    Convert the text that goes through a pipe to bytes.
+
+    Binary data travels through the simulated pipes as latin-1 text.
+    """
+    try:
+        return text.encode('latin-1')
+    except UnicodeEncodeError:
+        return text.encode('utf-8')
+
+
+def _to_text(data):
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('latin-1')
+
+
+def _gzip_compress(data):
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def _gzip_decompress(data):
+    with gzip.GzipFile(fileobj=io.BytesIO(data)) as f:
+        return f.read()
+
+
+def _split_sql(statements):
+    """
+    Split SQL statements on the semicolons that are not quoted.
+    """
+    result = []
+    current = ''
+    quote_char = None
+    for char in statements or '':
+        if quote_char:
+            if char == quote_char:
+                quote_char = None
+        elif char in '\'"`':
+            quote_char = char
+        elif char == ';':
+            result.append(' '.join(current.split()))
+            current = ''
+            continue
+        current += char
+    result.append(' '.join(current.split()))
+    return [statement for statement in result if statement]
+
+
+def _stream_simulated_command(command, chunks, write, user=None):
+    """
+    Run a streaming command on the simulated host matching
+    ``env.host_string``.
+
+    (Replacement for ``fabtools.utils._stream_command``.)
+    """
+    host = _lookup(env.host_string)
+    if user is None:
+        user = env.user if env.user in host.users else host.login_user
+    stdin = b''.join(chunks).decode('latin-1')
+    stdout, stderr, status = host.execute(command, user=user, stdin=stdin)
+    if stdout:
+        write(_to_bytes(stdout))
+    return status, stderr
+
+
+@contextmanager
+def _noop():
+    yield
+
+
+@contextmanager
+def simulated(*hosts):
+    """
+    Context manager to route Fabric operations to simulated hosts.
+
+    Commands are sent to the host whose ``host_string`` matches
+    ``env.host_string``. If only one host is given and no host is
+    currently targeted, it becomes the current host.
+
+    The per-host caches of fabtools (see :func:`fabtools.utils.host_cache`)
+    are emptied when entering and leaving the block.
+    """
+    _orig_run_command = fabric.operations._run_command
+    _orig_sftp = fabric.operations.SFTP
+    _orig_stream_command = fabtools.utils._stream_command
+    _orig_hosts = dict(_HOSTS)
+    _orig_host_string = env.host_string
+    _orig_user = env.user
+
+    for host in hosts:
+        _HOSTS[host.host_string] = host
+    if len(hosts) == 1 and not env.host_string:
+        env.host_string = hosts[0].host_string
+    env.user = hosts[0].login_user
+
+    fabric.operations._run_command = _run_simulated_command
+    fabric.operations.SFTP = _SimulatedSFTP
+    fabtools.utils._stream_command = _stream_simulated_command
+    clear_host_caches()
+    try:
+        yield hosts[0] if len(hosts) == 1 else hosts
+    finally:
+        fabric.operations._run_command = _orig_run_command
+        fabric.operations.SFTP = _orig_sftp
+        fabtools.utils._stream_command = _orig_stream_command
+        _HOSTS.clear()
+        _HOSTS.update(_orig_hosts)
+        clear_host_caches()
+        env.host_string = _orig_host_string
+        env.user = _orig_user
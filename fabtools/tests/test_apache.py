@@ -94,3 +94,24 @@ def test_default_site_linkname_ubuntu_14_04(ubuntu_14_04):
 def test__site_config_filename():
     from fabtools.apache import _site_config_filename
     assert _site_config_filename('foo') == 'foo.conf'
+
+
+def test_require_many_sites():
+    from fabtools.require.apache import sites
+    from fabtools.tests.simulated import SimulatedHost, simulated
+    host = SimulatedHost()
+    host.install_package('apache2', '2.4.7')
+    host.unit('apache2')['active'] = True
+    host.register('apache2ctl', lambda inv: 'Syntax OK\n')
+    specs = [
+        {'site_name': 'site%d.example.com' % i,
+         'template_contents': '<VirtualHost *:%(port)s></VirtualHost>\n'}
+        for i in range(50)
+    ]
+    with simulated(host):
+        sites(specs)
+    assert len(host.listdir('/etc/apache2/sites-enabled')) == 50
+    assert host.read_file(
+        '/etc/apache2/sites-enabled/site7.example.com.conf'
+    ) == '<VirtualHost *:80></VirtualHost>\n'
+    assert host.unit('apache2')['actions'] == ['reload']
@@ -0,0 +1,62 @@
+import unittest
+
+
+REMOTE_URL = 'lp:app'
+
+
+class BazaarWorkingCopyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.tests.simulated import SimulatedHost
+        self.host = SimulatedHost()
+        self.host.install_package('bzr')
+        self.remote = self.host.bzr_remote(REMOTE_URL, revno=3)
+
+    def test_status_of_missing_path(self):
+        from fabtools.bazaar import status
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            state = status('/home/vagrant/app')
+        self.assertFalse(state['exists'])
+        self.assertFalse(state['branch'])
+
+    def test_branch(self):
+        from fabtools.bazaar import status
+        from fabtools.require.bazaar import working_copy
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            working_copy(REMOTE_URL, '/home/vagrant/app', version='2')
+            count = len(self.host.history)
+            state = status('/home/vagrant/app', location=REMOTE_URL)
+        self.assertEqual(state['revno'], '2')
+        self.assertEqual(state['nick'], 'app')
+        self.assertTrue(state['tree'])
+        self.assertFalse(state['dirty'])
+        self.assertTrue(state['missing'])
+        self.assertEqual(count, 3)
+
+    def test_update_with_a_single_command(self):
+        from fabtools.require.bazaar import working_copy
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            working_copy(REMOTE_URL, '/home/vagrant/app')
+            self.remote['revno'] = 5
+            count = len(self.host.history)
+            working_copy(REMOTE_URL, '/home/vagrant/app')
+        repo = self.host.bzr_repos['/home/vagrant/app']
+        self.assertEqual((repo['revno'], repo['tree']), (5, 5))
+        self.assertEqual(len(self.host.history), count + 3)
+
+    def test_local_modifications(self):
+        from fabric.api import settings
+        from fabtools.require.bazaar import working_copy
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            working_copy(REMOTE_URL, '/home/vagrant/app')
+            repo = self.host.bzr_repos['/home/vagrant/app']
+            repo['dirty'] = True
+            with settings(abort_exception=RuntimeError):
+                self.assertRaises(RuntimeError, working_copy, REMOTE_URL,
+                                  '/home/vagrant/app')
+            working_copy(REMOTE_URL, '/home/vagrant/app', force=True)
+        self.assertFalse(repo['dirty'])
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from fabric.api import env, execute, run, settings
+
+
+def build(destdir):
+    run('mkdir -p %s/opt/foo && echo foo > %s/opt/foo/foo' % (destdir, destdir))
+
+
+class BuildCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.tests.simulated import SimulatedHost
+        self.cache = tempfile.mkdtemp()
+        self.hosts = [SimulatedHost('web%d' % i) for i in range(3)]
+
+    def tearDown(self):
+        shutil.rmtree(self.cache)
+
+    def execute(self, task, hosts=None):
+        from fabtools.tests.simulated import simulated
+        if hosts is None:
+            hosts = [host.host_string for host in self.hosts]
+        with simulated(*self.hosts):
+            with settings(build_cache=self.cache):
+                return execute(task, hosts=hosts)
+
+    def test_cache_key(self):
+        from fabtools.build import cache_key
+        from fabtools.tests.simulated import SimulatedHost, simulated
+        with simulated(SimulatedHost(distrib='Ubuntu', release='14.04')):
+            self.assertEqual(cache_key('redis', '2.6.16'),
+                             'redis-2.6.16-ubuntu-14.04-x86_64')
+            self.assertNotEqual(cache_key('node', '1.0', ['--debug']),
+                                cache_key('node', '1.0'))
+
+    def test_build_once(self):
+        from fabtools.build import install_cached
+        builders = []
+
+        def task():
+            def counting_build(destdir):
+                builders.append(env.host_string)
+                build(destdir)
+            return install_cached('foo', '1.0', counting_build)
+
+        keys = self.execute(task)
+        self.assertEqual(builders, ['web0'])
+        self.assertEqual(len(set(keys.values())), 1)
+        for host in self.hosts:
+            self.assertEqual(host.read_file('/opt/foo/foo'), 'foo\n')
+            self.assertEqual(host.node('/opt/foo/foo').owner, 'root')
+        self.assertIn(keys['web0'] + '.tar.gz', os.listdir(self.cache))
+        self.assertFalse(self.hosts[0].listdir('/tmp'))
+
+    def test_build_host(self):
+        from fabtools.build import install_cached
+        from fabtools.tests.simulated import SimulatedHost
+        builder = SimulatedHost('builder')
+        targets = list(self.hosts)
+        self.hosts.append(builder)
+
+        def task():
+            install_cached('foo', '1.0', build)
+
+        with settings(build_host='builder'):
+            self.execute(task, hosts=[host.host_string for host in targets])
+        self.assertFalse(builder.exists('/opt/foo/foo'))
+        self.assertTrue(all(host.exists('/opt/foo/foo') for host in targets))
+        self.assertFalse(any('mkdir -p' in command
+                             for host in targets for command in host.history))
@@ -0,0 +1,145 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+
+SPEC = """\
+# platform: linux-64
+@EXPLICIT
+https://repo.continuum.io/pkgs/free/linux-64/numpy-1.11.1-py27_0.tar.bz2
+https://repo.continuum.io/pkgs/free/linux-64/python-2.7.12-1.tar.bz2
+"""
+
+
+class ParseSpecTestCase(unittest.TestCase):
+
+    def test_parse_spec(self):
+        from fabtools.conda import parse_spec
+        self.assertEqual(parse_spec('numpy'), ('numpy', None))
+        self.assertEqual(parse_spec('numpy=1.11'), ('numpy', '1.11'))
+        self.assertEqual(parse_spec('numpy==1.11.1=py27_0'),
+                         ('numpy', '1.11.1'))
+        self.assertEqual(parse_spec('numpy=1.11.*'), ('numpy', '1.11'))
+        for spec in ['numpy>=1.11', 'numpy<2', 'numpy!=1.11.0']:
+            self.assertRaises(ValueError, parse_spec, spec)
+
+    def test_parse_explicit_spec(self):
+        from fabtools.conda import parse_explicit_spec
+        self.assertEqual(parse_explicit_spec(SPEC), {
+            'numpy': '1.11.1',
+            'python': '2.7.12',
+        })
+
+
+class RequireCondaTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.tests.simulated import SimulatedHost
+        self.host = SimulatedHost()
+        self.host.conda_channel.update({
+            'numpy': '1.11.1',
+            'pandas': '0.18.1',
+            'python': '2.7.12',
+        })
+        self.host.conda_envs['/home/vagrant/miniconda'] = {
+            'python': '2.7.12',
+        }
+        self.host.conda_envs['/home/vagrant/miniconda/envs/myenv'] = {
+            'python': '2.7.12',
+            'numpy': '1.10.4',
+        }
+
+    def test_env_exists(self):
+        from fabtools.conda import env_exists
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            self.assertTrue(env_exists(name='myenv'))
+            self.assertFalse(env_exists(name='other'))
+            self.assertTrue(env_exists(name='base'))
+        self.assertEqual(len(self.host.history), 1)
+
+    def test_packages(self):
+        from fabtools.require.conda import packages
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            installed = packages(['python', 'numpy=1.11', 'pandas'],
+                                 name='myenv')
+            count = len(self.host.history)
+            self.assertEqual(packages(['numpy=1.11', 'pandas'],
+                                      name='myenv'), [])
+        self.assertEqual(installed, ['numpy=1.11', 'pandas'])
+        self.assertEqual(
+            [command for command in self.host.history
+             if command.startswith('conda install')],
+            ["conda install --name myenv --yes --quiet numpy=1.11 pandas"])
+        self.assertEqual(len(self.host.history), count + 1)
+
+    def test_env_from_spec(self):
+        from fabtools.require.conda import env
+        from fabtools.tests.simulated import simulated
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        spec_file = os.path.join(directory, 'spec.txt')
+        with open(spec_file, 'w') as f:
+            f.write(SPEC)
+        with simulated(self.host):
+            env('locked', spec_file=spec_file)
+            count = len(self.host.history)
+            env('locked', spec_file=spec_file)
+        self.assertEqual(
+            self.host.conda_envs['/home/vagrant/miniconda/envs/locked'],
+            {'numpy': {'version': '1.11.1', 'build': 'py27_0'},
+             'python': {'version': '2.7.12', 'build': '1'}})
+        self.assertEqual(len(self.host.history), count + 3)
+        self.assertFalse(any('conda create' in command
+                             for command in self.host.history[count:]))
+
+    def test_env_from_spec_as_other_user(self):
+        from fabtools.conda import create_env_from_spec
+        from fabtools.tests.simulated import simulated
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        spec_file = os.path.join(directory, 'spec.txt')
+        with open(spec_file, 'w') as f:
+            f.write(SPEC)
+        self.host.add_user('deploy')
+        with simulated(self.host):
+            create_env_from_spec(spec_file, prefix='/opt/envs/locked',
+                                 use_sudo=True, user='deploy')
+        self.assertIn('numpy', self.host.conda_envs['/opt/envs/locked'])
+
+    def test_env_from_spec_with_pip_packages(self):
+        from fabtools.require.conda import env
+        from fabtools.tests.simulated import simulated
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        spec_file = os.path.join(directory, 'spec.txt')
+        with open(spec_file, 'w') as f:
+            f.write(SPEC)
+        self.host.conda_envs['/home/vagrant/miniconda/envs/locked'] = {
+            'numpy': {'version': '1.11.1', 'build': 'py27_0'},
+            'python': {'version': '2.7.12', 'build': '1'},
+            'requests': {'version': '2.11.1', 'channel': 'pypi'},
+        }
+        with simulated(self.host):
+            env('locked', spec_file=spec_file)
+        self.assertFalse(any('conda create' in command
+                             for command in self.host.history))
+
+    def test_env_from_spec_with_other_build(self):
+        from fabtools.require.conda import env
+        from fabtools.tests.simulated import simulated
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        spec_file = os.path.join(directory, 'spec.txt')
+        with open(spec_file, 'w') as f:
+            f.write(SPEC)
+        self.host.conda_envs['/home/vagrant/miniconda/envs/locked'] = {
+            'numpy': {'version': '1.11.1', 'build': 'py27_1'},
+            'python': {'version': '2.7.12', 'build': '1'},
+        }
+        with simulated(self.host):
+            env('locked', spec_file=spec_file)
+        self.assertTrue(any('conda create' in command
+                            for command in self.host.history))
@@ -0,0 +1,229 @@
+import unittest
+
+from fabric.api import settings
+
+
+REMOTE_URL = 'https://github.com/example/app.git'
+
+
+class GitWorkingCopyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.tests.simulated import SimulatedHost
+        self.host = SimulatedHost()
+        self.host.install_package('git')
+        self.remote = self.host.git_remote(
+            REMOTE_URL,
+            branches={'master': 'a1', 'develop': 'b1'},
+            tags={'v1.0': 't1'},
+        )
+
+    def test_status_of_missing_path(self):
+        from fabtools.git import status
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            state = status('/home/vagrant/app')
+        self.assertFalse(state['exists'])
+        self.assertFalse(state['repository'])
+
+    def test_clone(self):
+        from fabtools.git import status
+        from fabtools.require.git import working_copy
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            working_copy(REMOTE_URL, path='/home/vagrant/app', depth=1,
+                         filter='blob:none', sparse=['api', 'lib'])
+            count = len(self.host.history)
+            state = status('/home/vagrant/app')
+        self.assertEqual(state['head'], 'a1')
+        self.assertEqual(state['branch'], 'master')
+        self.assertEqual(state['remote_url'], REMOTE_URL)
+        self.assertFalse(state['dirty'])
+        repo = self.host.git_repos['/home/vagrant/app']
+        self.assertEqual(repo['depth'], 1)
+        self.assertEqual(repo['filter'], 'blob:none')
+        self.assertEqual(repo['sparse'], ['api', 'lib'])
+        self.assertEqual(count, 3)
+
+    def test_update_with_a_single_command(self):
+        from fabtools.require.git import working_copy
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            working_copy(REMOTE_URL, path='/home/vagrant/app')
+            self.remote['branches']['master'] = 'a2'
+            count = len(self.host.history)
+            working_copy(REMOTE_URL, path='/home/vagrant/app')
+        self.assertEqual(self.host.git_repos['/home/vagrant/app']['head'],
+                         'a2')
+        self.assertEqual(len(self.host.history), count + 3)
+
+    def test_switch_branch_and_tag(self):
+        from fabtools.require.git import working_copy
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            working_copy(REMOTE_URL, path='/home/vagrant/app')
+            working_copy(REMOTE_URL, path='/home/vagrant/app',
+                         branch='develop', update=False)
+            repo = self.host.git_repos['/home/vagrant/app']
+            self.assertEqual((repo['branch'], repo['head']),
+                             ('develop', 'b1'))
+            count = len(self.host.history)
+            working_copy(REMOTE_URL, path='/home/vagrant/app',
+                         branch='develop', update=False)
+            self.assertEqual(len(self.host.history), count + 2)
+            working_copy(REMOTE_URL, path='/home/vagrant/app',
+                         branch='v1.0')
+        self.assertEqual((repo['branch'], repo['head']), (None, 't1'))
+
+    def _commit(self, branch, commit):
+        repo = self.host.git_repos['/home/vagrant/app']
+        repo['local_commits'].add(commit)
+        repo['branches'][branch] = commit
+        if repo['branch'] == branch:
+            repo['head'] = commit
+        return repo
+
+    def test_update_keeps_local_commits(self):
+        from fabtools.require.git import working_copy
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            working_copy(REMOTE_URL, path='/home/vagrant/app')
+            repo = self._commit('master', 'l1')
+            self.remote['branches']['master'] = 'a2'
+            working_copy(REMOTE_URL, path='/home/vagrant/app')
+        self.assertEqual(repo['head'], 'l1+a2')
+
+    def test_force_update_resets_branch(self):
+        from fabtools.require.git import working_copy
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            working_copy(REMOTE_URL, path='/home/vagrant/app')
+            repo = self._commit('master', 'l1')
+            self.remote['branches']['master'] = 'a2'
+            working_copy(REMOTE_URL, path='/home/vagrant/app', force=True)
+        self.assertEqual(repo['head'], 'a2')
+
+    def test_switch_branch_without_update(self):
+        from fabtools.require.git import working_copy
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            working_copy(REMOTE_URL, path='/home/vagrant/app')
+            repo = self._commit('develop', 'l2')
+            self.remote['branches']['develop'] = 'b2'
+            working_copy(REMOTE_URL, path='/home/vagrant/app',
+                         branch='develop', update=False)
+        self.assertEqual((repo['branch'], repo['head']), ('develop', 'l2'))
+
+
+class GitMirrorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.tests.simulated import SimulatedHost
+        self.host = SimulatedHost()
+        self.host.install_package('git')
+        self.host.mkdir('/srv/releases', owner='vagrant')
+        self.remote = self.host.git_remote(REMOTE_URL)
+
+    def test_mirror_is_refreshed_once(self):
+        from fabtools.require.git import mirror
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            with settings(git_mirror_dir='/home/vagrant/mirrors'):
+                path = mirror(REMOTE_URL)
+                self.assertEqual(mirror(REMOTE_URL), path)
+                mirror(REMOTE_URL, refresh=True)
+        self.assertEqual(path,
+                         '/home/vagrant/mirrors/github.com_example_app.git')
+        self.assertTrue(self.host.git_repos[path]['bare'])
+        self.assertEqual(self.remote['fetches'], 2)
+
+    def test_working_copies_use_mirror(self):
+        from fabtools.require.git import working_copy
+        from fabtools.tests.simulated import simulated
+        releases = ['/srv/releases/%d' % i for i in range(3)]
+        with simulated(self.host):
+            with settings(git_mirror_dir='/home/vagrant/mirrors'):
+                for path in releases:
+                    working_copy(REMOTE_URL, path=path, use_mirror=True)
+                self.remote['branches']['master'] = 'c0ffee1'
+                working_copy(REMOTE_URL, path=releases[0], use_mirror=True)
+        self.assertEqual(self.remote['fetches'], 1)
+        for path in releases:
+            repo = self.host.git_repos[path]
+            self.assertEqual(repo['reference'],
+                             '/home/vagrant/mirrors/github.com_example_app.git')
+            self.assertTrue(repo['dissociate'])
+        # The mirror was already refreshed during this run
+        self.assertEqual(self.host.git_repos[releases[0]]['head'], 'c0ffee0')
+
+
+class GitWorkingCopiesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.tests.simulated import SimulatedHost
+        self.host = SimulatedHost()
+        self.host.install_package('git')
+        self.host.mkdir('/srv/apps', owner='vagrant')
+        self.urls = ['https://github.com/example/app%d.git' % i
+                     for i in range(5)]
+        for url in self.urls:
+            self.host.git_remote(url)
+
+    def test_clone_and_update_with_one_command(self):
+        from fabtools.require.git import working_copies, working_copy
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            working_copy(self.urls[0], path='/srv/apps/app0')
+            self.host.git_remotes[self.urls[0]]['branches']['master'] = 'a2'
+            count = len(self.host.history)
+            results = working_copies(
+                [{'remote_url': url, 'path': '/srv/apps/app%d' % i}
+                 for i, url in enumerate(self.urls)],
+                concurrency=2)
+        self.assertEqual(list(results),
+                         ['/srv/apps/app%d' % i for i in range(5)])
+        self.assertTrue(all(result.succeeded for result in results.values()))
+        repos = self.host.git_repos
+        self.assertEqual(repos['/srv/apps/app0']['head'], 'a2')
+        self.assertEqual(repos['/srv/apps/app4']['head'], 'c0ffee0')
+        # git --version, the status of all the working copies, and the
+        # concurrent checkouts
+        self.assertEqual(len(self.host.history), count + 3)
+
+    def test_up_to_date_working_copies(self):
+        from fabtools.require.git import working_copies
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            working_copies(self.urls)
+            count = len(self.host.history)
+            results = working_copies(self.urls, concurrency=8)
+            self.assertEqual(len(self.host.history), count + 3)
+            results = working_copies(
+                [{'remote_url': url, 'update': False} for url in self.urls])
+        self.assertEqual(set(results.values()), set([None]))
+        self.assertIn('/home/vagrant/app3', self.host.git_repos)
+
+    def test_errors(self):
+        from fabtools.require.git import working_copies
+        from fabtools.tests.simulated import simulated
+        urls = self.urls[:2] + ['https://github.com/example/missing.git']
+        with simulated(self.host):
+            with settings(abort_exception=RuntimeError):
+                self.assertRaises(RuntimeError, working_copies, urls)
+            with settings(warn_only=True):
+                results = working_copies(urls)
+        self.assertTrue(results['app0'].succeeded)
+        self.assertTrue(results['missing'].failed)
+        self.assertIn('not found', results['missing'])
+
+    def test_mirrors(self):
+        from fabtools.require.git import working_copies
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            with settings(git_mirror_dir='/home/vagrant/mirrors'):
+                working_copies(
+                    [{'remote_url': self.urls[0], 'path': '/srv/apps/%d' % i,
+                      'use_mirror': True} for i in range(3)])
+        self.assertEqual(self.host.git_remotes[self.urls[0]]['fetches'], 1)
+        self.assertEqual(self.host.git_repos['/srv/apps/2']['reference'],
+                         '/home/vagrant/mirrors/github.com_example_app0.git')
@@ -0,0 +1,103 @@
+import unittest
+
+import mock
+
+
+class DeferredTestCase(unittest.TestCase):
+
+    def test_run_immediately_outside_block(self):
+        from fabtools.handlers import notify
+        callback = mock.Mock()
+        notify('foo', callback)
+        notify('foo', callback)
+        self.assertEqual(callback.call_count, 2)
+
+    def test_coalesce(self):
+        from fabtools.handlers import deferred, notify
+        callback = mock.Mock()
+        with deferred():
+            notify('foo', callback)
+            notify('foo', callback)
+            self.assertFalse(callback.called)
+        self.assertEqual(callback.call_count, 1)
+
+    def test_nested_blocks(self):
+        from fabtools.handlers import deferred, notify
+        callback = mock.Mock()
+        with deferred():
+            with deferred():
+                notify('foo', callback)
+            notify('foo', callback)
+            self.assertFalse(callback.called)
+        self.assertEqual(callback.call_count, 1)
+
+    def test_dependencies(self):
+        from fabtools.handlers import deferred, notify
+        calls = []
+        with deferred():
+            notify('start', lambda: calls.append('start'), after=['update'])
+            notify('update', lambda: calls.append('update'))
+            notify('other', lambda: calls.append('other'), after=['missing'])
+        self.assertEqual(calls, ['update', 'start', 'other'])
+
+    def test_not_run_on_error(self):
+        from fabtools.handlers import deferred, notify
+        callback = mock.Mock()
+        with self.assertRaises(ValueError):
+            with deferred():
+                notify('foo', callback)
+                raise ValueError
+        self.assertFalse(callback.called)
+
+    def test_parallel_tasks(self):
+        import os
+        import shutil
+        import tempfile
+        from fabric.api import env, execute, parallel
+        from fabtools.handlers import deferred, notify
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        def touch():
+            open(os.path.join(directory, env.host_string), 'w').close()
+
+        @parallel
+        def task():
+            notify('foo', touch)
+            notify('foo', touch)
+
+        with deferred() as queue:
+            execute(task, hosts=['web1', 'web2'])
+            self.assertFalse(queue)
+            # Handlers notified in the forked processes were not lost
+            self.assertEqual(sorted(os.listdir(directory)),
+                             ['web1', 'web2'])
+
+    @mock.patch('fabtools.service.reload')
+    @mock.patch('fabtools.service.restart')
+    def test_restart_replaces_reload(self, restart, reload):
+        from fabtools.handlers import deferred, reload_service, restart_service
+        with deferred():
+            reload_service('nginx')
+            restart_service('nginx')
+            reload_service('nginx')
+            reload_service('apache2')
+        restart.assert_called_once_with('nginx')
+        reload.assert_called_once_with('apache2')
+
+
+class WatchHandlerTestCase(unittest.TestCase):
+
+    def test_many_nginx_sites(self):
+        from fabtools.handlers import deferred
+        from fabtools.require.nginx import site
+        from fabtools.tests.simulated import SimulatedHost, simulated
+        host = SimulatedHost()
+        host.unit('nginx')['active'] = True
+        host.install_package('nginx-common', '1.4.6')
+        host.register('nginx', lambda inv: ('', 0))
+        with simulated(host), deferred():
+            for i in range(10):
+                site('site%d.example.com' % i, template_contents='server {}',
+                     check_config=False)
+        self.assertEqual(host.unit('nginx')['actions'], ['reload'])
@@ -0,0 +1,73 @@
+import unittest
+
+
+REMOTE_URL = 'https://hg.example.com/app'
+
+
+class MercurialWorkingCopyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.tests.simulated import SimulatedHost
+        self.host = SimulatedHost()
+        self.host.install_package('mercurial')
+        self.remote = self.host.hg_remote(REMOTE_URL, branches={
+            'default': 'a1a1a1a1a1a1',
+            'stable': 'b1b1b1b1b1b1',
+        })
+
+    def test_status_of_missing_path(self):
+        from fabtools.mercurial import status
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            state = status('/home/vagrant/app')
+        self.assertFalse(state['exists'])
+        self.assertFalse(state['repository'])
+
+    def test_clone(self):
+        from fabtools.mercurial import status
+        from fabtools.require.mercurial import working_copy
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            working_copy(REMOTE_URL, path='/home/vagrant/app',
+                         branch='stable')
+            count = len(self.host.history)
+            state = status('/home/vagrant/app', remote=True)
+        self.assertEqual(state['revision'], 'b1b1b1b1b1b1')
+        self.assertEqual(state['branch'], 'stable')
+        self.assertFalse(state['dirty'])
+        self.assertFalse(state['incoming'])
+        self.assertEqual(count, 3)
+
+    def test_update_with_a_single_command(self):
+        from fabtools.mercurial import status
+        from fabtools.require.mercurial import working_copy
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            working_copy(REMOTE_URL, path='/home/vagrant/app')
+            self.host.hg_repos['/home/vagrant/app']['dirty'] = True
+            self.remote['branches']['default'] = 'a2a2a2a2a2a2'
+            state = status('/home/vagrant/app', remote=True)
+            self.assertTrue(state['dirty'])
+            self.assertTrue(state['incoming'])
+            count = len(self.host.history)
+            working_copy(REMOTE_URL, path='/home/vagrant/app')
+        self.assertEqual(
+            self.host.hg_repos['/home/vagrant/app']['revision'],
+            'a2a2a2a2a2a2')
+        self.assertEqual(len(self.host.history), count + 3)
+
+    def test_switch_branch_without_pulling(self):
+        from fabtools.require.mercurial import working_copy
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            working_copy(REMOTE_URL, path='/home/vagrant/app')
+            pulls = self.remote['pulls']
+            working_copy(REMOTE_URL, path='/home/vagrant/app',
+                         branch='stable', update=False)
+            count = len(self.host.history)
+            working_copy(REMOTE_URL, path='/home/vagrant/app',
+                         branch='stable', update=False)
+        repo = self.host.hg_repos['/home/vagrant/app']
+        self.assertEqual(repo['branch'], 'stable')
+        self.assertEqual(self.remote['pulls'], pulls)
+        self.assertEqual(len(self.host.history), count + 2)
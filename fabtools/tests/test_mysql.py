@@ -0,0 +1,192 @@
+import unittest
+
+from fabric.api import settings
+
+
+class MySQLQueryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.tests.simulated import SimulatedHost
+        self.host = SimulatedHost()
+        self.host.mysql_root_password = 's3cr3t'
+        self.host.install_package('mysql-server')
+
+    def test_password_in_defaults_file(self):
+        from fabtools.mysql import user_exists
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            with settings(mysql_user='root', mysql_password='s3cr3t'):
+                self.assertTrue(user_exists('root'))
+                self.assertFalse(user_exists('bob'))
+        self.assertEqual(len(self.host.history), 2)
+        self.assertNotIn('sshpass', self.host.history[0])
+        self.assertIn('--defaults-extra-file="$f"', self.host.history[0])
+        self.assertEqual(self.host.listdir('/tmp'), [])
+
+    def test_password_with_quotes(self):
+        from fabtools.mysql import user_exists
+        from fabtools.tests.simulated import simulated
+        password = 'a"b\\c\''
+        self.host.mysql_users[('root', 'localhost')]['password'] = password
+        with simulated(self.host):
+            with settings(mysql_user='root', mysql_password=password):
+                self.assertTrue(user_exists('root'))
+
+    def test_wrong_password(self):
+        from fabtools.mysql import user_exists
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            with settings(mysql_user='root', mysql_password='wrong'):
+                self.assertFalse(user_exists('root'))
+
+    def test_queries(self):
+        from fabtools.mysql import queries
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            with settings(mysql_user='root', mysql_password='s3cr3t'):
+                results = queries([
+                    'CREATE DATABASE shop;',
+                    "SHOW DATABASES LIKE 'shop'",
+                    "SHOW DATABASES LIKE 'blog'",
+                ])
+        self.assertEqual(results, ['', 'shop', ''])
+        self.assertEqual(len(self.host.history), 1)
+
+    def test_create_database_with_owner(self):
+        from fabtools.mysql import create_database, create_user
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            with settings(mysql_user='root', mysql_password='s3cr3t'):
+                create_user('bob', 'secret')
+                create_database('shop', owner='bob')
+        self.assertEqual(len(self.host.history), 2)
+        self.assertIn('shop', self.host.mysql_databases)
+        self.assertEqual(self.host.mysql_grants[('bob', 'localhost')],
+                         [('ALL PRIVILEGES', 'shop.*', True)])
+
+
+class ParseGrantTestCase(unittest.TestCase):
+
+    def test_column_privileges(self):
+        from fabtools.mysql import _parse_grant
+        self.assertEqual(
+            _parse_grant("GRANT SELECT (`id`, `name`), INSERT ON "
+                         "`shop`.`items` TO 'app'@'localhost'"),
+            (frozenset(['SELECT (`ID`, `NAME`)', 'INSERT']), 'shop.items',
+             False))
+
+    def test_role_and_proxy_grants(self):
+        from fabtools.mysql import _parse_grant
+        self.assertIsNone(
+            _parse_grant("GRANT `readers`@`%` TO `app`@`localhost`"))
+        self.assertIsNone(
+            _parse_grant("GRANT PROXY ON ''@'' TO 'root'@'localhost' "
+                         "WITH GRANT OPTION"))
+
+
+class RequireMySQLBulkTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.tests.simulated import SimulatedHost
+        self.host = SimulatedHost()
+        self.host.mysql_root_password = 's3cr3t'
+        self.host.install_package('mysql-server')
+        self.host.mysql_users[('app', 'localhost')] = {'password': 'x'}
+        self.host.mysql_databases['shop'] = {}
+        self.host.mysql_grants[('app', 'localhost')] = [
+            ('SELECT, INSERT', 'shop.*', False)]
+
+    def test_snapshot(self):
+        from fabtools.mysql import snapshot
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            with settings(mysql_user='root', mysql_password='s3cr3t'):
+                state = snapshot([('app', 'localhost'), ('bob', 'localhost')])
+        self.assertIn(('app', 'localhost'), state['users'])
+        self.assertIn('shop', state['databases'])
+        self.assertEqual(state['grants'], {('app', 'localhost'): [
+            (frozenset(['USAGE']), '*.*', False),
+            (frozenset(['SELECT', 'INSERT']), 'shop.*', False),
+        ]})
+        self.assertEqual(len(self.host.history), 1)
+
+    def test_provision(self):
+        from fabtools.require.mysql import databases, grants, users
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            with settings(mysql_user='root', mysql_password='s3cr3t'):
+                created_users = users([
+                    {'name': 'app', 'password': 'x'},
+                    {'name': 'tenant1', 'password': 'y'},
+                    {'name': 'tenant2', 'password': 'z'},
+                ])
+                created_databases = databases([
+                    {'name': 'shop'},
+                    {'name': 'tenant1', 'owner': 'tenant1'},
+                    {'name': 'tenant2', 'owner': 'tenant2'},
+                ])
+                statements = grants([
+                    {'user': 'app', 'database': 'shop',
+                     'privileges': 'SELECT'},
+                    {'user': 'app', 'database': 'tenant1',
+                     'privileges': 'SELECT'},
+                    {'user': 'tenant1', 'database': 'tenant1'},
+                    {'user': 'tenant2', 'database': 'tenant2',
+                     'grant_option': True},
+                ])
+        self.assertEqual(created_users, [('tenant1', 'localhost'),
+                                         ('tenant2', 'localhost')])
+        self.assertEqual(created_databases, ['tenant1', 'tenant2'])
+        self.assertEqual(statements, [
+            "GRANT SELECT ON tenant1.* TO 'app'@'localhost'",
+        ])
+        self.assertEqual(len(self.host.history), 6)
+        for command in self.host.history[1::2]:
+            self.assertEqual(command.count('FLUSH PRIVILEGES'), 1)
+
+    def test_nothing_to_do(self):
+        from fabtools.require.mysql import grants
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            with settings(mysql_user='root', mysql_password='s3cr3t'):
+                grants([{'user': 'app', 'database': 'shop',
+                         'privileges': 'insert, select'}])
+        self.assertEqual(len(self.host.history), 1)
+
+
+class MySQLStreamingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.tests.simulated import SimulatedHost
+        self.host = SimulatedHost()
+        self.host.mysql_root_password = 's3cr3t'
+        self.host.install_package('mysql-server')
+        self.host.mysql_databases['shop'] = {}
+
+    def test_load(self):
+        import io
+        from fabtools.mysql import load
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            with settings(mysql_user='root', mysql_password='s3cr3t'):
+                load('shop', io.BytesIO(b'-- seed\nCREATE DATABASE blog;\n'))
+        self.assertEqual(len(self.host.history), 1)
+        self.assertIn('blog', self.host.mysql_databases)
+        self.assertEqual(self.host.listdir('/tmp'), [])
+
+    def test_dump(self):
+        import os
+        import shutil
+        import tempfile
+        from fabtools.mysql import dump
+        from fabtools.tests.simulated import simulated
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'shop.sql')
+            with simulated(self.host):
+                with settings(mysql_user='root', mysql_password='s3cr3t'):
+                    dump('shop', path)
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b'-- MySQL dump of shop\n')
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,84 @@
+import unittest
+
+from fabric.api import settings
+
+from fabtools.tests.simulated import SimulatedHost, simulated
+
+
+TEMPLATE = 'server { server_name %(server_name)s; }\n'
+
+
+class RequireSitesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.host = SimulatedHost()
+        self.host.install_package('nginx-common', '1.4.6')
+        self.host.unit('nginx')['active'] = True
+        self.host.register('nginx', self._nginx)
+
+    def _nginx(self, inv):
+        # Fail if any enabled site contains the word "broken"
+        for name in self.host.listdir('/etc/nginx/sites-enabled'):
+            path = '/etc/nginx/sites-enabled/' + name
+            if 'broken' in self.host.read_file(path):
+                return 'nginx: configuration test failed\n', 1
+        return 'nginx: configuration test is successful\n'
+
+    def _specs(self, count):
+        return [
+            {'server_name': 'site%d.example.com' % i,
+             'template_contents': TEMPLATE}
+            for i in range(count)
+        ]
+
+    def test_many_sites(self):
+        from fabtools.require.nginx import sites
+        with simulated(self.host):
+            sites(self._specs(100))
+        self.assertEqual(len(self.host.listdir('/etc/nginx/sites-enabled')),
+                         100)
+        self.assertEqual(self.host.unit('nginx')['actions'], ['reload'])
+        self.assertTrue(len(self.host.history) <= 10)
+
+        count = len(self.host.history)
+        with simulated(self.host):
+            sites(self._specs(100))
+        self.assertEqual(self.host.unit('nginx')['actions'], ['reload'])
+        self.assertEqual(len(self.host.history), count + 3)
+
+    def test_disable(self):
+        from fabtools.require.nginx import sites
+        specs = self._specs(3)
+        with simulated(self.host):
+            sites(specs)
+            specs[1]['enabled'] = False
+            sites(specs)
+        self.assertEqual(sorted(self.host.listdir('/etc/nginx/sites-enabled')),
+                         ['site0.example.com.conf', 'site2.example.com.conf'])
+
+    def test_bisect_broken_site(self):
+        from fabtools.require.nginx import sites
+        specs = self._specs(64)
+        specs[37]['template_contents'] = 'broken\n'
+        with simulated(self.host), settings(abort_exception=SystemExit):
+            with self.assertRaises(SystemExit):
+                sites(specs)
+        enabled = self.host.listdir('/etc/nginx/sites-enabled')
+        self.assertEqual(len(enabled), 63)
+        self.assertNotIn('site37.example.com.conf', enabled)
+        self.assertEqual(self.host.unit('nginx')['actions'], ['reload'])
+        self.assertTrue(len(self.host.history) < 25)
+
+    def test_relative_links(self):
+        from fabtools.require.nginx import sites
+        specs = self._specs(2)
+        with simulated(self.host):
+            sites(specs)
+        self.host.execute(
+            'ln -sfn ../sites-available/site0.example.com.conf '
+            '/etc/nginx/sites-enabled/site0.example.com.conf', user='root')
+        count = len(self.host.history)
+        with simulated(self.host):
+            sites(specs)
+        self.assertFalse(any('ln -sfn' in command
+                             for command in self.host.history[count:]))
@@ -0,0 +1,78 @@
+import json
+import unittest
+
+
+class ParseListingTestCase(unittest.TestCase):
+
+    def test_parse_listing(self):
+        from fabtools.nodejs import _parse_listing
+        self.assertEqual(_parse_listing(json.dumps({
+            'dependencies': {
+                'express': {'version': '4.14.0'},
+                'broken': {'missing': True},
+            },
+        })), {'express': '4.14.0'})
+
+    def test_parse_empty_listing(self):
+        from fabtools.nodejs import _parse_listing
+        self.assertEqual(_parse_listing(''), {})
+        self.assertEqual(_parse_listing('{}'), {})
+
+
+class RequireNodejsPackagesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.tests.simulated import SimulatedHost
+        self.host = SimulatedHost()
+        self.host.npm_registry.update({
+            'coffee-script': '1.11.1',
+            'express': '4.14.0',
+            'forever': '0.15.3',
+        })
+        self.host.npm_packages['/usr/local'] = {
+            'coffee-script': '1.10.0',
+            'forever': '0.15.3',
+        }
+
+    def test_packages(self):
+        from fabtools.require.nodejs import packages
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            installed = packages({
+                'coffee-script': '1.11.1',
+                'express': None,
+                'forever': None,
+            })
+        self.assertEqual(installed, ['coffee-script', 'express'])
+        self.assertEqual(self.host.npm_packages['/usr/local'], {
+            'coffee-script': '1.11.1',
+            'express': '4.14.0',
+            'forever': '0.15.3',
+        })
+        self.assertEqual(len(self.host.history), 2)
+
+    def test_packages_are_idempotent(self):
+        from fabtools.require.nodejs import package, packages
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            packages(['express', 'forever'])
+            count = len(self.host.history)
+            self.assertEqual(packages(['express', 'forever']), [])
+            package('coffee-script')
+        self.assertEqual(len(self.host.history), count + 1)
+
+    def test_install_dependencies_with_lockfile(self):
+        from fabric.api import cd
+        from fabtools.nodejs import install_dependencies, snapshot
+        from fabtools.tests.simulated import simulated
+        self.host.mkdir('/srv/app', owner='vagrant')
+        self.host.write_file('/srv/app/package.json', json.dumps({
+            'dependencies': {'express': '4.14.0'},
+        }))
+        self.host.write_file('/srv/app/package-lock.json', '{}')
+        with simulated(self.host):
+            with cd('/srv/app'):
+                self.assertEqual(snapshot(local=True), {})
+                install_dependencies(ci=True)
+                self.assertEqual(snapshot(local=True), {'express': '4.14.0'})
+        self.assertIn('npm ci', self.host.history[1])
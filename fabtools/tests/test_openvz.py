@@ -0,0 +1,80 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from fabric.api import put, settings
+
+
+class GuestUploadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.tests.simulated import SimulatedHost
+        self.host = SimulatedHost(user='root')
+        self.container = self.host.containers['foo'] = SimulatedHost('foo')
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.local_path = os.path.join(self.directory, 'hello.txt')
+        with open(self.local_path, 'w') as f:
+            f.write('Hello\n')
+
+    def test_put_file(self):
+        from fabtools.openvz import guest
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            with settings(user='root'):
+                with guest('foo'):
+                    paths = put(self.local_path, '/etc', mode=0o600)
+        self.assertEqual(paths, ['/etc/hello.txt'])
+        self.assertEqual(self.container.read_file('/etc/hello.txt'),
+                         'Hello\n')
+        self.assertEqual(self.container.node('/etc/hello.txt').mode, 0o600)
+        # Nothing is left on the host or in the container
+        self.assertEqual(self.host.listdir('/root'), [])
+        self.assertEqual(self.host.listdir('/tmp'), [])
+        self.assertEqual(
+            [name for name in self.container.listdir('/etc')
+             if 'fabtools' in name], [])
+
+    def test_put_file_object_keeps_mode_and_owner(self):
+        from fabtools.openvz import guest
+        from fabtools.tests.simulated import simulated
+        self.container.write_file('/home/vagrant/app.conf', 'old\n',
+                                  owner='vagrant', mode=0o640)
+        with simulated(self.host):
+            with settings(user='root'):
+                with guest('foo'):
+                    put(io.BytesIO(b'new\n'), '/home/vagrant/app.conf')
+        node = self.container.node('/home/vagrant/app.conf')
+        self.assertEqual(node.data, b'new\n')
+        self.assertEqual((node.owner, node.mode), ('vagrant', 0o640))
+
+    def test_failed_upload_is_cleaned_up(self):
+        from fabtools.openvz import guest
+        from fabtools.tests.simulated import simulated
+        self.container.register('mv', lambda inv: ('', 1))
+        with simulated(self.host):
+            with settings(user='root', abort_exception=RuntimeError):
+                with guest('foo'):
+                    self.assertRaises(RuntimeError, put, self.local_path,
+                                      '/etc/hello.txt')
+                    self.assertRaises(RuntimeError, put, self.local_path,
+                                      '/missing/hello.txt')
+        self.assertEqual(
+            [name for name in self.container.listdir('/etc')
+             if 'hello' in name], [])
+        self.assertFalse(self.container.exists('/missing'))
+
+    def test_guest_is_left_on_error(self):
+        import fabric.operations
+        from fabtools.openvz import guest
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            put_method = fabric.operations.SFTP.put
+            try:
+                with guest('foo'):
+                    raise ValueError
+            except ValueError:
+                pass
+            self.assertEqual(fabric.operations.SFTP.put, put_method)
@@ -8,10 +8,12 @@ class TestRequirePostgresDatabase(unittest.TestCase):
     @mock.patch('fabtools.require.postgres.restarted')
     @mock.patch('fabtools.require.postgres.require_locale')
     @mock.patch('fabtools.require.postgres.create_database')
-    @mock.patch('fabtools.require.postgres.run')
+    @mock.patch('fabtools.require.postgres.catalog')
+    @mock.patch('fabtools.require.postgres.has_locale')
     @mock.patch('fabtools.require.postgres.database_exists')
-    def test_params_respected(self, database_exists, run, create_database,
-                              require_locale, restarted, service_name):
+    def test_params_respected(self, database_exists, has_locale, catalog,
+                              create_database, require_locale, restarted,
+                              service_name):
         """
         If require.database is called, ensure that the template,
         encoding and locale parameters are passed through to the
@@ -19,11 +21,11 @@ class TestRequirePostgresDatabase(unittest.TestCase):
         """
         from fabtools import require
         database_exists.return_value = False
-        run.return_value = 'en-US.UTF-8\nde-DE.UTF-8'
+        has_locale.return_value = False
         require.postgres.database('foo', 'bar', locale='some_locale',
                                   encoding='some_encoding',
                                   template='some_template')
-        run.assert_called_with('locale -a')
+        has_locale.assert_called_with('some_locale')
         require_locale.assert_called_with('some_locale')
         create_database.assert_called_with('foo', 'bar', locale='some_locale',
                                            encoding='some_encoding',
@@ -106,3 +108,268 @@ class TestPostgresDropDatabase(unittest.TestCase):
         drop_database('foo')
 
         _run_as_pg.assert_called_with('dropdb foo')
+
+
+class PostgresCatalogTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.tests.simulated import SimulatedHost
+        self.host = SimulatedHost()
+        self.host.install_package('postgresql', '9.3')
+        self.host.pg_roles['alice'] = {}
+        self.host.pg_databases['shop'] = {'owner': 'alice'}
+
+    def test_existence_checks_share_one_snapshot(self):
+        from fabtools.postgres import database_exists, user_exists
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            self.assertTrue(user_exists('alice'))
+            self.assertFalse(user_exists('bob'))
+            self.assertTrue(database_exists('shop'))
+            self.assertFalse(database_exists('blog'))
+        self.assertEqual(len(self.host.history), 1)
+
+    def test_group_roles_are_not_users(self):
+        from fabtools.postgres import catalog, user_exists
+        from fabtools.tests.simulated import simulated
+        self.host.pg_roles['readers'] = {'options': 'NOLOGIN'}
+        with simulated(self.host):
+            self.assertFalse(user_exists('readers'))
+            self.assertIn('readers', catalog()['roles'])
+
+    def test_snapshot_follows_changes(self):
+        from fabtools.postgres import (create_database, create_user,
+                                       database_exists, drop_user,
+                                       user_exists)
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            self.assertFalse(user_exists('bob'))
+            create_user('bob', 'secret')
+            create_database('blog', owner='bob')
+            drop_user('alice')
+            self.assertTrue(user_exists('bob'))
+            self.assertFalse(user_exists('alice'))
+            self.assertTrue(database_exists('blog'))
+        self.assertEqual(len(self.host.history), 4)
+
+    def test_schemas(self):
+        from fabtools.postgres import create_schema, schema_exists
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            self.assertTrue(schema_exists('public', 'shop'))
+            self.assertFalse(schema_exists('sales', 'shop'))
+            create_schema('sales', 'shop')
+            self.assertTrue(schema_exists('sales', 'shop'))
+        self.assertIn(('shop', 'sales'), self.host.pg_schemas)
+
+    def test_locales(self):
+        from fabtools.postgres import has_locale
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            self.assertTrue(has_locale('en_US.UTF-8'))
+            self.assertFalse(has_locale('fr_FR.UTF-8'))
+        self.assertEqual(len(self.host.history), 1)
+
+
+class RequirePostgresBulkTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.tests.simulated import SimulatedHost
+        self.host = SimulatedHost()
+        self.host.install_package('postgresql', '9.3')
+        self.host.pg_roles['tenant0'] = {}
+        self.host.pg_databases['tenant0'] = {'owner': 'tenant0'}
+
+    def test_users(self):
+        from fabtools.require.postgres import users
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            created = users([{'name': 'tenant%d' % i, 'password': 's3cr3t'}
+                             for i in range(10)])
+            self.assertEqual(users([{'name': 'tenant1', 'password': 'x'}]),
+                             [])
+        self.assertEqual(created, ['tenant%d' % i for i in range(1, 10)])
+        self.assertEqual(len(self.host.history), 2)
+        self.assertEqual(len(self.host.pg_roles), 10)
+
+    def test_users_in_one_transaction(self):
+        from fabric.api import settings
+        from fabtools.postgres import create_users
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            with settings(warn_only=True):
+                create_users([{'name': 'tenant1', 'password': 'x'},
+                              {'name': 'tenant0', 'password': 'x'}])
+        self.assertNotIn('tenant1', self.host.pg_roles)
+
+    def test_databases(self):
+        from fabtools.require.postgres import databases
+        from fabtools.tests.simulated import simulated
+        self.host.pg_roles['tenant1'] = {}
+        with simulated(self.host):
+            created = databases([
+                {'name': 'tenant%d' % i, 'owner': 'tenant%d' % (i % 2)}
+                for i in range(6)
+            ], concurrency=2)
+        self.assertEqual(created, ['tenant%d' % i for i in range(1, 6)])
+        self.assertEqual(len(self.host.history), 2)
+        self.assertEqual(self.host.pg_databases['tenant3'],
+                         {'owner': 'tenant1'})
+
+    def test_databases_failure(self):
+        from fabtools.require.postgres import databases
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            with self.assertRaises(SystemExit):
+                databases([{'name': 'blog', 'owner': 'nobody'}])
+
+    def test_schemas(self):
+        from fabtools.require.postgres import schemas
+        from fabtools.tests.simulated import simulated
+        self.host.pg_databases['tenant1'] = {'owner': 'tenant0'}
+        self.host.pg_schemas[('tenant0', 'billing')] = {'owner': 'tenant0'}
+        with simulated(self.host):
+            created = schemas([
+                {'name': name, 'database': database, 'owner': 'tenant0'}
+                for database in ['tenant0', 'tenant1']
+                for name in ['public', 'billing', 'reports']
+            ])
+        self.assertEqual(created, [('tenant0', 'reports'),
+                                   ('tenant1', 'billing'),
+                                   ('tenant1', 'reports')])
+        self.assertEqual(len(self.host.history), 3)
+        self.assertIn(('tenant1', 'reports'), self.host.pg_schemas)
+
+
+class PostgresStreamingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.tests.simulated import SimulatedHost
+        self.host = SimulatedHost()
+        self.host.install_package('postgresql', '9.3')
+        self.host.pg_roles['alice'] = {}
+        self.host.pg_databases['shop'] = {'owner': 'alice'}
+
+    def test_load_plain_dump(self):
+        import io
+        from fabtools.postgres import load
+        from fabtools.tests.simulated import simulated
+        dump = io.BytesIO(b'-- seed\nCREATE SCHEMA sales;\nCREATE SCHEMA hr;\n')
+        with simulated(self.host):
+            load('shop', dump)
+        self.assertEqual(len(self.host.history), 1)
+        self.assertIn('gunzip -c | psql', self.host.history[0])
+        self.assertIn(('shop', 'sales'), self.host.pg_schemas)
+        self.assertIn(('shop', 'hr'), self.host.pg_schemas)
+        self.assertEqual(self.host.listdir('/tmp'), [])
+
+    def test_load_custom_dump(self):
+        import io
+        from fabtools.postgres import load
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            load('shop', io.BytesIO(b'PGDMP\nCREATE SCHEMA sales;\n'))
+        self.assertIn('pg_restore', self.host.history[0])
+        self.assertIn(('shop', 'sales'), self.host.pg_schemas)
+
+    def test_load_directory_dump_in_parallel(self):
+        import os
+        import shutil
+        import tempfile
+        from fabtools.postgres import load
+        from fabtools.tests.simulated import simulated
+        directory = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(directory, 'toc.dat'), 'wb') as f:
+                f.write(b'PGDMP\nCREATE SCHEMA sales;\n')
+            with simulated(self.host):
+                load('shop', directory, jobs=4)
+        finally:
+            shutil.rmtree(directory)
+        self.assertIn('pg_restore --exit-on-error --jobs=4 -d shop',
+                      self.host.history[0])
+        self.assertIn(('shop', 'sales'), self.host.pg_schemas)
+
+    def test_dump(self):
+        import gzip
+        import io
+        from fabtools.postgres import dump
+        from fabtools.tests.simulated import simulated
+        self.host.pg_schemas[('shop', 'sales')] = {'owner': 'alice'}
+        custom, plain = io.BytesIO(), io.BytesIO()
+        with simulated(self.host):
+            dump('shop', custom)
+            dump('shop', plain, format='plain')
+        self.assertTrue(custom.getvalue().startswith(b'PGDMP'))
+        self.assertIn(b'CREATE SCHEMA sales AUTHORIZATION alice;',
+                      gzip.GzipFile(fileobj=io.BytesIO(plain.getvalue())).read())
+        self.assertEqual(len(self.host.history), 2)
+
+
+class TuningProfileTestCase(unittest.TestCase):
+
+    def test_large_host(self):
+        from fabtools.postgres import huge_pages_needed, tuning_profile
+        profile = tuning_profile(cpus=64, memory=256 * 1024 ** 3,
+                                 connections=400, version=100000)
+        self.assertEqual(profile['shared_buffers'], '65536MB')
+        self.assertEqual(profile['effective_cache_size'], '196608MB')
+        self.assertEqual(profile['work_mem'], '41943kB')
+        self.assertEqual(profile['max_parallel_workers'], '64')
+        self.assertEqual(profile['max_parallel_workers_per_gather'], '4')
+        self.assertEqual(profile['huge_pages'], 'try')
+        self.assertEqual(huge_pages_needed(profile), 34407)
+
+    def test_old_version_on_spinning_disks(self):
+        from fabtools.postgres import huge_pages_needed, tuning_profile
+        profile = tuning_profile(cpus=2, memory=2 * 1024 ** 3, ssd=False,
+                                 version=90300)
+        self.assertEqual(profile['shared_buffers'], '512MB')
+        self.assertEqual(profile['random_page_cost'], '4')
+        self.assertNotIn('max_wal_size', profile)
+        self.assertNotIn('huge_pages', profile)
+        self.assertEqual(huge_pages_needed(profile), 0)
+
+
+class RequirePostgresTuningTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.tests.simulated import SimulatedHost
+        self.host = SimulatedHost(cpus=8, memory=16 * 1024 ** 3)
+        self.host.install_package('postgresql', '9.3')
+        self.host.unit('postgresql')['active'] = True
+
+    def test_tuning(self):
+        from fabtools.require.postgres import tuning
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            changed = tuning()
+            count = len(self.host.history)
+            self.assertEqual(tuning(), {})
+            self.assertEqual(len(self.host.history), count + 1)
+            changed_again = tuning(overrides={'random_page_cost': '1.5'})
+        self.assertEqual(changed['shared_buffers'], '4096MB')
+        self.assertEqual(changed_again, {'random_page_cost': '1.5'})
+        self.assertIn("include_dir = 'conf.d'", self.host.read_file(
+            '/etc/postgresql/9.3/main/postgresql.conf'))
+        self.assertIn("random_page_cost = '1.5'", self.host.read_file(
+            '/etc/postgresql/9.3/main/conf.d/fabtools-tuning.conf'))
+        self.assertEqual(self.host.unit('postgresql')['actions'],
+                         ['restart', 'reload'])
+
+    def test_tuning_before_9_3(self):
+        from fabtools.require.postgres import tuning
+        from fabtools.tests.simulated import SimulatedHost, simulated
+        host = SimulatedHost(cpus=8, memory=16 * 1024 ** 3)
+        host.pg_settings['server_version_num'] = '90100'
+        host.pg_settings['config_file'] = \
+            '/etc/postgresql/9.1/main/postgresql.conf'
+        host.install_package('postgresql', '9.1')
+        host.unit('postgresql')['active'] = True
+        with simulated(host):
+            self.assertTrue(tuning())
+            self.assertEqual(tuning(), {})
+        config = host.read_file('/etc/postgresql/9.1/main/postgresql.conf')
+        self.assertNotIn('include_dir', config)
+        self.assertEqual(
+            config.count("include 'conf.d/fabtools-tuning.conf'"), 1)
@@ -29,3 +29,147 @@ class RedisTestCase(unittest.TestCase):
             _download_url('2.6.15'),
             'http://download.redis.io/releases/'
         )
+
+
+class TuningProfileTestCase(unittest.TestCase):
+
+    def test_cache(self):
+        from fabtools.redis import tuning_profile
+        params = tuning_profile('cache', cpus=8, memory=16 * 1024 ** 3,
+                                version='6.0.9')
+        self.assertEqual(params['maxmemory'], '12288mb')
+        self.assertEqual(params['maxmemory-policy'], 'allkeys-lru')
+        self.assertEqual(params['save'], ['""'])
+        self.assertEqual(params['io-threads'], '6')
+        self.assertEqual(params['lazyfree-lazy-eviction'], 'yes')
+
+    def test_store_on_old_version(self):
+        from fabtools.redis import tuning_profile
+        params = tuning_profile('store', cpus=2, memory=2 * 1024 ** 3,
+                                version='2.6.16')
+        self.assertEqual(params['maxmemory'], '1024mb')
+        self.assertEqual(params['maxmemory-policy'], 'noeviction')
+        self.assertNotIn('save', params)
+        self.assertNotIn('tcp-backlog', params)
+        self.assertNotIn('io-threads', params)
+
+    def test_memory_share(self):
+        from fabtools.redis import tuning_profile
+        params = tuning_profile('cache', cpus=8, memory=16 * 1024 ** 3,
+                                version='6.0.9', memory_share=0.25)
+        self.assertEqual(params['maxmemory'], '3072mb')
+        with self.assertRaises(ValueError):
+            tuning_profile('cache', cpus=8, memory=16 * 1024 ** 3,
+                           version='6.0.9', memory_share=2)
+
+    def test_unknown_profile(self):
+        from fabtools.redis import tuning_profile
+        with self.assertRaises(ValueError):
+            tuning_profile('fast', cpus=2, memory=2 * 1024 ** 3,
+                           version='2.6.16')
+
+
+class BenchmarkTestCase(unittest.TestCase):
+
+    def test_parse_old_output(self):
+        from fabtools.redis import _parse_benchmark
+        self.assertEqual(
+            list(_parse_benchmark('"SET","85034.02"\n"GET","90090.09"\n').items()),
+            [('SET', 85034.02), ('GET', 90090.09)])
+
+    def test_parse_output_with_header(self):
+        from fabtools.redis import _parse_benchmark
+        self.assertEqual(
+            _parse_benchmark('"test","rps","avg_latency_ms"\n'
+                             '"SET","120481.93","0.221"\n'),
+            {'SET': 120481.93})
+
+    def test_benchmark(self):
+        from fabtools.redis import benchmark
+        from fabtools.tests.simulated import SimulatedHost, simulated
+        host = SimulatedHost()
+        calls = []
+
+        def redis_benchmark(inv):
+            calls.append(inv.args)
+            return '"SET","1000.00"\n"GET","2000.00"\n'
+
+        host.register('redis-benchmark', redis_benchmark)
+        with simulated(host):
+            results = benchmark(port=6380, version='6.0.9')
+        self.assertEqual(results, {'SET': 1000.0, 'GET': 2000.0})
+        self.assertIn('6380', calls[0])
+        self.assertEqual(host.history[0].split()[0],
+                         '/opt/redis-6.0.9/redis-benchmark')
+
+
+class RequireRedisTuningTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.tests.simulated import SimulatedHost
+        self.host = SimulatedHost(cpus=8, memory=16 * 1024 ** 3)
+        self.host.write_file('/opt/redis-2.6.16/redis-server', '')
+        self.host.install_package('supervisor')
+        self.host.mkdir('/etc/sysctl.d')
+
+    def test_instance_with_profile(self):
+        from fabtools.require.redis import instance
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            instance('cache', profile='cache', loglevel='warning')
+        config = self.host.read_file('/etc/redis/cache.conf').splitlines()
+        self.assertIn('maxmemory 12288mb', config)
+        self.assertIn('maxmemory-policy allkeys-lru', config)
+        self.assertIn('loglevel warning', config)
+        self.assertIn('save ""', config)
+        self.assertEqual(self.host.sysctl['net.core.somaxconn'], '65535')
+        self.assertEqual(self.host.read_file(
+            '/sys/kernel/mm/transparent_hugepage/enabled'), 'never\n')
+        self.assertTrue(self.host.exists(
+            '/etc/tmpfiles.d/redis-transparent-hugepage.conf'))
+
+    def test_instance_with_profile_is_idempotent(self):
+        from fabtools.require.redis import instance
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            instance('cache', profile='cache')
+            count = len(self.host.history)
+            instance('cache', profile='cache')
+        self.assertFalse(any(
+            'transparent_hugepage/enabled &&' in command or
+            'supervisorctl restart' in command
+            for command in self.host.history[count:]))
+
+    def test_deferred_restart_after_supervisor_update(self):
+        from fabtools.handlers import deferred
+        from fabtools.require.redis import instance
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            with deferred():
+                instance('cache', profile='cache')
+        commands = [command for command in self.host.history
+                    if 'supervisorctl' in command]
+        update = [i for i, command in enumerate(commands)
+                  if 'supervisorctl update' in command]
+        restart = [i for i, command in enumerate(commands)
+                   if 'restart redis_cache' in command]
+        self.assertTrue(update)
+        self.assertTrue(restart)
+        self.assertLess(update[0], restart[0])
+
+    def test_instance_with_profile_without_systemd(self):
+        from fabtools.require.redis import instance
+        from fabtools.tests.simulated import SimulatedHost, simulated
+        host = SimulatedHost(cpus=8, memory=16 * 1024 ** 3, systemd=False)
+        host.write_file('/opt/redis-2.6.16/redis-server', '')
+        host.install_package('supervisor')
+        host.mkdir('/etc/sysctl.d')
+        host.write_file('/etc/sysfs.conf', '')
+        with simulated(host):
+            instance('cache', profile='cache', memory_share=0.5)
+        config = host.read_file('/etc/redis/cache.conf').splitlines()
+        self.assertIn('maxmemory 6144mb', config)
+        self.assertFalse(host.exists(
+            '/etc/tmpfiles.d/redis-transparent-hugepage.conf'))
+        self.assertEqual(host.read_file('/etc/sysfs.conf'),
+                         'kernel/mm/transparent_hugepage/enabled = never\n')
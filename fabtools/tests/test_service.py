@@ -0,0 +1,141 @@
+import unittest
+
+
+class ParseListingTestCase(unittest.TestCase):
+
+    def test_systemctl_list(self):
+        from fabtools.service import _parse_systemctl_list
+        states = _parse_systemctl_list(
+            'cron.service loaded active running Regular background program\n'
+            'nginx.service loaded inactive dead A high performance web server\n',
+            'cron.service enabled\n'
+            'nginx.service disabled\n'
+            'ssh.service enabled\n'
+            'systemd-fsck@.service static\n',
+        )
+        self.assertEqual(states['cron'], {'running': True, 'enabled': True})
+        self.assertEqual(states['nginx'], {'running': False, 'enabled': False})
+        self.assertEqual(states['ssh'], {'running': False, 'enabled': True})
+
+    def test_systemctl_show(self):
+        from fabtools.service import _parse_systemctl_show
+        states = _parse_systemctl_show(['mysql', 'foo'], (
+            'Id=mariadb.service\n'
+            'ActiveState=active\n'
+            'UnitFileState=enabled\n'
+            '\n'
+            'Id=foo.service\n'
+            'ActiveState=inactive\n'
+            'UnitFileState=\n'
+        ))
+        self.assertEqual(states['mysql'], {'running': True, 'enabled': True})
+        self.assertEqual(states['foo'], {'running': False, 'enabled': False})
+
+    def test_upstart(self):
+        from fabtools.service import _parse_initctl_list
+        states = _parse_initctl_list(
+            'ssh start/running, process 1042\n'
+            'tty1 stop/waiting\n',
+            ' [ + ]  apache2\n'
+            ' [ - ]  nginx\n'
+            ' [ ? ]  networking\n',
+        )
+        self.assertTrue(states['ssh']['running'])
+        self.assertFalse(states['tty1']['running'])
+        self.assertTrue(states['apache2']['running'])
+        self.assertFalse(states['networking']['running'])
+
+    def test_sysv(self):
+        from fabtools.service import _parse_sysv
+        states = _parse_sysv(
+            'crond (pid  1234) is running...\n'
+            'nginx is stopped\n',
+            '/etc/rc3.d:\n'
+            'K15nginx\n'
+            'S90crond\n',
+        )
+        self.assertEqual(states['crond'], {'running': True, 'enabled': True})
+        self.assertEqual(states['nginx'], {'running': False, 'enabled': False})
+
+    def test_openrc(self):
+        from fabtools.service import _parse_rc_status
+        states = _parse_rc_status(
+            'Runlevel: default\n'
+            ' sshd      [  started  ]\n'
+            ' nginx     [  stopped  ]\n',
+            '  sshd | default\n'
+            ' nginx |\n',
+        )
+        self.assertEqual(states['sshd'], {'running': True, 'enabled': True})
+        self.assertEqual(states['nginx'], {'running': False, 'enabled': False})
+
+
+class RequireServicesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.tests.simulated import SimulatedHost
+        self.host = SimulatedHost()
+        self.host.unit('nginx')['active'] = True
+
+    def test_is_running_many(self):
+        from fabtools.service import is_running
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            states = is_running(['nginx', 'redis-server'])
+        self.assertEqual(states, {'nginx': True, 'redis-server': False})
+        self.assertEqual(len(self.host.history), 1)
+
+    def test_started_many(self):
+        from fabtools.require.service import started
+        from fabtools.tests.simulated import simulated
+        names = ['nginx', 'postgresql', 'redis-server', 'memcached']
+        with simulated(self.host):
+            started(names)
+        self.assertEqual(len(self.host.history), 2)
+        self.assertTrue(all(self.host.unit(name)['active'] for name in names))
+        self.assertNotIn('actions', self.host.unit('nginx'))
+
+    def test_restarted(self):
+        from fabtools.require.service import restarted
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            restarted(['nginx', 'redis-server'])
+        self.assertEqual(self.host.unit('nginx')['actions'], ['restart'])
+        self.assertEqual(self.host.unit('redis-server')['actions'], ['start'])
+
+    def test_stopped_without_systemd(self):
+        from fabtools.require.service import stopped
+        from fabtools.tests.simulated import SimulatedHost, simulated
+        host = SimulatedHost(systemd=False)
+        host.unit('nginx')['active'] = True
+        host.unit('apache2')['active'] = True
+        with simulated(host):
+            stopped(['nginx', 'apache2', 'redis-server'])
+        self.assertEqual(len(host.history), 2)
+        self.assertFalse(host.unit('nginx')['active'])
+        self.assertFalse(host.unit('apache2')['active'])
+
+    def test_named_without_systemd(self):
+        from fabtools.service import is_running, snapshot
+        from fabtools.tests.simulated import SimulatedHost, simulated
+        host = SimulatedHost(systemd=False)
+        host.unit('nginx')['active'] = True
+        host.register('initctl', lambda inv: ('', 127))
+        with simulated(host):
+            states = snapshot(['nginx', 'networking'])
+            self.assertTrue(is_running('nginx'))
+        self.assertEqual(states['nginx'], {'running': True, 'enabled': False})
+        self.assertFalse(states['networking']['running'])
+        self.assertEqual(len(host.history), 2)
+        self.assertIn('service nginx status', host.history[0])
+        self.assertNotIn('--status-all', host.history[0])
+
+    def test_states_are_read_on_each_call(self):
+        from fabtools.require.service import stopped
+        from fabtools.service import is_running
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            self.assertFalse(is_running('redis-server'))
+            self.host.unit('redis-server')['active'] = True
+            stopped('redis-server')
+        self.assertFalse(self.host.unit('redis-server')['active'])
@@ -0,0 +1,176 @@
+import unittest
+
+from fabric.api import cd, execute, run, settings, sudo
+import pytest
+
+from fabtools.tests.simulated import SimulatedHost, simulated
+
+
+class ShellTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.host = SimulatedHost()
+
+    def execute(self, command, user='vagrant'):
+        return self.host.execute(command, user=user)
+
+    def test_and_or(self):
+        out, err, status = self.execute('false && echo no || echo yes')
+        self.assertEqual(out, 'yes\n')
+        self.assertEqual(status, 0)
+
+    def test_pipeline(self):
+        out, err, status = self.execute('printf "b\\na\\n" | sort | head -n 1')
+        self.assertEqual(out, 'a\n')
+
+    def test_redirections(self):
+        self.execute('echo hello >/tmp/foo && echo world >>/tmp/foo')
+        self.assertEqual(self.host.read_file('/tmp/foo'), 'hello\nworld\n')
+
+    def test_stderr_redirection(self):
+        out, err, status = self.execute('cat /nonexistent 2>/dev/null')
+        self.assertEqual((out, err, status), ('', '', 1))
+
+    def test_substitution_and_variables(self):
+        out, err, status = self.execute('X=$(echo foo) && echo "$X-$HOME"')
+        self.assertEqual(out, 'foo-/home/vagrant\n')
+
+    def test_tilde_expansion(self):
+        out, err, status = self.execute('echo ~root ~/bin')
+        self.assertEqual(out, '/root /home/vagrant/bin\n')
+
+    def test_if_and_for(self):
+        out, err, status = self.execute(
+            'for x in a b; do if [ "$x" = a ]; then echo A; else echo $x; fi; done')
+        self.assertEqual(out, 'A\nb\n')
+
+    def test_set_e(self):
+        out, err, status = self.execute('set -e; false; echo unreachable')
+        self.assertEqual((out, status), ('', 1))
+
+    def test_permissions(self):
+        out, err, status = self.execute('touch /etc/foo')
+        self.assertEqual(status, 1)
+        self.assertIn('Permission denied', err)
+        out, err, status = self.execute('touch /etc/foo', user='root')
+        self.assertEqual(status, 0)
+
+    def test_unknown_command(self):
+        out, err, status = self.execute('frobnicate --now')
+        self.assertEqual(status, 127)
+
+    def test_register_handler(self):
+        self.host.register('frobnicate', lambda inv: ' '.join(inv.args) + '\n')
+        out, err, status = self.execute('frobnicate --now')
+        self.assertEqual((out, status), ('--now\n', 0))
+
+    def test_history(self):
+        self.execute('true')
+        self.execute('false')
+        self.assertEqual(self.host.history, ['true', 'false'])
+
+    def test_missing_directory(self):
+        out, err, status = self.execute(
+            'echo x >/etc/supervisor/conf.d/app.conf', user='root')
+        self.assertEqual(status, 1)
+        self.assertIn('No such file or directory', err)
+        self.host.install_package('supervisor')
+        out, err, status = self.execute(
+            'echo x >/etc/supervisor/conf.d/app.conf', user='root')
+        self.assertEqual(status, 0)
+
+    def test_restart_unknown_process(self):
+        self.host.install_package('supervisor')
+        out, err, status = self.execute('supervisorctl restart app',
+                                        user='root')
+        self.assertEqual(status, 1)
+        self.assertIn('no such process', out)
+
+
+@pytest.fixture
+def host():
+    host = SimulatedHost()
+    with simulated(host):
+        yield host
+
+
+def test_run_and_sudo(host):
+    assert run('whoami') == 'vagrant'
+    assert sudo('whoami') == 'root'
+    assert sudo('whoami', user='alice') == 'alice'
+
+
+def test_cd(host):
+    with cd('/etc'):
+        assert run('pwd') == '/etc'
+
+
+def test_failed_command(host):
+    with settings(warn_only=True):
+        res = run('test -d /nonexistent')
+    assert res.failed
+    assert res.return_code == 1
+
+
+def test_require_user(host):
+    from fabtools.require import user
+    from fabtools.user import exists, home_directory
+    user('alice', shell='/bin/bash')
+    assert exists('alice')
+    assert home_directory('alice') == '/home/alice'
+    assert host.users['alice']['shell'] == '/bin/bash'
+    assert host.is_dir('/home/alice')
+
+
+def test_require_file_with_sudo(host):
+    from fabtools.require import file as require_file
+    require_file('/etc/foo.conf', contents='foo\n', use_sudo=True)
+    assert host.read_file('/etc/foo.conf') == 'foo\n'
+    assert host.node('/etc/foo.conf').owner == 'root'
+    assert host.node('/etc/foo.conf').mode == 0o644
+
+
+def test_require_file_is_idempotent(host):
+    from fabtools.require import file as require_file
+    require_file('/tmp/foo', contents='foo\n')
+    count = len(host.history)
+    require_file('/tmp/foo', contents='foo\n')
+    assert not any(command.startswith('put:')
+                   for command in host.history[count:])
+
+
+def test_packages(host):
+    from fabtools.deb import install, is_installed
+    assert not is_installed('nginx')
+    install('nginx')
+    assert is_installed('nginx')
+
+
+def test_services(host):
+    from fabtools.require.service import started
+    from fabtools.systemd import is_running
+    assert not is_running('nginx')
+    started('nginx')
+    assert is_running('nginx')
+
+
+def test_postgres(host):
+    from fabtools.deb import install
+    from fabtools.postgres import create_user, user_exists
+    install('postgresql')
+    create_user('bob', 'secret')
+    assert user_exists('bob')
+    assert 'bob' in host.pg_roles
+
+
+def test_many_hosts():
+    from fabtools.require import user
+
+    def task():
+        user('svc')
+
+    hosts = [SimulatedHost('web%d' % i) for i in range(50)]
+    with simulated(*hosts):
+        execute(task, hosts=[host.host_string for host in hosts])
+
+    assert all('svc' in host.users for host in hosts)
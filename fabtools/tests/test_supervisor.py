@@ -0,0 +1,148 @@
+import unittest
+
+from fabtools.tests.simulated import SimulatedHost, simulated
+
+
+class StatusTestCase(unittest.TestCase):
+
+    def test_status(self):
+        from fabtools.supervisor import status
+        host = SimulatedHost()
+        host.supervisor['web'] = 'RUNNING'
+        host.supervisor['workers:worker1'] = 'STOPPED'
+        with simulated(host):
+            self.assertEqual(status(), {
+                'web': 'RUNNING',
+                'workers:worker1': 'STOPPED',
+            })
+
+
+class RequireProcessesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.host = SimulatedHost()
+
+    def _programs(self, count):
+        return dict(
+            ('worker%d' % i, {
+                'command': '/srv/app/bin/worker %d' % i,
+                'autostart': 'false',
+            })
+            for i in range(count)
+        )
+
+    def test_many_processes(self):
+        from fabtools.require.supervisor import processes
+        with simulated(self.host):
+            processes(self._programs(100))
+        self.assertEqual(len(self.host.supervisor), 100)
+        self.assertTrue(all(state == 'RUNNING'
+                            for state in self.host.supervisor.values()))
+        starts = [command for command in self.host.history
+                  if command.startswith('supervisorctl start')]
+        self.assertEqual(len(starts), 1)
+        self.assertEqual(
+            len([c for c in self.host.history if c.startswith('supervisorctl update')]), 1)
+
+    def test_unchanged(self):
+        from fabtools.require.supervisor import processes
+        with simulated(self.host):
+            processes(self._programs(10))
+            count = len(self.host.history)
+            processes(self._programs(10))
+        self.assertFalse([command for command in self.host.history[count:]
+                          if command.startswith('put:') or
+                          command.startswith('supervisorctl update') or
+                          command.startswith('supervisorctl start')])
+
+    def test_deferred(self):
+        from fabtools.handlers import deferred
+        from fabtools.require.supervisor import process
+        with simulated(self.host), deferred():
+            for name, params in sorted(self._programs(5).items()):
+                process(name, **params)
+            self.assertEqual(self.host.supervisor, {})
+        self.assertEqual(len(self.host.supervisor), 5)
+        self.assertEqual(
+            len([c for c in self.host.history if c.startswith('supervisorctl update')]), 1)
+        self.assertEqual(
+            [c for c in self.host.history if c.startswith('supervisorctl start')],
+            ['supervisorctl start worker0 worker1 worker2 worker3 worker4'])
+
+
+class XMLRPCBackendTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.host = SimulatedHost()
+        self.host.install_package('supervisor', '3.0')
+        for i in range(30):
+            self.host.supervisor['worker%d' % i] = 'STOPPED'
+        self.host.supervisor['web'] = 'RUNNING'
+
+    def test_status(self):
+        from fabric.api import settings
+        from fabtools.supervisor import process_status, status
+        with simulated(self.host), settings(supervisor_backend='xmlrpc'):
+            states = status()
+            self.assertEqual(process_status('web'), 'RUNNING')
+            self.assertEqual(process_status('missing'), None)
+        self.assertEqual(states['web'], 'RUNNING')
+        self.assertEqual(states['worker3'], 'STOPPED')
+        self.assertFalse([command for command in self.host.history
+                          if 'supervisorctl' in command])
+
+    def test_start_many(self):
+        from fabric.api import settings
+        from fabtools.supervisor import start_process, stop_process
+        names = ['web'] + ['worker%d' % i for i in range(30)]
+        with simulated(self.host), settings(supervisor_backend='xmlrpc'):
+            start_process(names)
+        self.assertEqual(len(self.host.history), 1)
+        self.assertTrue(all(state == 'RUNNING'
+                            for state in self.host.supervisor.values()))
+        with simulated(self.host), settings(supervisor_backend='xmlrpc'):
+            stop_process(names)
+        self.assertTrue(all(state == 'STOPPED'
+                            for state in self.host.supervisor.values()))
+
+    def test_restart_many(self):
+        from fabric.api import settings
+        from fabtools.supervisor import restart_process
+        names = ['web', 'worker0', 'worker1']
+        with simulated(self.host), settings(supervisor_backend='xmlrpc'):
+            restart_process(names)
+        self.assertEqual(len(self.host.history), 1)
+        self.assertTrue(all(self.host.supervisor[name] == 'RUNNING'
+                            for name in names))
+
+    def test_error(self):
+        from fabric.api import settings
+        from fabtools.supervisor import start_process
+        with simulated(self.host), settings(supervisor_backend='xmlrpc',
+                                            abort_exception=SystemExit):
+            with self.assertRaises(SystemExit):
+                start_process(['web', 'missing'])
+
+    def test_update_config(self):
+        from fabric.api import settings
+        from fabtools.require.supervisor import processes
+        self.host.supervisor.clear()
+        with simulated(self.host), settings(supervisor_backend='xmlrpc'):
+            processes({'app': {'command': '/bin/app'}})
+        self.assertEqual(dict(self.host.supervisor), {'app': 'RUNNING'})
+        self.assertFalse([command for command in self.host.history
+                          if command.startswith('supervisorctl')])
+
+    def test_update_config_error(self):
+        from fabric.api import settings
+        from fabtools.supervisor import update_config
+        from six.moves import xmlrpc_client
+
+        def fail(method, params):
+            raise xmlrpc_client.Fault(2, 'SHUTDOWN_STATE')
+
+        self.host._supervisor_call = fail
+        with simulated(self.host), settings(supervisor_backend='xmlrpc',
+                                            abort_exception=SystemExit):
+            with self.assertRaises(SystemExit):
+                update_config()
@@ -14,3 +14,330 @@ class CreateUserTestCase(unittest.TestCase):
     def test_uid_int(self, mock_run_as_root):
         from fabtools.user import create
         create('alice', uid=421)
+
+
+class SnapshotTestCase(unittest.TestCase):
+
+    @mock.patch('fabtools.user.run_as_root')
+    def test_parse(self, mock_run_as_root):
+        from fabtools.user import snapshot
+        mock_run_as_root.return_value = '\n'.join([
+            'root:x:0:0:root:/root:/bin/bash',
+            'alice:x:1000:1000:Alice:/home/alice:/bin/sh',
+            '--fabtools-snapshot--',
+            'root:x:0:',
+            'alice:x:1000:',
+            'sudo:x:27:alice',
+            '--fabtools-snapshot--',
+            'alice:!:17000:0:99999:7:::',
+        ])
+        state = snapshot()
+        self.assertEqual(state['users']['alice'], {
+            'uid': 1000,
+            'gid': 1000,
+            'group': 'alice',
+            'comment': 'Alice',
+            'home': '/home/alice',
+            'shell': '/bin/sh',
+            'groups': ['sudo'],
+        })
+        self.assertEqual(state['groups']['sudo'], {
+            'gid': 27,
+            'members': ['alice'],
+        })
+        self.assertEqual(state['passwords'], {'alice': '!'})
+
+
+class RequireUsersTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.tests.simulated import SimulatedHost
+        self.host = SimulatedHost()
+
+    def test_create_many_users_in_one_batch(self):
+        from fabtools.require.users import users
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            users(['user%d' % i for i in range(200)] + [
+                {'name': 'worker', 'group': 'workers', 'shell': '/bin/bash'},
+            ])
+        self.assertEqual(len(self.host.history), 2)
+        self.assertIn('user199', self.host.users)
+        self.assertEqual(self.host.users['worker']['shell'], '/bin/bash')
+        self.assertEqual(self.host.users['worker']['gid'],
+                         self.host.groups['workers']['gid'])
+
+    def test_only_modify_what_differs(self):
+        from fabtools.require.users import users
+        from fabtools.tests.simulated import simulated
+        self.host.add_user('alice', shell='/bin/sh')
+        self.host.add_user('bob', shell='/bin/bash')
+        with simulated(self.host):
+            users([
+                {'name': 'alice', 'shell': '/bin/bash'},
+                {'name': 'bob', 'shell': '/bin/bash'},
+            ])
+        self.assertEqual(self.host.history[-1],
+                         "usermod -s /bin/bash alice")
+
+    def test_nothing_to_do(self):
+        from fabtools.require.users import users
+        from fabtools.tests.simulated import simulated
+        self.host.add_user('alice', shell='/bin/bash', extra_groups=['sudo'])
+        with simulated(self.host):
+            users([{'name': 'alice', 'shell': '/bin/bash',
+                    'extra_groups': ['sudo']}])
+        self.assertEqual(len(self.host.history), 1)
+
+    def test_home_directory_owner(self):
+        from fabtools.require.users import users
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            users([
+                {'name': 'alice', 'home': '/srv/alice'},
+                {'name': 'worker', 'group': 'workers', 'home': '/srv/worker'},
+            ])
+        self.assertIn('chown alice /srv/alice', self.host.history[-1])
+        self.assertIn('chown worker:workers /srv/worker',
+                      self.host.history[-1])
+
+    def test_password_without_crypt(self):
+        import sys
+        from fabtools.user import _password_matches
+        with mock.patch.dict(sys.modules, {'crypt': None}):
+            self.assertFalse(_password_matches('secret', '$6$salt$hash'))
+
+    def test_require_groups(self):
+        from fabtools.require.groups import groups
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            groups(['sudo', 'admins', {'name': 'deploy', 'gid': 2000}])
+        self.assertEqual(len(self.host.history), 2)
+        self.assertEqual(self.host.groups['deploy']['gid'], 2000)
+        self.assertIn('admins', self.host.groups)
+
+
+KEY1 = 'ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAAAgQCysMENTuVeMJ2jTP8Unkgx alice@laptop'
+KEY2 = 'ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAIGw0Cq6aqZc bob@laptop'
+KEY3 = 'command="backup" ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAAAgQDx5 backup'
+
+
+class MergePublicKeysTestCase(unittest.TestCase):
+
+    def test_add_missing_keys(self):
+        from fabtools.user import _merge_public_keys
+        merged = _merge_public_keys([KEY1], [KEY1, KEY2])
+        self.assertEqual(merged, [KEY1, KEY2])
+
+    def test_ignore_comments(self):
+        from fabtools.user import _merge_public_keys
+        merged = _merge_public_keys([KEY1], [KEY1.replace('laptop', 'desktop')])
+        self.assertEqual(merged, [KEY1])
+
+    def test_options(self):
+        from fabtools.user import _public_key_id
+        self.assertEqual(_public_key_id(KEY3),
+                         ('ssh-rsa', 'AAAAB3NzaC1yc2EAAAADAQABAAAAgQDx5'))
+
+    def test_exclusive(self):
+        from fabtools.user import _merge_public_keys
+        merged = _merge_public_keys([KEY1, KEY3], [KEY2, KEY2], exclusive=True)
+        self.assertEqual(merged, [KEY2])
+
+
+class RequireAuthorizedKeysTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.tests.simulated import SimulatedHost
+        self.host = SimulatedHost()
+        self.host.add_user('alice')
+        self.host.add_user('bob')
+
+    def test_many_keys_in_one_upload(self):
+        from fabtools.require.users import authorized_keys
+        from fabtools.tests.simulated import simulated
+        keys = ['ssh-rsa AAAA%d key%d' % (i, i) for i in range(50)]
+        with simulated(self.host):
+            authorized_keys('alice', keys)
+        self.assertEqual(len(self.host.history), 3)
+        path = '/home/alice/.ssh/authorized_keys'
+        self.assertEqual(self.host.read_file(path).splitlines(), keys)
+        self.assertEqual(self.host.node(path).owner, 'alice')
+        self.assertEqual(self.host.node(path).mode, 0o600)
+        self.assertEqual(self.host.node('/home/alice/.ssh').mode, 0o700)
+
+    def test_unchanged(self):
+        from fabtools.require.users import authorized_keys
+        from fabtools.tests.simulated import simulated
+        self.host.mkdir('/home/alice/.ssh', owner='alice', mode=0o700)
+        self.host.write_file('/home/alice/.ssh/authorized_keys',
+                             KEY1 + '\n' + KEY2 + '\n', owner='alice')
+        with simulated(self.host):
+            authorized_keys('alice', [KEY2])
+        self.assertEqual(len(self.host.history), 1)
+
+    def test_revoke(self):
+        from fabtools.require.users import authorized_keys
+        from fabtools.tests.simulated import simulated
+        self.host.mkdir('/home/alice/.ssh', owner='alice', mode=0o700)
+        self.host.write_file('/home/alice/.ssh/authorized_keys',
+                             KEY1 + '\n' + KEY2 + '\n', owner='alice')
+        with simulated(self.host):
+            authorized_keys('alice', [KEY2], exclusive=True)
+        self.assertEqual(
+            self.host.read_file('/home/alice/.ssh/authorized_keys'),
+            KEY2 + '\n')
+
+    def test_many_users(self):
+        from fabtools.require.users import authorized_keys_by_user
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            authorized_keys_by_user({'alice': [KEY1], 'bob': [KEY1, KEY2]})
+        self.assertEqual(len(self.host.history), 3)
+        self.assertEqual(
+            self.host.read_file('/home/bob/.ssh/authorized_keys'),
+            KEY1 + '\n' + KEY2 + '\n')
+        self.assertFalse([path for path in self.host.fs
+                          if path.startswith('/tmp/fabtools-')])
+
+    def test_missing_user(self):
+        from fabtools.require.users import authorized_keys_by_user
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            self.assertRaises(SystemExit, authorized_keys_by_user,
+                              {'alice': [KEY1], 'nobody; rm -rf /': [KEY1]})
+        self.assertFalse(self.host.exists('/home/alice/.ssh/authorized_keys'))
+
+
+GITHUB_KEY = 'AAAAB3NzaC1yc2EAAAABIwAAAQEAq2A7hRGmdnm9tUDbO9IDSwBK6TbQa'
+
+
+class KnownHostsTestCase(unittest.TestCase):
+
+    def test_hashed_entry(self):
+        from fabtools.user import _KnownHosts, _hashed_host
+        index = _KnownHosts([
+            '%s ssh-rsa %s' % (_hashed_host('github.com'), GITHUB_KEY),
+        ])
+        self.assertEqual(index.keys('github.com', 'ssh-rsa'), set([GITHUB_KEY]))
+        self.assertEqual(index.keys('gitlab.com', 'ssh-rsa'), set())
+
+    def test_port(self):
+        from fabtools.user import _known_hosts_name
+        self.assertEqual(_known_hosts_name('example.com:22'), 'example.com')
+        self.assertEqual(_known_hosts_name('example.com:2222'),
+                         '[example.com]:2222')
+
+    def test_merge(self):
+        from fabtools.user import _hashed_host, _merge_known_hosts
+        current = [
+            '%s ssh-rsa %s' % (_hashed_host('github.com'), GITHUB_KEY),
+            'example.com,10.0.0.1 ssh-ed25519 AAAAC3',
+            'example.com,10.0.0.1 ssh-ed25519 AAAAC3',
+        ]
+        merged = _merge_known_hosts(current, [
+            'github.com ssh-rsa %s' % GITHUB_KEY,
+            '10.0.0.1 ssh-ed25519 AAAAC3',
+            'example.com ssh-rsa AAAAB3',
+            'example.com ssh-rsa AAAAB3',
+        ])
+        self.assertEqual(merged, current[:2] + ['example.com ssh-rsa AAAAB3'])
+
+    @mock.patch('fabtools.user.warn')
+    def test_changed_key(self, warn):
+        from fabtools.user import _merge_known_hosts
+        current = ['example.com ssh-rsa AAAAB3']
+        merged = _merge_known_hosts(current, ['example.com ssh-rsa OTHER'])
+        self.assertEqual(merged, current)
+        self.assertTrue(warn.called)
+
+
+class RequireKnownHostsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.tests.simulated import SimulatedHost
+        self.host = SimulatedHost()
+        self.host.add_user('alice')
+        for i in range(20):
+            self.host.ssh_host_keys['git%d.example.com' % i] = [
+                ('ssh-rsa', 'AAAAB3rsa%d' % i),
+                ('ssh-ed25519', 'AAAAC3ed%d' % i),
+            ]
+
+    def test_many_hosts(self):
+        from fabtools.require.users import known_hosts
+        from fabtools.tests.simulated import simulated
+        hostnames = ['git%d.example.com' % i for i in range(20)]
+        with simulated(self.host):
+            known_hosts('alice', hostnames)
+        self.assertEqual(len(self.host.history), 3)
+        path = '/home/alice/.ssh/known_hosts'
+        self.assertEqual(len(self.host.read_file(path).splitlines()), 40)
+        self.assertEqual(self.host.node(path).owner, 'alice')
+
+        with simulated(self.host):
+            known_hosts('alice', hostnames)
+        self.assertEqual(len(self.host.history), 4)
+
+    def test_hashed(self):
+        from fabtools.require.users import known_hosts
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            known_hosts('alice', ['git1.example.com'], hash_hosts=True)
+            known_hosts('alice', ['git1.example.com'])
+        lines = self.host.read_file('/home/alice/.ssh/known_hosts').splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(all(line.startswith('|1|') for line in lines))
+
+    def test_port(self):
+        from fabtools.require.users import known_hosts
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            known_hosts('alice', ['git1.example.com:2222'], key_types=['rsa'])
+        self.assertEqual(
+            self.host.read_file('/home/alice/.ssh/known_hosts'),
+            '[git1.example.com]:2222 ssh-rsa AAAAB3rsa1\n')
+
+
+class RequireSudoersTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.tests.simulated import SimulatedHost
+        self.host = SimulatedHost()
+
+    def test_many_entries(self):
+        from fabtools.require.users import sudoers
+        from fabtools.tests.simulated import simulated
+        entries = [{'username': 'user%d' % i} for i in range(100)]
+        with simulated(self.host):
+            sudoers(entries)
+        self.assertEqual(len(self.host.history), 3)
+        path = '/etc/sudoers.d/fabtools-user42'
+        self.assertEqual(self.host.read_file(path),
+                         'user42 ALL=(ALL) NOPASSWD: ALL\n')
+        self.assertEqual(self.host.node(path).mode, 0o440)
+
+        with simulated(self.host):
+            sudoers(entries)
+        self.assertEqual(len(self.host.history), 4)
+
+    def test_sudoer(self):
+        from fabtools.require.users import sudoer
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host):
+            sudoer('alice', passwd=True)
+            sudoer('alice', commands='/bin/ls')
+        self.assertEqual(
+            self.host.read_file('/etc/sudoers.d/fabtools-alice'),
+            'alice ALL=(ALL) NOPASSWD: /bin/ls\n')
+
+    def test_invalid(self):
+        from fabric.api import settings
+        from fabtools.require.users import sudoers
+        from fabtools.tests.simulated import simulated
+        with simulated(self.host), settings(abort_exception=SystemExit):
+            with self.assertRaises(SystemExit):
+                sudoers([{'username': 'alice'},
+                         {'username': 'bob', 'hosts': ''}])
+        self.assertFalse(self.host.exists('/etc/sudoers.d/fabtools-alice'))
+        self.assertFalse(self.host.exists('/etc/sudoers.d/fabtools-bob'))
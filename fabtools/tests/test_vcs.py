@@ -0,0 +1,52 @@
+import unittest
+
+
+class RunConcurrentlyTestCase(unittest.TestCase):
+
+    def test_results(self):
+        from fabtools.tests.simulated import SimulatedHost, simulated
+        from fabtools.utils import run_concurrently
+        host = SimulatedHost()
+        with simulated(host):
+            results = run_concurrently(
+                ['echo one', 'false', 'echo two; echo three'], concurrency=2)
+        self.assertEqual(results, ['one', '', 'two\nthree'])
+        self.assertEqual([result.return_code for result in results],
+                         [0, 1, 0])
+        self.assertTrue(results[1].failed)
+        self.assertEqual(len(host.history), 1)
+        self.assertEqual(host.listdir('/tmp'), [])
+
+
+class WorkingCopiesTestCase(unittest.TestCase):
+
+    def test_git_and_mercurial(self):
+        from fabtools.require.vcs import working_copies
+        from fabtools.tests.simulated import SimulatedHost, simulated
+        host = SimulatedHost()
+        host.install_package('git')
+        host.install_package('mercurial')
+        host.mkdir('/srv/apps', owner='vagrant')
+        host.git_remote('https://github.com/example/api.git')
+        host.hg_remote('https://hg.example.com/web',
+                       branches={'default': 'a1a1a1a1a1a1',
+                                 'stable': 'b1b1b1b1b1b1'})
+        with simulated(host):
+            results = working_copies([
+                {'remote_url': 'https://github.com/example/api.git',
+                 'path': '/srv/apps/api'},
+                {'vcs': 'hg', 'remote_url': 'https://hg.example.com/web',
+                 'path': '/srv/apps/web', 'branch': 'stable'},
+            ])
+        self.assertEqual(list(results), ['/srv/apps/api', '/srv/apps/web'])
+        self.assertEqual(host.git_repos['/srv/apps/api']['head'], 'c0ffee0')
+        self.assertEqual(host.hg_repos['/srv/apps/web']['revision'],
+                         'b1b1b1b1b1b1')
+        # git --version, hg --version, one status command for each, and
+        # the concurrent checkouts
+        self.assertEqual(len(host.history), 5)
+
+    def test_unsupported_vcs(self):
+        from fabtools.require.vcs import working_copies
+        self.assertRaises(ValueError, working_copies,
+                          [{'vcs': 'svn', 'remote_url': 'svn://example.com'}])
@@ -4,11 +4,17 @@ Users
 """
 
 from pipes import quote
+import base64
+import hashlib
+import hmac
+import os
 import posixpath
 import random
+import re
 import string
+import warnings
 
-from fabric.api import hide, run, settings, sudo, local
+from fabric.api import hide, run, settings, local, warn
 import six
 
 from fabtools.group import (
@@ -27,6 +33,81 @@ def exists(name):
         return run('getent passwd %(name)s' % locals()).succeeded
 
 
+_SNAPSHOT_SEPARATOR = '--fabtools-snapshot--'
+
+
+def snapshot():
+    """
+    Get the state of all users and groups, using a single command.
+
+    Returns a dict with the following keys:
+
+    - ``users``: a dict mapping user names to dicts with ``uid``,
+      ``gid``, ``comment``, ``home``, ``shell`` and ``groups``
+      (the names of the user's supplementary groups)
+    - ``groups``: a dict mapping group names to dicts with ``gid``
+      and ``members``
+    - ``passwords``: a dict mapping user names to their encrypted
+      password, as found in the shadow database
+
+    Example::
+
+        import fabtools
+
+        state = fabtools.user.snapshot()
+        for name, info in state['users'].items():
+            print("%s: %s" % (name, info['home']))
+
+    """
+    separator = _SNAPSHOT_SEPARATOR
+    with settings(hide('running', 'stdout', 'stderr', 'warnings'),
+                  warn_only=True):
+        res = run_as_root('getent passwd; echo %(separator)s; '
+                          'getent group; echo %(separator)s; '
+                          'getent shadow' % locals())
+    sections = (res.replace('\r\n', '\n') + '\n').split(separator + '\n')
+    sections += [''] * (3 - len(sections))
+    passwd_lines, group_lines, shadow_lines = sections[:3]
+
+    groups = {}
+    names_by_gid = {}
+    for line in group_lines.splitlines():
+        fields = line.split(':')
+        if len(fields) < 4:
+            continue
+        name, _, gid, members = fields[:4]
+        groups[name] = {
+            'gid': int(gid),
+            'members': [member for member in members.split(',') if member],
+        }
+        names_by_gid.setdefault(int(gid), name)
+
+    users = {}
+    for line in passwd_lines.splitlines():
+        fields = line.split(':')
+        if len(fields) < 7:
+            continue
+        name, _, uid, gid, comment, home, shell = fields[:7]
+        users[name] = {
+            'uid': int(uid),
+            'gid': int(gid),
+            'group': names_by_gid.get(int(gid)),
+            'comment': comment,
+            'home': home,
+            'shell': shell,
+            'groups': sorted(group for group, info in groups.items()
+                             if name in info['members']),
+        }
+
+    passwords = {}
+    for line in shadow_lines.splitlines():
+        fields = line.split(':')
+        if len(fields) >= 2:
+            passwords[fields[0]] = fields[1]
+
+    return {'users': users, 'groups': groups, 'passwords': passwords}
+
+
 _SALT_CHARS = string.ascii_letters + string.digits + './'
 
 
@@ -40,6 +121,26 @@ def _crypt_password(password):
     return crypted_password
 
 
+def _password_matches(password, crypted_password):
+    """
+    Check a password against an encrypted password from ``/etc/shadow``.
+
+    The ``crypt`` module is deprecated, and missing from recent Python
+    versions, and the hashing methods it supports depend on the local
+    platform. When the password cannot be checked, it is assumed to
+    differ, so that it is set again.
+    """
+    if not crypted_password or crypted_password[0] in '!*':
+        return False
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            from crypt import crypt
+        return crypt(password, crypted_password) == crypted_password
+    except (ImportError, OSError):
+        return False
+
+
 def create(name, comment=None, home=None, create_home=None, skeleton_dir=None,
            group=None, create_group=True, extra_groups=None, password=None,
            system=False, shell=None, uid=None, ssh_public_keys=None,
@@ -79,6 +180,30 @@ def create(name, comment=None, home=None, create_home=None, skeleton_dir=None,
     # portable command to create users across various distributions:
     # http://refspecs.linuxbase.org/LSB_4.1.0/LSB-Core-generic/LSB-Core-generic/useradd.html
 
+    if group and create_group:
+        if not _group_exists(group):
+            _group_create(group)
+
+    args = _create_args(name, comment=comment, home=home,
+                        create_home=create_home, skeleton_dir=skeleton_dir,
+                        group=group, extra_groups=extra_groups,
+                        password=password, system=system, shell=shell,
+                        uid=uid, non_unique=non_unique)
+    run_as_root('useradd %s' % args)
+
+    if ssh_public_keys:
+        if isinstance(ssh_public_keys, six.string_types):
+            ssh_public_keys = [ssh_public_keys]
+        add_ssh_public_keys(name, ssh_public_keys)
+
+
+def _create_args(name, comment=None, home=None, create_home=None,
+                 skeleton_dir=None, group=None, extra_groups=None,
+                 password=None, system=False, shell=None, uid=None,
+                 non_unique=False):
+    """
+    Build the arguments of the ``useradd`` command.
+    """
     args = []
     if comment:
         args.append('-c %s' % quote(comment))
@@ -86,9 +211,6 @@ def create(name, comment=None, home=None, create_home=None, skeleton_dir=None,
         args.append('-d %s' % quote(home))
     if group:
         args.append('-g %s' % quote(group))
-        if create_group:
-            if not _group_exists(group):
-                _group_create(group)
     if extra_groups:
         groups = ','.join(quote(group) for group in extra_groups)
         args.append('-G %s' % groups)
@@ -114,13 +236,7 @@ def create(name, comment=None, home=None, create_home=None, skeleton_dir=None,
         if non_unique:
             args.append('-o')
     args.append(name)
-    args = ' '.join(args)
-    run_as_root('useradd %s' % args)
-
-    if ssh_public_keys:
-        if isinstance(ssh_public_keys, six.string_types):
-            ssh_public_keys = [ssh_public_keys]
-        add_ssh_public_keys(name, ssh_public_keys)
+    return ' '.join(args)
 
 
 def modify(name, comment=None, home=None, move_current_home=False, group=None,
@@ -142,6 +258,28 @@ def modify(name, comment=None, home=None, move_current_home=False, group=None,
 
     """
 
+    args = _modify_args(name, comment=comment, home=home,
+                        move_current_home=move_current_home, group=group,
+                        extra_groups=extra_groups, login_name=login_name,
+                        password=password, shell=shell, uid=uid,
+                        non_unique=non_unique)
+    if args:
+        run_as_root('usermod %s' % args)
+
+    if ssh_public_keys:
+        if isinstance(ssh_public_keys, six.string_types):
+            ssh_public_keys = [ssh_public_keys]
+        add_ssh_public_keys(name, ssh_public_keys)
+
+
+def _modify_args(name, comment=None, home=None, move_current_home=False,
+                 group=None, extra_groups=None, login_name=None,
+                 password=None, shell=None, uid=None, non_unique=False):
+    """
+    Build the arguments of the ``usermod`` command.
+
+    Returns an empty string if there is nothing to modify.
+    """
     args = []
     if comment:
         args.append('-c %s' % quote(comment))
@@ -162,19 +300,14 @@ def modify(name, comment=None, home=None, move_current_home=False, group=None,
     if shell:
         args.append('-s %s' % quote(shell))
     if uid:
-        args.append('-u %s' % quote(uid))
+        args.append('-u %s' % quote(str(uid)))
         if non_unique:
             args.append('-o')
 
-    if args:
-        args.append(name)
-        args = ' '.join(args)
-        run_as_root('usermod %s' % args)
-
-    if ssh_public_keys:
-        if isinstance(ssh_public_keys, six.string_types):
-            ssh_public_keys = [ssh_public_keys]
-        add_ssh_public_keys(name, ssh_public_keys)
+    if not args:
+        return ''
+    args.append(name)
+    return ' '.join(args)
 
 
 def home_directory(name):
@@ -252,53 +385,192 @@ def add_ssh_public_keys(name, filenames):
             '~/.ssh/id2_rsa.pub',
         ])
 
+    .. seealso:: :func:`fabtools.require.users.authorized_keys`
     """
 
-    from fabtools.require.files import (
-        directory as _require_directory,
-        file as _require_file,
-    )
+    from fabtools.require.users import authorized_keys as _require_keys
 
-    ssh_dir = posixpath.join(home_directory(name), '.ssh')
-    _require_directory(ssh_dir, mode='700', owner=name, use_sudo=True)
+    _require_keys(name, filenames)
 
-    authorized_keys_filename = posixpath.join(ssh_dir, 'authorized_keys')
-    _require_file(authorized_keys_filename, mode='600', owner=name,
-                  use_sudo=True)
 
-    for filename in filenames:
+_KEY_TYPE_RE = re.compile(r'^(ssh-|ecdsa-|sk-)')
+
 
-        with open(filename) as public_key_file:
-            public_keys = public_key_file.read().strip().split("\n")
+def _public_key_id(line):
+    """
+    Get the identity of a public key, ignoring its options and comment.
 
-        # we don't use fabric.contrib.files.append() as it's buggy
-        for public_key in public_keys:
-            if public_key not in authorized_keys(name):
-                sudo('echo %s >>%s' % (quote(public_key),
-                                    quote(authorized_keys_filename)))
+    Returns a ``(type, base64 blob)`` tuple, or ``None`` if *line* is
+    not a public key.
+    """
+    fields = line.split()
+    for index, field in enumerate(fields[:-1]):
+        if _KEY_TYPE_RE.match(field):
+            return (field, fields[index + 1])
+    return None
+
+
+def _load_public_keys(keys):
+    """
+    Get a list of public key lines.
+
+    Each item of *keys* can be either a public key, or the local
+    filename of a file holding one or more public keys.
+    """
+    lines = []
+    for key in keys:
+        if _public_key_id(key) is None:
+            with open(os.path.expanduser(key)) as public_key_file:
+                key = public_key_file.read()
+        lines.extend(line.strip() for line in key.splitlines()
+                     if line.strip() and not line.startswith('#'))
+    return lines
+
+
+def _merge_public_keys(current, required, exclusive=False):
+    """
+    Merge public key lines with set semantics.
+
+    Keys are compared by type and value, so that a key is not added
+    again if only its comment differs. If *exclusive* is ``True``,
+    only the *required* keys are kept.
+    """
+    if exclusive:
+        merged = []
+        seen = set()
+        for line in required:
+            key_id = _public_key_id(line)
+            if key_id not in seen:
+                merged.append(line)
+                seen.add(key_id)
+        return merged
+
+    merged = list(current)
+    seen = set(_public_key_id(line) for line in current)
+    for line in required:
+        key_id = _public_key_id(line)
+        if key_id not in seen:
+            merged.append(line)
+            seen.add(key_id)
+    return merged
 
 
 def add_host_keys(name, hostname):
     """
-    Add all public keys of a host to the user's SSH known hosts file
+    Add all public keys of a host to the user's SSH known hosts file.
+
+    *hostname* may also be a list of hosts, which are all scanned at once.
+
+    .. seealso:: :func:`fabtools.require.users.known_hosts`
+    """
+    from fabtools.require.users import known_hosts
+
+    if isinstance(hostname, six.string_types):
+        hostname = [hostname]
+    known_hosts(name, hostname)
+
+
+def _known_hosts_name(hostname):
+    """
+    Get the name used in a known hosts file for ``host[:port]``.
     """
+    host, sep, port = hostname.partition(':')
+    if sep and port != '22':
+        return '[%s]:%s' % (host, port)
+    return host
 
-    from fabtools.require.files import (
-        directory as _require_directory,
-        file as _require_file,
+
+def _hash_host(name, salt):
+    return hmac.new(salt, name.encode('utf-8'), hashlib.sha1).digest()
+
+
+def _hashed_host(name):
+    """
+    Hash a host name the way ``ssh-keygen -H`` does.
+    """
+    salt = os.urandom(20)
+    return '|1|%s|%s' % (
+        base64.b64encode(salt).decode('ascii'),
+        base64.b64encode(_hash_host(name, salt)).decode('ascii'),
     )
 
-    ssh_dir = posixpath.join(home_directory(name), '.ssh')
-    _require_directory(ssh_dir, mode='700', owner=name, use_sudo=True)
 
-    known_hosts_filename = posixpath.join(ssh_dir, 'known_hosts')
-    _require_file(known_hosts_filename, mode='644', owner=name, use_sudo=True)
+class _KnownHosts(object):
+    """
+    Index of the keys in a known hosts file.
 
-    known_hosts = uncommented_lines(known_hosts_filename, use_sudo=True)
+    Plain entries are indexed by host name, and hashed entries
+    (``|1|salt|hash``) are matched by computing the HMAC-SHA1 of
+    the host name being looked up.
+    """
 
-    with hide('running', 'stdout'):
-        res = run('ssh-keyscan -t rsa,dsa %s 2>/dev/null' % hostname)
-    for host_key in res.splitlines():
-        if host_key not in known_hosts:
-            sudo('echo %s >>%s' % (quote(host_key),
-                                   quote(known_hosts_filename)))
+    def __init__(self, lines=()):
+        self._plain = {}
+        self._hashed = []
+        for line in lines:
+            self.add(line)
+
+    def add(self, line):
+        parts = line.split()
+        if len(parts) < 3 or parts[0].startswith(('#', '@')):
+            return
+        names, key_type, key = parts[:3]
+        if names.startswith('|1|'):
+            try:
+                salt, digest = names[3:].split('|')
+                salt = base64.b64decode(salt)
+                digest = base64.b64decode(digest)
+            except (TypeError, ValueError):
+                return
+            self._hashed.append((salt, digest, key_type, key))
+        else:
+            for name in names.split(','):
+                self._plain.setdefault((name, key_type), set()).add(key)
+
+    def keys(self, name, key_type):
+        """
+        Get the set of keys of the given type known for a host name.
+        """
+        keys = set(self._plain.get((name, key_type), ()))
+        for salt, digest, hashed_type, key in self._hashed:
+            if hashed_type == key_type and _hash_host(name, salt) == digest:
+                keys.add(key)
+        return keys
+
+
+def _merge_known_hosts(current, scanned, hash_hosts=False):
+    """
+    Merge scanned host keys into the lines of a known hosts file.
+
+    Duplicate lines are dropped, and keys that are already known, in
+    plain or hashed form, are not added again. A key that conflicts
+    with a known key of the same type is not added, and a warning is
+    shown instead.
+    """
+    merged = []
+    seen = set()
+    for line in current:
+        if line not in seen:
+            merged.append(line)
+            seen.add(line)
+
+    index = _KnownHosts(merged)
+    for line in scanned:
+        parts = line.split()
+        if len(parts) < 3 or parts[0].startswith('#'):
+            continue
+        name, key_type, key = parts[:3]
+        known = index.keys(name, key_type)
+        if key in known:
+            continue
+        if known:
+            warn("Host key for %s (%s) does not match the known key, "
+                 "not updating" % (name, key_type))
+            continue
+        if hash_hosts:
+            line = ' '.join([_hashed_host(name), key_type, key])
+        else:
+            line = ' '.join([name, key_type, key])
+        merged.append(line)
+        index.add(' '.join([name, key_type, key]))
+    return merged
@@ -3,11 +3,23 @@ Utilities
 =========
 """
 
+from functools import partial
 from pipes import quote
+import itertools
 import os
 import posixpath
+import threading
+import time
+import zlib
 
-from fabric.api import env, hide, run, sudo
+from fabric.api import abort, env, hide, puts, run, settings, sudo, warn
+from fabric.operations import (
+    _AttributeString,
+    _prefix_commands,
+    _prefix_env_vars,
+    _shell_wrap,
+)
+from fabric.state import connections
 
 
 def run_as_root(command, *args, **kwargs):
@@ -59,3 +71,364 @@ def read_file(path):
 
 def read_lines(path):
     return read_file(path).splitlines()
+
+
+_host_caches = []
+
+
+def host_cache():
+    """
+    Create a dict to cache some state of the remote hosts.
+
+    The dict is meant to be keyed by ``env.host_string``. All the
+    caches created by this function can be emptied at once with
+    :func:`clear_host_caches`.
+    """
+    cache = {}
+    _host_caches.append(cache)
+    return cache
+
+
+def clear_host_caches():
+    """
+    Empty all the caches created by :func:`host_cache`.
+
+    Use it when the remote hosts were changed by other means.
+    """
+    for cache in _host_caches:
+        cache.clear()
+
+
+_JOB_MARKER = '--fabtools-job--'
+
+
+def run_concurrently(commands, concurrency=4, use_sudo=False, user=None):
+    """
+    Run many remote commands at the same time, with a single command.
+
+    The *commands* are spread over *concurrency* queues that run in the
+    background on the remote host, so that at most *concurrency* of them
+    run at the same time. This is most useful for network-bound
+    commands, such as downloads or version control checkouts. The output
+    of each command is kept in a private temporary directory until they
+    are all finished.
+
+    Returns the outputs of the commands, in the same order, as strings
+    with the ``return_code``, ``succeeded`` and ``failed`` attributes of
+    the results of Fabric's ``run``. A failed command does not stop the
+    others, and does not abort.
+
+    ::
+
+        from fabtools.utils import run_concurrently
+
+        results = run_concurrently([
+            'curl -sO https://example.com/%d.tar.gz' % i for i in range(8)
+        ])
+        failed = [result for result in results if result.failed]
+
+    """
+    commands = list(commands)
+    if not commands:
+        return []
+    concurrency = max(1, min(concurrency, len(commands)))
+    queues = []
+    for start in range(concurrency):
+        jobs = [
+            '( %s ) >"$d"/%d 2>&1 </dev/null; echo $? >"$d"/%d.rc;'
+            % (commands[index], index, index)
+            for index in range(start, len(commands), concurrency)
+        ]
+        queues.append('{ %s } &' % ' '.join(jobs))
+    cmd = (
+        'd=$(mktemp -d) && { %(queues)s wait; '
+        'for i in %(indexes)s; do echo "%(marker)s $(cat "$d"/$i.rc)"; '
+        'cat "$d"/$i; done; rm -rf "$d"; }'
+    ) % {
+        'queues': ' '.join(queues),
+        'indexes': ' '.join(str(index) for index in range(len(commands))),
+        'marker': _JOB_MARKER,
+    }
+    if use_sudo and user is None:
+        func = run_as_root
+    elif use_sudo:
+        func = partial(sudo, user=user)
+    else:
+        func = run
+    with settings(hide('running', 'stdout')):
+        res = func(cmd)
+
+    results = []
+    for line in res.replace('\r\n', '\n').split('\n'):
+        if line.startswith(_JOB_MARKER + ' '):
+            results.append([int(line.split()[1]), []])
+        elif results:
+            results[-1][1].append(line)
+    outputs = []
+    for return_code, lines in results:
+        output = _AttributeString('\n'.join(lines).strip())
+        output.return_code = return_code
+        output.succeeded = return_code == 0
+        output.failed = not output.succeeded
+        outputs.append(output)
+    return outputs
+
+
+_CHUNK_SIZE = 64 * 1024
+
+_SUDO_PROMPT = 'fabtools-sudo-password: '
+
+_STARTED_MARKER = '--fabtools-started--'
+
+
+def stream(command, stdin=None, stdout=None, user=None, label=None):
+    """
+    Run a remote command, streaming data to and from local files.
+
+    The data read from the local *stdin* file object (or iterable of
+    byte strings) is sent to the standard input of the remote command
+    as it is read, and the standard output of the command is written
+    to the local *stdout* file object as it arrives. Nothing is stored
+    in memory or in temporary files on either side, which makes this
+    suitable for very large transfers.
+
+    If *user* is given, the command is run as this user with ``sudo``.
+    As ``sudo -S`` reads the password from the same standard input as
+    the command, the command first prints a marker on its standard
+    error, and the data is only sent once the marker is seen. If
+    ``sudo`` asks for a password before that, the password of the
+    current host is sent, and prompted for if needed, as with Fabric's
+    ``sudo``. A wrong password is not asked again: the input is closed
+    instead, so that ``sudo`` fails without reading any data, and
+    the error is reported as a failure of the command.
+
+    The command is wrapped in ``env.shell``, and the ``cd``, ``prefix``
+    and ``shell_env`` contexts apply, as with ``run``.
+
+    Progress is reported every few megabytes, using *label* to
+    describe the transfer.
+
+    Returns the exit status of the command, and aborts if it failed,
+    unless ``warn_only`` is set.
+
+    ::
+
+        from fabtools.utils import stream
+
+        with open('backup.tar.gz', 'wb') as f:
+            stream('tar -czf - /srv/data', stdout=f, user='root',
+                   label='Backup')
+
+    """
+    if user is not None and user == env.user:
+        user = None
+    if stdin is None:
+        chunks = iter(())
+    elif hasattr(stdin, 'read'):
+        chunks = read_chunks(stdin)
+    else:
+        chunks = iter(stdin)
+
+    label = label or command
+    sent = _Progress('%s (sent)' % label)
+    received = _Progress('%s (received)' % label)
+
+    def send_chunks():
+        for chunk in chunks:
+            sent.update(len(chunk))
+            yield chunk
+
+    def write(data):
+        received.update(len(data))
+        if stdout is not None:
+            stdout.write(data)
+
+    full_command = _prefix_env_vars(_prefix_commands(command, 'remote'))
+    status, stderr = _stream_command(full_command, send_chunks(), write, user)
+    sent.done()
+    received.done()
+
+    if status != 0:
+        message = 'stream() received nonzero return code %s while ' \
+                  'executing %r' % (status, command)
+        if stderr.strip():
+            message += ':\n\n%s' % stderr.strip()
+        if env.warn_only:
+            warn(message)
+        else:
+            abort(message)
+    return status
+
+
+class _Progress(object):
+    """
+    Report the progress of a transfer.
+    """
+
+    step = 16 * 1024 * 1024
+
+    def __init__(self, label):
+        self.label = label
+        self.count = 0
+        self.reported = 0
+        self.start = time.time()
+
+    def update(self, size):
+        self.count += size
+        if self.count - self.reported >= self.step:
+            self.report()
+
+    def done(self):
+        if self.count:
+            self.report()
+
+    def report(self):
+        self.reported = self.count
+        elapsed = max(time.time() - self.start, 0.001)
+        puts('%s: %.1f MB (%.1f MB/s)' % (
+            self.label, self.count / 1048576.0,
+            self.count / 1048576.0 / elapsed))
+
+
+def _stream_command(command, chunks, write, user=None):
+    """
+    Run a remote command on a new SSH channel, sending the *chunks* to
+    its standard input while passing its standard output to *write*.
+
+    Returns the exit status and the standard error of the command.
+    """
+    command = 'echo %s >&2; %s' % (_STARTED_MARKER, command)
+    if user is None:
+        command = _shell_wrap(command, shell_escape=True)
+    else:
+        # sudo needs a shell to run the marker and the command
+        with settings(use_shell=True):
+            command = _shell_wrap(command, shell_escape=True)
+        command = 'sudo -S -p %s -u %s %s' % (
+            quote(_SUDO_PROMPT), quote(user), command)
+
+    channel = connections[env.host_string].get_transport().open_session()
+    channel.exec_command(command)
+
+    started = threading.Event()
+    errors = []
+
+    def send():
+        started.wait()
+        try:
+            for chunk in chunks:
+                if channel.closed:
+                    break
+                channel.sendall(chunk)
+            channel.shutdown_write()
+        except Exception as e:
+            errors.append(e)
+            channel.close()
+
+    sender = threading.Thread(target=send)
+    sender.daemon = True
+    sender.start()
+
+    stderr = b''
+    password_sent = False
+    while True:
+        busy = False
+        if channel.recv_ready():
+            write(channel.recv(_CHUNK_SIZE))
+            busy = True
+        if channel.recv_stderr_ready():
+            stderr += channel.recv_stderr(_CHUNK_SIZE)
+            busy = True
+            if not started.is_set():
+                marker = _STARTED_MARKER.encode('ascii') + b'\n'
+                prompt = _SUDO_PROMPT.encode('ascii')
+                if marker in stderr:
+                    stderr = stderr.replace(marker, b'', 1)
+                    started.set()
+                elif stderr.endswith(prompt):
+                    stderr = stderr[:-len(prompt)]
+                    if password_sent:
+                        # Wrong password: let sudo fail
+                        channel.shutdown_write()
+                    else:
+                        channel.sendall(_sudo_password().encode('utf-8') +
+                                        b'\n')
+                        password_sent = True
+        if not busy:
+            if channel.exit_status_ready() and not channel.recv_ready() \
+                    and not channel.recv_stderr_ready():
+                break
+            time.sleep(0.01)
+
+    status = channel.recv_exit_status()
+    started.set()
+    sender.join()
+    channel.close()
+    if errors:
+        raise errors[0]
+    return status, stderr.decode('utf-8', 'replace')
+
+
+def _sudo_password():
+    """
+    Get the sudo password of the current host, prompting for it if
+    needed, as Fabric does.
+    """
+    from fabric.network import (
+        get_password,
+        normalize,
+        prompt_for_password,
+        set_password,
+    )
+
+    user, host, port = normalize(env.host_string)
+    password = get_password(user, host, port)
+    if not password:
+        password = prompt_for_password()
+        set_password(user, host, port, password)
+    return password
+
+
+def read_chunks(fileobj, size=_CHUNK_SIZE):
+    """
+    Iterate over the contents of a local file object, as byte strings.
+    """
+    return iter(lambda: fileobj.read(size), b'')
+
+
+def gzip_chunks(chunks, level=6):
+    """
+    Compress an iterable of byte strings in the ``gzip`` format.
+
+    The data is passed as is if it is already compressed.
+    """
+    chunks = iter(chunks)
+    first = next(chunks, b'')
+    if first.startswith(b'\x1f\x8b'):
+        yield first
+        for chunk in chunks:
+            yield chunk
+        return
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for data in itertools.chain([first], chunks):
+        chunk = compressor.compress(data)
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+class GunzipWriter(object):
+    """
+    Wrap a local file object to decompress the ``gzip`` data written
+    to it.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.decompressor = zlib.decompressobj(31)
+
+    def write(self, data):
+        self.fileobj.write(self.decompressor.decompress(data))
+
+    def flush(self):
+        self.fileobj.write(self.decompressor.flush())